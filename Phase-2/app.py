@@ -6,14 +6,23 @@ from sqlalchemy.exc import SQLAlchemyError
 from werkzeug.exceptions import HTTPException
 import os
 
-from db import SessionLocal, engine, Base
+from db import SessionLocal, Base, init_engine
 from error_handlers import register_error_handlers
+from rate_limit import init_rate_limiting
+from db_session import init_sessions
+from metrics import init_metrics
+from serializers import init_serializers
+from formats import init_formats
+from compression import init_compression
+from config import Config, get_config
 from resources.users import UserList, UserResource, UserLoginAPI, UserLogoutAPI, CurrentUser
 from resources.patients import PatientList, PatientResource, PatientRegisterAPI, PatientAppointmentsAPI, PatientAppointmentsSortedAPI, PatientBookAppointmentAPI
 from resources.doctors import DoctorList, DoctorResource, DoctorAvailabilityList, DoctorAvailabilityResource, DoctorAppointmentsAPI, DoctorAppointmentsSortedAPI, DoctorSetAvailabilityAPI, DoctorViewScheduleAPI
-from resources.appointments import AppointmentListAPI, AppointmentAPI, AppointmentCreateAPI, AppointmentCancelAPI, AppointmentRescheduleAPI
-from resources.medical_records import MedicalRecordListAPI, MedicalRecordAPI, PatientMedicalRecordsAPI
+from resources.appointments import AppointmentListAPI, AppointmentSearchAPI, AppointmentAPI, AppointmentCreateAPI, AppointmentCancelAPI, AppointmentRescheduleAPI
+from resources.medical_records import MedicalRecordListAPI, MedicalRecordAPI, PatientMedicalRecordsAPI, MedicalRecordExportAPI
 from resources.departments import DepartmentListAPI, DepartmentAPI
+from resources.search import SearchSuggestAPI, PatientSearchAPI
+from resources.system import PoolStatsAPI
 
 # Load environment variables
 load_dotenv()
@@ -21,14 +30,8 @@ load_dotenv()
 def create_app(config_object=None):
     app = Flask(__name__)
     
-    # Configuration
-    if config_object:
-        app.config.from_object(config_object)
-    else:
-        app.config['SECRET_KEY'] = os.getenv('SECRET_KEY', 'dev-key-change-this')
-        app.config['SQLALCHEMY_DATABASE_URI'] = os.getenv('SQLSERVER_CONN', "mssql+pyodbc://@localhost/HospitalDB?driver=ODBC+Driver+17+for+SQL+Server&trusted_connection=yes")
-        app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
-        app.config['JWT_SECRET_KEY'] = os.getenv('JWT_SECRET_KEY', 'jwt-key-change-this')
+    # Configuration: the class picked by FLASK_ENV unless one is passed in
+    app.config.from_object(config_object or get_config())
 
     # Initialize extensions
     CORS(app, resources={
@@ -41,10 +44,33 @@ def create_app(config_object=None):
     
     # Initialize API
     api = Api(app)
+    # JSON responses through serializers.output_json (orjson when JSON_BACKEND asks for it),
+    # MessagePack and columnar JSON for clients that ask for them (see formats.py)
+    init_serializers(app, api)
+    init_formats(api)
 
     # Register error handlers
     register_error_handlers(app)
 
+    # gzip/brotli; registered before the other after_request hooks so it runs last, on the final body
+    if app.config.get('COMPRESSION_ENABLED', Config.COMPRESSION_ENABLED):
+        init_compression(app)
+
+    # Engine and pool sized from the config; one session per request,
+    # committed or rolled back and closed at teardown
+    engine = init_engine(app.config)
+    app.config.setdefault('DB_LEAK_DETECTION', Config.DB_LEAK_DETECTION)
+    init_sessions(app, SessionLocal)
+
+    # Request and query metrics at /metrics; registered before the rate limiter so 429s are timed too
+    init_metrics(app, engine)
+
+    # Shared rate limit backend and per-route limits
+    app.config.setdefault('RATE_LIMIT_STORAGE', Config.RATE_LIMIT_STORAGE)
+    app.config.setdefault('RATE_LIMIT_PER_MINUTE', Config.RATE_LIMIT_PER_MINUTE)
+    app.config.setdefault('RATE_LIMITS', Config.RATE_LIMITS)
+    init_rate_limiting(app)
+
     # Create database tables
     Base.metadata.create_all(bind=engine)
 
@@ -72,18 +98,25 @@ def create_app(config_object=None):
     api.add_resource(DoctorViewScheduleAPI, '/api/doctors/<string:doctor_id>/schedule')
     
     api.add_resource(AppointmentListAPI, '/api/appointments')
+    api.add_resource(AppointmentSearchAPI, '/api/appointments/search')
     api.add_resource(AppointmentAPI, '/api/appointments/<string:appointment_id>')
     api.add_resource(AppointmentCreateAPI, '/api/appointments/create')
     api.add_resource(AppointmentCancelAPI, '/api/appointments/<string:appointment_id>/cancel')
     api.add_resource(AppointmentRescheduleAPI, '/api/appointments/<string:appointment_id>/reschedule')
     
     api.add_resource(MedicalRecordListAPI, '/api/medical-records')
+    api.add_resource(MedicalRecordExportAPI, '/api/medical-records/export')
     api.add_resource(MedicalRecordAPI, '/api/medical-records/<string:record_id>')
     api.add_resource(PatientMedicalRecordsAPI, '/api/patients/<string:patient_id>/medical-records')
     
     api.add_resource(DepartmentListAPI, '/api/departments')
     api.add_resource(DepartmentAPI, '/api/departments/<string:department_id>')
 
+    api.add_resource(SearchSuggestAPI, '/api/search/suggest')
+    api.add_resource(PatientSearchAPI, '/api/search/patients')
+
+    api.add_resource(PoolStatsAPI, '/api/system/db-pool')
+
     return app
 
 if __name__ == '__main__':
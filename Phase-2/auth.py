@@ -1,5 +1,9 @@
 from functools import wraps
-from flask import request, jsonify
+from flask import request, jsonify, g, has_request_context
+from collections import OrderedDict
+import hashlib
+import threading
+import time
 import jwt
 from datetime import datetime, timedelta
 from models import User
@@ -13,20 +17,96 @@ load_dotenv()
 # Configuration
 SECRET_KEY = os.getenv('JWT_SECRET_KEY', 'your-secret-key-here')  # In production, use environment variable
 TOKEN_EXPIRATION = int(os.getenv('TOKEN_EXPIRATION_HOURS', '24'))  # hours
+TOKEN_CACHE_SIZE = int(os.getenv('TOKEN_CACHE_SIZE', '10000'))
+USER_CACHE_TTL = int(os.getenv('USER_CACHE_TTL', '60'))  # seconds, 0 disables
 
-def generate_token(user_id, role):
-    """Generate a JWT token for the user"""
+class TokenCache:
+    """Bounded LRU of verified JWT payloads, keyed by a digest of the token.
+
+    A hit skips the decode and HMAC check. An entry is dropped once the
+    token's ``exp`` has passed, so a cached token is never accepted after
+    jwt.decode would have rejected it. Only valid tokens are stored.
+    """
+
+    def __init__(self, maxsize=TOKEN_CACHE_SIZE):
+        self.maxsize = maxsize
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _key(token):
+        if isinstance(token, str):
+            token = token.encode()
+        return hashlib.blake2b(token, digest_size=16).digest()
+
+    def get(self, token):
+        key = self._key(token)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                payload, expires = entry
+                if time.time() < expires:
+                    self._entries.move_to_end(key)
+                    self.hits += 1
+                    return payload
+                del self._entries[key]
+            self.misses += 1
+            return None
+
+    def put(self, token, payload):
+        expires = payload.get('exp')
+        if not self.maxsize or not isinstance(expires, (int, float)):
+            return
+        key = self._key(token)
+        with self._lock:
+            self._entries[key] = (payload, expires)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self.hits = self.misses = 0
+
+    def stats(self):
+        with self._lock:
+            return {'hits': self.hits, 'misses': self.misses,
+                    'size': len(self._entries), 'maxsize': self.maxsize}
+
+token_cache = TokenCache()
+
+def token_cache_stats():
+    """Hit/miss counters and size of the verified-token cache"""
+    return token_cache.stats()
+
+def generate_token(user_id, role, patient_id=None, doctor_id=None):
+    """Generate a JWT token for the user
+
+    The linked patient/doctor IDs are carried as claims so requests can
+    resolve who the caller is without touching the users table.
+    """
     payload = {
         'user_id': user_id,
         'role': role,
         'exp': datetime.utcnow() + timedelta(hours=TOKEN_EXPIRATION)
     }
+    if patient_id:
+        payload['patient_id'] = patient_id
+    if doctor_id:
+        payload['doctor_id'] = doctor_id
     return jwt.encode(payload, SECRET_KEY, algorithm='HS256')
 
 def verify_token(token):
     """Verify and decode the JWT token"""
+    payload = token_cache.get(token)
+    if payload is not None:
+        return payload
     try:
         payload = jwt.decode(token, SECRET_KEY, algorithms=['HS256'])
+        token_cache.put(token, payload)
         return payload
     except jwt.ExpiredSignatureError:
         return None
@@ -53,6 +133,7 @@ def login_required(f):
             return {'message': 'Invalid or expired token'}, 401
         
         # Add user info to request context
+        g.identity = Identity.from_payload(payload)
         request.user_id = payload['user_id']
         request.user_role = payload['role']
         return f(*args, **kwargs)
@@ -74,20 +155,95 @@ def admin_required(f):
     """Decorator to require admin role"""
     return role_required(['Admin'])(f)
 
+def doctor_required(f):
+    """Decorator to require doctor (or admin) role"""
+    return role_required(['Doctor', 'Admin'])(f)
+
+class Identity:
+    """Who is making the request, as stated by the verified token"""
+
+    __slots__ = ('id', 'role', 'patient_id', 'doctor_id')
+
+    def __init__(self, id, role, patient_id=None, doctor_id=None):
+        self.id = id
+        self.role = role
+        self.patient_id = patient_id
+        self.doctor_id = doctor_id
+
+    @classmethod
+    def from_payload(cls, payload):
+        return cls(payload['user_id'], payload['role'],
+                   payload.get('patient_id'), payload.get('doctor_id'))
+
+    def __repr__(self):
+        return f"<Identity {self.id} {self.role}>"
+
 def get_current_user():
-    """Get the current authenticated user"""
+    """Get the current authenticated user's identity (no database access)
+
+    Built once per request from the token claims and kept on ``flask.g``.
+    Use ``load_user`` when the full User row is needed.
+    """
+    identity = g.get('identity') if has_request_context() else None
+    if identity is not None:
+        return identity
+
     token = get_token_from_header()
     if not token:
         return None
-    
+
     payload = verify_token(token)
     if not payload:
         return None
-    
-    session = SessionLocal()
-    user = session.query(User).get(payload['user_id'])
-    session.close()
-    return user
+
+    g.identity = Identity.from_payload(payload)
+    return g.identity
+
+class UserCache:
+    """Per-process cache of detached User rows with a TTL.
+
+    Writers must call ``invalidate`` after changing or deleting a user;
+    other workers see the change once their entry expires.
+    """
+
+    def __init__(self, ttl=USER_CACHE_TTL):
+        self.ttl = ttl
+        self._entries = {}
+        self._lock = threading.Lock()
+
+    def get(self, user_id):
+        if self.ttl:
+            with self._lock:
+                entry = self._entries.get(user_id)
+            if entry is not None and entry[0] > time.monotonic():
+                return entry[1]
+
+        session = SessionLocal()
+        try:
+            user = session.query(User).get(user_id)
+        finally:
+            session.close()
+        if user is not None and self.ttl:
+            with self._lock:
+                self._entries[user_id] = (time.monotonic() + self.ttl, user)
+        return user
+
+    def invalidate(self, user_id=None):
+        with self._lock:
+            if user_id is None:
+                self._entries.clear()
+            else:
+                self._entries.pop(user_id, None)
+
+user_cache = UserCache()
+
+def load_user(user_id):
+    """Fetch a User row, served from the per-process cache when fresh"""
+    return user_cache.get(user_id)
+
+def invalidate_user(user_id=None):
+    """Drop a user (or everyone) from the per-process cache"""
+    user_cache.invalidate(user_id)
 
 # Role-based access control permissions
 PERMISSIONS = {
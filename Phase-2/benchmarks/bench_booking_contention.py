@@ -0,0 +1,106 @@
+"""
+Hundreds of threads booking the same doctor's slots on SQLite.
+
+Compares the old read-then-write flow (load Schedule, check is_available,
+set it False, insert) with booking.book_appointment, which claims the slot
+with one conditional UPDATE. Reports throughput and double bookings.
+
+    python benchmarks/bench_booking_contention.py [threads] [slots] [attempts_per_thread]
+"""
+import random
+import sys
+import threading
+from datetime import datetime, timedelta
+
+from common import make_engine, run_threads, report
+from sqlalchemy import func, select
+from models import Patient, Doctor, Schedule, Appointment
+from error_handlers import APIError
+from id_allocator import appointment_ids
+import booking
+
+
+def legacy_book(session, patient_id, schedule_id):
+    schedule = session.query(Schedule).get(schedule_id)
+    if not schedule.is_available:
+        raise APIError('This time slot is not available')
+    appointment = Appointment(
+        id=appointment_ids.next_id(),
+        patient_id=patient_id,
+        doctor_id=schedule.doctor_id,
+        schedule_id=schedule.id,
+        status='Scheduled'
+    )
+    schedule.is_available = False
+    session.add(appointment)
+
+
+def seed(Session, slots, patients):
+    session = Session()
+    session.add(Doctor(id='D001', first_name='John', last_name='Smith', specialization='Cardiology',
+                       qualification='MD', experience_years=10))
+    session.add_all(Patient(id=f"P{i:03}", first_name='Pat', last_name=f"N{i}", email=f"p{i}@example.com")
+                    for i in range(1, patients + 1))
+    start = datetime.now().replace(minute=0, second=0, microsecond=0) + timedelta(days=1)
+    session.add_all(Schedule(id=f"SC{i:04}", doctor_id='D001', datetime=start + timedelta(hours=i),
+                             duration=60, is_available=True)
+                    for i in range(1, slots + 1))
+    session.commit()
+    session.close()
+
+
+def run(label, book, threads, slots, attempts):
+    engine, Session = make_engine()
+    appointment_ids.bind = engine
+    appointment_ids.reset()
+    seed(Session, slots, patients=50)
+    stats = {'booked': 0, 'conflicts': 0}
+    lock = threading.Lock()
+
+    def worker(index):
+        rng = random.Random(index)
+        session = Session()
+        try:
+            for _ in range(attempts):
+                try:
+                    book(session, f"P{rng.randint(1, 50):03}", f"SC{rng.randint(1, slots):04}")
+                    session.commit()
+                    outcome = 'booked'
+                except APIError:
+                    session.rollback()
+                    outcome = 'conflicts'
+                with lock:
+                    stats[outcome] += 1
+        finally:
+            session.close()
+
+    elapsed = run_threads(worker, threads)
+    with engine.connect() as conn:
+        stored = conn.execute(select(func.count()).select_from(Appointment.__table__)).scalar()
+        double_booked = conn.execute(
+            select(Appointment.schedule_id)
+            .group_by(Appointment.schedule_id)
+            .having(func.count() > 1)
+        ).all()
+    engine.dispose()
+    report(label, [
+        ('attempts', threads * attempts),
+        ('attempts/sec', f"{threads * attempts / elapsed:,.0f}"),
+        ('appointments stored', stored),
+        ('rejected as unavailable', stats['conflicts']),
+        ('slots', slots),
+        ('double-booked slots', len(double_booked)),
+    ])
+    return len(double_booked)
+
+
+if __name__ == '__main__':
+    threads = int(sys.argv[1]) if len(sys.argv) > 1 else 300
+    slots = int(sys.argv[2]) if len(sys.argv) > 2 else 40
+    attempts = int(sys.argv[3]) if len(sys.argv) > 3 else 5
+    print(f"{threads} threads x {attempts} attempts on {slots} slots of one doctor (SQLite, WAL)")
+    run('Before: read is_available, then write', legacy_book, threads, slots, attempts)
+    doubles = run('After: booking.book_appointment (conditional UPDATE)', booking.book_appointment,
+                  threads, slots, attempts)
+    if doubles:
+        sys.exit(f"{doubles} slots were double-booked by the booking engine")
@@ -0,0 +1,144 @@
+"""
+Cost and effect of response compression (compression.py).
+
+1. CPU per MB: an AppointmentListAPI page and a medical record NDJSON export
+   compressed with gzip and brotli at several levels, best of several runs,
+   with the compression ratio each level reaches, and the export as it is
+   streamed: the default settings, flushed after every 1,000-line chunk.
+2. Under load: a Flask app serving an appointment list page through
+   ``init_compression``, hit by concurrent clients asking for identity, gzip
+   and br, with the body cache on and off. Latency is measured through the
+   test client, so it is the server's cost only; the bytes column is what
+   would go over the wire.
+
+    python benchmarks/bench_compression.py [rows] [threads] [requests per thread]
+    python benchmarks/bench_compression.py 1000 8 50
+"""
+import gc
+import json
+import sys
+import time
+import zlib
+from datetime import date, timedelta
+
+from common import percentile, report, run_threads
+from flask import Flask
+from flask_restful import Api, Resource
+import compression
+from compression import init_compression
+
+if compression.brotli is None:
+    raise SystemExit('brotli is not installed')
+import brotli
+
+
+def appointment_page(count):
+    """An AppointmentListAPI page with ?expand=schedule,doctor"""
+    return [{'id': f"A{i:07}", 'patient_id': f"P{i % 700:05}", 'doctor_id': f"D{i % 40:03}",
+             'schedule_id': f"SC{i:07}", 'status': ('Scheduled', 'Completed', 'Cancelled')[i % 3],
+             'reason': 'Follow-up consultation', 'created_at': f"2030-01-{1 + i % 28:02}T08:15:00",
+             'doctor_name': f"Dr. John Smith{i % 40}",
+             'schedule': {'date': f"2030-02-{1 + i % 28:02}", 'start': f"{9 + i % 8:02}:00", 'end': f"{9 + i % 8:02}:30"}}
+            for i in range(count)]
+
+
+def export_body(count):
+    first = date(2020, 1, 1)
+    return ''.join(json.dumps({'id': f"M{i:07}", 'patient_id': f"P{i % 1000:03}", 'department_id': f"DEPT{i % 5:03}",
+                               'diagnosis': 'Seasonal influenza, uncomplicated',
+                               'prescription': 'Oseltamivir 75mg twice daily',
+                               'notes': 'Follow up in two weeks if symptoms persist',
+                               'visit_date': (first + timedelta(days=i % 1500)).isoformat()}) + '\n'
+                   for i in range(count)).encode()
+
+
+def gzip_level(level):
+    def compress(body):
+        compressor = zlib.compressobj(level, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+        return compressor.compress(body) + compressor.flush()
+    return compress
+
+
+CODECS = [(f"gzip -{level}", gzip_level(level)) for level in (1, 6, 9)] + \
+         [(f"br q{quality}", lambda body, q=quality: brotli.compress(body, quality=q)) for quality in (1, 4, 6, 11)]
+
+
+def best(repeats, fn):
+    times, result = [], None
+    for _ in range(repeats):
+        gc.collect()
+        gc.disable()
+        try:
+            start = time.perf_counter()
+            result = fn()
+            times.append(time.perf_counter() - start)
+        finally:
+            gc.enable()
+    return min(times), result
+
+
+def cpu_per_mb(title, body, repeats=5, chunk_lines=None):
+    megabytes = len(body) / 1e6
+    rows = []
+    if chunk_lines:
+        # As the export is streamed: compressed and flushed one chunk at a time
+        lines = body.splitlines(keepends=True)
+        chunks = [b''.join(lines[i:i + chunk_lines]) for i in range(0, len(lines), chunk_lines)]
+        for encoding in ('gzip', 'br'):
+            compressor = compression.Compressor()
+            seconds, out = best(repeats, lambda: b''.join(compressor.stream(chunks, encoding)))
+            rows.append((f"{encoding} streamed", f"{seconds * 1000 / megabytes:7.1f} ms/MB  {len(out):>9,} bytes  "
+                                                 f"ratio {len(body) / len(out):5.1f}x  ({len(chunks)} flushes)"))
+    for name, compress in CODECS:
+        seconds, out = best(repeats if 'q11' not in name else 1, lambda: compress(body))
+        rows.append((name, f"{seconds * 1000 / megabytes:7.1f} ms/MB  {len(out):>9,} bytes  "
+                           f"ratio {len(body) / len(out):5.1f}x"))
+    report(f"{title}: {len(body):,} bytes", rows)
+
+
+def under_load(count, threads, per_thread):
+    page = appointment_page(count)
+    rows = []
+    for label, encoding, cache_bytes in (('identity', 'identity', 0), ('gzip, no cache', 'gzip', 0),
+                                         ('br, no cache', 'br', 0), ('gzip, cache', 'gzip', 32 << 20),
+                                         ('br, cache', 'br', 32 << 20)):
+        app = Flask(__name__)
+        app.debug = False
+        app.config['COMPRESSION_CACHE_BYTES'] = cache_bytes
+        api = Api(app)
+
+        class Appointments(Resource):
+            def get(self):
+                return page
+
+        api.add_resource(Appointments, '/api/appointments')
+        init_compression(app)
+        client = app.test_client()
+        sizes, samples = [], [[] for _ in range(threads)]
+
+        def worker(index):
+            for _ in range(per_thread):
+                start = time.perf_counter()
+                response = client.get('/api/appointments', headers={'Accept-Encoding': encoding})
+                samples[index].append(time.perf_counter() - start)
+                if index == 0:
+                    sizes.append(len(response.get_data()))
+
+        elapsed = run_threads(worker, threads)
+        latencies = [s for per in samples for s in per]
+        rows.append((label, f"p50 {percentile(latencies, 50) * 1000:6.1f} ms  p95 {percentile(latencies, 95) * 1000:6.1f} ms"
+                            f"  {len(latencies) / elapsed:6.0f} req/s  {sizes[0]:>9,} bytes"))
+    report(f"Appointment list, {count:,} rows, {threads} threads x {per_thread} requests", rows)
+
+
+def main():
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 1000
+    threads = int(sys.argv[2]) if len(sys.argv) > 2 else 8
+    per_thread = int(sys.argv[3]) if len(sys.argv) > 3 else 50
+    cpu_per_mb(f"AppointmentListAPI page, {count:,} rows", json.dumps(appointment_page(count)).encode())
+    cpu_per_mb('Medical record export, 20,000 lines', export_body(20000), chunk_lines=1000)
+    under_load(count, threads, per_thread)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,67 @@
+"""
+Duplicate patient detection: blocked record linkage.
+
+Builds synthetic patients, re-registers 2% of them with a typo in the
+name, a reformatted phone number or a new email, and runs
+``find_duplicates`` serially and with a process pool. Reports the pairs
+actually compared against the n^2/2 an all-pairs pass would need, the
+run time, and precision/recall against the planted duplicates.
+
+    python benchmarks/bench_dedupe.py [sizes] [processes]
+    python benchmarks/bench_dedupe.py 10000,100000 4
+"""
+import os
+import random
+import sys
+import time
+from datetime import date, timedelta
+
+from common import report
+from bench_fuzzy_search import FIRST, surname, misspell
+from dedupe import Record, record, find_duplicates
+
+
+def patients(size, rng):
+    surnames = [surname(rng) for _ in range(max(size // 20, 100))]
+    rows = []
+    for i in range(size):
+        born = date(1930, 1, 1) + timedelta(days=rng.randrange(33000))
+        rows.append(record(Record(f"P{i:07}", rng.choice(FIRST), rng.choice(surnames), born,
+                                  f"555-{rng.randrange(10 ** 7):07}", f"p{i}@example.com")))
+    planted = set()
+    for n, original in enumerate(rng.sample(rows, size // 50)):
+        change = n % 3
+        first = misspell(original.first_name, rng) if change == 0 else original.first_name
+        phone = f"(555) {original.phone[:3]} {original.phone[3:]}" if change == 1 else original.phone
+        rows.append(record(Record(f"Q{n:07}", first, original.last_name, original.birth_date, phone,
+                                  f"new{n}@example.com" if change == 2 else original.email)))
+        planted.add((original.id, f"Q{n:07}"))
+    return rows, planted
+
+
+def run(records, planted, processes):
+    started = time.perf_counter()
+    matches, stats = find_duplicates(records, processes=processes)
+    elapsed = time.perf_counter() - started
+    found = {(m.a.id, m.b.id) for m in matches}
+    precision = len(found & planted) / len(found) if found else 1.0
+    return elapsed, stats, precision, len(found & planted) / len(planted)
+
+
+if __name__ == '__main__':
+    sizes = [int(s) for s in sys.argv[1].split(',')] if len(sys.argv) > 1 else [10000, 100000]
+    processes = int(sys.argv[2]) if len(sys.argv) > 2 else os.cpu_count()
+    print(f"2% planted duplicates, {processes} worker processes for the pool run ({os.cpu_count()} CPUs)")
+    for size in sizes:
+        records, planted = patients(size, random.Random(size))
+        serial, stats, precision, recall = run(records, planted, None)
+        pooled, _, _, _ = run(records, planted, processes)
+        n = len(records)
+        report(f"{n:,} patients", [
+            ('pairs compared', f"{stats['comparisons']:,} of {n * (n - 1) // 2:,} "
+                               f"({stats['comparisons'] / (n * (n - 1) / 2):.5%})"),
+            ('blocks / skipped', f"{stats['blocks']:,} / {stats['skipped_blocks']:,}"),
+            ('serial', f"{serial:.2f}s"),
+            (f"pool x{processes}", f"{pooled:.2f}s"),
+            ('precision / recall', f"{precision:.1%} / {recall:.1%}"),
+        ])
@@ -0,0 +1,127 @@
+"""
+Payload size and encode/decode time of the schedule views per format.
+
+A 30-day schedule for 20 doctors, 16 half-hour slots a day (9,600 rows), is
+marshalled and encoded the way each Accept header is served: JSON (ISO
+timestamps), MessagePack and columnar JSON (epoch seconds). Two field maps:
+DoctorViewScheduleAPI's flat one and ScheduleCheckAvailabilityAPI's, which
+nests the doctor. Marshalling and encoding are the server's cost, decoding
+is what a client pays to parse the body. Best of several runs.
+
+    python benchmarks/bench_formats.py [days] [doctors] [repeats]
+    python benchmarks/bench_formats.py 30 20 7
+"""
+import gc
+import gzip
+import json
+import sys
+import time
+from datetime import datetime, timedelta
+
+from common import report
+from flask import Flask
+from flask_restful import fields
+from models import Department, Doctor, Schedule
+import formats
+from formats import COLUMNS, JSON, MSGPACK, marshal_negotiated
+
+if formats.msgpack is None:
+    raise SystemExit('msgpack is not installed')
+import msgpack
+
+# DoctorViewScheduleAPI (resources/doctors.py)
+flat_fields = {
+    'id': fields.String,
+    'datetime': fields.DateTime,
+    'duration': fields.Integer,
+    'is_available': fields.Boolean,
+}
+
+# ScheduleCheckAvailabilityAPI (resources/schedules.py): the doctor nested in every row
+doctor_fields = {
+    'id': fields.String,
+    'first_name': fields.String,
+    'last_name': fields.String,
+    'department': fields.String(attribute=lambda d: d.department_obj.name if d.department_obj else None),
+    'availability': fields.Raw,
+    'phone': fields.String,
+}
+nested_fields = {
+    'id': fields.String,
+    'doctor_id': fields.String,
+    'doctor': fields.Nested(doctor_fields),
+    'datetime': fields.DateTime(dt_format='iso8601'),
+    'day': fields.String(attribute=lambda s: s.datetime.strftime("%A")),
+    'duration': fields.Integer,
+    'is_available': fields.Boolean,
+}
+
+ENCODERS = {
+    JSON: lambda data: (json.dumps(data) + "\n").encode(),
+    MSGPACK: lambda data: msgpack.packb(data, use_bin_type=True),
+    COLUMNS: lambda data: (json.dumps(data, separators=(',', ':')) + "\n").encode(),
+}
+DECODERS = {
+    JSON: json.loads,
+    MSGPACK: lambda body: msgpack.unpackb(body, raw=False),
+    COLUMNS: json.loads,
+}
+
+
+def build(days, doctors):
+    department = Department(id='DEPT1', name='Cardiology')
+    staff = [Doctor(id=f"D{d:03}", first_name='John', last_name=f"Smith{d}", phone='555-0100',
+                    department_obj=department, availability={'Monday': '9-17', 'Tuesday': '9-17'})
+             for d in range(doctors)]
+    start = datetime(2030, 1, 7, 9)
+    return [Schedule(id=f"SC{n:07}", doctor_id=doctor.id, doctor=doctor,
+                     datetime=start + timedelta(days=day, minutes=30 * slot), duration=30,
+                     is_available=(day + slot) % 3 != 0)
+            for n, (doctor, day, slot) in enumerate((doctor, day, slot) for doctor in staff
+                                                   for day in range(days) for slot in range(16))]
+
+
+def best(repeats, fn):
+    # As timeit does: no collector pauses inside a run (9,600 ORM rows make them long)
+    times, result = [], None
+    for _ in range(repeats):
+        gc.collect()
+        gc.disable()
+        try:
+            start = time.perf_counter()
+            result = fn()
+            times.append(time.perf_counter() - start)
+        finally:
+            gc.enable()
+    return min(times), result
+
+
+def main():
+    days = int(sys.argv[1]) if len(sys.argv) > 1 else 30
+    doctors = int(sys.argv[2]) if len(sys.argv) > 2 else 20
+    repeats = int(sys.argv[3]) if len(sys.argv) > 3 else 7
+    schedules = build(days, doctors)
+    app = Flask(__name__)
+
+    for title, item_fields in (('DoctorViewScheduleAPI fields', flat_fields),
+                               ('ScheduleCheckAvailabilityAPI fields (doctor nested)', nested_fields)):
+        rows, baseline = [], None
+        for mediatype, encode in ENCODERS.items():
+            with app.test_request_context(headers={'Accept': mediatype}):
+                marshal_time, data = best(repeats, lambda: marshal_negotiated(schedules, item_fields))
+            encode_time, body = best(repeats, lambda: encode(data))
+            decode_time, _ = best(repeats, lambda: DECODERS[mediatype](body))
+            baseline = baseline or (len(body), marshal_time + encode_time, decode_time)
+            total = marshal_time + encode_time
+            rows += [
+                (f"{mediatype}: bytes", f"{len(body):>10,}  ({len(body) / baseline[0]:.0%} of JSON), "
+                                        f"gzip {len(gzip.compress(body, 6)):,}"),
+                (f"{mediatype}: marshal + encode ms", f"{marshal_time * 1000:>6.1f} + {encode_time * 1000:5.1f}"
+                                                      f"  ({total / baseline[1]:.0%})"),
+                (f"{mediatype}: decode ms", f"{decode_time * 1000:>10.1f}  ({decode_time / baseline[2]:.0%})"),
+            ]
+        report(f"{title}: {days} days x {doctors} doctors = {len(schedules):,} slots, best of {repeats}", rows)
+
+
+if __name__ == '__main__':
+    main()
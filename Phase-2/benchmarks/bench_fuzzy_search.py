@@ -0,0 +1,123 @@
+"""
+Fuzzy patient name search: phonetic-key candidates vs scoring every row.
+
+The patients table is filled with synthetic names (first names from a
+fixed list, surnames built from syllables so there are thousands of
+them), with the phonetic keys written alongside as the mapper event
+would. Queries are real names with a typo: a dropped, doubled or swapped
+letter, or a sound-alike spelling. Each is run through
+``fuzzy_patient_matches`` and, on a sample, through a full scan that
+trigram-scores every name. Reports p50/p99 latency, candidates read per
+query, and recall (the misspelt name is in the top 10).
+
+    python benchmarks/bench_fuzzy_search.py [sizes] [queries]
+    python benchmarks/bench_fuzzy_search.py 10000,100000,1000000 200
+"""
+import random
+import sys
+import time
+from functools import lru_cache
+
+from common import make_engine, percentile, report
+from sqlalchemy import insert
+from models import Patient
+from phonetic import name_keys, similarity, trigrams
+import search
+
+FIRST = ['James', 'Mary', 'Robert', 'Patricia', 'John', 'Jennifer', 'Michael', 'Linda', 'David', 'Elizabeth',
+         'William', 'Barbara', 'Richard', 'Susan', 'Joseph', 'Jessica', 'Thomas', 'Sarah', 'Charles', 'Karen',
+         'Catherine', 'Stephen', 'Philip', 'Christina', 'Ahmed', 'Fatima', 'Carlos', 'Sofia', 'Ivan', 'Olga']
+SYLLABLES = ['an', 'ber', 'cal', 'dor', 'el', 'fen', 'gar', 'hol', 'ing', 'kir', 'lan', 'mor', 'nes', 'ost',
+             'par', 'quin', 'ros', 'sten', 'tor', 'val', 'wick', 'yar', 'zel', 'ash', 'brook', 'ford', 'ley', 'ton']
+SOUNDS_LIKE = [('ph', 'f'), ('c', 'k'), ('y', 'i'), ('ck', 'k'), ('th', 't'), ('s', 'z')]
+
+
+def surname(rng):
+    return ''.join(rng.choice(SYLLABLES) for _ in range(rng.choice((2, 2, 3)))).capitalize()
+
+
+@lru_cache(maxsize=None)
+def keys(first, last):
+    return name_keys(first, last)
+
+
+def build(size):
+    rng = random.Random(size)
+    engine, Session = make_engine(f"fuzzy-{size}.db")
+    surnames = [surname(rng) for _ in range(max(size // 50, 100))]
+    rows = []
+    for i in range(size):
+        first, last = rng.choice(FIRST), rng.choice(surnames)
+        rows.append({'id': f"P{i:07}", 'first_name': first, 'last_name': last,
+                     'email': f"p{i}@example.com", **keys(first, last)})
+    with engine.begin() as conn:
+        for start in range(0, size, 50000):
+            conn.execute(insert(Patient), rows[start:start + 50000])
+    return engine, Session, rows
+
+
+def misspell(word, rng):
+    for wrong, right in rng.sample(SOUNDS_LIKE, len(SOUNDS_LIKE)):
+        if wrong in word.lower() and rng.random() < 0.5:
+            return word.lower().replace(wrong, right, 1).capitalize()
+    i = rng.randrange(1, len(word) - 1)
+    kind = rng.choice(('drop', 'double', 'swap'))
+    if kind == 'drop':
+        return word[:i] + word[i + 1:]
+    if kind == 'double':
+        return word[:i] + word[i] + word[i:]
+    return word[:i] + word[i + 1] + word[i] + word[i + 2:]
+
+
+def queries(rows, count):
+    rng = random.Random(1)
+    picked = []
+    for _ in range(count):
+        row = rng.choice(rows)
+        wrong = rng.choice(('first', 'last'))
+        first = misspell(row['first_name'], rng) if wrong == 'first' else row['first_name']
+        last = misspell(row['last_name'], rng) if wrong == 'last' else row['last_name']
+        picked.append((f"{first} {last}", (row['first_name'], row['last_name'])))
+    return picked
+
+
+def scan_matches(session, query, limit=10):
+    """The alternative without keys: trigram-score every patient name"""
+    grams = trigrams(query)
+    scored = [(round(similarity(grams, f"{first} {last}"), 4), pid) for pid, first, last
+              in session.query(Patient.id, Patient.first_name, Patient.last_name).yield_per(10000)]
+    scored.sort(key=lambda match: (-match[0], match[1]))
+    return [(pid, score) for score, pid in scored[:limit]]
+
+
+def measure(session, matcher, qs, names):
+    samples, found = [], 0
+    for query, expected in qs:
+        started = time.perf_counter()
+        matches = matcher(session, query)
+        samples.append(time.perf_counter() - started)
+        found += expected in {names[pid] for pid, _ in matches}
+    return percentile(samples, 50) * 1000, percentile(samples, 99) * 1000, found / len(qs)
+
+
+if __name__ == '__main__':
+    sizes = [int(s) for s in sys.argv[1].split(',')] if len(sys.argv) > 1 else [10000, 100000, 1000000]
+    count = int(sys.argv[2]) if len(sys.argv) > 2 else 200
+    print(f"{count} misspelt 'first last' queries per size, top 10, SQLite")
+    for size in sizes:
+        engine, Session, rows = build(size)
+        names = {row['id']: (row['first_name'], row['last_name']) for row in rows}
+        session = Session()
+        qs = queries(rows, count)
+
+        candidates = [session.query(Patient.id).filter(search._fuzzy_candidates(q.split())).count() for q, _ in qs[:50]]
+        fz50, fz99, fz_recall = measure(session, search.fuzzy_patient_matches, qs, names)
+        # Scoring every row is slow enough at 1M that a sample is plenty
+        sc50, sc99, sc_recall = measure(session, scan_matches, qs[:max(5, count * 2000 // size)], names)
+        report(f"{size:,} patients", [
+            ('candidates p50 / max', f"{percentile(candidates, 50):,.0f} / {max(candidates):,}"),
+            ('phonetic p50 / p99', f"{fz50:.2f} / {fz99:.2f} ms  recall {fz_recall:.0%}"),
+            ('full scan p50 / p99', f"{sc50:.2f} / {sc99:.2f} ms  recall {sc_recall:.0%}"),
+        ])
+        session.close()
+        engine.dispose()
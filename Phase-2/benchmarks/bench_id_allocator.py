@@ -0,0 +1,81 @@
+"""
+Appointment inserts/sec for concurrent bookers: "ORDER BY id DESC" vs IdAllocator.
+
+The legacy path reads the highest ID, increments it and inserts; concurrent
+bookers read the same maximum and collide on the primary key, so they retry.
+The default load (32 x 30 = 960 rows) stays below A999 because past that
+point the legacy path stops working altogether ("A999" > "A1000").
+
+    python benchmarks/bench_id_allocator.py [bookers] [inserts_per_booker]
+"""
+import sys
+import threading
+
+from common import make_engine, run_threads, report
+from sqlalchemy import func, select
+from sqlalchemy.exc import IntegrityError
+from models import Appointment
+from id_allocator import IdAllocator
+
+MAX_RETRIES = 50
+
+
+def legacy_insert(session):
+    last_appointment = session.query(Appointment).order_by(Appointment.id.desc()).first()
+    new_id = f"A{(int(last_appointment.id[1:]) + 1) if last_appointment else 1:03}"
+    session.add(Appointment(id=new_id, patient_id='P001', doctor_id='D001', status='Scheduled'))
+    session.commit()
+
+
+def run(label, bookers, per_booker, insert_factory):
+    engine, Session = make_engine()
+    insert = insert_factory(engine)
+    stats = {'collisions': 0, 'failed': 0}
+    lock = threading.Lock()
+
+    def worker(_):
+        session = Session()
+        try:
+            for _ in range(per_booker):
+                for _ in range(MAX_RETRIES):
+                    try:
+                        insert(session)
+                        break
+                    except IntegrityError:
+                        session.rollback()
+                        with lock:
+                            stats['collisions'] += 1
+                else:
+                    with lock:
+                        stats['failed'] += 1
+        finally:
+            session.close()
+
+    elapsed = run_threads(worker, bookers)
+    with engine.connect() as conn:
+        stored = conn.execute(select(func.count()).select_from(Appointment.__table__)).scalar()
+    engine.dispose()
+    report(label, [
+        ('rows inserted', stored),
+        ('elapsed', f"{elapsed:.2f}s"),
+        ('inserts/sec', f"{stored / elapsed:,.0f}"),
+        ('PK collisions', stats['collisions']),
+        ('gave up', stats['failed']),
+    ])
+
+
+def allocator_factory(engine):
+    allocator = IdAllocator('appointments', 'A', 3, Appointment.id, bind=engine)
+
+    def insert(session):
+        session.add(Appointment(id=allocator.next_id(), patient_id='P001', doctor_id='D001', status='Scheduled'))
+        session.commit()
+    return insert
+
+
+if __name__ == '__main__':
+    bookers = int(sys.argv[1]) if len(sys.argv) > 1 else 32
+    per_booker = int(sys.argv[2]) if len(sys.argv) > 2 else 30
+    print(f"{bookers} concurrent bookers x {per_booker} appointments each (SQLite, WAL)")
+    run('Before: ORDER BY id DESC', bookers, per_booker, lambda engine: legacy_insert)
+    run('After: IdAllocator (block size 50)', bookers, per_booker, allocator_factory)
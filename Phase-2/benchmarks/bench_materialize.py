@@ -0,0 +1,101 @@
+"""
+Availability edits for a doctor with 2,000 future slots: rebuild vs diff.
+
+"Rebuild" is the old DoctorSetAvailabilityAPI flow (delete every future
+slot, re-insert the whole window). "Diff" is slots.materialize_schedule.
+Each scenario starts from the same 2,000 slots with 10% of them booked.
+
+    python benchmarks/bench_materialize.py
+"""
+import time
+from datetime import datetime, timedelta
+
+from common import make_engine, report
+from sqlalchemy import event, func, select
+from models import Doctor, Patient, Schedule, Appointment
+from id_allocator import schedule_ids
+from slots import expand_slots, parse_availability, materialize_schedule
+
+DAYS = 125
+BASE = {day: "6-22" for day in ["Monday", "Tuesday", "Wednesday", "Thursday", "Friday", "Saturday", "Sunday"]}
+SCENARIOS = [
+    ('no-op edit', BASE),
+    ('one weekday shortened by 2h', dict(BASE, Monday="7-21")),
+    ('one weekday removed', {day: spec for day, spec in BASE.items() if day != "Sunday"}),
+]
+
+
+def legacy_rebuild(session, doctor_id, availability, start_date, days):
+    session.query(Schedule).filter(
+        Schedule.doctor_id == doctor_id,
+        Schedule.datetime >= start_date
+    ).delete()
+    slots = expand_slots(parse_availability(availability), start_date, start_date + timedelta(days=days))
+    session.bulk_save_objects([
+        Schedule(id=f"SC{i:04}", doctor_id=doctor_id, datetime=slot, duration=60, is_available=True)
+        for i, slot in enumerate(slots, 1)
+    ])
+
+
+def diff(session, doctor_id, availability, start_date, days):
+    materialize_schedule(session, doctor_id, availability, start_date=start_date, days=days)
+
+
+def setup(start_date):
+    engine, Session = make_engine()
+    schedule_ids.bind = engine
+    schedule_ids.reset()
+    session = Session()
+    session.add(Doctor(id='D001', first_name='John', last_name='Smith', specialization='Cardiology',
+                       qualification='MD', experience_years=10))
+    session.add(Patient(id='P001', first_name='Ann', last_name='Lee', email='ann@example.com'))
+    session.commit()
+    materialize_schedule(session, 'D001', BASE, start_date=start_date, days=DAYS)
+    session.commit()
+    booked = session.query(Schedule.id).order_by(Schedule.datetime).all()[::10]
+    session.query(Schedule).filter(Schedule.id.in_([sid for (sid,) in booked])).update(
+        {'is_available': False}, synchronize_session=False)
+    session.add_all(Appointment(id=f"A{i:04}", patient_id='P001', doctor_id='D001', schedule_id=sid, status='Scheduled')
+                    for i, (sid,) in enumerate(booked, 1))
+    session.commit()
+    session.close()
+    return engine, Session, len(booked)
+
+
+def measure(apply, availability):
+    start_date = datetime.now().replace(hour=0, minute=0, second=0, microsecond=0) + timedelta(days=1)
+    engine, Session, booked = setup(start_date)
+    statements, written = [], []
+
+    def count(conn, cursor, statement, *args):
+        statements.append(1)
+        if not statement.lstrip().upper().startswith('SELECT') and cursor.rowcount > 0:
+            written.append(cursor.rowcount)
+    event.listen(engine, 'after_cursor_execute', count)
+    session = Session()
+    started = time.perf_counter()
+    apply(session, 'D001', availability, start_date, DAYS)
+    session.commit()
+    elapsed = time.perf_counter() - started
+    session.close()
+    with engine.connect() as conn:
+        # Booked slots survive only if the row is still there and still marked taken
+        kept = conn.execute(
+            select(func.count())
+            .select_from(Appointment.__table__.join(Schedule.__table__))
+            .where(Schedule.is_available == False)
+        ).scalar()
+    engine.dispose()
+    return elapsed, len(statements), sum(written), booked - kept
+
+
+if __name__ == '__main__':
+    total = len(list(expand_slots(parse_availability(BASE), datetime(2030, 1, 1), datetime(2030, 1, 1) + timedelta(days=DAYS))))
+    print(f"Doctor with {total} future slots over {DAYS} days, 10% booked (SQLite, WAL)")
+    for name, availability in SCENARIOS:
+        rows = []
+        for label, apply in [('rebuild', legacy_rebuild), ('diff', diff)]:
+            elapsed, statements, written, lost = measure(apply, availability)
+            rows.append((label, f"{elapsed * 1000:7.1f} ms  {statements:2} statements  "
+                                f"{written:5} rows written  {lost:4} booked slots lost"))
+        report(name, rows)
@@ -0,0 +1,118 @@
+"""
+Cost of the Prometheus instrumentation per request and per query.
+
+The request hooks that ``init_metrics`` installs are called directly inside
+one pushed request context, so the figure is their own cost without the
+noise of routing and the test client. The query listeners are timed by
+running ``SELECT 1`` with and without them. An end-to-end comparison
+through the test client is printed as well. The whole run is repeated in
+a child process with ``PROMETHEUS_MULTIPROC_DIR`` set, where every update
+goes to an mmap'd file instead of memory.
+
+    python benchmarks/bench_metrics.py [requests]
+"""
+import os
+import subprocess
+import sys
+import tempfile
+import time
+
+from common import percentile, report
+from flask import Flask
+from sqlalchemy import create_engine, text
+import metrics
+
+ROUNDS = 15
+
+
+def best_of(run, n):
+    """Fastest of several rounds, in microseconds per call"""
+    rounds = []
+    for _ in range(ROUNDS):
+        start = time.perf_counter()
+        run(n)
+        rounds.append((time.perf_counter() - start) / n * 1e6)
+    return min(rounds)
+
+
+def hook_cost(n):
+    app = Flask(__name__)
+    metrics.init_metrics(app, create_engine('sqlite://'))
+    app.add_url_rule('/items/<item_id>', 'item', lambda item_id: 'ok')
+    before, = app.before_request_funcs[None]
+    after, = app.after_request_funcs[None]
+    teardown, = app.teardown_request_funcs[None]
+    response = app.response_class('ok')
+
+    def run(count):
+        for _ in range(count):
+            before()
+            after(response)
+            teardown(None)
+
+    with app.test_request_context('/items/1'):
+        app.preprocess_request()  # matches the URL rule
+        teardown(None)
+        return best_of(run, n)
+
+
+def query_cost(n):
+    """SELECT 1 on a plain engine and on an instrumented one, rounds interleaved to share the noise"""
+    plain, instrumented = create_engine('sqlite://'), create_engine('sqlite://')
+    metrics.init_metrics(Flask(__name__), instrumented)
+    statement = text('SELECT 1')
+    connections = [plain.connect(), instrumented.connect()]
+    metrics._local.route = metrics._route_metrics('GET', '/bench')
+    metrics._local.queries, metrics._local.query_seconds = 0, 0.0
+    rounds = [[], []]
+    for _ in range(ROUNDS):
+        for conn, results in zip(connections, rounds):
+            start = time.perf_counter()
+            for _ in range(n):
+                conn.execute(statement)
+            results.append((time.perf_counter() - start) / n * 1e6)
+    metrics._local.route = None
+    for conn in connections:
+        conn.close()
+    return min(rounds[0]), min(rounds[1])
+
+
+def end_to_end(n):
+    """Test client p50 with and without the hooks, requests interleaved"""
+    clients = []
+    for instrument in (False, True):
+        app = Flask(__name__)
+        if instrument:
+            metrics.init_metrics(app)
+        app.add_url_rule('/items/<item_id>', 'item', lambda item_id: 'ok')
+        clients.append(app.test_client())
+    samples = [[], []]
+    for i in range(n + 500):
+        for client, results in zip(clients, samples):
+            start = time.perf_counter()
+            client.get(f"/items/{i}")
+            if i >= 500:  # warm up
+                results.append(time.perf_counter() - start)
+    return [percentile(results, 50) * 1e6 for results in samples]
+
+
+def main():
+    n = int(sys.argv[1]) if len(sys.argv) > 1 else 20000
+    mode = 'multiprocess (mmap files)' if metrics.MULTIPROCESS else 'single process'
+    plain_query, instrumented_query = query_cost(n)
+    plain_request, instrumented_request = end_to_end(n // 4)
+    report(f"Prometheus metrics, {mode}", [
+        ('request hooks', f"{hook_cost(n):.2f} us/request"),
+        ('query listeners', f"{instrumented_query - plain_query:.2f} us/query "
+                            f"({plain_query:.1f} -> {instrumented_query:.1f} us per SELECT 1)"),
+        ('test client p50', f"{plain_request:.0f} -> {instrumented_request:.0f} us/request"),
+    ])
+
+    if not metrics.MULTIPROCESS:
+        with tempfile.TemporaryDirectory() as directory:
+            env = dict(os.environ, PROMETHEUS_MULTIPROC_DIR=directory)
+            subprocess.run([sys.executable, '-u', __file__, str(n)], env=env, check=True)
+
+
+if __name__ == '__main__':
+    main()
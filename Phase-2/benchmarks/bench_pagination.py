@@ -0,0 +1,66 @@
+"""
+Keyset vs OFFSET pagination on a 1M-row appointments table.
+
+Times fetching one 50-row page at page 1, 100, 1,000 and 10,000 with the
+cursor layer (``pagination.paginate``) and with the equivalent
+``ORDER BY id LIMIT 50 OFFSET n`` query. The cursor for page N is built
+from the id of the row just before it, exactly as the API would have
+handed it out.
+
+    python benchmarks/bench_pagination.py [rows] [page_size] [repeats]
+"""
+import sys
+import time
+
+from common import make_engine, percentile, report
+from sqlalchemy import insert
+from models import Appointment
+from pagination import paginate, encode_cursor
+
+PAGES = [1, 100, 1000, 10000]
+
+
+def build(rows):
+    engine, Session = make_engine('pagination.db')
+    chunk = 50000
+    with engine.begin() as conn:
+        for start in range(0, rows, chunk):
+            conn.execute(insert(Appointment), [
+                {'id': f"A{i:07}", 'patient_id': f"P{i % 5000:04}", 'doctor_id': f"D{i % 200:03}",
+                 'schedule_id': f"SC{i:07}", 'status': 'Scheduled'}
+                for i in range(start, min(start + chunk, rows))
+            ])
+    return engine, Session
+
+
+def time_page(fetch, repeats):
+    samples = []
+    for _ in range(repeats):
+        started = time.perf_counter()
+        rows = fetch()
+        samples.append(time.perf_counter() - started)
+    assert rows
+    return percentile(samples, 50) * 1000
+
+
+if __name__ == '__main__':
+    rows = int(sys.argv[1]) if len(sys.argv) > 1 else 1000000
+    page_size = int(sys.argv[2]) if len(sys.argv) > 2 else 50
+    repeats = int(sys.argv[3]) if len(sys.argv) > 3 else 20
+    print(f"{rows:,} appointments, {page_size} per page, median of {repeats} (SQLite, WAL)")
+    engine, Session = build(rows)
+    session = Session()
+    query = session.query(Appointment)
+
+    keyset, offset = [], []
+    for page in PAGES:
+        skip = (page - 1) * page_size
+        cursor = encode_cursor([f"A{skip - 1:07}"]) if skip else None
+        keyset.append((f"page {page:,}",
+                       f"{time_page(lambda: paginate(query, [Appointment.id], cursor, page_size)[0], repeats):.2f} ms"))
+        offset.append((f"page {page:,}",
+                       f"{time_page(lambda: query.order_by(Appointment.id).limit(page_size).offset(skip).all(), repeats):.2f} ms"))
+    report('keyset cursor (paginate)', keyset)
+    report('LIMIT/OFFSET', offset)
+    session.close()
+    engine.dispose()
@@ -0,0 +1,111 @@
+"""
+Connection pool under 64 concurrent clients.
+
+Each client thread sends requests through its own Flask test client to an
+endpoint that runs a query on its request session and then holds the
+connection for ``latency`` seconds. The sleep stands in for the network
+round trip and server time of a SQL Server query, which SQLite doesn't
+have; like a socket wait it releases the GIL. The engine is built by
+``create_db_engine`` from a config dict, so the pool is the same
+TimedQueuePool the app uses and the wait times come from ``pool_stats``.
+
+Reports throughput, request latency, pool wait p50/p99/max, peak
+connections checked out and timeouts for several pool sizes.
+
+    python benchmarks/bench_pool_load.py [clients] [requests per client] [latency ms]
+    python benchmarks/bench_pool_load.py 64 50 5
+"""
+import os
+import sys
+import tempfile
+import threading
+import time
+
+from common import percentile, report, run_threads
+from flask import Flask
+from sqlalchemy.orm import sessionmaker
+from db import Base, create_db_engine, pool_stats
+from db_session import get_session, init_sessions
+from models import Department
+
+POOLS = [  # (pool size, max overflow)
+    (5, 10),   # Config defaults
+    (20, 10),  # ProductionConfig
+    (64, 0),
+]
+
+
+def build(pool_size, max_overflow, latency):
+    path = os.path.join(tempfile.mkdtemp(prefix='hms-bench-'), 'pool.db')
+    engine = create_db_engine({
+        'SQLALCHEMY_DATABASE_URI': f"sqlite:///{path}",
+        'SQLALCHEMY_POOL_SIZE': pool_size,
+        'SQLALCHEMY_MAX_OVERFLOW': max_overflow,
+        'SQLALCHEMY_POOL_TIMEOUT': 30,
+    })
+    Base.metadata.create_all(bind=engine)
+    Session = sessionmaker(bind=engine)
+    with Session() as session:
+        session.add_all(Department(id=f"DEPT{i:03}", name=f"Department {i}") for i in range(100))
+        session.commit()
+
+    app = Flask(__name__)
+    init_sessions(app, Session)
+
+    @app.route('/departments/<department_id>')
+    def department(department_id):
+        get_session().get(Department, department_id)
+        time.sleep(latency)
+        return {}
+
+    return engine, app
+
+
+def main():
+    clients = int(sys.argv[1]) if len(sys.argv) > 1 else 64
+    per_client = int(sys.argv[2]) if len(sys.argv) > 2 else 50
+    latency = (float(sys.argv[3]) if len(sys.argv) > 3 else 5) / 1000
+    print(f"{clients} clients x {per_client} requests, {latency * 1000:.0f} ms held per request")
+
+    for pool_size, max_overflow in POOLS:
+        engine, app = build(pool_size, max_overflow, latency)
+        engine.pool.recent_waits = type(engine.pool.recent_waits)(maxlen=clients * per_client)
+        samples = [[] for _ in range(clients)]
+        peak = [0]
+        running = threading.Event()
+        running.set()
+
+        def watch():
+            while running.is_set():
+                peak[0] = max(peak[0], engine.pool.checkedout())
+                time.sleep(0.0005)
+
+        def worker(index):
+            client = app.test_client()
+            for i in range(per_client):
+                start = time.perf_counter()
+                client.get(f"/departments/DEPT{(index + i) % 100:03}")
+                samples[index].append(time.perf_counter() - start)
+
+        watcher = threading.Thread(target=watch)
+        watcher.start()
+        elapsed = run_threads(worker, clients)
+        running.clear()
+        watcher.join()
+
+        latencies = [s for client in samples for s in client]
+        stats = pool_stats(engine)
+        report(f"pool_size={pool_size} max_overflow={max_overflow}", [
+            ('throughput', f"{len(latencies) / elapsed:,.0f} req/s"),
+            ('request p50 / p99', f"{percentile(latencies, 50) * 1000:.1f} / {percentile(latencies, 99) * 1000:.1f} ms"),
+            ('pool wait p50 / p99', f"{stats['wait_seconds_p50'] * 1000:.2f} / {stats['wait_seconds_p99'] * 1000:.2f} ms"),
+            ('pool wait max', f"{stats['wait_seconds_max'] * 1000:.1f} ms"),
+            ('pool wait share', f"{stats['wait_seconds_total'] / sum(latencies):.0%} of request time"),
+            ('peak checked out', peak[0]),
+            ('timeouts', stats['timeouts']),
+        ])
+        engine.dispose()
+
+
+if __name__ == '__main__':
+    main()
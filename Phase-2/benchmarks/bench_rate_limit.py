@@ -0,0 +1,94 @@
+"""
+Rate limiter microbenchmark: throughput across 16 threads and memory for 1M keys.
+
+"legacy" is the previous implementation (a timestamp list per key, rebuilt
+on every call under one global lock, keys never deleted).
+
+    python benchmarks/bench_rate_limit.py [threads] [checks_per_thread] [distinct_keys]
+"""
+import gc
+import sys
+import threading
+import time
+import tracemalloc
+from collections import defaultdict
+
+from common import run_threads, report
+import rate_limit
+from rate_limit import RateLimiter, SLIDING_WINDOW, TOKEN_BUCKET
+
+
+class LegacyRateLimiter:
+    def __init__(self, requests_per_minute=60):
+        self.requests_per_minute = requests_per_minute
+        self.requests = defaultdict(list)
+        self.lock = threading.Lock()
+
+    def is_allowed(self, key):
+        now = time.time()
+        minute_ago = now - 60
+        with self.lock:
+            self.requests[key] = [req_time for req_time in self.requests[key]
+                                  if req_time > minute_ago]
+            if len(self.requests[key]) >= self.requests_per_minute:
+                return False
+            self.requests[key].append(now)
+            return True
+
+
+def throughput(limiter, threads, per_thread):
+    # 1,000 active clients, each thread cycling through its own share
+    keys = [f"client-{i}" for i in range(1000)]
+
+    def worker(index):
+        check = limiter.is_allowed
+        for i in range(per_thread):
+            check(keys[(index * 7919 + i) % 1000])
+
+    elapsed = run_threads(worker, threads)
+    return threads * per_thread / elapsed
+
+
+def memory(factory, distinct):
+    """Traced bytes after one check from each of ``distinct`` keys, and again once they have gone idle"""
+    keys = [f"key-{i:07}" for i in range(distinct)]
+    gc.collect()
+    tracemalloc.start()
+    limiter = factory()
+    for key in keys:
+        limiter.is_allowed(key)
+    gc.collect()
+    loaded, _ = tracemalloc.get_traced_memory()
+
+    if hasattr(limiter, 'evict_idle'):
+        # Pretend two windows passed without traffic
+        real_time = rate_limit.time.time
+        rate_limit.time.time = lambda: real_time() + 121
+        try:
+            limiter.evict_idle()
+        finally:
+            rate_limit.time.time = real_time
+    gc.collect()
+    idle, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return loaded, idle
+
+
+if __name__ == '__main__':
+    threads = int(sys.argv[1]) if len(sys.argv) > 1 else 16
+    per_thread = int(sys.argv[2]) if len(sys.argv) > 2 else 50000
+    distinct = int(sys.argv[3]) if len(sys.argv) > 3 else 1000000
+    print(f"{threads} threads x {per_thread:,} checks over 1,000 keys; memory after {distinct:,} distinct keys")
+    candidates = [
+        ('legacy (timestamp lists, global lock)', lambda: LegacyRateLimiter(requests_per_minute=60)),
+        ('sliding window counter', lambda: RateLimiter(requests_per_minute=60, algorithm=SLIDING_WINDOW)),
+        ('token bucket', lambda: RateLimiter(requests_per_minute=60, algorithm=TOKEN_BUCKET)),
+    ]
+    for label, factory in candidates:
+        rate = throughput(factory(), threads, per_thread)
+        loaded, idle = memory(factory, distinct)
+        report(label, [
+            ('checks/sec', f"{rate:,.0f}"),
+            (f"memory, {distinct:,} keys", f"{loaded / 1024 / 1024:,.1f} MiB"),
+            ('memory once idle', f"{idle / 1024 / 1024:,.1f} MiB"),
+        ])
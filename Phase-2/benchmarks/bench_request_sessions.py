@@ -0,0 +1,79 @@
+"""
+Per-request session cost: a session per call site vs one per request.
+
+Before request-scoped sessions a request that touched the database from
+three places (say the handler, a lookup helper and an index refresh)
+opened and closed three sessions, each checking a connection out of the
+pool and running its own transaction. The same three queries are served
+here both ways through a Flask test client. Reports p50/p99 latency and
+pool checkouts per request.
+
+    python benchmarks/bench_request_sessions.py [requests]
+"""
+import sys
+import time
+
+from common import make_engine, percentile, report
+from flask import Flask
+from sqlalchemy import event
+from models import Department
+from db_session import get_session, init_sessions
+
+CALL_SITES = 3
+
+
+def build_app(Session):
+    app = Flask(__name__)
+    init_sessions(app, Session)
+
+    @app.route('/per-call/<department_id>')
+    def per_call(department_id):
+        for _ in range(CALL_SITES):
+            session = Session()
+            try:
+                session.get(Department, department_id)
+            finally:
+                session.close()
+        return {}
+
+    @app.route('/per-request/<department_id>')
+    def per_request(department_id):
+        for _ in range(CALL_SITES):
+            get_session().get(Department, department_id)
+        return {}
+
+    return app
+
+
+def main():
+    requests = int(sys.argv[1]) if len(sys.argv) > 1 else 5000
+    engine, Session = make_engine('request-sessions.db')
+    with Session() as session:
+        session.add_all(Department(id=f"DEPT{i:03}", name=f"Department {i}") for i in range(100))
+        session.commit()
+    client = build_app(Session).test_client()
+
+    checkouts = []
+    event.listen(engine, 'checkout', lambda *args: checkouts.append(1))
+    for title, prefix in (('session per call site (old)', '/per-call'),
+                          ('session per request', '/per-request')):
+        for i in range(200):  # warm up
+            client.get(f"{prefix}/DEPT{i % 100:03}")
+        checkouts.clear()
+        samples = []
+        for i in range(requests):
+            start = time.perf_counter()
+            client.get(f"{prefix}/DEPT{i % 100:03}")
+            samples.append(time.perf_counter() - start)
+        report(title, [
+            ('requests', f"{requests:,}"),
+            ('checkouts/request', f"{len(checkouts) / requests:.1f}"),
+            ('p50', f"{percentile(samples, 50) * 1e6:.0f} us"),
+            ('p99', f"{percentile(samples, 99) * 1e6:.0f} us"),
+            ('throughput', f"{requests / sum(samples):,.0f} req/s"),
+        ])
+    engine.dispose()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,108 @@
+"""
+Patient search latency: in-process inverted index vs the old ilike scan.
+
+For each table size the patients table is filled with synthetic names,
+emails and phones, then the same queries (a surname, a first-name prefix,
+a "first last" pair, a phone number) are run through
+``InvertedIndex.search`` plus the row fetch, and through the previous
+``ilike('%q%')`` query. Reports p50/p99 latency and index build time.
+
+    python benchmarks/bench_search_index.py [sizes] [queries]
+    python benchmarks/bench_search_index.py 10000,100000,1000000 200
+"""
+import random
+import sys
+import time
+
+from common import make_engine, percentile, report
+from sqlalchemy import insert, or_
+from models import Patient
+from search_index import InvertedIndex, patient_document
+
+FIRST = ['James', 'Mary', 'Robert', 'Patricia', 'John', 'Jennifer', 'Michael', 'Linda', 'David', 'Elizabeth',
+         'William', 'Barbara', 'Richard', 'Susan', 'Joseph', 'Jessica', 'Thomas', 'Sarah', 'Charles', 'Karen',
+         'Ahmed', 'Fatima', 'Wei', 'Mei', 'Carlos', 'Sofia', 'Ivan', 'Olga', 'Kenji', 'Yuki']
+LAST = ['Smith', 'Johnson', 'Williams', 'Brown', 'Jones', 'Garcia', 'Miller', 'Davis', 'Rodriguez', 'Martinez',
+        'Hernandez', 'Lopez', 'Gonzalez', 'Wilson', 'Anderson', 'Thomas', 'Taylor', 'Moore', 'Jackson', 'Martin',
+        'Lee', 'Perez', 'Thompson', 'White', 'Harris', 'Sanchez', 'Clark', 'Ramirez', 'Lewis', 'Robinson']
+
+
+def person(i, rng):
+    first = rng.choice(FIRST)
+    # Suffix the surname so the vocabulary grows with the table like real data does
+    last = f"{rng.choice(LAST)}{'' if i % 4 else rng.choice(['son', 'ova', 'ez', 'er', 'man'])}{i % 997 if i % 3 == 0 else ''}"
+    return {'id': f"P{i:07}", 'first_name': first, 'last_name': last,
+            'email': f"{first.lower()}.{last.lower()}.{i}@example.com", 'phone': f"555-{i:07}"}
+
+
+def build(size):
+    rng = random.Random(size)
+    engine, Session = make_engine(f"search-{size}.db")
+    rows = [person(i, rng) for i in range(size)]
+    with engine.begin() as conn:
+        for start in range(0, size, 50000):
+            conn.execute(insert(Patient), rows[start:start + 50000])
+    return engine, Session, rows
+
+
+def queries(rows, count):
+    rng = random.Random(1)
+    picked = []
+    for n in range(count):
+        row = rng.choice(rows)
+        picked.append([row['last_name'], row['first_name'][:3],
+                       f"{row['first_name']} {row['last_name']}", row['phone']][n % 4])
+    return picked
+
+
+def ilike_search(session, query, limit=10):
+    search = f"%{query}%"
+    return session.query(Patient).filter(
+        or_(
+            Patient.first_name.ilike(search),
+            Patient.last_name.ilike(search),
+            Patient.email.ilike(search)
+        )
+    ).limit(limit).all()
+
+
+def index_search(session, index, query, limit=10):
+    ids = index.search(query, limit)
+    rows = {p.id: p for p in session.query(Patient).filter(Patient.id.in_(ids))} if ids else {}
+    return [rows[i] for i in ids if i in rows]
+
+
+def measure(search, qs):
+    samples = []
+    for q in qs:
+        started = time.perf_counter()
+        search(q)
+        samples.append(time.perf_counter() - started)
+    return percentile(samples, 50) * 1000, percentile(samples, 99) * 1000
+
+
+if __name__ == '__main__':
+    sizes = [int(s) for s in sys.argv[1].split(',')] if len(sys.argv) > 1 else [10000, 100000, 1000000]
+    count = int(sys.argv[2]) if len(sys.argv) > 2 else 200
+    print(f"{count} queries per size (surname / first-name prefix / full name / phone), top 10, SQLite")
+    for size in sizes:
+        engine, Session, rows = build(size)
+        session = Session()
+        qs = queries(rows, count)
+
+        index = InvertedIndex()
+        started = time.perf_counter()
+        index.load(patient_document(row) for row in session.query(
+            Patient.id, Patient.first_name, Patient.last_name, Patient.email, Patient.phone).yield_per(5000))
+        build_time = time.perf_counter() - started
+
+        idx50, idx99 = measure(lambda q: index_search(session, index, q), qs)
+        # The scan is slow enough at 1M that a sample of the queries is plenty
+        like50, like99 = measure(lambda q: ilike_search(session, q), qs[:max(20, count * 10000 // size)])
+        report(f"{size:,} patients", [
+            ('index build', f"{build_time:.2f}s"),
+            ('index p50 / p99', f"{idx50:.2f} / {idx99:.2f} ms"),
+            ('ilike p50 / p99', f"{like50:.2f} / {like99:.2f} ms"),
+        ])
+        session.close()
+        engine.dispose()
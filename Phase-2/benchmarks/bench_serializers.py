@@ -0,0 +1,111 @@
+"""
+Marshalling 100,000 schedules: flask_restful's ``marshal`` against the
+compiled ``serializers.marshal``, then JSON encoding with the stdlib encoder
+(as ``output_json`` does by default) and with orjson when it is installed.
+
+The rows are Schedule objects with their doctor and department attached, as
+the schedule list loads them, marshalled with the schedule and doctor field
+maps of resources/schedules.py and resources/doctors.py. Each step is timed
+several times and the best run is reported. The compiled output is checked
+to encode to the same bytes as flask_restful's.
+
+    python benchmarks/bench_serializers.py [rows] [repeats]
+    python benchmarks/bench_serializers.py 100000 5
+"""
+import json
+import sys
+import time
+from datetime import datetime, timedelta
+
+from common import report
+from flask_restful import fields, marshal as restful_marshal
+from models import Department, Doctor, Schedule
+import serializers
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+
+# Copies of the field maps: resources.schedules imports resources.doctors, whose
+# flask_restx models need a newer flask_restful than some environments have
+def get_dept_name(doc):
+    return doc.department_obj.name if doc.department_obj else None
+
+
+def get_day(obj):
+    return obj.datetime.strftime("%A")
+
+
+doctor_fields = {
+    'id': fields.String,
+    'first_name': fields.String,
+    'last_name': fields.String,
+    'department': fields.String(attribute=get_dept_name),
+    'availability': fields.Raw,
+    'phone': fields.String,
+}
+
+schedule_fields = {
+    'id': fields.String,
+    'doctor_id': fields.String,
+    'doctor': fields.Nested(doctor_fields),
+    'datetime': fields.DateTime(dt_format='iso8601'),
+    'day': fields.String(attribute=get_day),
+    'duration': fields.Integer,
+    'is_available': fields.Boolean,
+}
+
+
+def build(count):
+    departments = [Department(id=f"DEPT{d}", name=f"Department {d}") for d in range(5)]
+    doctors = [Doctor(id=f"D{d:03}", first_name='John', last_name=f"Smith{d}", phone='555-0100',
+                      department_obj=departments[d % 5], availability={'Monday': '9-12', 'Thursday': '13-17'})
+               for d in range(20)]
+    start = datetime(2030, 1, 7, 9)
+    return [Schedule(id=f"SC{i:07}", doctor_id=doctors[i % 20].id, doctor=doctors[i % 20],
+                     datetime=start + timedelta(minutes=30 * i), duration=30, is_available=i % 3 != 0)
+            for i in range(count)]
+
+
+def best(repeats, fn):
+    times = []
+    for _ in range(repeats):
+        start = time.perf_counter()
+        result = fn()
+        times.append(time.perf_counter() - start)
+    return min(times), result
+
+
+def main():
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 100000
+    repeats = int(sys.argv[2]) if len(sys.argv) > 2 else 5
+    schedules = build(count)
+
+    old_marshal, old = best(repeats, lambda: restful_marshal(schedules, schedule_fields))
+    new_marshal, new = best(repeats, lambda: serializers.marshal(schedules, schedule_fields))
+    stdlib, encoded = best(repeats, lambda: json.dumps(new))
+    if json.dumps(old) != encoded:
+        raise SystemExit('compiled output differs from flask_restful')
+
+    rows = [
+        ('flask_restful marshal', f"{old_marshal * 1000:8.0f} ms  {old_marshal / count * 1e6:5.2f} us/row"),
+        ('compiled marshal', f"{new_marshal * 1000:8.0f} ms  {new_marshal / count * 1e6:5.2f} us/row"
+                             f"  ({old_marshal / new_marshal:.1f}x)"),
+        ('json.dumps', f"{stdlib * 1000:8.0f} ms  {len(encoded):,} bytes"),
+    ]
+    if orjson is not None:
+        fast, fast_encoded = best(repeats, lambda: orjson.dumps(new))
+        rows.append(('orjson.dumps', f"{fast * 1000:8.0f} ms  {len(fast_encoded):,} bytes"))
+    else:
+        rows.append(('orjson.dumps', 'not installed'))
+    rows += [
+        ('before: marshal + json.dumps', f"{(old_marshal + stdlib) * 1000:8.0f} ms"),
+        ('after: compiled + json.dumps', f"{(new_marshal + stdlib) * 1000:8.0f} ms  (same bytes)"),
+    ]
+    report(f"Serializing {count:,} schedules with doctor and department, best of {repeats}", rows)
+
+
+if __name__ == '__main__':
+    main()
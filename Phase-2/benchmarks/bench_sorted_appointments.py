@@ -0,0 +1,99 @@
+"""
+Sorted appointment views for a patient with 5,000 appointments.
+
+Compares the old way (load every appointment through the relationship,
+lazy-load each slot, split and sort in Python) with ``appointment_timeline``,
+which runs one keyset-paged query per list joined to the slots. The
+database also holds appointments of other patients so the indexes have
+something to skip. Reports p50/p99 latency and statements per request.
+
+    python benchmarks/bench_sorted_appointments.py [appointments] [requests]
+    python benchmarks/bench_sorted_appointments.py 5000 100
+"""
+import sys
+import time
+from datetime import datetime, timedelta
+
+from common import make_engine, percentile, report
+from sqlalchemy import event, insert
+from models import Appointment, Doctor, Patient, Schedule
+import search
+
+OTHER_PATIENTS = 20
+
+
+def build(count):
+    engine, Session = make_engine(f"sorted-{count}.db")
+    now = datetime.utcnow()
+    with engine.begin() as conn:
+        conn.execute(insert(Doctor), [{'id': f"D{d:03}", 'first_name': 'John', 'last_name': 'Smith',
+                                       'specialization': 'Cardiology', 'qualification': 'MD',
+                                       'experience_years': 10} for d in range(10)])
+        conn.execute(insert(Patient), [{'id': f"P{p:04}", 'first_name': 'Ann', 'last_name': 'Lee',
+                                        'email': f"p{p}@example.com"} for p in range(OTHER_PATIENTS + 1)])
+        schedules, appointments = [], []
+        for p in range(OTHER_PATIENTS + 1):
+            for i in range(count):
+                n = p * count + i
+                # Half in the past, half to come
+                schedules.append({'id': f"SC{n:08}", 'doctor_id': f"D{n % 10:03}", 'duration': 30,
+                                  'datetime': now + timedelta(minutes=30 * (i - count // 2), seconds=p),
+                                  'is_available': False})
+                appointments.append({'id': f"A{n:08}", 'patient_id': f"P{p:04}", 'doctor_id': f"D{n % 10:03}",
+                                     'schedule_id': f"SC{n:08}", 'status': 'Scheduled'})
+        conn.execute(insert(Schedule), schedules)
+        conn.execute(insert(Appointment), appointments)
+    return engine, Session
+
+
+def old_sorted(session, patient_id):
+    patient = session.query(Patient).filter(Patient.id == patient_id).first()
+    now = datetime.utcnow()
+    upcoming = sorted([a for a in patient.appointments if a.schedule.datetime > now],
+                      key=lambda a: a.schedule.datetime)
+    history = sorted([a for a in patient.appointments if a.schedule.datetime <= now],
+                     key=lambda a: a.schedule.datetime, reverse=True)
+    return upcoming, history
+
+
+def new_sorted(session, patient_id):
+    session.query(Patient.id).filter(Patient.id == patient_id).first()
+    timeline = search.appointment_timeline(session, patient_id=patient_id)
+    return timeline['upcoming'], timeline['history']
+
+
+def measure(engine, Session, run, requests):
+    statements = []
+    listener = lambda *args: statements.append(1)
+    event.listen(engine, 'before_cursor_execute', listener)
+    samples = []
+    for _ in range(requests):
+        session = Session()
+        start = time.perf_counter()
+        upcoming, history = run(session, 'P0000')
+        samples.append(time.perf_counter() - start)
+        session.close()
+    event.remove(engine, 'before_cursor_execute', listener)
+    return samples, len(statements) // requests, len(upcoming) + len(history)
+
+
+def main():
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 5000
+    requests = int(sys.argv[2]) if len(sys.argv) > 2 else 100
+    engine, Session = build(count)
+    print(f"{count:,} appointments for the patient, {count * (OTHER_PATIENTS + 1):,} in total")
+    for title, run, n in (('relationship + Python sort (old)', old_sorted, max(requests // 10, 5)),
+                          ('appointment_timeline, default page', new_sorted, requests)):
+        samples, per_request, rows = measure(engine, Session, run, n)
+        report(title, [
+            ('requests', n),
+            ('rows returned', f"{rows:,}"),
+            ('statements/request', per_request),
+            ('p50', f"{percentile(samples, 50) * 1000:.2f} ms"),
+            ('p99', f"{percentile(samples, 99) * 1000:.2f} ms"),
+        ])
+    engine.dispose()
+
+
+if __name__ == '__main__':
+    main()
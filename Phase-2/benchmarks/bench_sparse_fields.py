@@ -0,0 +1,130 @@
+"""
+``MedicalRecordListAPI`` with and without ``?fields=``.
+
+Walks every page of 20,000 medical records whose diagnosis, prescription and
+notes hold a few KB of text between them, once for the full records and once
+for ``?fields=id,patient_id,visit_date``, which is all a visit list shows.
+The two walks alternate page by page. Reports bytes on the wire, time spent
+in the database (statement execution and fetch) and request latency.
+
+    python benchmarks/bench_sparse_fields.py [records] [page size]
+    python benchmarks/bench_sparse_fields.py 20000 500
+"""
+import sys
+import time
+from datetime import date, timedelta
+
+from common import make_engine, percentile, report
+from flask import Flask
+from flask_restful import Api
+from sqlalchemy import event, insert
+from db_session import init_sessions
+from models import Department, MedicalRecord, Patient
+import resources.medical_records as medical_record_resource
+
+WORDS = 'patient presents with mild intermittent chest pain radiating to left arm no fever'.split()
+PROJECTION = 'id,patient_id,visit_date'
+
+
+def text(n, length):
+    words = [WORDS[(n + i) % len(WORDS)] for i in range(length // 6)]
+    return ' '.join(words)[:length]
+
+
+def build(count):
+    engine, Session = make_engine(f"sparse-{count}.db")
+    with engine.begin() as conn:
+        conn.execute(insert(Department), [{'id': 'DEPT001', 'name': 'Cardiology'}])
+        conn.execute(insert(Patient), [{'id': f"P{p:04}", 'first_name': 'Ann', 'last_name': 'Lee',
+                                        'email': f"p{p}@example.com"} for p in range(100)])
+        conn.execute(insert(MedicalRecord), [
+            {'id': f"M{n:07}", 'patient_id': f"P{n % 100:04}", 'department_id': 'DEPT001',
+             'diagnosis': text(n, 600), 'prescription': text(n + 1, 400), 'notes': text(n + 2, 2000),
+             'visit_date': date(2020, 1, 1) + timedelta(days=n % 1500)} for n in range(count)])
+    return engine, Session
+
+
+class DbTimer:
+    """Time from each statement's execution to the end of its fetch, per request"""
+
+    def __init__(self, engine):
+        self.seconds = 0.0
+        event.listen(engine, 'before_cursor_execute', self.before)
+        event.listen(engine, 'after_cursor_execute', self.after)
+        self.start = None
+
+    def before(self, conn, cursor, statement, params, context, many):
+        self.start = time.perf_counter()
+
+    def after(self, conn, cursor, statement, params, context, many):
+        # SQLite computes rows lazily: fetch them here so the read is timed, then hand them back
+        rows = cursor.fetchall()
+        self.seconds += time.perf_counter() - self.start
+        context.cursor = ReplayCursor(cursor, rows)
+
+
+class ReplayCursor:
+    def __init__(self, cursor, rows):
+        self._cursor = cursor
+        self._rows = rows
+
+    def fetchall(self):
+        rows, self._rows = self._rows, []
+        return rows
+
+    def fetchmany(self, size=None):
+        rows, self._rows = self._rows[:size], self._rows[size:]
+        return rows
+
+    def fetchone(self):
+        return self._rows.pop(0) if self._rows else None
+
+    def __getattr__(self, name):
+        return getattr(self._cursor, name)
+
+
+def main():
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 20000
+    page = int(sys.argv[2]) if len(sys.argv) > 2 else 500
+    engine, Session = build(count)
+    timer = DbTimer(engine)
+    app = Flask(__name__)
+    init_sessions(app, Session)
+    Api(app).add_resource(medical_record_resource.MedicalRecordListAPI, '/api/medical-records')
+    client = app.test_client()
+
+    results = {'full records': ([], [], []), f"fields={PROJECTION}": ([], [], [])}
+    cursors = dict.fromkeys(results, '')
+    for label in results:  # warm up
+        client.get(f"/api/medical-records?limit={page}" + ('' if label == 'full records' else f"&fields={PROJECTION}"))
+    while any(cursor is not None for cursor in cursors.values()):
+        for label, (sizes, db_times, latencies) in results.items():
+            if cursors[label] is None:
+                continue
+            url = f"/api/medical-records?limit={page}&cursor={cursors[label]}"
+            if label != 'full records':
+                url += f"&fields={PROJECTION}"
+            timer.seconds = 0.0
+            start = time.perf_counter()
+            response = client.get(url)
+            latencies.append(time.perf_counter() - start)
+            db_times.append(timer.seconds)
+            sizes.append(len(response.get_data()))
+            cursors[label] = response.get_json()['next_cursor']
+
+    rows = []
+    for label, (sizes, db_times, latencies) in results.items():
+        rows += [
+            (f"{label}: pages", len(sizes)),
+            (f"{label}: bytes per page (mean)", f"{sum(sizes) / len(sizes):,.0f}"),
+            (f"{label}: bytes total", f"{sum(sizes):,}"),
+            (f"{label}: DB ms per page p50", f"{percentile(db_times, 50) * 1000:.1f}"),
+            (f"{label}: DB ms total", f"{sum(db_times) * 1000:.0f}"),
+            (f"{label}: request ms p50 / p99",
+             f"{percentile(latencies, 50) * 1000:.1f} / {percentile(latencies, 99) * 1000:.1f}"),
+        ]
+    report(f"MedicalRecordListAPI, {count:,} records, {page} per page", rows)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,98 @@
+"""
+Typeahead latency: sorted-array prefix index vs an ilike scan per keystroke.
+
+Builds the suggestion index over N patients, 2,000 doctors, 40
+departments and their specializations, then replays typed prefixes of
+1-6 characters (as a user typing a name would send them) through
+``suggestions.suggest`` and through the ilike query each keystroke used
+to run (patients + doctors + departments).
+
+    python benchmarks/bench_suggest.py [patients] [keystrokes]
+"""
+import random
+import sys
+import time
+
+from common import make_engine, percentile, report
+from sqlalchemy import insert, or_
+from models import Patient, Doctor, Department
+from search_index import PrefixIndex, SUGGEST_KINDS, full_name
+
+sys.path.insert(0, __file__.rsplit('/', 1)[0])
+from bench_search_index import FIRST, LAST, person  # noqa: E402
+
+SPECIALIZATIONS = ['Cardiology', 'Neurology', 'Pediatrics', 'Orthopedics', 'Dermatology', 'Oncology',
+                   'Radiology', 'Psychiatry', 'Urology', 'Endocrinology', 'Gastroenterology', 'Nephrology']
+
+
+def build(patients):
+    rng = random.Random(3)
+    engine, Session = make_engine('suggest.db')
+    rows = [person(i, rng) for i in range(patients)]
+    with engine.begin() as conn:
+        for start in range(0, patients, 50000):
+            conn.execute(insert(Patient), rows[start:start + 50000])
+        conn.execute(insert(Department), [{'id': f"DEPT{i:03}", 'name': f"{SPECIALIZATIONS[i % 12]} Unit {i}"}
+                                          for i in range(40)])
+        conn.execute(insert(Doctor), [
+            {'id': f"D{i:04}", 'first_name': rng.choice(FIRST), 'last_name': rng.choice(LAST),
+             'department_id': f"DEPT{i % 40:03}", 'specialization': SPECIALIZATIONS[i % 12],
+             'qualification': 'MD', 'experience_years': 5}
+            for i in range(2000)
+        ])
+    return engine, Session, rows
+
+
+def keystrokes(rows, count):
+    rng = random.Random(5)
+    typed = []
+    while len(typed) < count:
+        name = rng.choice([rng.choice(rows)['last_name'], rng.choice(FIRST), rng.choice(SPECIALIZATIONS)])
+        typed.extend(name[:n] for n in range(1, min(len(name), 6) + 1))
+    return typed[:count]
+
+
+def ilike_suggest(session, prefix, limit=10):
+    search = f"{prefix}%"
+    found = session.query(Department.name).filter(Department.name.ilike(search)).limit(limit).all()
+    found += session.query(Doctor.first_name, Doctor.last_name).filter(
+        or_(Doctor.first_name.ilike(search), Doctor.last_name.ilike(search))).limit(limit).all()
+    found += session.query(Patient.first_name, Patient.last_name).filter(
+        or_(Patient.first_name.ilike(search), Patient.last_name.ilike(search))).limit(limit).all()
+    return found[:limit]
+
+
+def measure(fn, typed):
+    samples = []
+    for prefix in typed:
+        started = time.perf_counter()
+        fn(prefix)
+        samples.append(time.perf_counter() - started)
+    return percentile(samples, 50) * 1000, percentile(samples, 99) * 1000
+
+
+if __name__ == '__main__':
+    patients = int(sys.argv[1]) if len(sys.argv) > 1 else 1000000
+    count = int(sys.argv[2]) if len(sys.argv) > 2 else 2000
+    print(f"{patients:,} patients, 2,000 doctors, 40 departments; {count:,} keystrokes, top 10")
+    engine, Session, rows = build(patients)
+    session = Session()
+
+    index = PrefixIndex(SUGGEST_KINDS)
+    started = time.perf_counter()
+    doctors = session.query(Doctor.id, Doctor.first_name, Doctor.last_name, Doctor.specialization).all()
+    index.load(
+        [('patient', r.id, full_name(r)) for r in session.query(Patient.id, Patient.first_name, Patient.last_name)]
+        + [('doctor', r.id, full_name(r)) for r in doctors]
+        + [('department', r.id, r.name) for r in session.query(Department.id, Department.name)],
+        shared=[('specialization', r.specialization) for r in doctors]
+    )
+    build_time = time.perf_counter() - started
+
+    typed = keystrokes(rows, count)
+    p50, p99 = measure(lambda prefix: index.suggest(prefix, 10), typed)
+    like50, like99 = measure(lambda prefix: ilike_suggest(session, prefix), typed[:200])
+    report('prefix index', [('build', f"{build_time:.1f}s"), ('p50 / p99', f"{p50:.3f} / {p99:.3f} ms")])
+    report('ilike per keystroke', [('p50 / p99', f"{like50:.2f} / {like99:.2f} ms")])
+    session.close()
+    engine.dispose()
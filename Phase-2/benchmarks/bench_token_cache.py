@@ -0,0 +1,65 @@
+"""
+Authenticated GET throughput with and without the verified-token cache.
+
+A bare Flask app with one ``@login_required`` endpoint that also calls
+``verify_token`` again (like ``get_current_user`` does), so each request
+verifies the token twice. No database is touched; this isolates the JWT
+cost. 200 distinct client tokens are replayed round-robin.
+
+    python benchmarks/bench_token_cache.py [requests] [clients]
+"""
+import sys
+import time
+
+import common  # noqa: F401  (sys.path / env setup)
+from common import report
+from flask import Flask
+import auth
+from auth import generate_token, login_required, token_cache, token_cache_stats
+
+
+def build_app():
+    app = Flask(__name__)
+
+    @app.route('/api/appointments')
+    @login_required
+    def appointments():
+        auth.verify_token(auth.get_token_from_header())
+        return {'appointments': []}
+
+    return app
+
+
+def run(app, tokens, requests):
+    client = app.test_client()
+    headers = [{'Authorization': f"Bearer {token}"} for token in tokens]
+    started = time.perf_counter()
+    for i in range(requests):
+        client.get('/api/appointments', headers=headers[i % len(headers)])
+    return requests / (time.perf_counter() - started)
+
+
+def verify_rate(tokens, count):
+    started = time.perf_counter()
+    for i in range(count):
+        auth.verify_token(tokens[i % len(tokens)])
+    return count / (time.perf_counter() - started)
+
+
+if __name__ == '__main__':
+    requests = int(sys.argv[1]) if len(sys.argv) > 1 else 20000
+    clients = int(sys.argv[2]) if len(sys.argv) > 2 else 200
+    tokens = [generate_token(f"U{i:03}", 'Patient') for i in range(clients)]
+    app = build_app()
+    print(f"{requests:,} authenticated GETs from {clients} clients (Flask test client, one thread)")
+    for label, size in [('no cache', 0), ('token cache', auth.TOKEN_CACHE_SIZE)]:
+        token_cache.maxsize = size
+        token_cache.clear()
+        rate = run(app, tokens, requests)
+        verify = verify_rate(tokens, requests * 5)
+        stats = token_cache_stats()
+        report(label, [
+            ('requests/sec', f"{rate:,.0f}"),
+            ('verify_token calls/sec', f"{verify:,.0f}"),
+            ('cache hits / misses', f"{stats['hits']:,} / {stats['misses']:,}"),
+        ])
@@ -0,0 +1,102 @@
+"""
+Materialized vs virtual slots for 500 doctors over a 1-year horizon.
+
+Materialized: one Schedule row per weekday hour (9-17) per doctor, like
+create_dummy_data.py but for 365 days. Virtual: only the booked slots have
+rows; free time comes from Doctor.availability. Both databases hold the same
+bookings (5% of slots). Reports table size and the latency of the
+ScheduleCheckAvailabilityAPI query (7-day window) in each mode.
+
+    python benchmarks/bench_virtual_slots.py [doctors] [days] [queries]
+"""
+import os
+import random
+import sys
+import time
+from datetime import datetime, timedelta
+
+from common import make_engine, percentile, report
+from sqlalchemy import insert, func, select
+from models import Doctor, Schedule
+from slots import parse_availability, expand_slots
+from virtual_slots import open_slots
+
+WEEKDAYS = {day: "9-17" for day in ["Monday", "Tuesday", "Wednesday", "Thursday", "Friday"]}
+BOOKED_EVERY = 20  # 5% of slots carry an appointment
+
+
+def build(doctors, days, materialized):
+    engine, Session = make_engine('materialized.db' if materialized else 'virtual.db')
+    start = datetime.now().replace(hour=0, minute=0, second=0, microsecond=0)
+    slot_times = list(expand_slots(parse_availability(WEEKDAYS), start, start + timedelta(days=days)))
+    with engine.begin() as conn:
+        conn.execute(insert(Doctor), [
+            {'id': f"D{i:04}", 'first_name': 'Doc', 'last_name': str(i), 'availability': WEEKDAYS,
+             'specialization': 'General', 'qualification': 'MD', 'experience_years': 5}
+            for i in range(doctors)
+        ])
+        counter = 0
+        for i in range(doctors):
+            rows = []
+            for n, slot in enumerate(slot_times):
+                booked = (n + i) % BOOKED_EVERY == 0
+                if materialized or booked:
+                    counter += 1
+                    rows.append({'id': f"S{counter:08}", 'doctor_id': f"D{i:04}", 'datetime': slot,
+                                 'duration': 60, 'is_available': not booked})
+            conn.execute(insert(Schedule), rows)
+    with engine.connect() as conn:
+        count = conn.execute(select(func.count()).select_from(Schedule.__table__)).scalar()
+    size = os.path.getsize(engine.url.database)
+    return engine, Session, start, count, size
+
+
+def materialized_query(session, doctor_id, start_date, end_date):
+    return session.query(Schedule)\
+        .filter(
+            Schedule.doctor_id == doctor_id,
+            Schedule.datetime >= start_date,
+            Schedule.datetime < end_date,
+            Schedule.is_available == True
+        )\
+        .order_by(Schedule.datetime)\
+        .all()
+
+
+def virtual_query(session, doctor_id, start_date, end_date):
+    doctor = session.query(Doctor).get(doctor_id)
+    return open_slots(session, doctor, start_date, end_date)
+
+
+def measure(Session, query, doctors, days, start, queries):
+    rng = random.Random(7)
+    samples, returned = [], 0
+    for _ in range(queries):
+        session = Session()
+        window_start = start + timedelta(days=rng.randrange(days - 7))
+        started = time.perf_counter()
+        returned += len(query(session, f"D{rng.randrange(doctors):04}", window_start, window_start + timedelta(days=7)))
+        samples.append(time.perf_counter() - started)
+        session.close()
+    return samples, returned / queries
+
+
+if __name__ == '__main__':
+    doctors = int(sys.argv[1]) if len(sys.argv) > 1 else 500
+    days = int(sys.argv[2]) if len(sys.argv) > 2 else 365
+    queries = int(sys.argv[3]) if len(sys.argv) > 3 else 100
+    print(f"{doctors} doctors, {days}-day horizon, Mon-Fri 9-17, 5% booked (SQLite, WAL)")
+    for label, materialized, query in [('materialized', True, materialized_query), ('virtual', False, virtual_query)]:
+        started = time.perf_counter()
+        engine, Session, start, count, size = build(doctors, days, materialized)
+        build_time = time.perf_counter() - started
+        samples, per_query = measure(Session, query, doctors, days, start, queries)
+        report(f"{label} mode", [
+            ('schedules rows', f"{count:,}"),
+            ('database file', f"{size / 1024 / 1024:,.1f} MiB"),
+            ('time to generate', f"{build_time:.1f}s"),
+            ('free slots per 7-day query', f"{per_query:.1f}"),
+            ('p50 latency', f"{percentile(samples, 50) * 1000:.2f} ms"),
+            ('p99 latency', f"{percentile(samples, 99) * 1000:.2f} ms"),
+        ])
+        engine.dispose()
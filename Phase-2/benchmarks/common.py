@@ -0,0 +1,73 @@
+"""
+Shared helpers for the benchmark scripts.
+
+Benchmarks run against a throwaway SQLite file so they need no SQL Server
+instance. Run them from the Phase-2 directory, e.g.
+``python benchmarks/bench_id_allocator.py``.
+"""
+import os
+import sys
+import tempfile
+import threading
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault('SQLSERVER_CONN', 'sqlite://')
+
+from sqlalchemy import create_engine, event
+from sqlalchemy.orm import sessionmaker
+from db import Base
+
+
+def make_engine(name='bench.db'):
+    """Create a fresh SQLite database file with all tables"""
+    path = os.path.join(tempfile.mkdtemp(prefix='hms-bench-'), name)
+    engine = create_engine(
+        f"sqlite:///{path}",
+        connect_args={'check_same_thread': False, 'timeout': 30},
+        future=True,
+    )
+
+    @event.listens_for(engine, 'connect')
+    def _set_pragmas(dbapi_conn, _):
+        cursor = dbapi_conn.cursor()
+        cursor.execute('PRAGMA journal_mode=WAL')
+        cursor.execute('PRAGMA synchronous=NORMAL')
+        cursor.close()
+
+    Base.metadata.create_all(bind=engine)
+    return engine, sessionmaker(bind=engine)
+
+
+def run_threads(worker, count):
+    """Run ``worker(index)`` on ``count`` threads and return elapsed seconds"""
+    barrier = threading.Barrier(count)
+
+    def target(index):
+        barrier.wait()
+        worker(index)
+
+    threads = [threading.Thread(target=target, args=(i,)) for i in range(count)]
+    start = time.perf_counter()
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    return time.perf_counter() - start
+
+
+def percentile(samples, pct):
+    ordered = sorted(samples)
+    if not ordered:
+        return 0.0
+    index = min(len(ordered) - 1, int(round(pct / 100 * (len(ordered) - 1))))
+    return ordered[index]
+
+
+def report(title, rows):
+    """Print a small aligned table: rows are (label, value) pairs"""
+    print(f"\n{title}")
+    print('-' * len(title))
+    width = max(len(label) for label, _ in rows)
+    for label, value in rows:
+        print(f"  {label:<{width}}  {value}")
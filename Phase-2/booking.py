@@ -0,0 +1,189 @@
+from datetime import datetime
+
+from sqlalchemy import event, update
+from sqlalchemy.orm import Session
+
+from models import Appointment, Schedule, Patient
+from error_handlers import ResourceNotFoundError, ValidationError, SlotUnavailableError
+from id_allocator import appointment_ids
+from virtual_slots import is_virtual_slot_id, materialize_slot
+from metrics import BOOKINGS
+
+# Every endpoint that books, moves, cancels or deletes an appointment goes
+# through this module. Slots are claimed with a single conditional UPDATE, so
+# two concurrent bookers can never both win the same schedule row, and no row
+# locks are held while the rest of the request runs.
+#
+# None of these functions commit: the claim, the appointment INSERT/UPDATE and
+# the release of the old slot all ride on the caller's transaction. Callers
+# roll back on any exception, which also undoes a successful claim.
+
+_BOOKED, _BOOK_CONFLICT = BOOKINGS.labels('book', 'success'), BOOKINGS.labels('book', 'conflict')
+_MOVED, _MOVE_CONFLICT = BOOKINGS.labels('move', 'success'), BOOKINGS.labels('move', 'conflict')
+
+# A claim only succeeds once the caller commits, so successes wait in
+# session.info until then and are dropped if the transaction ends any other way
+_PENDING = 'booking_counters'
+
+
+def _count_on_commit(session, counter):
+    session.info.setdefault(_PENDING, []).append(counter)
+
+
+@event.listens_for(Session, 'after_commit')
+def _count_committed(session):
+    if session.in_nested_transaction():
+        return  # a savepoint: the outer transaction may still roll back
+    for counter in session.info.pop(_PENDING, ()):
+        counter.inc()
+
+
+@event.listens_for(Session, 'after_transaction_end')
+def _drop_uncommitted(session, transaction):
+    if transaction.parent is None:
+        session.info.pop(_PENDING, None)
+
+
+def claim_slot(session, schedule_id):
+    """UPDATE schedules SET is_available = 0 WHERE id = ? AND is_available = 1; True if this caller won"""
+    result = session.execute(
+        update(Schedule)
+        .where(Schedule.id == schedule_id, Schedule.is_available == True)
+        .values(is_available=False)
+        .execution_options(synchronize_session=False)
+    )
+    return result.rowcount == 1
+
+
+def release_slot(session, schedule_id):
+    """Make a slot bookable again"""
+    session.execute(
+        update(Schedule)
+        .where(Schedule.id == schedule_id)
+        .values(is_available=True)
+        .execution_options(synchronize_session=False)
+    )
+
+
+def _resolve_slot(session, schedule_id):
+    # Virtual slots ("D001@20300107T0900") get their Schedule row only now, at booking time
+    if is_virtual_slot_id(schedule_id):
+        return materialize_slot(session, schedule_id)
+    return schedule_id
+
+
+def _get_slot(session, schedule_id, message='Schedule not found'):
+    # Column query rather than the entity so a stale is_available is never read from the identity map
+    slot = session.query(Schedule.id, Schedule.doctor_id, Schedule.datetime)\
+        .filter(Schedule.id == schedule_id)\
+        .first()
+    if not slot:
+        raise ResourceNotFoundError(message)
+    return slot
+
+
+def book_appointment(session, patient_id, schedule_id, status='Scheduled', allow_past=False):
+    """Claim a slot and add the appointment for it to the session"""
+    if not session.query(Patient.id).filter(Patient.id == patient_id).first():
+        raise ResourceNotFoundError('Patient not found')
+
+    schedule_id = _resolve_slot(session, schedule_id)
+    slot = _get_slot(session, schedule_id)
+    if not allow_past and slot.datetime < datetime.now():
+        raise ValidationError('Cannot book past time slots')
+
+    # Take the ID before claiming: a block refill writes id_counters on its own
+    # connection, which must not wait behind this session's write lock on SQLite
+    appointment_id = appointment_ids.next_id()
+    if not claim_slot(session, schedule_id):
+        _BOOK_CONFLICT.inc()
+        raise SlotUnavailableError()
+    _count_on_commit(session, _BOOKED)
+
+    appointment = Appointment(
+        id=appointment_id,
+        patient_id=patient_id,
+        doctor_id=slot.doctor_id,
+        schedule_id=schedule_id,
+        status=status
+    )
+    session.add(appointment)
+    session.flush()
+    return appointment
+
+
+def _holds_slot(appointment):
+    # A cancelled appointment already gave its slot back, which may since have been rebooked
+    return appointment.schedule_id and appointment.status != 'Cancelled'
+
+
+def move_appointment(session, appointment, schedule_id, message='New schedule slot not available'):
+    """Claim ``schedule_id`` for an existing appointment and free its old slot"""
+    schedule_id = _resolve_slot(session, schedule_id)
+    if schedule_id == appointment.schedule_id and _holds_slot(appointment):
+        return appointment
+    if not claim_slot(session, schedule_id):
+        _MOVE_CONFLICT.inc()
+        raise SlotUnavailableError(message)
+    _count_on_commit(session, _MOVED)
+    if _holds_slot(appointment):
+        release_slot(session, appointment.schedule_id)
+    appointment.schedule_id = schedule_id
+    session.flush()
+    return appointment
+
+
+def reschedule_appointment(session, appointment, new_schedule_id):
+    """Move a scheduled appointment to another future slot of the same doctor"""
+    if appointment.status != 'Scheduled':
+        raise ValidationError('Can only reschedule scheduled appointments')
+
+    new_schedule_id = _resolve_slot(session, new_schedule_id)
+    slot = _get_slot(session, new_schedule_id, 'New schedule slot not found')
+    if slot.datetime < datetime.now():
+        raise ValidationError('Cannot reschedule to past time slots')
+    if slot.doctor_id != appointment.doctor_id:
+        raise ValidationError('Cannot reschedule to a different doctor')
+
+    return move_appointment(session, appointment, new_schedule_id, 'New time slot is not available')
+
+
+def cancel_appointment(session, appointment):
+    """Mark an appointment cancelled and give its slot back"""
+    if appointment.status == 'Cancelled':
+        raise ValidationError('Appointment is already cancelled')
+    if appointment.status == 'Completed':
+        raise ValidationError('Cannot cancel completed appointment')
+
+    slot = _get_slot(session, appointment.schedule_id)
+    if slot.datetime < datetime.now():
+        raise ValidationError('Cannot cancel past appointments')
+
+    appointment.status = 'Cancelled'
+    release_slot(session, appointment.schedule_id)
+    session.flush()
+    return appointment
+
+
+def update_appointment(session, appointment, schedule_id, status):
+    """Set an appointment's slot and status, claiming or giving back slots to match"""
+    if status == 'Cancelled':
+        if appointment.status != 'Cancelled':
+            move_appointment(session, appointment, schedule_id)
+            cancel_appointment(session, appointment)
+        # Already cancelled: it holds no slot, so there is nothing to move
+        return appointment
+
+    # A cancelled appointment made active again claims its slot like a new booking
+    move_appointment(session, appointment, schedule_id)
+    appointment.status = status
+    session.flush()
+    return appointment
+
+
+def delete_appointment(session, appointment):
+    """Delete an appointment and give its slot back"""
+    if _holds_slot(appointment):
+        release_slot(session, appointment.schedule_id)
+    session.delete(appointment)
+    session.flush()
@@ -0,0 +1,168 @@
+"""
+Response compression: brotli or gzip, whichever the client accepts.
+
+``init_compression(app)`` compresses JSON, NDJSON, MessagePack and text
+responses once the request has been served:
+
+- bodies smaller than ``COMPRESSION_MIN_SIZE`` go out as they are, since
+  the headers would eat what compression saves;
+- streamed responses (e.g. the medical record export) are compressed chunk
+  by chunk as they are produced, each chunk flushed so the client receives
+  it without waiting for the rest, and the stream is never buffered;
+- the compressed form of a successful GET is kept in a small LRU cache keyed
+  by the digest of the body and the encoding, so popular lists are compressed
+  once. Keyed by content, an entry can never be served for a different
+  body, whoever asks.
+
+brotli needs the optional ``brotli`` package; without it only gzip is offered.
+Brotli runs at a low quality (4 by default): at that setting it is about as
+fast as gzip -6 and still compresses better (see
+benchmarks/bench_compression.py).
+"""
+import hashlib
+import threading
+import zlib
+from collections import OrderedDict
+
+from flask import request
+
+try:
+    import brotli
+except ImportError:  # optional: gzip only
+    brotli = None
+
+COMPRESSIBLE = {'application/json', 'application/x-ndjson', 'application/msgpack', 'application/x-msgpack'}
+
+
+def compressible(mimetype):
+    return mimetype in COMPRESSIBLE or mimetype.startswith('text/') or mimetype.endswith('+json')
+
+
+def encodings():
+    """What the server can produce, preferred first"""
+    return ['br', 'gzip'] if brotli is not None else ['gzip']
+
+
+class BodyCache:
+    """LRU of compressed bodies, bounded by their total size in bytes"""
+
+    def __init__(self, max_bytes):
+        self.max_bytes = max_bytes
+        self.size = 0
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            body = self._entries.get(key)
+            if body is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return body
+
+    def put(self, key, body):
+        if len(body) > self.max_bytes // 4:
+            return  # one huge body would push out everything else
+        with self._lock:
+            if key in self._entries:
+                return
+            self._entries[key] = body
+            self.size += len(body)
+            while self.size > self.max_bytes:
+                _, evicted = self._entries.popitem(last=False)
+                self.size -= len(evicted)
+
+
+class Compressor:
+    """Compresses whole bodies and streams for one app's settings"""
+
+    def __init__(self, min_size=1024, gzip_level=6, brotli_quality=4, cache_bytes=32 * 1024 * 1024):
+        self.min_size = min_size
+        self.gzip_level = gzip_level
+        self.brotli_quality = brotli_quality
+        self.cache = BodyCache(cache_bytes) if cache_bytes else None
+
+    def compress(self, body, encoding):
+        if encoding == 'br':
+            return brotli.compress(body, quality=self.brotli_quality)
+        compressor = zlib.compressobj(self.gzip_level, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+        return compressor.compress(body) + compressor.flush()
+
+    def compress_cached(self, body, encoding):
+        key = (encoding, hashlib.blake2b(body, digest_size=16).digest())
+        compressed = self.cache.get(key)
+        if compressed is None:
+            compressed = self.compress(body, encoding)
+            self.cache.put(key, compressed)
+        return compressed
+
+    def stream(self, chunks, encoding):
+        """Compress an iterable of byte chunks, flushing after each so nothing waits on the next"""
+        if encoding == 'br':
+            compressor = brotli.Compressor(quality=self.brotli_quality)
+            process, flush, finish = compressor.process, compressor.flush, compressor.finish
+        else:
+            compressor = zlib.compressobj(self.gzip_level, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+            process, finish = compressor.compress, compressor.flush
+            flush = lambda: compressor.flush(zlib.Z_SYNC_FLUSH)  # noqa: E731
+        for chunk in chunks:
+            if chunk:
+                out = process(chunk) + flush()
+                if out:
+                    yield out
+        yield finish()
+
+
+def _add_vary(response):
+    if 'accept-encoding' not in {v.lower() for v in response.vary}:
+        response.vary.add('Accept-Encoding')
+
+
+def init_compression(app):
+    """Compress ``app``'s responses; register it before the other after_request hooks so it runs last"""
+    config = app.config
+    compressor = app.extensions['compression'] = Compressor(
+        min_size=config.get('COMPRESSION_MIN_SIZE', 1024),
+        gzip_level=config.get('COMPRESSION_GZIP_LEVEL', 6),
+        brotli_quality=config.get('COMPRESSION_BROTLI_QUALITY', 4),
+        cache_bytes=config.get('COMPRESSION_CACHE_BYTES', 32 * 1024 * 1024),
+    )
+
+    @app.after_request
+    def compress_response(response):
+        if (response.status_code < 200 or response.status_code in (204, 206, 304)
+                or request.method == 'HEAD' or response.direct_passthrough
+                or 'Content-Encoding' in response.headers or not compressible(response.mimetype)):
+            return response
+        if not response.is_streamed and response.calculate_content_length() < compressor.min_size:
+            return response
+        _add_vary(response)
+        encoding = request.accept_encodings.best_match(encodings())
+        if encoding is None:
+            return response
+        response.headers['Content-Encoding'] = encoding
+
+        if response.is_streamed:
+            original = response.response
+            response.response = compressor.stream(response.iter_encoded(), encoding)
+            if hasattr(original, 'close'):
+                response.call_on_close(original.close)  # e.g. the export's session, if the client goes away
+            response.headers.pop('Content-Length', None)
+            return response
+
+        body = response.get_data()
+        cacheable = (compressor.cache is not None and request.method == 'GET' and response.status_code == 200
+                     and not response.cache_control.no_store)
+        response.set_data(compressor.compress_cached(body, encoding) if cacheable
+                          else compressor.compress(body, encoding))
+        if response.headers.get('ETag'):
+            # A strong ETag names exact bytes: the compressed body needs its own
+            tag, weak = response.get_etag()
+            response.set_etag(f"{tag}-{encoding}", weak)
+        return response
+
+    return compressor
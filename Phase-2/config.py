@@ -9,6 +9,13 @@ class Config:
     SECRET_KEY = os.getenv('SECRET_KEY', 'your-secret-key-here')
     SQLALCHEMY_DATABASE_URI = os.getenv('SQLSERVER_CONN', "mssql+pyodbc://@localhost/HospitalDB?driver=ODBC+Driver+17+for+SQL+Server&trusted_connection=yes")
     SQLALCHEMY_TRACK_MODIFICATIONS = False
+    SQLALCHEMY_ECHO = False
+    # Connection pool, per worker process (see db.create_db_engine)
+    SQLALCHEMY_POOL_SIZE = int(os.getenv('DB_POOL_SIZE', '5'))
+    SQLALCHEMY_MAX_OVERFLOW = int(os.getenv('DB_MAX_OVERFLOW', '10'))
+    SQLALCHEMY_POOL_TIMEOUT = int(os.getenv('DB_POOL_TIMEOUT', '30'))
+    SQLALCHEMY_POOL_RECYCLE = int(os.getenv('DB_POOL_RECYCLE', '1800'))
+    SQLALCHEMY_POOL_PRE_PING = True
     JWT_SECRET_KEY = os.getenv('JWT_SECRET_KEY', 'your-jwt-secret-key-here')
     JWT_ACCESS_TOKEN_EXPIRES = 24 * 60 * 60  # 24 hours
     
@@ -22,10 +29,39 @@ class Config:
     LOG_FORMAT = '%(asctime)s - %(name)s - %(levelname)s - %(message)s'
     LOG_FILE = 'app.log'
 
+    # Scheduling: 'materialized' serves pre-generated Schedule rows, 'virtual'
+    # computes free slots from the availability rules (see virtual_slots.py)
+    SLOT_MODE = os.getenv('SLOT_MODE', 'materialized')
+
+    # Rate limiting: memory:// (per worker), shm:///dev/shm/hms-ratelimit (per host), redis://... (cluster)
+    RATE_LIMIT_STORAGE = os.getenv('RATE_LIMIT_STORAGE', 'memory://')
+    RATE_LIMIT_PER_MINUTE = int(os.getenv('RATE_LIMIT_PER_MINUTE', '60'))
+    # Per-route budgets, requests per minute per client
+    RATE_LIMITS = {
+        '/api/auth/login': 5,
+        '/api/patients/register': 10,
+    }
+
+    # Log connections a request leaves checked out (see db_session.py); costs a stack capture per checkout
+    DB_LEAK_DETECTION = os.getenv('DB_LEAK_DETECTION', 'false').lower() == 'true'
+
+    # 'json' keeps responses byte-for-byte as flask_restful writes them; 'orjson' (if installed)
+    # encodes faster but compact and UTF-8 (see serializers.py)
+    JSON_BACKEND = os.getenv('JSON_BACKEND', 'json')
+
+    # Response compression (see compression.py): brotli or gzip for bodies of at least
+    # COMPRESSION_MIN_SIZE bytes; compressed GET bodies are cached up to COMPRESSION_CACHE_BYTES
+    COMPRESSION_ENABLED = os.getenv('COMPRESSION_ENABLED', 'true').lower() == 'true'
+    COMPRESSION_MIN_SIZE = int(os.getenv('COMPRESSION_MIN_SIZE', '1024'))
+    COMPRESSION_GZIP_LEVEL = int(os.getenv('COMPRESSION_GZIP_LEVEL', '6'))
+    COMPRESSION_BROTLI_QUALITY = int(os.getenv('COMPRESSION_BROTLI_QUALITY', '4'))
+    COMPRESSION_CACHE_BYTES = int(os.getenv('COMPRESSION_CACHE_BYTES', str(32 * 1024 * 1024)))
+
 class DevelopmentConfig(Config):
     """Development configuration"""
     DEBUG = True
     SQLALCHEMY_ECHO = True
+    DB_LEAK_DETECTION = True
 
 class TestingConfig(Config):
     """Testing configuration"""
@@ -37,7 +73,8 @@ class ProductionConfig(Config):
     DEBUG = False
     SQLALCHEMY_ECHO = False
     # Add production-specific settings
-    SQLALCHEMY_POOL_SIZE = 20
+    SQLALCHEMY_POOL_SIZE = int(os.getenv('DB_POOL_SIZE', '20'))
+    SQLALCHEMY_MAX_OVERFLOW = int(os.getenv('DB_MAX_OVERFLOW', '10'))
     SQLALCHEMY_POOL_TIMEOUT = 30
     SQLALCHEMY_POOL_RECYCLE = 1800
 
@@ -1,18 +1,115 @@
 from sqlalchemy import create_engine
+from sqlalchemy.engine import make_url
+from sqlalchemy.exc import TimeoutError as PoolTimeout
 from sqlalchemy.orm import sessionmaker, declarative_base
+from sqlalchemy.pool import QueuePool
+from collections import deque
 import os
+import threading
+import time
 from dotenv import load_dotenv
+from config import get_config
 
 # Load environment variables
 load_dotenv()
 
-# Set up SQLAlchemy engine and session
-engine = create_engine(os.getenv("SQLSERVER_CONN"), echo=True, future=True)
+# Engine keyword -> config key for the pool settings
+POOL_SETTINGS = {
+    'pool_size': 'SQLALCHEMY_POOL_SIZE',
+    'max_overflow': 'SQLALCHEMY_MAX_OVERFLOW',
+    'pool_timeout': 'SQLALCHEMY_POOL_TIMEOUT',
+    'pool_recycle': 'SQLALCHEMY_POOL_RECYCLE',
+}
+RECENT_WAITS = 1024  # checkouts kept for the wait-time percentiles
+
+
+class TimedQueuePool(QueuePool):
+    """QueuePool that records how long each checkout waited for a connection.
+
+    The wait includes opening a new connection when the pool grows, which
+    is time a request spends before its first query just the same.
+    """
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._stats_lock = threading.Lock()
+        self.waits = 0
+        self.wait_seconds = 0.0
+        self.max_wait = 0.0
+        self.timeouts = 0
+        self.recent_waits = deque(maxlen=RECENT_WAITS)
+
+    def _do_get(self):
+        start = time.perf_counter()
+        try:
+            return super()._do_get()
+        except PoolTimeout:
+            with self._stats_lock:
+                self.timeouts += 1
+            raise
+        finally:
+            waited = time.perf_counter() - start
+            with self._stats_lock:
+                self.waits += 1
+                self.wait_seconds += waited
+                self.max_wait = max(self.max_wait, waited)
+                self.recent_waits.append(waited)
+
+
+def _setting(config, key, default=None):
+    # Flask's app.config is a dict; the classes in config.py are read as attributes
+    return config.get(key, default) if isinstance(config, dict) else getattr(config, key, default)
+
+
+def create_db_engine(config):
+    """Build the engine from a config class or ``app.config``: URL, echo, pre-ping and pool sizing"""
+    url = make_url(_setting(config, 'SQLALCHEMY_DATABASE_URI'))
+    options = {
+        'echo': _setting(config, 'SQLALCHEMY_ECHO', False),
+        'pool_pre_ping': _setting(config, 'SQLALCHEMY_POOL_PRE_PING', True),
+        'future': True,
+    }
+    if url.get_backend_name() == 'sqlite':
+        if url.database in (None, '', ':memory:'):
+            return create_engine(url, **options)  # one connection per thread; there is no pool to size
+        options['connect_args'] = {'check_same_thread': False}
+    options['poolclass'] = TimedQueuePool
+    for name, key in POOL_SETTINGS.items():
+        if _setting(config, key) is not None:
+            options[name] = _setting(config, key)
+    return create_engine(url, **options)
+
+
+def init_engine(config):
+    """Replace the module engine with one built from ``config`` and bind SessionLocal to it"""
+    global engine
+    engine.dispose()
+    engine = create_db_engine(config)
+    SessionLocal.configure(bind=engine)
+    return engine
+
+
+def pool_stats(bind=None):
+    """This worker's pool: connections in use, overflow and checkout wait times"""
+    pool = (bind or engine).pool
+    stats = {'pid': os.getpid(), 'pool': type(pool).__name__}
+    if isinstance(pool, QueuePool):
+        stats.update(size=pool.size(), checked_out=pool.checkedout(), checked_in=pool.checkedin(),
+                     overflow=max(pool.overflow(), 0), max_overflow=pool._max_overflow, timeout=pool.timeout())
+    if isinstance(pool, TimedQueuePool):
+        with pool._stats_lock:
+            recent = sorted(pool.recent_waits)
+            stats.update(waits=pool.waits, timeouts=pool.timeouts, wait_seconds_total=pool.wait_seconds,
+                         wait_seconds_max=pool.max_wait)
+        for pct in (50, 99):
+            stats[f"wait_seconds_p{pct}"] = recent[int(pct / 100 * (len(recent) - 1))] if recent else 0.0
+    return stats
+
+
+# Default engine for scripts; create_app replaces it with one built from the app's config
+engine = create_db_engine(get_config())
 SessionLocal = sessionmaker(bind=engine)
 Base = declarative_base()
 
-# Create a db instance to be imported by other modules
-db = SessionLocal()
-
-# Export the session instance
-__all__ = ['db', 'engine', 'Base', 'SessionLocal']
+# Resources don't open sessions themselves: see db_session.get_session
+__all__ = ['engine', 'Base', 'SessionLocal', 'create_db_engine', 'init_engine', 'pool_stats']
@@ -0,0 +1,103 @@
+"""
+One database session per request.
+
+``get_session()`` returns the session of the current request, opening it on
+first use. ``init_sessions`` registers the hooks that end it: a successful
+response (status below 400) is committed, anything else is rolled back, and
+the session is closed at teardown whatever happened, so an exception in a
+resource can no longer leave its connection checked out.
+
+With ``DB_LEAK_DETECTION`` on (the default when the app runs in debug mode)
+every pool checkout made while serving a request is recorded with its
+stack. A connection that is still checked out once the request's session
+has been closed is logged as a leak and kept in ``leaks``.
+"""
+import logging
+import threading
+import traceback
+
+from flask import current_app, g, has_request_context, jsonify, request
+from sqlalchemy import event
+from sqlalchemy.exc import SQLAlchemyError
+
+logger = logging.getLogger(__name__)
+
+
+class RequestSessions:
+    """Per-app state: the session factory and, when enabled, the leak tracker"""
+
+    def __init__(self, factory, leak_detection=False):
+        self.factory = factory
+        self.leak_detection = leak_detection
+        self.leaks = []  # (method, path, stack of the checkout) per leaked connection
+        self._checked_out = {}
+        self._lock = threading.Lock()
+        if leak_detection:
+            engine = factory.kw['bind']
+            event.listen(engine, 'checkout', self._on_checkout)
+            event.listen(engine, 'checkin', self._on_checkin)
+
+    def _on_checkout(self, dbapi_connection, record, proxy):
+        if not has_request_context():
+            return
+        stack = ''.join(traceback.format_stack()[:-2])
+        with self._lock:
+            self._checked_out[id(record)] = stack
+        g.setdefault('db_checkouts', []).append(id(record))
+
+    def _on_checkin(self, dbapi_connection, record):
+        with self._lock:
+            self._checked_out.pop(id(record), None)
+
+    def check_leaks(self):
+        """Report this request's checkouts that were never returned to the pool"""
+        for key in g.pop('db_checkouts', ()):
+            with self._lock:
+                stack = self._checked_out.pop(key, None)
+            if stack is not None:
+                self.leaks.append((request.method, request.path, stack))
+                logger.warning("%s %s leaked a database connection, checked out at:\n%s",
+                               request.method, request.path, stack)
+
+
+def init_sessions(app, factory):
+    """Give every request of ``app`` its own session from ``factory`` (a sessionmaker)"""
+    sessions = app.extensions['db_sessions'] = RequestSessions(
+        factory, app.config.get('DB_LEAK_DETECTION', app.debug))
+
+    @app.after_request
+    def commit_session(response):
+        session = g.get('db_session')
+        if session is None or response.status_code >= 400:
+            return response
+        try:
+            session.commit()
+        except SQLAlchemyError as e:
+            session.rollback()
+            logger.error(f"Database Error: {str(e)}")
+            response = jsonify({'message': 'Database error occurred', 'status': 'error'})
+            response.status_code = 500
+        return response
+
+    @app.teardown_request
+    def close_session(exc):
+        session = g.pop('db_session', None)
+        if session is not None:
+            session.close()  # rolls back whatever was not committed
+        if sessions.leak_detection:
+            sessions.check_leaks()
+
+    return sessions
+
+
+def session_factory():
+    """The current app's session factory, for work that outlives the request (e.g. streaming)"""
+    return current_app.extensions['db_sessions'].factory
+
+
+def get_session():
+    """The current request's session; closed by the app at teardown, never by the caller"""
+    session = g.get('db_session')
+    if session is None:
+        session = g.db_session = session_factory()()
+    return session
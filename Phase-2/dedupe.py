@@ -0,0 +1,240 @@
+"""
+Duplicate patient detection (record linkage).
+
+Comparing every pair of patients is O(n^2). Instead each patient is put
+into a few blocks - same birth date, same last digits of the phone
+number, same-sounding last and first name - and only
+patients that share a block are compared. A block bigger than
+``MAX_BLOCK_SIZE`` (a birth date shared by thousands of patients) is
+too common to say anything and is skipped; the other blocks still pair
+those patients up.
+
+    python dedupe.py [report.csv] [processes]
+
+writes every pair scoring at least ``REVIEW_THRESHOLD`` to a CSV report
+for staff to review, best match first. With ``processes`` the blocks are
+scored in a process pool.
+"""
+import csv
+import os
+import re
+import sys
+from collections import defaultdict, namedtuple
+from functools import lru_cache
+from multiprocessing import Pool
+
+from phonetic import soundex, metaphone, similarity, trigrams
+
+REVIEW_THRESHOLD = float(os.getenv('DUPLICATE_REVIEW_THRESHOLD', '0.8'))
+# Registration is refused at or above this score
+REJECT_THRESHOLD = float(os.getenv('DUPLICATE_REJECT_THRESHOLD', '0.95'))
+MAX_BLOCK_SIZE = int(os.getenv('DUPLICATE_MAX_BLOCK_SIZE', '500'))
+PHONE_DIGITS = 7
+
+# Name is always compared; the others only count when both records have them.
+# People change email addresses, so a different one is not held against a pair.
+WEIGHTS = {'name': 0.4, 'birth_date': 0.25, 'phone': 0.25, 'email': 0.1}
+
+Record = namedtuple('Record', 'id first_name last_name birth_date phone email')
+Match = namedtuple('Match', 'score a b matched')
+
+
+def phone_suffix(phone):
+    """Last ``PHONE_DIGITS`` digits of a phone number however it is written; None if it has fewer"""
+    digits = re.sub(r'\D', '', phone or '')
+    return digits[-PHONE_DIGITS:] if len(digits) >= PHONE_DIGITS else None
+
+
+def record(patient):
+    """Normalised comparison record for a Patient row (or anything with the same attributes)"""
+    birth_date = patient.birth_date
+    return Record(
+        patient.id,
+        (patient.first_name or '').strip(),
+        (patient.last_name or '').strip(),
+        birth_date.isoformat() if hasattr(birth_date, 'isoformat') else birth_date or None,
+        phone_suffix(patient.phone),
+        (patient.email or '').strip().lower() or None,
+    )
+
+
+def blocking_keys(rec):
+    """Blocks the record falls into, always in the same order"""
+    keys = []
+    if rec.birth_date:
+        keys.append(f"dob:{rec.birth_date}")
+    if rec.phone:
+        keys.append(f"phone:{rec.phone}")
+    if rec.last_name and rec.first_name:
+        keys.append(f"name:{soundex(rec.last_name)}:{metaphone(rec.first_name)}")
+    return keys
+
+
+@lru_cache(maxsize=65536)
+def _name_features(first_name, last_name):
+    # Names repeat a lot, so each is reduced to trigrams and phonetic keys once per process
+    return frozenset(trigrams(f"{first_name} {last_name}")), (metaphone(first_name), metaphone(last_name))
+
+
+def compare(a, b):
+    """Score how likely two records are the same person (0.0 - 1.0) and list the fields that agree"""
+    a_grams, a_sound = _name_features(a.first_name, a.last_name)
+    b_grams, b_sound = _name_features(b.first_name, b.last_name)
+    name = similarity(a_grams, b_grams)
+    if a_sound == b_sound:
+        # Spelt differently, sounds the same: Catherine / Kathryn
+        name = max(name, 0.9)
+    evidence = {'name': name}
+    for field in ('birth_date', 'phone'):
+        x, y = getattr(a, field), getattr(b, field)
+        if x and y:
+            evidence[field] = 1.0 if x == y else 0.0
+    if a.email and a.email == b.email:
+        evidence['email'] = 1.0
+    if len(evidence) < 2:
+        # A name alone is not enough to call two patients the same
+        return 0.0, ()
+    score = sum(WEIGHTS[f] * v for f, v in evidence.items()) / sum(WEIGHTS[f] for f in evidence)
+    matched = tuple(f for f, v in evidence.items() if v >= 0.8)
+    return round(score, 4), matched
+
+
+def _score_block(block):
+    """Compare every pair in one block; returns (matches, comparisons)"""
+    key, members, threshold = block
+    matches, comparisons = [], 0
+    for i, (a, a_keys) in enumerate(members):
+        for b, b_keys in members[i + 1:]:
+            # A pair sharing several blocks is only scored in the first of them
+            if next(k for k in a_keys if k in b_keys) != key:
+                continue
+            comparisons += 1
+            score, matched = compare(a, b)
+            if score >= threshold:
+                matches.append(Match(score, *sorted((a, b)), matched))
+    return matches, comparisons
+
+
+def find_duplicates(records, threshold=REVIEW_THRESHOLD, processes=None, max_block_size=MAX_BLOCK_SIZE):
+    """Candidate duplicate pairs among ``records``, best first, and counts of the work done.
+
+    ``processes`` > 1 scores the blocks in a process pool.
+    """
+    blocks = defaultdict(list)
+    keyed = []
+    for rec in records:
+        keys = blocking_keys(rec)
+        keyed.append((rec, keys))
+        for key in keys:
+            blocks[key].append(rec.id)
+    usable = {key for key, ids in blocks.items() if 1 < len(ids) <= max_block_size}
+
+    members = defaultdict(list)
+    for rec, keys in keyed:
+        keys = tuple(k for k in keys if k in usable)
+        for key in keys:
+            members[key].append((rec, keys))
+    work = [(key, group, threshold) for key, group in members.items()]
+
+    if processes and processes > 1:
+        with Pool(processes) as pool:
+            results = list(pool.imap_unordered(_score_block, work, chunksize=64))
+    else:
+        results = [_score_block(block) for block in work]
+
+    matches = [match for found, _ in results for match in found]
+    matches.sort(key=lambda m: (-m.score, m.a.id, m.b.id))
+    stats = {
+        'records': len(keyed),
+        'blocks': len(work),
+        'skipped_blocks': sum(1 for ids in blocks.values() if len(ids) > max_block_size),
+        'comparisons': sum(count for _, count in results),
+    }
+    return matches, stats
+
+
+def find_matches(session, first_name, last_name, phone=None, birth_date=None, email=None,
+                 threshold=REVIEW_THRESHOLD):
+    """Existing patients that look like the one about to be registered, best first"""
+    from sqlalchemy import or_
+    from models import Patient
+
+    new = record(Record(None, first_name, last_name, birth_date, phone, email))
+    conditions = []
+    if new.last_name and new.first_name:
+        conditions.append((Patient.last_name_soundex == soundex(new.last_name))
+                          & (Patient.first_name_metaphone == metaphone(new.first_name)))
+    if birth_date:
+        conditions.append(Patient.birth_date == birth_date)
+    if new.phone:
+        # The stored suffix, so "+1 (555) 123-4567" finds "5551234567" as the batch blocks do
+        conditions.append(Patient.phone_suffix == new.phone)
+    if email:
+        conditions.append(Patient.email == email)
+    if not conditions:
+        return []
+
+    candidates = session.query(Patient.id, Patient.first_name, Patient.last_name, Patient.birth_date,
+                               Patient.phone, Patient.email).filter(or_(*conditions)).limit(MAX_BLOCK_SIZE)
+    matches = []
+    for row in candidates:
+        score, matched = compare(new, record(row))
+        if score >= threshold:
+            matches.append(Match(score, new, record(row), matched))
+    matches.sort(key=lambda m: (-m.score, m.b.id))
+    return matches
+
+
+def backfill(session, batch_size=5000):
+    """Fill ``phone_suffix`` for patients written before it existed; returns the number updated"""
+    from models import Patient
+
+    updated, last_id = 0, ''
+    while True:
+        rows = session.query(Patient.id, Patient.phone)\
+            .filter(Patient.phone_suffix.is_(None), Patient.phone.isnot(None), Patient.id > last_id)\
+            .order_by(Patient.id).limit(batch_size).all()
+        if not rows:
+            return updated
+        last_id = rows[-1].id
+        # Phones too short to have a suffix stay NULL; the id cursor keeps them from coming back
+        mappings = [{'id': row.id, 'phone_suffix': phone_suffix(row.phone)} for row in rows
+                    if phone_suffix(row.phone)]
+        session.bulk_update_mappings(Patient, mappings)
+        session.commit()
+        updated += len(mappings)
+
+
+def load_records(session):
+    from models import Patient
+    rows = session.query(Patient.id, Patient.first_name, Patient.last_name, Patient.birth_date,
+                         Patient.phone, Patient.email).yield_per(10000)
+    return [record(row) for row in rows]
+
+
+def write_report(matches, out):
+    """Write the duplicate candidates as CSV, one pair per row"""
+    writer = csv.writer(out)
+    writer.writerow(['score', 'matched', 'patient_id', 'name', 'birth_date', 'phone',
+                     'duplicate_id', 'duplicate_name', 'duplicate_birth_date', 'duplicate_phone'])
+    for m in matches:
+        writer.writerow([m.score, '+'.join(m.matched),
+                         m.a.id, f"{m.a.first_name} {m.a.last_name}", m.a.birth_date or '', m.a.phone or '',
+                         m.b.id, f"{m.b.first_name} {m.b.last_name}", m.b.birth_date or '', m.b.phone or ''])
+
+
+if __name__ == '__main__':
+    from db import SessionLocal
+
+    path = sys.argv[1] if len(sys.argv) > 1 else 'duplicate_patients.csv'
+    processes = int(sys.argv[2]) if len(sys.argv) > 2 else None
+    session = SessionLocal()
+    try:
+        records = load_records(session)
+    finally:
+        session.close()
+    matches, stats = find_duplicates(records, processes=processes)
+    with open(path, 'w', newline='') as out:
+        write_report(matches, out)
+    print(f"{len(matches)} candidate pairs among {stats['records']} patients "
+          f"({stats['comparisons']} comparisons, {stats['skipped_blocks']} oversized blocks skipped) -> {path}")
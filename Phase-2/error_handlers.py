@@ -95,4 +95,8 @@ class AuthorizationError(APIError):
 
 class ConflictError(APIError):
     def __init__(self, message='Resource conflict'):
-        super().__init__(message=message, status_code=409) 
\ No newline at end of file
+        super().__init__(message=message, status_code=409) 
+
+class SlotUnavailableError(ConflictError):
+    def __init__(self, message='This time slot is not available'):
+        super().__init__(message=message)
@@ -0,0 +1,114 @@
+"""
+Response shaping for the list endpoints: ``?expand=`` and ``?fields=``.
+
+``?expand=``: related rows are returned only when asked for, and then
+loaded together with the page instead of one lazy load per row.
+
+Each endpoint declares what it can expand, e.g.
+
+    APPOINTMENT_EXPANSIONS = {
+        'doctor': Expansion(joinedload(Appointment.doctor), fields={'doctor_name': ...}),
+    }
+
+and ``expand(query, fields, APPOINTMENT_EXPANSIONS)`` adds the loaders of
+the names in ``?expand=doctor,schedule`` to the query before it runs and
+returns the fields to marshal with. Many-to-one relations are joined into
+the page query; collections use ``selectinload``, one more query per page.
+Either way the number of queries does not depend on the number of rows.
+
+``?fields=id,visit_date``: ``sparse(query, fields, MedicalRecord)`` keeps
+only the listed fields in the output and defers the columns that nothing
+kept reads, so e.g. the Text columns of a medical record are not fetched
+at all. Apply it after ``expand`` so expanded fields can be picked too.
+"""
+from flask_restful import reqparse
+from sqlalchemy import inspect
+from sqlalchemy.orm import defer
+from error_handlers import ValidationError
+
+expand_parser = reqparse.RequestParser()
+expand_parser.add_argument('expand', location='args')
+
+fields_parser = reqparse.RequestParser()
+fields_parser.add_argument('fields', location='args')
+
+
+class Expansion:
+    """The loader options of one expandable relation and the fields that show it"""
+
+    def __init__(self, *loaders, fields=None):
+        self.loaders = loaders  # none when the endpoint's query already loads the relation
+        self.fields = fields or {}
+
+
+def expand_args(expansions):
+    """The names listed in ``?expand=``, each checked against ``expansions``"""
+    raw = expand_parser.parse_args()['expand'] or ''
+    names = _names(raw)
+    unknown = [name for name in names if name not in expansions]
+    if unknown:
+        raise ValidationError(f"Cannot expand {', '.join(unknown)}; choose from {', '.join(sorted(expansions))}")
+    return names
+
+
+def expand(query, fields, expansions, names=None):
+    """Add the loaders of the requested expansions to ``query``; return it and the fields to marshal with"""
+    names = expand_args(expansions) if names is None else names
+    for name in names:
+        expansion = expansions[name]
+        if expansion.loaders:
+            query = query.options(*expansion.loaders)
+        fields = dict(fields, **expansion.fields)
+    return query, fields
+
+
+def _names(raw):
+    return list(dict.fromkeys(name.strip() for name in raw.split(',') if name.strip()))
+
+
+def field_args(item_fields):
+    """The names listed in ``?fields=`` (None when absent), each checked against ``item_fields``"""
+    raw = fields_parser.parse_args()['fields']
+    if raw is None:
+        return None
+    names = _names(raw)
+    unknown = [name for name in names if name not in item_fields]
+    if not names or unknown:
+        raise ValidationError(f"Unknown fields {', '.join(unknown) or '(none given)'}; "
+                              f"choose from {', '.join(item_fields)}")
+    return names
+
+
+def _source(name, field):
+    """The attribute a field reads: its ``attribute`` when that is a plain name, else its own name"""
+    attribute = getattr(field, 'attribute', None)
+    if attribute is None:
+        return name
+    return attribute if isinstance(attribute, str) else None
+
+
+def sparse(query, item_fields, model, names=None, keep=(), reads=None):
+    """Trim ``item_fields`` to ``?fields=`` and defer the columns only the dropped fields read.
+
+    ``keep`` names columns to load whatever is asked for, e.g. the sort key
+    ``paginate`` reads from the last row. Fields computed by a function are
+    assumed to read no column of ``model``; ``reads`` maps those that do to
+    the columns they need (``{'day': ['datetime']}``).
+    """
+    names = field_args(item_fields) if names is None else names
+    if not names:
+        return query, item_fields
+    kept = {name: item_fields[name] for name in names}
+    needed = set(keep)
+    for name, field in kept.items():
+        needed.add(_source(name, field))
+        needed.update((reads or {}).get(name, ()))
+    mapper = inspect(model)
+    primary_key = {mapper.get_property_by_column(c).key for c in mapper.primary_key}
+    columns = {prop.key for prop in mapper.column_attrs}
+    deferred = [getattr(model, key) for key in dict.fromkeys(
+        _source(name, field) for name, field in item_fields.items() if name not in kept)
+        if key in columns and key not in needed and key not in primary_key]
+    if deferred:
+        query = query.options(*[defer(column) for column in deferred])
+    return query, kept
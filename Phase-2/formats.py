@@ -0,0 +1,165 @@
+"""
+Compact response formats, chosen by the ``Accept`` header.
+
+    application/json                    rows of objects, ISO timestamps (the default)
+    application/msgpack                 the same rows as MessagePack, timestamps as epoch seconds
+    application/vnd.hms.columns+json    one array per field, {"id": [...], "datetime": [...]},
+                                        timestamps as epoch seconds
+
+Only the schedule views polled by the mobile and kiosk clients speak the
+compact formats. They set ``representations = REPRESENTATIONS`` and marshal
+with ``negotiated_marshal_with(fields)`` instead of ``marshal_with``: for
+the compact formats their DateTime fields become ``Epoch`` fields and, for
+the columnar layout, the rows are turned into columns. Any other resource
+answers a client that accepts nothing but a compact format with 406 (see
+``init_formats``). MessagePack needs the optional ``msgpack`` package;
+without it that media type is not offered and such clients get JSON.
+"""
+import json
+import threading
+import time
+from calendar import timegm
+from collections import OrderedDict
+from functools import wraps
+
+from flask import current_app, make_response, request
+from flask_restful import fields
+from flask_restful.utils import unpack
+from werkzeug.exceptions import NotAcceptable
+
+from serializers import marshal, output_json
+
+try:
+    import msgpack
+except ImportError:  # optional: only needed to offer application/msgpack
+    msgpack = None
+
+JSON = 'application/json'
+MSGPACK = 'application/msgpack'
+MSGPACK_LEGACY = 'application/x-msgpack'
+COLUMNS = 'application/vnd.hms.columns+json'
+
+MAX_COMPACT = 128
+
+_compact = OrderedDict()
+_lock = threading.Lock()
+
+
+def _epoch(value):
+    # Naive datetimes are server local time, as booking and slot generation write them with datetime.now()
+    if value.tzinfo is None:
+        return int(time.mktime(value.timetuple()))
+    return timegm(value.utctimetuple())
+
+
+class Epoch(fields.Raw):
+    """A datetime as integer seconds since 1970-01-01 UTC; naive datetimes are taken as local time"""
+
+    # Inlined by serializers.compile_fields
+    compiled_format = '_epoch(v)'
+    compiled_names = {'_epoch': _epoch}
+
+    def format(self, value):
+        return _epoch(value)
+
+
+def offered():
+    """The media types the API can answer with, JSON first"""
+    return [JSON, COLUMNS] + ([MSGPACK, MSGPACK_LEGACY] if msgpack is not None else [])
+
+
+def negotiated():
+    """The media type of the current request's response"""
+    return request.accept_mimetypes.best_match(offered(), default=JSON)
+
+
+def _compact_field(field):
+    if isinstance(field, dict):
+        return compact_fields(field)
+    if isinstance(field, type):
+        field = field()
+    if isinstance(field, fields.DateTime):
+        return Epoch(default=field.default, attribute=field.attribute)
+    if isinstance(field, fields.Nested):
+        return fields.Nested(compact_fields(field.nested), allow_null=field.allow_null, default=field.default,
+                             attribute=field.attribute)
+    return field
+
+
+def compact_fields(item_fields):
+    """``item_fields`` with every DateTime, nested ones included, written as epoch seconds"""
+    key = id(item_fields)
+    with _lock:
+        cached = _compact.get(key)
+        if cached is not None:
+            _compact.move_to_end(key)
+            return cached[1]
+    compact = {name: _compact_field(field) for name, field in item_fields.items()}
+    with _lock:
+        _compact[key] = (item_fields, compact)  # holding item_fields keeps its id from being reused
+        if len(_compact) > MAX_COMPACT:
+            _compact.popitem(last=False)
+    return compact
+
+
+def marshal_negotiated(data, item_fields):
+    """``marshal`` in the shape the negotiated format wants"""
+    mediatype = negotiated()
+    if mediatype == JSON:
+        return marshal(data, item_fields)
+    compact = compact_fields(item_fields)
+    if mediatype == COLUMNS and isinstance(data, (list, tuple)):
+        rows = marshal(data, compact)
+        return {name: [row[name] for row in rows] for name in compact}
+    return marshal(data, compact)
+
+
+class negotiated_marshal_with:
+    """``marshal_with`` that honours the Accept header (see ``marshal_negotiated``)"""
+
+    def __init__(self, item_fields):
+        self.fields = item_fields
+
+    def __call__(self, f):
+        @wraps(f)
+        def wrapper(*args, **kwargs):
+            resp = f(*args, **kwargs)
+            if isinstance(resp, tuple):
+                data, code, headers = unpack(resp)
+                return marshal_negotiated(data, self.fields), code, headers
+            return marshal_negotiated(resp, self.fields)
+        return wrapper
+
+
+def _respond(body, code, headers):
+    resp = make_response(body, code)
+    resp.headers.extend(headers or {})
+    return resp
+
+
+def output_msgpack(data, code, headers=None):
+    return _respond(msgpack.packb(data, use_bin_type=True), code, headers)
+
+
+def output_columns(data, code, headers=None):
+    return _respond(json.dumps(data, separators=(',', ':')) + "\n", code, headers)
+
+
+# ``representations`` of the resources that serve the compact formats, JSON first
+REPRESENTATIONS = OrderedDict([(JSON, output_json), (COLUMNS, output_columns)])
+if msgpack is not None:
+    REPRESENTATIONS[MSGPACK] = output_msgpack
+    REPRESENTATIONS[MSGPACK_LEGACY] = output_msgpack
+
+
+def init_formats(api):
+    """Answer 406 when a compact format is all the client takes and the resource doesn't serve it"""
+    @api.app.before_request
+    def check_acceptable():
+        view = current_app.view_functions.get(request.endpoint)
+        resource = getattr(view, 'view_class', None)
+        if resource is None or COLUMNS in (resource.representations or ()):
+            return None
+        if negotiated() != JSON and not request.accept_mimetypes.quality(JSON):
+            raise NotAcceptable(f"{request.path} is only available as {JSON}")
+        return None
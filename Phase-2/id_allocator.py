@@ -0,0 +1,113 @@
+import os
+import re
+import threading
+
+from sqlalchemy import select, update, insert
+from sqlalchemy.exc import IntegrityError
+
+import db
+from models import IdCounter, User, Patient, Doctor, Appointment, MedicalRecord, Department, Schedule
+
+# How many numbers a worker reserves per round-trip to the counter table
+DEFAULT_BLOCK_SIZE = int(os.getenv('ID_BLOCK_SIZE', '50'))
+
+
+class IdAllocator:
+    """Hand out prefixed string IDs (U001, P001, SC0001, ...) without querying the target table.
+
+    Numbers are reserved from the ``id_counters`` table in blocks of
+    ``block_size`` (hi/lo): one short transaction bumps the counter, then the
+    block is served from memory. Unused numbers are lost when a worker exits,
+    so IDs are unique but not gap-free.
+    """
+
+    def __init__(self, name, prefix, width, column, block_size=DEFAULT_BLOCK_SIZE, bind=None):
+        self.name = name
+        self.prefix = prefix
+        self.width = width
+        self.column = column
+        self.block_size = block_size
+        self.bind = bind
+        self._pattern = re.compile(rf'^{re.escape(prefix)}(\d+)$')
+        self._lock = threading.Lock()
+        self._next = 0
+        self._limit = 0
+        self._pid = None
+
+    def next_id(self):
+        """Return the next free ID for this entity"""
+        with self._lock:
+            # A block reserved before a fork (gunicorn preload) must not be reused by the children
+            if self._pid != os.getpid() or self._next >= self._limit:
+                self._reserve(self.block_size)
+            value = self._next
+            self._next += 1
+        return self.format(value)
+
+    def next_ids(self, count):
+        """Return ``count`` IDs, reserving one large block when the current one runs short"""
+        values = []
+        with self._lock:
+            if self._pid != os.getpid():
+                self._next = self._limit = 0
+            while len(values) < count:
+                if self._next >= self._limit:
+                    self._reserve(max(self.block_size, count - len(values)))
+                take = min(count - len(values), self._limit - self._next)
+                values.extend(range(self._next, self._next + take))
+                self._next += take
+        return [self.format(value) for value in values]
+
+    def format(self, value):
+        return f"{self.prefix}{value:0{self.width}}"
+
+    def reset(self):
+        """Drop the in-memory block so the next call reserves a fresh one"""
+        with self._lock:
+            self._next = self._limit = 0
+            self._pid = None
+
+    def _reserve(self, size):
+        bind = self.bind or db.engine
+        # Two attempts: the second one covers losing the race to seed the counter row
+        for _ in range(2):
+            try:
+                with bind.begin() as conn:
+                    result = conn.execute(
+                        update(IdCounter)
+                        .where(IdCounter.name == self.name)
+                        .values(next_value=IdCounter.next_value + size)
+                    )
+                    if result.rowcount:
+                        end = conn.execute(
+                            select(IdCounter.next_value).where(IdCounter.name == self.name)
+                        ).scalar_one()
+                    else:
+                        end = self._max_existing(conn) + 1 + size
+                        conn.execute(insert(IdCounter).values(name=self.name, next_value=end))
+            except IntegrityError:
+                continue
+            self._next = end - size
+            self._limit = end
+            self._pid = os.getpid()
+            return
+        raise RuntimeError(f"Could not reserve IDs for {self.name}")
+
+    def _max_existing(self, conn):
+        """Highest numeric suffix already in the table; only runs once, when the counter is created"""
+        highest = 0
+        rows = conn.execute(select(self.column).where(self.column.like(f"{self.prefix}%")))
+        for (value,) in rows:
+            match = self._pattern.match(value)
+            if match:
+                highest = max(highest, int(match.group(1)))
+        return highest
+
+
+user_ids = IdAllocator('users', 'U', 3, User.id)
+patient_ids = IdAllocator('patients', 'P', 3, Patient.id)
+doctor_ids = IdAllocator('doctors', 'D', 3, Doctor.id)
+appointment_ids = IdAllocator('appointments', 'A', 3, Appointment.id)
+medical_record_ids = IdAllocator('medical_records', 'M', 3, MedicalRecord.id)
+department_ids = IdAllocator('departments', 'DEPT', 3, Department.id)
+schedule_ids = IdAllocator('schedules', 'SC', 4, Schedule.id)
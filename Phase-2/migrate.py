@@ -0,0 +1,109 @@
+"""
+Bring an existing database up to the schema declared in models.py.
+
+``create_all`` only creates missing tables, so a database set up before a
+column, index or unique constraint was added to the models never gets it.
+``upgrade`` creates missing tables, adds missing nullable columns, indexes
+and unique constraints, then fills derived columns such as the phonetic
+name keys and phone suffixes. It never drops or changes anything, so it is
+safe to run on every deploy:
+
+    python migrate.py           # apply
+    python migrate.py --check   # only list what is missing
+"""
+import sys
+
+from sqlalchemy import UniqueConstraint, inspect, text
+from sqlalchemy.orm import Session
+
+import db
+from db import Base
+import models  # noqa: F401  (registers the tables on Base.metadata)
+
+
+def pending(bind):
+    """What the database lacks compared to the models, as (description, apply) pairs"""
+    inspector = inspect(bind)
+    existing_tables = set(inspector.get_table_names())
+    preparer = bind.dialect.identifier_preparer
+    steps = []
+    for table in Base.metadata.sorted_tables:
+        if table.name not in existing_tables:
+            steps.append((f"create table {table.name}", lambda conn, t=table: t.create(conn)))
+            continue
+
+        columns = {column['name'] for column in inspector.get_columns(table.name)}
+        for column in table.columns:
+            if column.name in columns:
+                continue
+            if not column.nullable or column.primary_key:
+                raise RuntimeError(f"{table.name}.{column.name} is NOT NULL and has to be added by hand")
+            ddl = (f"ALTER TABLE {preparer.format_table(table)} "
+                   f"ADD {preparer.format_column(column)} {column.type.compile(dialect=bind.dialect)}")
+            steps.append((f"add column {table.name}.{column.name}", lambda conn, ddl=ddl: conn.execute(text(ddl))))
+
+        reflected = inspector.get_indexes(table.name)
+        indexes = {index['name'] for index in reflected}
+        for index in sorted(table.indexes, key=lambda i: i.name):
+            if index.name not in indexes:
+                steps.append((f"create index {index.name} on {table.name}", lambda conn, i=index: i.create(conn)))
+
+        # Matched by columns: the database may have named an inline UNIQUE itself
+        unique = {tuple(c['column_names']) for c in inspector.get_unique_constraints(table.name)}
+        unique |= {tuple(i['column_names']) for i in reflected if i['unique']}
+        for constraint in table.constraints:
+            if not isinstance(constraint, UniqueConstraint):
+                continue
+            columns = tuple(column.name for column in constraint.columns)
+            if columns not in unique:
+                name = constraint.name or f"uq_{table.name}_{'_'.join(columns)}"
+                steps.append((f"add unique constraint {name} on {table.name}",
+                              lambda conn, t=table, n=name, c=columns: _add_unique(conn, t, n, c)))
+    return steps
+
+
+def _add_unique(conn, table, name, columns):
+    preparer = conn.dialect.identifier_preparer
+    quoted = ', '.join(preparer.quote(column) for column in columns)
+    duplicate = conn.execute(text(
+        f"SELECT {quoted} FROM {preparer.format_table(table)} "
+        f"WHERE {' AND '.join(f'{preparer.quote(c)} IS NOT NULL' for c in columns)} "
+        f"GROUP BY {quoted} HAVING COUNT(*) > 1"
+    )).first()
+    if duplicate is not None:
+        raise RuntimeError(f"{table.name} has duplicate rows for {name} ({', '.join(map(str, duplicate))}); "
+                           f"they have to be resolved by hand")
+    if conn.dialect.name == 'sqlite':
+        # SQLite can't add a constraint to an existing table; a unique index enforces the same
+        ddl = f"CREATE UNIQUE INDEX {preparer.quote(name)} ON {preparer.format_table(table)} ({quoted})"
+    else:
+        ddl = f"ALTER TABLE {preparer.format_table(table)} ADD CONSTRAINT {preparer.quote(name)} UNIQUE ({quoted})"
+    conn.execute(text(ddl))
+
+
+def upgrade(bind=None):
+    """Apply every pending step; returns their descriptions"""
+    import dedupe
+    import phonetic
+
+    bind = bind or db.engine
+    with bind.begin() as conn:
+        steps = pending(conn)
+        for _, apply in steps:
+            apply(conn)
+    # Rows that predate the key columns, or were bulk-loaded without them
+    with Session(bind=bind) as session:
+        filled = phonetic.backfill(session)
+        suffixes = dedupe.backfill(session)
+    return ([description for description, _ in steps]
+            + ([f"fill phonetic keys for {filled} patients"] if filled else [])
+            + ([f"fill phone suffixes for {suffixes} patients"] if suffixes else []))
+
+
+if __name__ == '__main__':
+    if '--check' in sys.argv[1:]:
+        with db.engine.connect() as conn:
+            descriptions = [description for description, _ in pending(conn)]
+    else:
+        descriptions = upgrade()
+    print('\n'.join(descriptions) if descriptions else 'Database is up to date')
@@ -1,9 +1,11 @@
-from sqlalchemy import Column, Integer, String, JSON, ForeignKey, Date, DateTime, Text
+from sqlalchemy import Column, Integer, String, JSON, ForeignKey, Date, DateTime, Text, UniqueConstraint, Index, event
 from sqlalchemy.orm import relationship
 from db import Base
 from datetime import datetime
 from werkzeug.security import generate_password_hash, check_password_hash
 from sqlalchemy import Boolean
+from phonetic import name_keys
+from dedupe import PHONE_DIGITS, phone_suffix
 
 class User(Base):
     __tablename__ = "users"
@@ -29,25 +31,50 @@ class User(Base):
 
 class Patient(Base):
     __tablename__ = "patients"
+    __table_args__ = (
+        # Candidate lookups for fuzzy name search (see phonetic.py)
+        Index("ix_patients_name_soundex", "last_name_soundex", "first_name_soundex"),
+        Index("ix_patients_name_metaphone", "last_name_metaphone", "first_name_metaphone"),
+        Index("ix_patients_user_id", "user_id"),
+    )
 
     id = Column(String(10), primary_key=True)
     user_id = Column(String(10), ForeignKey("users.id"))
     first_name = Column(String(50))
     last_name = Column(String(50))
-    birth_date = Column(Date, nullable=True)
+    birth_date = Column(Date, nullable=True, index=True)
     gender     = Column(String(1), nullable=True)   # 'M' or 'F'
     address    = Column(String(200), nullable=True)
     email = Column(String(100), unique=True)
-    phone = Column(String(20))
+    phone = Column(String(20), index=True)
     created_at = Column(DateTime, default=datetime.utcnow)
     updated_at = Column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+    # Phonetic keys of the names, kept in sync by _set_search_keys below
+    first_name_soundex = Column(String(4), index=True)
+    last_name_soundex = Column(String(4))
+    first_name_metaphone = Column(String(8), index=True)
+    last_name_metaphone = Column(String(8))
+    # Last digits of the phone, whatever its formatting, for duplicate lookups (see dedupe.py)
+    phone_suffix = Column(String(PHONE_DIGITS), index=True)
 
     user = relationship("User", back_populates="patients")
     appointments = relationship("Appointment", back_populates="patient")
 
 
+@event.listens_for(Patient, "before_insert")
+@event.listens_for(Patient, "before_update")
+def _set_search_keys(mapper, connection, patient):
+    for column, value in name_keys(patient.first_name, patient.last_name).items():
+        setattr(patient, column, value)
+    patient.phone_suffix = phone_suffix(patient.phone)
+
+
 class Doctor(Base):
     __tablename__ = "doctors"
+    __table_args__ = (
+        Index("ix_doctors_department_id", "department_id"),
+        Index("ix_doctors_user_id", "user_id"),
+    )
 
     id = Column(String(10), primary_key=True)
     user_id     = Column(String(10), ForeignKey("users.id"))
@@ -83,6 +110,14 @@ class Admin(Base):
 
 class Schedule(Base):
     __tablename__ = "schedules"
+    __table_args__ = (
+        # One slot per doctor and start time; virtual slot booking relies on it
+        UniqueConstraint("doctor_id", "datetime", name="uq_schedules_doctor_datetime"),
+        # Date-range searches that don't name a doctor
+        Index("ix_schedules_datetime", "datetime"),
+        # A doctor's open slots in a date range
+        Index("ix_schedules_doctor_available", "doctor_id", "is_available", "datetime"),
+    )
 
     id = Column(String(10), primary_key=True)
     doctor_id = Column(String(10), ForeignKey("doctors.id"))
@@ -97,6 +132,12 @@ class Schedule(Base):
 
 class Appointment(Base):
     __tablename__ = "appointments"
+    __table_args__ = (
+        # Appointment search: joined from a slot, or looked up by patient
+        Index("ix_appointments_schedule_id", "schedule_id"),
+        Index("ix_appointments_patient_status", "patient_id", "status"),
+        Index("ix_appointments_doctor_status", "doctor_id", "status"),
+    )
 
     id = Column(String(10), primary_key=True)
     patient_id = Column(String(10), ForeignKey("patients.id"))
@@ -113,6 +154,11 @@ from sqlalchemy import Text
 from datetime import datetime
 class MedicalRecord(Base):
     __tablename__ = "medical_records"
+    __table_args__ = (
+        # A patient's (or department's) records, newest visit first
+        Index("ix_medical_records_patient_visit", "patient_id", "visit_date"),
+        Index("ix_medical_records_department_visit", "department_id", "visit_date"),
+    )
 
     id = Column(String(10), primary_key=True)
     patient_id = Column(String(10), ForeignKey("patients.id"))
@@ -142,6 +188,9 @@ class Department(Base):
 
 class DoctorAvailability(Base):
     __tablename__ = "doctor_availabilities"
+    __table_args__ = (
+        Index("ix_doctor_availabilities_doctor_id", "doctor_id"),
+    )
     id = Column(Integer, primary_key=True)
     doctor_id = Column(Integer, ForeignKey("doctors.id"))
     day_of_week = Column(Integer, nullable=False)  # 0 = Monday, 6 = Sunday
@@ -151,4 +200,10 @@ class DoctorAvailability(Base):
     created_at = Column(DateTime, default=datetime.utcnow)
     updated_at = Column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
 
-    doctor = relationship("Doctor", back_populates="availabilities")
\ No newline at end of file
+    doctor = relationship("Doctor", back_populates="availabilities")
+
+class IdCounter(Base):
+    __tablename__ = "id_counters"
+
+    name = Column(String(50), primary_key=True)  # e.g. "appointments"
+    next_value = Column(Integer, nullable=False)  # first number not yet handed out to any worker
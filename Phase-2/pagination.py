@@ -0,0 +1,91 @@
+import base64
+import json
+import os
+from datetime import date, datetime
+from flask_restful import reqparse
+from sqlalchemy import and_, or_
+from error_handlers import ValidationError
+
+PAGE_SIZE = int(os.getenv('PAGE_SIZE', '50'))
+MAX_PAGE_SIZE = int(os.getenv('MAX_PAGE_SIZE', '500'))
+
+page_parser = reqparse.RequestParser()
+page_parser.add_argument('cursor', location='args')
+page_parser.add_argument('limit', type=int, location='args')
+
+
+def page_args():
+    """Read ``cursor`` and ``limit`` from the query string"""
+    args = page_parser.parse_args()
+    return args['cursor'], args['limit']
+
+
+def encode_cursor(values):
+    """Pack the sort key of the last row into an opaque, URL-safe token"""
+    raw = json.dumps([v.isoformat() if isinstance(v, (date, datetime)) else v for v in values],
+                     separators=(',', ':'))
+    return base64.urlsafe_b64encode(raw.encode()).decode().rstrip('=')
+
+
+def decode_cursor(cursor, columns):
+    """Unpack a cursor made by ``encode_cursor`` for the given sort columns"""
+    try:
+        padded = cursor + '=' * (-len(cursor) % 4)
+        values = json.loads(base64.urlsafe_b64decode(padded.encode()))
+        if not isinstance(values, list) or len(values) != len(columns):
+            raise ValueError
+        return [_from_json(column, value) for column, value in zip(columns, values)]
+    except (ValueError, TypeError):
+        raise ValidationError('Invalid cursor')
+
+
+def _from_json(column, value):
+    if value is None:
+        return None
+    python_type = column.type.python_type
+    if python_type is datetime:
+        return datetime.fromisoformat(value)
+    if python_type is date:
+        return date.fromisoformat(value)
+    return python_type(value)
+
+
+def _after(columns, values, descending):
+    """WHERE clause for rows strictly after ``values`` in (col1, col2, ..., id) order.
+
+    Spelled out as (a > x) OR (a = x AND b > y) ... rather than a row-value
+    comparison, which SQL Server does not support.
+    """
+    clauses = []
+    for i, column in enumerate(columns):
+        step = column < values[i] if descending else column > values[i]
+        clauses.append(and_(*[columns[j] == values[j] for j in range(i)], step))
+    return or_(*clauses)
+
+
+def paginate(query, columns, cursor=None, limit=None, descending=False, key=None):
+    """Return one page of ``query`` ordered by ``columns`` and the cursor for the next.
+
+    The last column must be unique (normally the primary key) so the order
+    is total. Pages are found with a WHERE on the sort key instead of
+    OFFSET, so page 10,000 costs the same as page 1 given an index on the
+    sort columns. ``next_cursor`` is None on the last page.
+
+    ``key(row)`` returns the sort values of a row when they are not all
+    attributes of it, e.g. when sorting on a joined table's column.
+    """
+    limit = PAGE_SIZE if limit is None else limit
+    if limit < 1:
+        raise ValidationError('limit must be at least 1')
+    limit = min(limit, MAX_PAGE_SIZE)
+
+    if cursor:
+        query = query.filter(_after(columns, decode_cursor(cursor, columns), descending))
+    query = query.order_by(*[c.desc() if descending else c.asc() for c in columns])
+
+    rows = query.limit(limit + 1).all()
+    if len(rows) <= limit:
+        return rows, None
+    rows = rows[:limit]
+    last = rows[-1]
+    return rows, encode_cursor(key(last) if key else [getattr(last, c.key) for c in columns])
@@ -0,0 +1,136 @@
+"""
+Phonetic keys and trigram similarity for typo-tolerant name matching.
+
+``soundex`` and ``metaphone`` reduce a name to a short code that sounds
+alike for common misspellings ("Smyth"/"Smith", "Catherine"/"Kathryn").
+The codes are stored on each Patient row (see models.py) so fuzzy search
+can find candidates with indexed equality lookups; ``similarity`` then
+ranks them. ``python migrate.py`` adds the columns to older databases;
+``python phonetic.py`` fills the keys for rows written without them.
+"""
+import re
+
+_SOUNDEX_CODES = {}
+for _letters, _code in (('BFPV', '1'), ('CGJKQSXZ', '2'), ('DT', '3'), ('L', '4'), ('MN', '5'), ('R', '6')):
+    for _letter in _letters:
+        _SOUNDEX_CODES[_letter] = _code
+
+METAPHONE_LENGTH = 6
+
+# Applied in order to an upper-cased, letters-only name. A simplified
+# Metaphone: enough to fold the usual spelling variants of names together.
+_METAPHONE_RULES = [
+    (re.compile(r'^(KN|GN|PN|WR|AE)'), lambda m: m.group(0)[1]),
+    (re.compile(r'^X'), 'S'),
+    (re.compile(r'X'), 'KS'),
+    (re.compile(r'MB$'), 'M'),
+    (re.compile(r'([^C])\1+'), r'\1'),
+    (re.compile(r'PH'), 'F'),
+    (re.compile(r'SCH'), 'SK'),
+    (re.compile(r'CH(?=[RL])'), 'K'),
+    (re.compile(r'TIA|TIO|SIA|SIO|SH|CH'), 'X'),
+    (re.compile(r'TH'), '0'),
+    (re.compile(r'DG(?=[EIY])'), 'J'),
+    (re.compile(r'C(?=[EIY])'), 'S'),
+    (re.compile(r'CK|C|Q'), 'K'),
+    (re.compile(r'GH(?![AEIOU])'), ''),
+    (re.compile(r'G(?=[EIY])'), 'J'),
+    (re.compile(r'Z'), 'S'),
+    (re.compile(r'V'), 'F'),
+    (re.compile(r'D'), 'T'),
+    (re.compile(r'[WY](?![AEIOU])'), ''),
+    (re.compile(r'(?<=.)[AEIOUH]'), ''),
+    (re.compile(r'^[AEIOU]'), 'A'),
+    (re.compile(r'(.)\1+'), r'\1'),
+]
+
+
+def _letters(name):
+    return re.sub(r'[^A-Z]', '', (name or '').upper())
+
+
+def soundex(name):
+    """American Soundex: first letter plus three digits, e.g. Robert -> R163"""
+    letters = _letters(name)
+    if not letters:
+        return ''
+    code, last = letters[0], _SOUNDEX_CODES.get(letters[0], '')
+    for letter in letters[1:]:
+        digit = _SOUNDEX_CODES.get(letter, '')
+        if digit and digit != last:
+            code += digit
+            if len(code) == 4:
+                break
+        if letter not in 'HW':
+            # Vowels separate repeated codes; H and W do not
+            last = digit
+    return code.ljust(4, '0')
+
+
+def metaphone(name, length=METAPHONE_LENGTH):
+    """Simplified Metaphone key, e.g. Catherine -> K0RN, Kathryn -> K0RN"""
+    word = _letters(name)
+    for pattern, replacement in _METAPHONE_RULES:
+        word = pattern.sub(replacement, word)
+    return word[:length]
+
+
+def name_keys(first_name, last_name):
+    """Column values for the phonetic keys of a patient"""
+    return {
+        'first_name_soundex': soundex(first_name) or None,
+        'last_name_soundex': soundex(last_name) or None,
+        'first_name_metaphone': metaphone(first_name) or None,
+        'last_name_metaphone': metaphone(last_name) or None,
+    }
+
+
+def trigrams(text):
+    """pg_trgm-style trigrams: each word padded with two spaces in front and one behind"""
+    grams = set()
+    for word in re.findall(r'[a-z0-9]+', (text or '').lower()):
+        padded = f"  {word} "
+        grams.update(padded[i:i + 3] for i in range(len(padded) - 2))
+    return grams
+
+
+def similarity(a, b):
+    """Share of trigrams two strings have in common (0.0 - 1.0)"""
+    if not isinstance(a, (set, frozenset)):
+        a = trigrams(a)
+    if not isinstance(b, (set, frozenset)):
+        b = trigrams(b)
+    if not a or not b:
+        return 0.0
+    return len(a & b) / len(a | b)
+
+
+def backfill(session=None, batch_size=5000):
+    """Compute phonetic keys for patients that have none; returns the number updated"""
+    from models import Patient
+    from db import SessionLocal
+
+    own = session is None
+    session = session or SessionLocal()
+    try:
+        updated, last_id = 0, ''
+        while True:
+            rows = session.query(Patient.id, Patient.first_name, Patient.last_name)\
+                .filter(Patient.first_name_soundex.is_(None), Patient.first_name.isnot(None), Patient.id > last_id)\
+                .order_by(Patient.id).limit(batch_size).all()
+            if not rows:
+                return updated
+            last_id = rows[-1].id
+            # Names without a letter A-Z (e.g. '李') have no soundex and stay NULL;
+            # the id cursor keeps them from being selected again
+            mappings = [dict(id=row.id, **name_keys(row.first_name, row.last_name)) for row in rows]
+            session.bulk_update_mappings(Patient, mappings)
+            session.commit()
+            updated += sum(1 for keys in mappings if keys['first_name_soundex'])
+    finally:
+        if own:
+            session.close()
+
+
+if __name__ == '__main__':
+    print(f"Filled phonetic keys for {backfill()} patients")
@@ -1,49 +1,339 @@
 from flask import request, jsonify
 from functools import wraps
+from urllib.parse import urlparse
+import hashlib
+import logging
+import mmap
+import os
+import struct
+import tempfile
 import time
-from collections import defaultdict
 import threading
 
+from metrics import RATE_LIMITED, UNMATCHED
+
+try:
+    import fcntl
+except ImportError:  # Windows: no shared-memory backend
+    fcntl = None
+
+logger = logging.getLogger(__name__)
+
+SLIDING_WINDOW = 'sliding_window'
+TOKEN_BUCKET = 'token_bucket'
+
+
+def _overlap(now, window):
+    """Share of the previous fixed window that still falls inside the sliding one"""
+    return 1.0 - (now % window) / window
+
+
 class RateLimiter:
-    def __init__(self, requests_per_minute=60):
+    """Per-key rate limiter with O(1) checks and bounded memory.
+
+    ``sliding_window`` keeps two counters per key (previous and current fixed
+    window) and weights the previous one by how much of it still overlaps the
+    last ``window`` seconds. ``token_bucket`` keeps a token count that refills
+    at ``requests_per_minute`` per window. Either way a key costs a few words
+    of memory instead of one timestamp per request.
+
+    Keys are spread over ``stripes`` independently locked dicts. Each stripe
+    is swept every ``window`` seconds, dropping keys whose state has decayed
+    back to that of a brand-new key, so idle clients are forgotten.
+    """
+
+    def __init__(self, requests_per_minute=60, algorithm=SLIDING_WINDOW, window=60, stripes=64):
+        if algorithm not in (SLIDING_WINDOW, TOKEN_BUCKET):
+            raise ValueError(f"Unknown rate limit algorithm: {algorithm}")
+        self.requests_per_minute = requests_per_minute
+        self.algorithm = algorithm
+        self.window = window
+        self._check = self._check_sliding if algorithm == SLIDING_WINDOW else self._check_bucket
+        self._is_idle = self._sliding_idle if algorithm == SLIDING_WINDOW else self._bucket_idle
+        self._stripes = [({}, threading.Lock()) for _ in range(stripes)]
+        self._next_sweep = [0.0] * stripes
+
+    def is_allowed(self, key, limit=None):
+        """Check if request is allowed based on rate limit"""
+        now = time.time()
+        index = hash(key) % len(self._stripes)
+        states, lock = self._stripes[index]
+        with lock:
+            if now >= self._next_sweep[index]:
+                self._sweep(states, now)
+                self._next_sweep[index] = now + self.window
+            return self._check(states, key, now, limit or self.requests_per_minute)
+
+    def evict_idle(self):
+        """Sweep every stripe now; returns the number of keys dropped"""
+        now = time.time()
+        dropped = 0
+        for states, lock in self._stripes:
+            with lock:
+                before = len(states)
+                self._sweep(states, now)
+                dropped += before - len(states)
+        return dropped
+
+    def __len__(self):
+        return sum(len(states) for states, _ in self._stripes)
+
+    def _sweep(self, states, now):
+        survivors = {key: state for key, state in states.items() if not self._is_idle(state, now)}
+        if len(survivors) < len(states):
+            # clear() releases the hash table; deleting keys one by one never shrinks it
+            states.clear()
+            states.update(survivors)
+
+    # Sliding window counter: state = [window index, previous count, current count]
+
+    def _check_sliding(self, states, key, now, limit):
+        current = int(now // self.window)
+        state = states.get(key)
+        if state is None:
+            state = states[key] = [current, 0, 0]
+        elif state[0] != current:
+            state[1] = state[2] if state[0] == current - 1 else 0
+            state[0], state[2] = current, 0
+
+        if state[1] * _overlap(now, self.window) + state[2] >= limit:
+            return False
+        state[2] += 1
+        return True
+
+    def _sliding_idle(self, state, now):
+        # Nothing in the current or previous window any more
+        return state[0] < int(now // self.window) - 1
+
+    # Token bucket: state = [tokens, last refill time]
+
+    def _check_bucket(self, states, key, now, limit):
+        state = states.get(key)
+        if state is None:
+            state = states[key] = [float(limit), now]
+        else:
+            state[0] = min(float(limit), state[0] + (now - state[1]) * limit / self.window)
+            state[1] = now
+
+        if state[0] < 1.0:
+            return False
+        state[0] -= 1.0
+        return True
+
+    def _bucket_idle(self, state, now):
+        # A full window without requests refills the bucket completely
+        return now - state[1] >= self.window
+
+
+class SharedMemoryRateLimiter:
+    """Sliding-window limiter whose counters live in an mmap'd file shared by all workers on a host.
+
+    The file is a fixed-size open-addressing table of 24-byte slots
+    (key hash, window index, previous count, current count) split into
+    stripes. A stripe is guarded by a thread lock plus an fcntl byte-range
+    lock, so gunicorn workers contend only when their keys share a stripe.
+    Memory is bounded by ``slots``: idle slots are reused first and, if a
+    probe finds none, the stalest slot in reach is taken over.
+    """
+
+    SLOT = struct.Struct('<QqII')
+    PROBES = 16
+
+    def __init__(self, path, requests_per_minute=60, window=60, slots=65536, stripes=64):
+        if fcntl is None:
+            raise RuntimeError('The shared-memory rate limit backend needs fcntl (POSIX only)')
         self.requests_per_minute = requests_per_minute
-        self.requests = defaultdict(list)
-        self.lock = threading.Lock()
+        self.window = window
+        self.stripes = stripes
+        self.stripe_slots = max(slots // stripes, self.PROBES)
+        size = self.stripe_slots * stripes * self.SLOT.size
+        self._fd = os.open(path, os.O_RDWR | os.O_CREAT, 0o600)
+        if os.fstat(self._fd).st_size < size:
+            os.ftruncate(self._fd, size)
+        self._map = mmap.mmap(self._fd, size)
+        self._locks = [threading.Lock() for _ in range(stripes)]
 
-    def is_allowed(self, key):
+    def is_allowed(self, key, limit=None):
         """Check if request is allowed based on rate limit"""
+        digest = self.digest(key)
+        stripe = digest % self.stripes
+        start = stripe * self.stripe_slots * self.SLOT.size
+        length = self.stripe_slots * self.SLOT.size
         now = time.time()
-        minute_ago = now - 60
-
-        with self.lock:
-            # Clean old requests
-            self.requests[key] = [req_time for req_time in self.requests[key] 
-                                if req_time > minute_ago]
-            
-            # Check if limit is reached
-            if len(self.requests[key]) >= self.requests_per_minute:
+        current = int(now // self.window)
+
+        with self._locks[stripe]:
+            fcntl.lockf(self._fd, fcntl.LOCK_EX, length, start)
+            try:
+                offset, prev, curr = self._find(digest, start, current)
+                if curr is None:
+                    prev = curr = 0
+                if prev * _overlap(now, self.window) + curr >= (limit or self.requests_per_minute):
+                    allowed = False
+                else:
+                    curr += 1
+                    allowed = True
+                self.SLOT.pack_into(self._map, offset, digest, current, prev, curr)
+                return allowed
+            finally:
+                fcntl.lockf(self._fd, fcntl.LOCK_UN, length, start)
+
+    @staticmethod
+    def digest(key):
+        """The key's 64-bit slot key; never 0, which marks an empty slot"""
+        if isinstance(key, str):
+            key = key.encode()
+        return int.from_bytes(hashlib.blake2b(key, digest_size=8).digest(), 'little') | 1
+
+    def _find(self, digest, start, current):
+        """Return (offset, previous, current) for the key's slot; counts are None for a new slot"""
+        home = (digest >> 32) % self.stripe_slots
+        free, victim, victim_window = None, None, None
+        # Look at every probe for the key before taking a slot: it may sit past a slot that has since gone idle
+        for probe in range(self.PROBES):
+            offset = start + ((home + probe) % self.stripe_slots) * self.SLOT.size
+            slot_key, slot_window, prev, curr = self.SLOT.unpack_from(self._map, offset)
+            if slot_key == digest:
+                if slot_window == current:
+                    return offset, prev, curr
+                # Roll the counters forward into the current window
+                return offset, (curr if slot_window == current - 1 else 0), 0
+            if slot_key == 0:
+                # Slots are never emptied, so the key can't be further along
+                return (offset if free is None else free), None, None
+            if free is None and slot_window < current - 1:
+                # Idle long enough that its counts no longer matter
+                free = offset
+            if victim is None or slot_window < victim_window:
+                victim, victim_window = offset, slot_window
+        return (victim if free is None else free), None, None
+
+    def close(self):
+        self._map.close()
+        os.close(self._fd)
+
+
+class RedisRateLimiter:
+    """Sliding-window limiter on a Redis server, shared by every host.
+
+    Each key has one counter per fixed window (``INCR`` + ``EXPIRE``);
+    the previous window's counter is read in the same pipeline. Rejected
+    requests are given back with ``DECR``. ``client`` is anything speaking
+    the redis-py API (``redis.Redis`` or a test double). If Redis is
+    unreachable requests are let through rather than failing the API.
+    """
+
+    def __init__(self, client, requests_per_minute=60, window=60, prefix='ratelimit:'):
+        self.client = client
+        self.requests_per_minute = requests_per_minute
+        self.window = window
+        self.prefix = prefix
+
+    def is_allowed(self, key, limit=None):
+        """Check if request is allowed based on rate limit"""
+        if isinstance(key, str):
+            key = key.encode()
+        name = self.prefix + hashlib.blake2b(key, digest_size=16).hexdigest()
+        now = time.time()
+        current = int(now // self.window)
+        counter = f"{name}:{current}"
+        try:
+            pipe = self.client.pipeline()
+            pipe.incr(counter)
+            pipe.expire(counter, self.window * 2)
+            pipe.get(f"{name}:{current - 1}")
+            count, _, previous = pipe.execute()
+            if int(previous or 0) * _overlap(now, self.window) + count - 1 >= (limit or self.requests_per_minute):
+                self.client.decr(counter)
                 return False
-            
-            # Add new request
-            self.requests[key].append(now)
             return True
+        except Exception as e:
+            logger.warning(f"Rate limit backend unavailable, allowing request: {e}")
+            return True
+
+
+def create_limiter(storage='memory://', requests_per_minute=60, algorithm=SLIDING_WINDOW):
+    """Build a limiter from a storage URI.
+
+    ``memory://``                     per-process (default)
+    ``shm:///dev/shm/hms-ratelimit``  shared by all workers on this host
+    ``redis://host:6379/0``           shared by all hosts
+    """
+    parsed = urlparse(storage)
+    if parsed.scheme in ('', 'memory'):
+        return RateLimiter(requests_per_minute=requests_per_minute, algorithm=algorithm)
+    if parsed.scheme == 'shm':
+        path = parsed.path or os.path.join(tempfile.gettempdir(), 'hms-ratelimit')
+        return SharedMemoryRateLimiter(path, requests_per_minute=requests_per_minute)
+    if parsed.scheme in ('redis', 'rediss'):
+        import redis
+        return RedisRateLimiter(redis.Redis.from_url(storage), requests_per_minute=requests_per_minute)
+    raise ValueError(f"Unknown rate limit storage: {storage}")
+
 
 # Create rate limiter instance
 limiter = RateLimiter()
 
+
+def client_key():
+    """Identify the caller by the user of a verified token, otherwise by IP address
+
+    Never by the raw header: a client sending a different junk
+    ``Authorization`` on every request would get a fresh budget each time.
+    """
+    from auth import get_token_from_header, verify_token
+
+    token = get_token_from_header()
+    payload = verify_token(token) if token else None
+    if payload and payload.get('user_id'):
+        return f"user:{payload['user_id']}".encode()
+    return (request.remote_addr or '').encode()
+
+
 def rate_limit(f):
     """Decorator to apply rate limiting"""
     @wraps(f)
     def decorated(*args, **kwargs):
         # Get client identifier (IP address or token)
-        key = request.headers.get('Authorization') or request.remote_addr
-        
+        key = client_key()
+
         if not limiter.is_allowed(key):
+            RATE_LIMITED.labels(request.url_rule.rule if request.url_rule else UNMATCHED).inc()
             response = {
                 'message': 'Rate limit exceeded. Please try again later.',
                 'status': 'error'
             }
             return jsonify(response), 429
-        
+
         return f(*args, **kwargs)
-    return decorated 
\ No newline at end of file
+    return decorated
+
+
+def init_rate_limiting(app):
+    """Pick the limiter backend from app config and enforce the per-route limits.
+
+    ``RATE_LIMITS`` maps URL rules, exactly as registered with
+    ``api.add_resource``, to requests per minute, e.g.
+    ``{'/api/auth/login': 5}``. Each route gets its own budget per client.
+    Routes that aren't listed are only limited where ``@rate_limit`` is used.
+    """
+    global limiter
+    limiter = create_limiter(
+        app.config.get('RATE_LIMIT_STORAGE', os.getenv('RATE_LIMIT_STORAGE', 'memory://')),
+        requests_per_minute=app.config.get('RATE_LIMIT_PER_MINUTE', 60),
+        algorithm=app.config.get('RATE_LIMIT_ALGORITHM', SLIDING_WINDOW)
+    )
+    limits = dict(app.config.get('RATE_LIMITS', {}))
+
+    @app.before_request
+    def enforce_route_limits():
+        rule = request.url_rule.rule if request.url_rule else None
+        if rule not in limits:
+            return None
+        if not limiter.is_allowed(rule.encode() + b'|' + client_key(), limits[rule]):
+            RATE_LIMITED.labels(rule).inc()
+            return jsonify({
+                'message': 'Rate limit exceeded. Please try again later.',
+                'status': 'error'
+            }), 429
+        return None
@@ -1,9 +1,16 @@
-from flask_restful import Resource, reqparse, fields, marshal_with
+from flask_restful import Resource, reqparse, fields
 from sqlalchemy.orm import joinedload
 from models import Appointment, Schedule, Patient, Doctor
-from db import SessionLocal
-from datetime import timedelta, datetime
+from db_session import get_session
+from datetime import timedelta, datetime, time
 from sqlalchemy.exc import IntegrityError
+from error_handlers import APIError
+from booking import book_appointment, update_appointment, cancel_appointment, reschedule_appointment, delete_appointment
+from pagination import page_args, paginate
+from auth import login_required, get_current_user
+from search import appointment_search_query
+from expand import Expansion, expand, sparse
+from serializers import marshal, marshal_with
 
 VALID_STATUS = ["Scheduled", "Completed", "Cancelled", "No-Show"]
 
@@ -24,9 +31,9 @@ def get_end(obj):
     return end_dt.time().isoformat()
 
 def get_doc_name(appt):
-    if not (appt.schedule and appt.schedule.doctor):
+    if not appt.doctor:
         return None
-    return f"{appt.schedule.doctor.first_name} {appt.schedule.doctor.last_name}"
+    return f"{appt.doctor.first_name} {appt.doctor.last_name}"
 
 appointment_fields = {
     'id': fields.String,
@@ -36,74 +43,118 @@ appointment_fields = {
     'status': fields.String,
 }
 
+appointment_search_fields = dict(appointment_fields, datetime=fields.DateTime(dt_format='iso8601', attribute='schedule.datetime'))
+
+# ?expand= on the appointment lists: the slot's date and times, the doctor's name
+slot_fields = {
+    'date': fields.String(attribute=get_date),
+    'start': fields.String(attribute=get_start),
+    'end': fields.String(attribute=get_end),
+}
+doctor_name_fields = {'doctor_name': fields.String(attribute=get_doc_name)}
+
+APPOINTMENT_EXPANSIONS = {
+    'schedule': Expansion(joinedload(Appointment.schedule), fields=slot_fields),
+    'doctor': Expansion(joinedload(Appointment.doctor), fields=doctor_name_fields),
+}
+# The search query is already joined to the slots and loads them
+SEARCH_EXPANSIONS = dict(APPOINTMENT_EXPANSIONS, schedule=Expansion(fields=slot_fields))
+
 parser = reqparse.RequestParser()
 parser.add_argument("patient_id", required=True)
 parser.add_argument("schedule_id", required=True)
 parser.add_argument("status", required=True, choices=VALID_STATUS)
 
 class AppointmentListAPI(Resource):
-    @marshal_with(appointment_fields)
     def get(self):
-        session = SessionLocal()
-        appointments = session.query(Appointment).options(
-            joinedload(Appointment.schedule)
-            .joinedload(Schedule.doctor)  # also pull in the doctor
-        ).all()
-        session.close()
-        return appointments
+        cursor, limit = page_args()
+        session = get_session()
+        try:
+            query, item_fields = expand(session.query(Appointment), appointment_fields, APPOINTMENT_EXPANSIONS)
+            query, item_fields = sparse(query, item_fields, Appointment)
+            appointments, next_cursor = paginate(query, [Appointment.id], cursor, limit)
+            return {"items": marshal(appointments, item_fields), "next_cursor": next_cursor}
+        except APIError as e:
+            return {"message": e.message}, e.status_code
 
     @marshal_with(appointment_fields)
     def post(self):
         args = parser.parse_args()
-        session = SessionLocal()
+        session = get_session()
 
         try:
-            # Atomic transaction
-            schedule = session.query(Schedule).filter(
-                Schedule.id == args["schedule_id"],
-                Schedule.is_available == True
-            ).with_for_update().first()  # Lock the row
-
-            if not schedule:
-                return {"message": "Slot not available"}, 400
-
-            # Generate appointment ID safely
-            last_appointment = session.query(Appointment).order_by(Appointment.id.desc()).first()
-            # Compute the next numeric suffix first
-            if last_appointment:
-                next_num = int(last_appointment.id[1:]) + 1
-            else:
-                next_num = 1
-
-            # Then format it with leading zeros
-            new_id = f"A{next_num:03}"
-            
-            # new_id = f"A{(int(last_appointment.id[1:]) + 1) if last_appointment else 1:03d}"
-
-            new_appointment = Appointment(
-                id=new_id,
-                patient_id=args["patient_id"],
-                schedule_id=args["schedule_id"],
-                status=args["status"]
+            new_appointment = book_appointment(
+                session,
+                args["patient_id"],
+                args["schedule_id"],
+                status=args["status"],
+                allow_past=True
             )
-
-            schedule.is_available = False
-            session.add(new_appointment)
             session.commit()
             return new_appointment, 201
 
+        except APIError as e:
+            session.rollback()
+            return {"message": e.message}, e.status_code
         except Exception as e:
             session.rollback()
             return {"message": str(e)}, 500
-        finally:
-            session.close()
+
+def _parse_search_time(value, end=False):
+    """ISO date or datetime; a bare end date covers that whole day"""
+    if not value:
+        return None
+    try:
+        parsed = datetime.fromisoformat(value)
+    except ValueError:
+        raise ValueError(f"Invalid date: {value}")
+    if end and len(value) == 10:
+        parsed = datetime.combine(parsed.date(), time.max)
+    return parsed
+
+class AppointmentSearchAPI(Resource):
+    @login_required
+    def get(self):
+        """Search appointments by doctor, patient, status and slot time, earliest first"""
+        search_parser = reqparse.RequestParser()
+        search_parser.add_argument("doctor_id", location="args")
+        search_parser.add_argument("patient_id", location="args")
+        search_parser.add_argument("status", choices=VALID_STATUS, location="args")
+        search_parser.add_argument("start_date", location="args")  # "YYYY-MM-DD" or ISO datetime
+        search_parser.add_argument("end_date", location="args")
+        args = search_parser.parse_args()
+        try:
+            start_date = _parse_search_time(args["start_date"])
+            end_date = _parse_search_time(args["end_date"], end=True)
+        except ValueError as e:
+            return {"message": str(e)}, 400
+
+        patient_id = args["patient_id"]
+        identity = get_current_user()
+        if identity.role == "Patient":
+            # Patients only ever see their own appointments
+            if not identity.patient_id or patient_id not in (None, identity.patient_id):
+                return {"message": "Insufficient permissions"}, 403
+            patient_id = identity.patient_id
+
+        cursor, limit = page_args()
+        session = get_session()
+        try:
+            query = appointment_search_query(session, args["doctor_id"], patient_id, args["status"],
+                                             start_date, end_date)
+            query, item_fields = expand(query, appointment_search_fields, SEARCH_EXPANSIONS)
+            query, item_fields = sparse(query, item_fields, Appointment)
+            appointments, next_cursor = paginate(query, [Schedule.datetime, Appointment.id], cursor, limit,
+                                                 key=lambda a: [a.schedule.datetime, a.id])
+            return {"items": marshal(appointments, item_fields), "next_cursor": next_cursor}
+        except APIError as e:
+            return {"message": e.message}, e.status_code
 
 class AppointmentAPI(Resource):
     @marshal_with(appointment_fields)
     def get(self, appointment_id):
-        session = SessionLocal()
+        session = get_session()
         appt = session.query(Appointment).get(appointment_id)
-        session.close()
         if not appt:
             return {"message": "Appointment not found"}, 404
         return appt
@@ -111,50 +162,28 @@ class AppointmentAPI(Resource):
     @marshal_with(appointment_fields)
     def put(self, appointment_id):
         args = parser.parse_args()
-        session = SessionLocal()
+        session = get_session()
         try:
             appt = session.query(Appointment).get(appointment_id)
             if not appt:
-                session.close()
                 return {"message": "Appointment not found"}, 404
 
-            # If changing schedule, verify new slot is available
-            if "schedule_id" in args and args["schedule_id"] != appt.schedule_id:
-                new_schedule = session.query(Schedule).filter(
-                    Schedule.id == args["schedule_id"],
-                    Schedule.is_available == True
-                ).with_for_update().first()
-                
-                if not new_schedule:
-                    session.close()
-                    return {"message": "New schedule slot not available"}, 400
-                
-                # Free up old slot
-                old_schedule = session.query(Schedule).filter(
-                    Schedule.id == appt.schedule_id
-                ).first()
-                if old_schedule:
-                    old_schedule.is_available = True
-                
-                # Take new slot
-                new_schedule.is_available = False
-                appt.schedule_id = args["schedule_id"]
-
-            if "status" in args:
-                appt.status = args["status"]
+            # Claims the new slot and frees the old one; cancelling gives the slot back
+            update_appointment(session, appt, args["schedule_id"], args["status"])
 
             session.commit()
             session.refresh(appt)
             return appt, 200
 
+        except APIError as e:
+            session.rollback()
+            return {"message": e.message}, e.status_code
         except Exception as e:
             session.rollback()
             return {"message": str(e)}, 500
-        finally:
-            session.close()
 
     def delete(self, appointment_id):
-        session = SessionLocal()
+        session = get_session()
         try:
             # Use transaction
             appointment = session.query(Appointment).filter(
@@ -165,22 +194,13 @@ class AppointmentAPI(Resource):
                 return {"message": "Appointment not found"}, 404
 
             # Free up the schedule slot
-            schedule = session.query(Schedule).filter(
-                Schedule.id == appointment.schedule_id
-            ).first()
-            
-            if schedule:
-                schedule.is_available = True
-
-            session.delete(appointment)
+            delete_appointment(session, appointment)
             session.commit()
             return {"message": f"Appointment {appointment_id} deleted"}, 200
 
         except Exception as e:
             session.rollback()
             return {"message": str(e)}, 500
-        finally:
-            session.close()
 
 class AppointmentCreateAPI(Resource):
     @marshal_with(appointment_fields)
@@ -190,82 +210,40 @@ class AppointmentCreateAPI(Resource):
         parser.add_argument("schedule_id", required=True)
         args = parser.parse_args()
 
-        session = SessionLocal()
+        session = get_session()
         try:
-            # Verify patient exists
-            patient = session.query(Patient).get(args["patient_id"])
-            if not patient:
-                return {"message": "Patient not found"}, 404
-
-            # Get and verify schedule
-            schedule = session.query(Schedule).get(args["schedule_id"])
-            if not schedule:
-                return {"message": "Schedule not found"}, 404
-            
-            if not schedule.is_available:
-                return {"message": "This time slot is not available"}, 400
-
-            if schedule.datetime < datetime.now():
-                return {"message": "Cannot book past time slots"}, 400
-
-            # Create new appointment
-            last_appointment = session.query(Appointment).order_by(Appointment.id.desc()).first()
-            new_id = f"A{(int(last_appointment.id[1:]) + 1) if last_appointment else 1:03}"
-            
-            appointment = Appointment(
-                id=new_id,
-                patient_id=args["patient_id"],
-                doctor_id=schedule.doctor_id,
-                schedule_id=schedule.id,
-                status="Scheduled"
-            )
-
-            # Mark schedule as unavailable
-            schedule.is_available = False
-
-            session.add(appointment)
+            # Claims the slot and inserts the appointment in one transaction
+            appointment = book_appointment(session, args["patient_id"], args["schedule_id"])
             session.commit()
             session.refresh(appointment)
             return appointment, 201
+        except APIError as e:
+            session.rollback()
+            return {"message": e.message}, e.status_code
         except IntegrityError:
             session.rollback()
             return {"message": "Database error occurred"}, 500
-        finally:
-            session.close()
 
 class AppointmentCancelAPI(Resource):
     @marshal_with(appointment_fields)
     def put(self, appointment_id):
-        session = SessionLocal()
+        session = get_session()
         try:
             appointment = session.query(Appointment).get(appointment_id)
             if not appointment:
                 return {"message": "Appointment not found"}, 404
 
-            if appointment.status == "Cancelled":
-                return {"message": "Appointment is already cancelled"}, 400
-
-            if appointment.status == "Completed":
-                return {"message": "Cannot cancel completed appointment"}, 400
-
-            if appointment.schedule.datetime < datetime.now():
-                return {"message": "Cannot cancel past appointments"}, 400
-
-            # Update appointment status
-            appointment.status = "Cancelled"
-            
-            # Make the schedule available again
-            schedule = session.query(Schedule).get(appointment.schedule_id)
-            schedule.is_available = True
-
+            # Update appointment status and make the schedule available again
+            cancel_appointment(session, appointment)
             session.commit()
             session.refresh(appointment)
             return appointment
+        except APIError as e:
+            session.rollback()
+            return {"message": e.message}, e.status_code
         except IntegrityError:
             session.rollback()
             return {"message": "Database error occurred"}, 500
-        finally:
-            session.close()
 
 class AppointmentRescheduleAPI(Resource):
     @marshal_with(appointment_fields)
@@ -274,43 +252,21 @@ class AppointmentRescheduleAPI(Resource):
         parser.add_argument("new_schedule_id", required=True)
         args = parser.parse_args()
 
-        session = SessionLocal()
+        session = get_session()
         try:
             # Verify appointment exists
             appointment = session.query(Appointment).get(appointment_id)
             if not appointment:
                 return {"message": "Appointment not found"}, 404
 
-            if appointment.status != "Scheduled":
-                return {"message": "Can only reschedule scheduled appointments"}, 400
-
-            # Get and verify new schedule
-            new_schedule = session.query(Schedule).get(args["new_schedule_id"])
-            if not new_schedule:
-                return {"message": "New schedule slot not found"}, 404
-
-            if not new_schedule.is_available:
-                return {"message": "New time slot is not available"}, 400
-
-            if new_schedule.datetime < datetime.now():
-                return {"message": "Cannot reschedule to past time slots"}, 400
-
-            if new_schedule.doctor_id != appointment.doctor_id:
-                return {"message": "Cannot reschedule to a different doctor"}, 400
-
-            # Make old schedule available
-            old_schedule = session.query(Schedule).get(appointment.schedule_id)
-            old_schedule.is_available = True
-
-            # Update appointment with new schedule
-            appointment.schedule_id = new_schedule.id
-            new_schedule.is_available = False
-
+            # Claim the new slot and make the old one available
+            reschedule_appointment(session, appointment, args["new_schedule_id"])
             session.commit()
             session.refresh(appointment)
             return appointment
+        except APIError as e:
+            session.rollback()
+            return {"message": e.message}, e.status_code
         except IntegrityError:
             session.rollback()
-            return {"message": "Database error occurred"}, 500
-        finally:
-            session.close()
\ No newline at end of file
+            return {"message": "Database error occurred"}, 500
\ No newline at end of file
@@ -1,7 +1,13 @@
-from flask_restful import Resource, reqparse, fields, marshal_with
+from flask_restful import Resource, reqparse, fields
 from models import Department, Doctor
-from db import SessionLocal
+from db_session import get_session
 from sqlalchemy.orm import joinedload
+from id_allocator import department_ids
+from error_handlers import APIError
+from pagination import page_args, paginate
+from search_index import index_department, unindex_department
+from expand import sparse
+from serializers import marshal, marshal_with
 
 # How we expose departments in JSON
 department_fields = {
@@ -24,35 +30,32 @@ doctor_fields = {
 }
 
 class DepartmentListAPI(Resource):
-    @marshal_with(department_fields)
     def get(self):
-        session = SessionLocal()
-        depts = session.query(Department).all()
-        session.close()
-        return depts
+        cursor, limit = page_args()
+        session = get_session()
+        try:
+            query, item_fields = sparse(session.query(Department), department_fields, Department)
+            depts, next_cursor = paginate(query, [Department.id], cursor, limit)
+            return {"items": marshal(depts, item_fields), "next_cursor": next_cursor}
+        except APIError as e:
+            return {"message": e.message}, e.status_code
 
     @marshal_with(department_fields)
     def post(self):
         args = parser.parse_args()
-        session = SessionLocal()
-        # generate ID like DEPT001
-        last = session.query(Department).order_by(Department.id.desc()).first()
-        num = int(last.id[4:]) + 1 if last else 1
-        new_id = f"DEPT{num:03}"
-
-        dept = Department(id=new_id, **args)
+        session = get_session()
+        dept = Department(id=department_ids.next_id(), **args)
         session.add(dept)
         session.commit()
         session.refresh(dept)
-        session.close()
+        index_department(dept)
         return dept, 201
 
 class DepartmentAPI(Resource):
     @marshal_with(department_fields)
     def get(self, department_id):
-        session = SessionLocal()
+        session = get_session()
         dept = session.query(Department).get(department_id)
-        session.close()
         if not dept:
             return {"message": "Department not found"}, 404
         return dept
@@ -60,45 +63,40 @@ class DepartmentAPI(Resource):
     @marshal_with(department_fields)
     def put(self, department_id):
         args = parser.parse_args()
-        session = SessionLocal()
+        session = get_session()
         dept = session.query(Department).get(department_id)
         if not dept:
-            session.close()
             return {"message": "Department not found"}, 404
 
         dept.name        = args["name"]
         dept.description = args.get("description")
         session.commit()
         session.refresh(dept)
-        session.close()
+        index_department(dept)
         return dept, 200
 
     def delete(self, department_id):
-        session = SessionLocal()
+        session = get_session()
         dept = session.query(Department).get(department_id)
         if not dept:
-            session.close()
             return {"message": "Department not found"}, 404
         session.delete(dept)
         session.commit()
-        session.close()
+        unindex_department(department_id)
         return {"message": f"Department {department_id} deleted"}, 200
 
 class DepartmentDoctorsAPI(Resource):
     @marshal_with(doctor_fields)
     def get(self, department_id):
-        session = SessionLocal()
-        try:
-            # Verify department exists
-            department = session.query(Department).get(department_id)
-            if not department:
-                return {"message": "Department not found"}, 404
+        session = get_session()
+        # Verify department exists
+        department = session.query(Department).get(department_id)
+        if not department:
+            return {"message": "Department not found"}, 404
 
-            # Get all doctors in the department
-            doctors = session.query(Doctor)\
-                .filter(Doctor.department_id == department_id)\
-                .all()
+        # Get all doctors in the department
+        doctors = session.query(Doctor)\
+            .filter(Doctor.department_id == department_id)\
+            .all()
 
-            return doctors
-        finally:
-            session.close()
+        return doctors
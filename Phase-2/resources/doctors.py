@@ -1,12 +1,23 @@
-from flask_restful import Resource, reqparse, fields, marshal_with
+from flask_restful import Resource, reqparse, fields
 from models import Doctor, Schedule, User, DoctorAvailability
-from db import SessionLocal
-from sqlalchemy.orm import joinedload
+from db_session import get_session
+from sqlalchemy.orm import contains_eager, joinedload, selectinload
 from sqlalchemy.exc import IntegrityError
 import json
 from datetime import datetime, timedelta
-from flask_restx import Namespace, request
+from flask import request
+from flask_restx import Namespace, marshal, fields as model_fields
 from auth import admin_required, doctor_required, get_current_user
+from id_allocator import doctor_ids
+from error_handlers import APIError
+from slots import materialize_schedule
+from virtual_slots import SLOT_MODES, use_virtual, default_window, doctor_schedule
+from pagination import page_args, paginate
+from search_index import index_doctor, unindex_doctor
+from search import appointment_timeline
+from expand import Expansion, expand, sparse
+from serializers import marshal_with, marshal as restful_marshal  # flask_restful fields; marshal is flask_restx's
+from formats import REPRESENTATIONS, negotiated_marshal_with
 
 def get_dept_name(doc):
     return doc.department_obj.name if doc.department_obj else None
@@ -28,6 +39,15 @@ appointment_fields = {
     'status': fields.String,
 }
 
+# Appointments with the time of their slot, for the sorted views
+appointment_slot_fields = dict(appointment_fields, datetime=fields.DateTime(dt_format='iso8601',
+                                                                             attribute='schedule.datetime'))
+
+timeline_parser = reqparse.RequestParser()
+timeline_parser.add_argument("upcoming_cursor", location="args")
+timeline_parser.add_argument("history_cursor", location="args")
+timeline_parser.add_argument("limit", type=int, location="args")
+
 parser = reqparse.RequestParser()
 # parser.add_argument("name", required=True)
 parser.add_argument("first_name", required=True)
@@ -40,45 +60,57 @@ parser.add_argument("user_id", required=True)
 ns = Namespace('doctors', description='Doctor operations')
 
 user_model = ns.model('User', {
-    'id': fields.Integer(readonly=True),
-    'username': fields.String(required=True),
-    'email': fields.String(required=True),
-    'role': fields.String(required=True)
+    'id': model_fields.String(readonly=True),
+    'username': model_fields.String(required=True),
+    'email': model_fields.String(required=True),
+    'role': model_fields.String(required=True)
 })
 
 availability_model = ns.model('Availability', {
-    'id': fields.Integer(readonly=True),
-    'doctor_id': fields.Integer(required=True),
-    'day_of_week': fields.Integer(required=True, min=0, max=6),
-    'start_time': fields.String(required=True),
-    'end_time': fields.String(required=True),
-    'is_available': fields.Boolean(default=True)
+    'id': model_fields.Integer(readonly=True),
+    'doctor_id': model_fields.String(required=True),
+    'day_of_week': model_fields.Integer(required=True, min=0, max=6),
+    'start_time': model_fields.String(required=True),
+    'end_time': model_fields.String(required=True),
+    'is_available': model_fields.Boolean(default=True)
 })
 
 doctor_model = ns.model('Doctor', {
-    'id': fields.Integer(readonly=True),
-    'user_id': fields.Integer(required=True),
-    'user': fields.Nested(user_model),
-    'specialization': fields.String(required=True),
-    'qualification': fields.String(required=True),
-    'experience_years': fields.Integer(required=True),
-    'availabilities': fields.List(fields.Nested(availability_model))
+    'id': model_fields.String(readonly=True),
+    'user_id': model_fields.String(required=True),
+    'user': model_fields.Nested(user_model),
+    'specialization': model_fields.String(required=True),
+    'qualification': model_fields.String(required=True),
+    'experience_years': model_fields.Integer(required=True),
+    'availabilities': model_fields.List(model_fields.Nested(availability_model))
 })
 
+DOCTOR_EXPANSIONS = {
+    'department': Expansion(joinedload(Doctor.department_obj),
+                            fields={'department': model_fields.String(attribute=get_dept_name)}),
+}
+
 @ns.route('')
 class DoctorList(Resource):
-    @ns.marshal_list_with(doctor_model)
+    @ns.doc(params={'cursor': 'next_cursor from the previous page', 'limit': 'Page size',
+                    'expand': 'Comma-separated: department',
+                    'fields': 'Comma-separated fields to return; the rest are left out'})
     def get(self):
-        """Get all doctors"""
-        session = SessionLocal()
-        doctors = (
-            session.query(Doctor)
-                .join(User)
-                .options(joinedload(Doctor.department_obj))
-                .all()
-        )
-        session.close()
-        return doctors
+        """Get all doctors, one page at a time"""
+        cursor, limit = page_args()
+        session = get_session()
+        try:
+            query, item_fields = expand(session.query(Doctor).join(User), doctor_model, DOCTOR_EXPANSIONS)
+            query, item_fields = sparse(query, item_fields, Doctor)
+            # doctor_model nests the user and the availability rules: load them with the page when shown
+            if 'user' in item_fields:
+                query = query.options(contains_eager(Doctor.user))
+            if 'availabilities' in item_fields:
+                query = query.options(selectinload(Doctor.availabilities))
+            doctors, next_cursor = paginate(query, [Doctor.id], cursor, limit)
+            return {"items": marshal(doctors, item_fields), "next_cursor": next_cursor}
+        except APIError as e:
+            return {"message": e.message}, e.status_code
 
     @admin_required
     @ns.expect(doctor_model)
@@ -86,22 +118,14 @@ class DoctorList(Resource):
     def post(self):
         """Create a new doctor (Admin only)"""
         data = request.json
-        session = SessionLocal()
+        session = get_session()
 
         user = session.query(User).filter_by(id=data['user_id'], role="Doctor").first()
         if not user:
-            session.close()
             return {"message": "Invalid user_id or role"}, 400
 
-        last = session.query(Doctor).order_by(Doctor.id.desc()).first()
-        if last:
-            last_num = int(last.id[1:])
-        else:
-            last_num = 0
-        doctor_id = f"D{last_num + 1:03}"
-
         doctor = Doctor(
-            id=doctor_id,
+            id=doctor_ids.next_id(),
             user_id=data['user_id'],
             first_name=data['first_name'],
             last_name=data['last_name'],
@@ -115,7 +139,7 @@ class DoctorList(Resource):
         session.add(doctor)
         session.commit()
         session.refresh(doctor)
-        session.close()
+        index_doctor(doctor, user.email)
         return doctor, 201
 
 @ns.route('/<int:id>')
@@ -123,7 +147,7 @@ class DoctorResource(Resource):
     @ns.marshal_with(doctor_model)
     def get(self, id):
         """Get a doctor by ID"""
-        session = SessionLocal()
+        session = get_session()
         doctor = (
             session.query(Doctor)
                 .join(User)
@@ -131,9 +155,7 @@ class DoctorResource(Resource):
                 .first()
         )
         if not doctor:
-            session.close()
             return {"message": "Doctor not found"}, 404
-        session.close()
         return doctor
 
     @admin_required
@@ -141,7 +163,7 @@ class DoctorResource(Resource):
     @ns.marshal_with(doctor_model)
     def put(self, id):
         """Update a doctor (Admin only)"""
-        session = SessionLocal()
+        session = get_session()
         doctor = (
             session.query(Doctor)
                 .join(User)
@@ -149,7 +171,6 @@ class DoctorResource(Resource):
                 .first()
         )
         if not doctor:
-            session.close()
             return {"message": "Doctor not found"}, 404
 
         data = request.json
@@ -163,13 +184,13 @@ class DoctorResource(Resource):
 
         session.commit()
         session.refresh(doctor)
-        session.close()
+        index_doctor(doctor, doctor.user.email if doctor.user else None)
         return doctor
 
     @admin_required
     def delete(self, id):
         """Delete a doctor (Admin only)"""
-        session = SessionLocal()
+        session = get_session()
         doctor = (
             session.query(Doctor)
                 .join(User)
@@ -177,12 +198,12 @@ class DoctorResource(Resource):
                 .first()
         )
         if not doctor:
-            session.close()
             return {"message": "Doctor not found"}, 404
 
+        doctor_id = doctor.id
         session.delete(doctor)
         session.commit()
-        session.close()
+        unindex_doctor(doctor_id)
         return {"message": f"Doctor {id} deleted"}, 200
 
 @ns.route('/<int:id>/availabilities')
@@ -190,7 +211,7 @@ class DoctorAvailabilityList(Resource):
     @ns.marshal_list_with(availability_model)
     def get(self, id):
         """Get doctor's availabilities"""
-        session = SessionLocal()
+        session = get_session()
         doctor = (
             session.query(Doctor)
                 .join(User)
@@ -198,11 +219,9 @@ class DoctorAvailabilityList(Resource):
                 .first()
         )
         if not doctor:
-            session.close()
             return {"message": "Doctor not found"}, 404
 
         availabilities = doctor.availabilities
-        session.close()
         return availabilities
 
     @doctor_required
@@ -211,7 +230,7 @@ class DoctorAvailabilityList(Resource):
     def post(self, id):
         """Add doctor availability (Doctor only)"""
         current_user = get_current_user()
-        session = SessionLocal()
+        session = get_session()
         doctor = (
             session.query(Doctor)
                 .join(User)
@@ -219,12 +238,10 @@ class DoctorAvailabilityList(Resource):
                 .first()
         )
         if not doctor:
-            session.close()
             return {"message": "Doctor not found"}, 404
 
         # Verify the doctor is adding their own availability
         if current_user.role != 'admin' and doctor.user_id != current_user.id:
-            session.close()
             return {'message': 'Unauthorized'}, 403
 
         data = request.json
@@ -238,7 +255,6 @@ class DoctorAvailabilityList(Resource):
         
         session.add(availability)
         session.commit()
-        session.close()
         return availability, 201
 
 @ns.route('/<int:doctor_id>/availabilities/<int:id>')
@@ -246,7 +262,7 @@ class DoctorAvailabilityResource(Resource):
     @ns.marshal_with(availability_model)
     def get(self, doctor_id, id):
         """Get specific availability"""
-        session = SessionLocal()
+        session = get_session()
         doctor = (
             session.query(Doctor)
                 .join(User)
@@ -254,15 +270,12 @@ class DoctorAvailabilityResource(Resource):
                 .first()
         )
         if not doctor:
-            session.close()
             return {"message": "Doctor not found"}, 404
 
         availability = session.query(DoctorAvailability).filter(DoctorAvailability.id == id).first()
         if not availability:
-            session.close()
             return {"message": "Availability not found"}, 404
 
-        session.close()
         return availability
 
     @doctor_required
@@ -271,7 +284,7 @@ class DoctorAvailabilityResource(Resource):
     def put(self, doctor_id, id):
         """Update availability (Doctor or Admin only)"""
         current_user = get_current_user()
-        session = SessionLocal()
+        session = get_session()
         doctor = (
             session.query(Doctor)
                 .join(User)
@@ -279,17 +292,14 @@ class DoctorAvailabilityResource(Resource):
                 .first()
         )
         if not doctor:
-            session.close()
             return {"message": "Doctor not found"}, 404
 
         # Verify the doctor is updating their own availability
         if current_user.role != 'admin' and doctor.user_id != current_user.id:
-            session.close()
             return {'message': 'Unauthorized'}, 403
 
         availability = session.query(DoctorAvailability).filter(DoctorAvailability.id == id).first()
         if not availability:
-            session.close()
             return {"message": "Availability not found"}, 404
 
         data = request.json
@@ -299,14 +309,13 @@ class DoctorAvailabilityResource(Resource):
         availability.is_available = data.get('is_available', availability.is_available)
         
         session.commit()
-        session.close()
         return availability
 
     @doctor_required
     def delete(self, doctor_id, id):
         """Delete availability (Doctor or Admin only)"""
         current_user = get_current_user()
-        session = SessionLocal()
+        session = get_session()
         doctor = (
             session.query(Doctor)
                 .join(User)
@@ -314,28 +323,24 @@ class DoctorAvailabilityResource(Resource):
                 .first()
         )
         if not doctor:
-            session.close()
             return {"message": "Doctor not found"}, 404
 
         # Verify the doctor is deleting their own availability
         if current_user.role != 'admin' and doctor.user_id != current_user.id:
-            session.close()
             return {'message': 'Unauthorized'}, 403
 
         availability = session.query(DoctorAvailability).filter(DoctorAvailability.id == id).first()
         if not availability:
-            session.close()
             return {"message": "Availability not found"}, 404
 
         session.delete(availability)
         session.commit()
-        session.close()
         return '', 204
 
 class DoctorAppointmentsAPI(Resource):
     @marshal_with(appointment_fields)
     def get(self, doctor_id):
-        session = SessionLocal()
+        session = get_session()
         doctor = (
             session.query(Doctor)
                 .join(User)
@@ -343,46 +348,29 @@ class DoctorAppointmentsAPI(Resource):
                 .first()
         )
         if not doctor:
-            session.close()
             return {"message": "Doctor not found"}, 404
 
         appointments = doctor.appointments
-        session.close()
         return appointments
 
-from datetime import datetime
-
 class DoctorAppointmentsSortedAPI(Resource):
-    @marshal_with(appointment_fields)
     def get(self, doctor_id):
-        session = SessionLocal()
-        doctor = (
-            session.query(Doctor)
-                .join(User)
-                .filter(Doctor.id == doctor_id)
-                .first()
-        )
-        if not doctor:
-            session.close()
-            return {"message": "Doctor not found"}, 404
-
-        now = datetime.utcnow()
-
-        upcoming = sorted(
-            [a for a in doctor.appointments if a.schedule and a.schedule.datetime > now],
-            key=lambda a: a.datetime
-        )
-        history = sorted(
-            [a for a in doctor.appointments if a.schedule and a.schedule.datetime <= now],
-            key=lambda a: a.datetime,
-            reverse=True
-        )
-
-        session.close()
-        return {
-            "upcoming": upcoming,
-            "history": history
-        }
+        """Upcoming appointments soonest first and history latest first, each paged by its own cursor"""
+        args = timeline_parser.parse_args()
+        session = get_session()
+        try:
+            if not session.query(Doctor.id).filter(Doctor.id == doctor_id).first():
+                return {"message": "Doctor not found"}, 404
+            timeline = appointment_timeline(session, doctor_id=doctor_id, upcoming_cursor=args["upcoming_cursor"],
+                                            history_cursor=args["history_cursor"], limit=args["limit"])
+            return {
+                "upcoming": restful_marshal(timeline["upcoming"], appointment_slot_fields),
+                "history": restful_marshal(timeline["history"], appointment_slot_fields),
+                "next_upcoming_cursor": timeline["upcoming_cursor"],
+                "next_history_cursor": timeline["history_cursor"],
+            }
+        except APIError as e:
+            return {"message": e.message}, e.status_code
 
 class DoctorSetAvailabilityAPI(Resource):
     def post(self, doctor_id):
@@ -391,57 +379,25 @@ class DoctorSetAvailabilityAPI(Resource):
             help="Availability should be a dictionary with days as keys and time ranges as values")
         args = parser.parse_args()
 
-        session = SessionLocal()
+        session = get_session()
         try:
             doctor = session.query(Doctor).join(User).filter(Doctor.id == doctor_id).first()
             if not doctor:
                 return {"message": "Doctor not found"}, 404
 
+            # Add/remove only the slots of the next 30 days that changed; booked slots are kept
+            changes = materialize_schedule(session, doctor_id, args["availability"])
+
             # Update the availability JSON
             doctor.availability = args["availability"]
             session.commit()
-
-            # Now create/update schedule entries for the next 30 days based on availability
-            start_date = datetime.now().replace(hour=0, minute=0, second=0, microsecond=0)
-            end_date = start_date + timedelta(days=30)
-            current_date = start_date
-
-            # Delete existing future schedules
-            session.query(Schedule).filter(
-                Schedule.doctor_id == doctor_id,
-                Schedule.datetime >= start_date
-            ).delete()
-
-            # Create new schedules
-            new_schedules = []
-            while current_date < end_date:
-                day_name = current_date.strftime("%A")
-                if day_name in args["availability"]:
-                    time_ranges = args["availability"][day_name].split(",")
-                    for time_range in time_ranges:
-                        start_time, end_time = time_range.split("-")
-                        start_hour = int(start_time.strip())
-                        end_hour = int(end_time.strip())
-                        
-                        for hour in range(start_hour, end_hour):
-                            schedule_time = current_date.replace(hour=hour)
-                            new_schedules.append(Schedule(
-                                id=f"SC{len(new_schedules)+1:04}",
-                                doctor_id=doctor_id,
-                                datetime=schedule_time,
-                                duration=60,
-                                is_available=True
-                            ))
-                current_date += timedelta(days=1)
-
-            session.bulk_save_objects(new_schedules)
-            session.commit()
-            return {"message": "Availability updated successfully"}, 200
+            return {"message": "Availability updated successfully", "slots": changes}, 200
+        except APIError as e:
+            session.rollback()
+            return {"message": e.message}, e.status_code
         except Exception as e:
             session.rollback()
             return {"message": f"Error occurred: {str(e)}"}, 500
-        finally:
-            session.close()
 
 schedule_fields = {
     'id': fields.String,
@@ -451,39 +407,50 @@ schedule_fields = {
 }
 
 class DoctorViewScheduleAPI(Resource):
-    @marshal_with(schedule_fields)
+    representations = REPRESENTATIONS
+
+    @negotiated_marshal_with(schedule_fields)  # JSON, MessagePack or columns, by Accept
     def get(self, doctor_id):
         parser = reqparse.RequestParser()
         parser.add_argument("start_date", type=str, required=False)
         parser.add_argument("end_date", type=str, required=False)
+        parser.add_argument("mode", type=str, required=False, choices=SLOT_MODES)
         args = parser.parse_args()
 
-        session = SessionLocal()
-        try:
-            # Verify doctor exists
-            doctor = (
-                session.query(Doctor)
-                    .join(User)
-                    .filter(Doctor.id == doctor_id)
-                    .first()
-            )
-            if not doctor:
-                return {"message": "Doctor not found"}, 404
+        session = get_session()
+        # Verify doctor exists
+        doctor = (
+            session.query(Doctor)
+                .join(User)
+                .filter(Doctor.id == doctor_id)
+                .first()
+        )
+        if not doctor:
+            return {"message": "Doctor not found"}, 404
 
-            query = session.query(Schedule).filter(Schedule.doctor_id == doctor_id)
-
-            # Add date filters if provided
-            if args["start_date"]:
-                start_date = datetime.strptime(args["start_date"], "%Y-%m-%d")
-                query = query.filter(Schedule.datetime >= start_date)
-            if args["end_date"]:
-                end_date = datetime.strptime(args["end_date"], "%Y-%m-%d")
-                query = query.filter(Schedule.datetime <= end_date)
-
-            # Order by datetime
-            schedules = query.order_by(Schedule.datetime).all()
-            return schedules
-        finally:
-            session.close()
+        if use_virtual(args["mode"]):
+            # Booked rows plus free slots computed from the availability rules
+            start_date, end_date = default_window(
+                datetime.strptime(args["start_date"], "%Y-%m-%d") if args["start_date"] else None,
+                datetime.strptime(args["end_date"], "%Y-%m-%d") if args["end_date"] else None
+            )
+            try:
+                return doctor_schedule(session, doctor, start_date, end_date)
+            except APIError as e:
+                return {"message": e.message}, e.status_code
+
+        query = session.query(Schedule).filter(Schedule.doctor_id == doctor_id)
+
+        # Add date filters if provided
+        if args["start_date"]:
+            start_date = datetime.strptime(args["start_date"], "%Y-%m-%d")
+            query = query.filter(Schedule.datetime >= start_date)
+        if args["end_date"]:
+            end_date = datetime.strptime(args["end_date"], "%Y-%m-%d")
+            query = query.filter(Schedule.datetime <= end_date)
+
+        # Order by datetime
+        schedules = query.order_by(Schedule.datetime).all()
+        return schedules
 
 
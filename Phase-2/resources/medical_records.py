@@ -1,9 +1,22 @@
-from flask_restful import Resource, reqparse, fields, marshal_with
+from flask_restful import Resource, reqparse, fields
+from flask import Response
 from sqlalchemy import desc
+from sqlalchemy.orm import joinedload
+import json
 from models import MedicalRecord, Patient, Appointment
-from db import SessionLocal
+from db_session import get_session, session_factory
 from sqlalchemy.exc import IntegrityError
 from datetime import datetime
+from id_allocator import medical_record_ids
+from error_handlers import APIError
+from pagination import page_args, paginate
+from search import filter_medical_records
+from expand import Expansion, expand, sparse
+from serializers import marshal, marshal_with
+from auth import role_required
+
+EXPORT_BATCH_SIZE = 1000  # rows fetched per round trip and written per chunk
+EXPORT_COLUMNS = [c for c in MedicalRecord.__table__.columns]
 
 def get_dept_name(rec):
     return rec.department.name if rec.department else None
@@ -25,11 +38,16 @@ medical_record_fields = {
     'diagnosis': fields.String,
     'prescription': fields.String,
     'notes': fields.String,
-    'visit_date': fields.DateTime,
+    'visit_date': fields.String,  # a date; fields.DateTime can't format one
     'date_created': fields.DateTime,
     'updated_at': fields.DateTime
 }
 
+RECORD_EXPANSIONS = {
+    'department': Expansion(joinedload(MedicalRecord.department),
+                            fields={'department': fields.String(attribute=get_dept_name)}),
+}
+
 parser = reqparse.RequestParser()
 parser.add_argument("patient_id", required=True)
 parser.add_argument("appointment_id")  # Optional
@@ -40,14 +58,16 @@ parser.add_argument("department_id")       # optional
 parser.add_argument("visit_date",   required=True)  # "YYYY-MM-DD"
 
 class MedicalRecordListAPI(Resource):
-    @marshal_with(medical_record_fields)
     def get(self):
-        session = SessionLocal()
+        cursor, limit = page_args()
+        session = get_session()
         try:
-            records = session.query(MedicalRecord).all()
-            return records
-        finally:
-            session.close()
+            query, item_fields = expand(session.query(MedicalRecord), medical_record_fields, RECORD_EXPANSIONS)
+            query, item_fields = sparse(query, item_fields, MedicalRecord)
+            records, next_cursor = paginate(query, [MedicalRecord.id], cursor, limit)
+            return {"items": marshal(records, item_fields), "next_cursor": next_cursor}
+        except APIError as e:
+            return {"message": e.message}, e.status_code
 
     @marshal_with(medical_record_fields)
     def post(self):
@@ -60,19 +80,15 @@ class MedicalRecordListAPI(Resource):
         parser.add_argument("notes")
         args = parser.parse_args()
 
-        session = SessionLocal()
+        session = get_session()
         try:
             # Verify patient exists
             patient = session.query(Patient).get(args["patient_id"])
             if not patient:
                 return {"message": "Patient not found"}, 404
 
-            # Get last record to generate new ID
-            last_record = session.query(MedicalRecord).order_by(MedicalRecord.id.desc()).first()
-            new_id = f"M{(int(last_record.id[1:]) + 1) if last_record else 1:03}"
-
             record = MedicalRecord(
-                id=new_id,
+                id=medical_record_ids.next_id(),
                 patient_id=args["patient_id"],
                 appointment_id=args["appointment_id"],
                 department_id=args["department_id"],
@@ -90,39 +106,38 @@ class MedicalRecordListAPI(Resource):
         except IntegrityError:
             session.rollback()
             return {"message": "Database error occurred"}, 500
-        finally:
-            session.close()
 
 class PatientMedicalRecordsAPI(Resource):
-    @marshal_with(medical_record_fields)
     def get(self, patient_id):
-        session = SessionLocal()
-        try:
-            # Verify patient exists
-            patient = session.query(Patient).get(patient_id)
-            if not patient:
-                return {"message": "Patient not found"}, 404
+        session = get_session()
+        # Verify patient exists
+        patient = session.query(Patient).get(patient_id)
+        if not patient:
+            return {"message": "Patient not found"}, 404
 
-            # Get all medical records for the patient
-            records = session.query(MedicalRecord)\
-                .filter(MedicalRecord.patient_id == patient_id)\
-                .order_by(MedicalRecord.visit_date.desc())\
-                .all()
-            return records
-        finally:
-            session.close()
+        # Get all medical records for the patient
+        try:
+            query, item_fields = expand(session.query(MedicalRecord), medical_record_fields, RECORD_EXPANSIONS)
+            query, item_fields = sparse(query, item_fields, MedicalRecord)
+        except APIError as e:
+            return {"message": e.message}, e.status_code
+        records = query\
+            .filter(MedicalRecord.patient_id == patient_id)\
+            .order_by(MedicalRecord.visit_date.desc())\
+            .all()
+        return marshal(records, item_fields)
 
 class MedicalRecordAPI(Resource):
-    @marshal_with(medical_record_fields)
     def get(self, record_id):
-        session = SessionLocal()
+        session = get_session()
         try:
-            record = session.query(MedicalRecord).get(record_id)
-            if not record:
-                return {"message": "Medical record not found"}, 404
-            return record
-        finally:
-            session.close()
+            query, item_fields = sparse(session.query(MedicalRecord), medical_record_fields, MedicalRecord)
+        except APIError as e:
+            return {"message": e.message}, e.status_code
+        record = query.get(record_id)
+        if not record:
+            return {"message": "Medical record not found"}, 404
+        return marshal(record, item_fields)
 
     @marshal_with(medical_record_fields)
     def put(self, record_id):
@@ -132,7 +147,7 @@ class MedicalRecordAPI(Resource):
         parser.add_argument("notes")
         args = parser.parse_args()
 
-        session = SessionLocal()
+        session = get_session()
         try:
             record = session.query(MedicalRecord).get(record_id)
             if not record:
@@ -152,16 +167,68 @@ class MedicalRecordAPI(Resource):
         except IntegrityError:
             session.rollback()
             return {"message": "Database error occurred"}, 500
-        finally:
-            session.close()
 
     def delete(self, record_id):
-        session = SessionLocal()
+        session = get_session()
         record = session.query(MedicalRecord).get(record_id)
         if not record:
-            session.close()
             return {"message": "Medical record not found"}, 404
         session.delete(record)
         session.commit()
-        session.close()
         return {"message": f"Medical record {record_id} deleted"}, 200
+
+
+def export_lines(session_factory, filters, batch_size=EXPORT_BATCH_SIZE):
+    """Yield medical records as NDJSON, ``batch_size`` lines per chunk.
+
+    Plain column rows are fetched with ``yield_per`` (a server-side cursor
+    where the driver supports one), so no ORM objects or identity map build
+    up and memory stays flat however many rows match.
+    """
+    session = session_factory()
+    try:
+        query = filter_medical_records(session.query(*EXPORT_COLUMNS), **filters)
+        query = query.order_by(MedicalRecord.id).yield_per(batch_size)
+        names = [c.key for c in EXPORT_COLUMNS]
+        chunk = []
+        for row in query:
+            record = {name: value.isoformat() if hasattr(value, 'isoformat') else value
+                      for name, value in zip(names, row)}
+            chunk.append(json.dumps(record))
+            if len(chunk) == batch_size:
+                yield '\n'.join(chunk) + '\n'
+                chunk = []
+        if chunk:
+            yield '\n'.join(chunk) + '\n'
+    finally:
+        session.close()
+
+def _parse_export_date(value):
+    try:
+        return datetime.fromisoformat(value).date() if value else None
+    except ValueError:
+        raise ValueError(f"Invalid date: {value}")
+
+class MedicalRecordExportAPI(Resource):
+    @role_required(['Admin', 'Doctor'])
+    def get(self):
+        """Stream medical records as NDJSON, one record per line"""
+        parser = reqparse.RequestParser()
+        parser.add_argument("patient_id", location="args")
+        parser.add_argument("department_id", location="args")
+        parser.add_argument("start_date", location="args")  # "YYYY-MM-DD"
+        parser.add_argument("end_date", location="args")
+        args = parser.parse_args()
+
+        try:
+            filters = {
+                "patient_id": args["patient_id"],
+                "department_id": args["department_id"],
+                "start_date": _parse_export_date(args["start_date"]),
+                "end_date": _parse_export_date(args["end_date"]),
+            }
+        except ValueError as e:
+            return {"message": str(e)}, 400
+
+        return Response(export_lines(session_factory(), filters), mimetype="application/x-ndjson",
+                        headers={"Content-Disposition": "attachment; filename=medical-records.ndjson"})
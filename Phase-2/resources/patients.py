@@ -1,12 +1,22 @@
-from flask_restful import Resource, reqparse, fields, marshal_with
+from flask_restful import Resource, reqparse, fields
 from models import Patient, User, Appointment, Schedule, MedicalRecord, Doctor
-from db import SessionLocal
+from db_session import get_session
 from sqlalchemy.orm import joinedload
 from datetime import datetime
 from sqlalchemy.exc import IntegrityError
-from flask_restx import Namespace, Resource, fields
+from flask_restx import Namespace, Resource, fields, marshal
 from flask import request
 from auth import admin_required, get_current_user
+from id_allocator import user_ids, patient_ids
+from error_handlers import APIError, ConflictError
+from booking import book_appointment
+from search_index import index_patient, unindex_patient
+from dedupe import find_matches, REJECT_THRESHOLD
+from search import appointment_timeline
+from serializers import marshal_with
+import logging
+
+logger = logging.getLogger(__name__)
 
 # Define how the output should look
 patient_fields = {
@@ -28,6 +38,15 @@ appointment_fields = {
     'status': fields.String,
 }
 
+# Appointments with the time of their slot, for the sorted views
+appointment_slot_fields = dict(appointment_fields, datetime=fields.DateTime(dt_format='iso8601',
+                                                                             attribute='schedule.datetime'))
+
+timeline_parser = reqparse.RequestParser()
+timeline_parser.add_argument("upcoming_cursor", location="args")
+timeline_parser.add_argument("history_cursor", location="args")
+timeline_parser.add_argument("limit", type=int, location="args")
+
 # Define what inputs are allowed
 parser = reqparse.RequestParser()
 parser.add_argument("first_name", required=True)
@@ -79,6 +98,7 @@ class PatientList(Resource):
         )
         db.session.add(patient)
         db.session.commit()
+        index_patient(patient)
         return patient, 201
 
 @ns.route('/<int:id>')
@@ -115,14 +135,17 @@ class PatientResource(Resource):
             patient.blood_type = data['blood_type']
 
         db.session.commit()
+        index_patient(patient)
         return patient
 
     @admin_required
     def delete(self, id):
         """Delete a patient (Admin only)"""
         patient = Patient.query.get_or_404(id)
+        patient_id = patient.id
         db.session.delete(patient)
         db.session.commit()
+        unindex_patient(patient_id)
         return '', 204
 
 class PatientRegisterAPI(Resource):
@@ -134,79 +157,85 @@ class PatientRegisterAPI(Resource):
         parser.add_argument("first_name", required=True)
         parser.add_argument("last_name", required=True)
         parser.add_argument("phone", required=True)
+        parser.add_argument("birth_date")   # "YYYY-MM-DD", optional
         args = parser.parse_args()
 
-        session = SessionLocal()
-
-        last_user = session.query(User).order_by(User.id.desc()).first()
-        new_user_id = f"U{(int(last_user.id[1:]) + 1) if last_user else 1:03}"
-
-        user = User(
-            id=new_user_id,
-            username=args["username"],
-            password=args["password"],
-            email=args["email"],
-            role="Patient"
-        )
-        session.add(user)
+        birth_date = None
+        if args["birth_date"]:
+            try:
+                birth_date = datetime.strptime(args["birth_date"], "%Y-%m-%d").date()
+            except ValueError:
+                return {"message": "birth_date must be YYYY-MM-DD"}, 400
 
-        # Create patient
-        last_patient = session.query(Patient).order_by(Patient.id.desc()).first()
-        new_patient_id = f"P{(int(last_patient.id[1:]) + 1) if last_patient else 1:03}"
-        patient = Patient(
-            id=new_patient_id,
-            user_id=new_user_id,
-            first_name=args["first_name"],
-            last_name=args["last_name"],
-            phone=args["phone"]
-        )
-        session.add(patient)
+        session = get_session()
+        try:
+            # Someone registering again under a new username gets pointed at their existing record
+            matches = find_matches(session, args["first_name"], args["last_name"],
+                                   args["phone"], birth_date, args["email"])
+            if matches and matches[0].score >= REJECT_THRESHOLD:
+                raise ConflictError("A patient with these details is already registered")
+
+            new_user_id = user_ids.next_id()
+
+            user = User(
+                id=new_user_id,
+                username=args["username"],
+                password=args["password"],
+                email=args["email"],
+                role="Patient"
+            )
+            session.add(user)
+
+            # Create patient
+            patient = Patient(
+                id=patient_ids.next_id(),
+                user_id=new_user_id,
+                first_name=args["first_name"],
+                last_name=args["last_name"],
+                phone=args["phone"],
+                birth_date=birth_date
+            )
+            session.add(patient)
 
-        session.commit()
-        session.close()
-        return {"message": f"Patient {patient.id} created and linked to user {user.id}"}, 201
+            session.commit()
+            index_patient(patient)
+            if matches:
+                logger.warning(f"Patient {patient.id} may duplicate "
+                               f"{', '.join(f'{m.b.id} ({m.score})' for m in matches)}")
+            return {"message": f"Patient {patient.id} created and linked to user {user.id}"}, 201
+        except APIError as e:
+            session.rollback()
+            return {"message": e.message}, e.status_code
 
 class PatientAppointmentsAPI(Resource):
     @marshal_with(appointment_fields)
     def get(self, patient_id):
-        session = SessionLocal()
+        session = get_session()
         patient = session.query(Patient).filter(Patient.id == patient_id).first()
         if not patient:
-            session.close()
             return {"message": "Patient not found"}, 404
 
         appointments = patient.appointments
-        session.close()
         return appointments
 
-from datetime import datetime
-
 class PatientAppointmentsSortedAPI(Resource):
-    @marshal_with(appointment_fields)
     def get(self, patient_id):
-        session = SessionLocal()
-        patient = session.query(Patient).filter(Patient.id == patient_id).first()
-        if not patient:
-            session.close()
-            return {"message": "Patient not found"}, 404
-
-        now = datetime.utcnow()
-
-        upcoming = sorted(
-            [a for a in patient.appointments if a.schedule.datetime > now],
-            key=lambda a: a.datetime
-        )
-        history = sorted(
-            [a for a in patient.appointments if a.datetime <= now],
-            key=lambda a: a.datetime,
-            reverse=True
-        )
-
-        session.close()
-        return {
-            "upcoming": upcoming,
-            "history": history
-        }
+        """Upcoming appointments soonest first and history latest first, each paged by its own cursor"""
+        args = timeline_parser.parse_args()
+        session = get_session()
+        try:
+            if not session.query(Patient.id).filter(Patient.id == patient_id).first():
+                return {"message": "Patient not found"}, 404
+            timeline = appointment_timeline(session, patient_id=patient_id, upcoming_cursor=args["upcoming_cursor"],
+                                            history_cursor=args["history_cursor"], limit=args["limit"])
+            return {
+                "upcoming": marshal(timeline["upcoming"], appointment_slot_fields),
+                "history": marshal(timeline["history"], appointment_slot_fields),
+                "next_upcoming_cursor": timeline["upcoming_cursor"],
+                "next_history_cursor": timeline["history_cursor"],
+            }
+        except APIError as e:
+            return {"message": e.message}, e.status_code
 
 class PatientBookAppointmentAPI(Resource):
     def post(self, patient_id):
@@ -214,47 +243,18 @@ class PatientBookAppointmentAPI(Resource):
         parser.add_argument("schedule_id", required=True)
         args = parser.parse_args()
 
-        session = SessionLocal()
+        session = get_session()
         try:
-            # Verify patient exists
-            patient = session.query(Patient).get(patient_id)
-            if not patient:
-                return {"message": "Patient not found"}, 404
-
-            # Get and verify schedule
-            schedule = session.query(Schedule).get(args["schedule_id"])
-            if not schedule:
-                return {"message": "Schedule not found"}, 404
-            
-            if not schedule.is_available:
-                return {"message": "This time slot is not available"}, 400
-
-            if schedule.datetime < datetime.now():
-                return {"message": "Cannot book past time slots"}, 400
-
-            # Create new appointment
-            last_appointment = session.query(Appointment).order_by(Appointment.id.desc()).first()
-            new_appointment_id = f"A{(int(last_appointment.id[1:]) + 1) if last_appointment else 1:03}"
-            
-            appointment = Appointment(
-                id=new_appointment_id,
-                patient_id=patient_id,
-                doctor_id=schedule.doctor_id,
-                schedule_id=schedule.id,
-                status="Scheduled"
-            )
-
-            # Mark schedule as unavailable
-            schedule.is_available = False
-
-            session.add(appointment)
+            # Claims the slot and inserts the appointment in one transaction
+            appointment = book_appointment(session, patient_id, args["schedule_id"])
             session.commit()
             return {"message": "Appointment booked successfully", "appointment_id": appointment.id}, 201
+        except APIError as e:
+            session.rollback()
+            return {"message": e.message}, e.status_code
         except IntegrityError:
             session.rollback()
             return {"message": "Database error occurred"}, 500
-        finally:
-            session.close()
 
 medical_record_fields = {
     'id': fields.String,
@@ -284,24 +284,21 @@ appointment_fields = {
 class PatientViewHistoryAPI(Resource):
     @marshal_with(appointment_fields)
     def get(self, patient_id):
-        session = SessionLocal()
-        try:
-            # Verify patient exists
-            patient = session.query(Patient).get(patient_id)
-            if not patient:
-                return {"message": "Patient not found"}, 404
+        session = get_session()
+        # Verify patient exists
+        patient = session.query(Patient).get(patient_id)
+        if not patient:
+            return {"message": "Patient not found"}, 404
 
-            # Get all appointments with related data
-            appointments = session.query(Appointment)\
-                .filter(Appointment.patient_id == patient_id)\
-                .options(
-                    joinedload(Appointment.schedule),
-                    joinedload(Appointment.doctor),
-                    joinedload(Appointment.medical_record)
-                )\
-                .order_by(Appointment.schedule.has(Schedule.datetime.desc()))\
-                .all()
-
-            return appointments
-        finally:
-            session.close()
+        # Get all appointments with related data
+        appointments = session.query(Appointment)\
+            .filter(Appointment.patient_id == patient_id)\
+            .options(
+                joinedload(Appointment.schedule),
+                joinedload(Appointment.doctor),
+                joinedload(Appointment.medical_record)
+            )\
+            .order_by(Appointment.schedule.has(Schedule.datetime.desc()))\
+            .all()
+
+        return appointments
@@ -1,11 +1,18 @@
-from flask_restful import Resource, reqparse, fields, marshal_with
+from flask_restful import Resource, reqparse, fields
 from models import Schedule, Doctor
 from resources.doctors import doctor_fields
-from db import SessionLocal
+from db_session import get_session
 from sqlalchemy.orm import joinedload
 import datetime
 from sqlalchemy.exc import IntegrityError
 from datetime import datetime, timedelta
+from id_allocator import schedule_ids
+from error_handlers import APIError
+from virtual_slots import SLOT_MODES, use_virtual, open_slots
+from pagination import page_args, paginate
+from expand import sparse
+from serializers import marshal, marshal_with
+from formats import REPRESENTATIONS, negotiated_marshal_with
 
 def get_day(obj):
     # obj.datetime is a Python datetime
@@ -21,26 +28,34 @@ schedule_fields = {
     'is_available': fields.Boolean,
 }
 
+# Schedules are always shown with their doctor, and doctor_fields shows the department's name:
+# load both with the schedules rather than once per row while marshalling
+with_doctor = joinedload(Schedule.doctor).joinedload(Doctor.department_obj)
+
 parser = reqparse.RequestParser()
 parser.add_argument("doctor_id", required=True)
 parser.add_argument("datetime", required=True)  # ISO format
 parser.add_argument("duration", type=int, required=True)
 
 class ScheduleListAPI(Resource):
-    @marshal_with(schedule_fields)
     def get(self, doctor_id):
-        session = SessionLocal()
-        schedules = session.query(Schedule).all()
-        session.close()
-        return schedules
+        cursor, limit = page_args()
+        session = get_session()
+        try:
+            query, item_fields = sparse(session.query(Schedule), schedule_fields, Schedule,
+                                        keep=['datetime'], reads={'day': ['datetime']})
+            if 'doctor' in item_fields:
+                query = query.options(with_doctor)
+            schedules, next_cursor = paginate(query, [Schedule.datetime, Schedule.id], cursor, limit)
+            return {"items": marshal(schedules, item_fields), "next_cursor": next_cursor}
+        except APIError as e:
+            return {"message": e.message}, e.status_code
 
     @marshal_with(schedule_fields)
     def post(self):
         args = parser.parse_args()
-        session = SessionLocal()
-        # Generate schedule ID (e.g., SC001)
-        last = session.query(Schedule).order_by(Schedule.id.desc()).first()
-        new_id = f"SC{(int(last.id[2:]) + 1) if last else 1:03}"
+        session = get_session()
+        new_id = schedule_ids.next_id()
 
         session.add(Schedule(id=new_id, **args))
         session.commit()
@@ -48,7 +63,7 @@ class ScheduleListAPI(Resource):
         # Now re-query with doctor eagerly loaded
         sched = (
             session.query(Schedule)
-            .options(joinedload(Schedule.doctor))
+            .options(with_doctor)
             .filter(Schedule.id == new_id)
             .one()
         )
@@ -57,25 +72,22 @@ class ScheduleListAPI(Resource):
         # session.add(new_schedule)
         # session.commit()
         # session.refresh(new_schedule)
-        session.close()
         return sched, 201
 
 class DoctorSchedulesAPI(Resource):
     @marshal_with(schedule_fields)
     def get(self, doctor_id):
-        session = SessionLocal()
-        schedules = session.query(Schedule).filter(
+        session = get_session()
+        schedules = session.query(Schedule).options(with_doctor).filter(
             Schedule.doctor_id == doctor_id
         ).all()
-        session.close()
         return schedules
 
 class ScheduleAPI(Resource):
     @marshal_with(schedule_fields)
     def get(self, schedule_id):
-        session = SessionLocal()
-        sched = session.query(Schedule).get(schedule_id)
-        session.close()
+        session = get_session()
+        sched = session.query(Schedule).options(with_doctor).get(schedule_id)
         if not sched:
             return {"message": "Schedule not found"}, 404
         return sched
@@ -83,10 +95,9 @@ class ScheduleAPI(Resource):
     @marshal_with(schedule_fields)
     def put(self, schedule_id):
         args = parser.parse_args()
-        session = SessionLocal()
+        session = get_session()
         sched = session.query(Schedule).get(schedule_id)
         if not sched:
-            session.close()
             return {"message": "Schedule not found"}, 404
 
         # Update mutable fields
@@ -95,53 +106,57 @@ class ScheduleAPI(Resource):
         sched.is_available = args.get("is_available", sched.is_available)
         session.commit()
         session.refresh(sched)
-        session.close()
         return sched, 200
 
     def delete(self, schedule_id):
-        session = SessionLocal()
+        session = get_session()
         sched = session.query(Schedule).get(schedule_id)
         if not sched:
-            session.close()
             return {"message": "Schedule not found"}, 404
         session.delete(sched)
         session.commit()
-        session.close()
         return {"message": f"Schedule {schedule_id} deleted"}, 200
 
 class ScheduleCheckAvailabilityAPI(Resource):
-    @marshal_with(schedule_fields)
+    representations = REPRESENTATIONS
+
+    @negotiated_marshal_with(schedule_fields)  # JSON, MessagePack or columns, by Accept
     def get(self, doctor_id):
         parser = reqparse.RequestParser()
         parser.add_argument("start_date", type=str, required=True, help="Start date in YYYY-MM-DD format")
         parser.add_argument("end_date", type=str, required=True, help="End date in YYYY-MM-DD format")
+        parser.add_argument("mode", type=str, required=False, choices=SLOT_MODES)
         args = parser.parse_args()
 
-        session = SessionLocal()
+        session = get_session()
+        # Verify doctor exists
+        doctor = session.query(Doctor).get(doctor_id)
+        if not doctor:
+            return {"message": "Doctor not found"}, 404
+
+        # Convert string dates to datetime
         try:
-            # Verify doctor exists
-            doctor = session.query(Doctor).get(doctor_id)
-            if not doctor:
-                return {"message": "Doctor not found"}, 404
+            start_date = datetime.strptime(args["start_date"], "%Y-%m-%d")
+            end_date = datetime.strptime(args["end_date"], "%Y-%m-%d") + timedelta(days=1)  # Include end date
+        except ValueError:
+            return {"message": "Invalid date format. Use YYYY-MM-DD"}, 400
 
-            # Convert string dates to datetime
+        if use_virtual(args["mode"]):
+            # Free slots computed from the availability rules minus booked times
             try:
-                start_date = datetime.strptime(args["start_date"], "%Y-%m-%d")
-                end_date = datetime.strptime(args["end_date"], "%Y-%m-%d") + timedelta(days=1)  # Include end date
-            except ValueError:
-                return {"message": "Invalid date format. Use YYYY-MM-DD"}, 400
-
-            # Get available schedules
-            available_schedules = session.query(Schedule)\
-                .filter(
-                    Schedule.doctor_id == doctor_id,
-                    Schedule.datetime >= start_date,
-                    Schedule.datetime < end_date,
-                    Schedule.is_available == True
-                )\
-                .order_by(Schedule.datetime)\
-                .all()
-
-            return available_schedules
-        finally:
-            session.close()
+                return open_slots(session, doctor, start_date, end_date)
+            except APIError as e:
+                return {"message": e.message}, e.status_code
+
+        # Get available schedules
+        available_schedules = session.query(Schedule)\
+            .filter(
+                Schedule.doctor_id == doctor_id,
+                Schedule.datetime >= start_date,
+                Schedule.datetime < end_date,
+                Schedule.is_available == True
+            )\
+            .order_by(Schedule.datetime)\
+            .all()
+
+        return available_schedules
@@ -0,0 +1,66 @@
+from flask import request
+from flask_restful import Resource, reqparse, fields
+from db_session import get_session
+from auth import login_required, role_required
+from models import Patient
+import search_index
+from search_index import suggestions, patient_index, SUGGEST_KINDS
+from search import fuzzy_patient_matches, fetch_ranked
+from serializers import marshal
+
+MAX_SUGGESTIONS = 25
+MAX_SEARCH_RESULTS = 100
+
+patient_match_fields = {
+    "id": fields.String,
+    "first_name": fields.String,
+    "last_name": fields.String,
+    "email": fields.String,
+    "phone": fields.String,
+    "score": fields.Float,
+}
+
+# Roles allowed to see patient names in suggestions
+PATIENT_SUGGESTION_ROLES = ("Admin", "Doctor")
+
+class SearchSuggestAPI(Resource):
+    @login_required
+    def get(self):
+        """Typeahead suggestions for patients, doctors, departments and specializations"""
+        parser = reqparse.RequestParser()
+        parser.add_argument("q", required=True, location="args")
+        parser.add_argument("limit", type=int, default=10, location="args")
+        parser.add_argument("type", choices=SUGGEST_KINDS, action="append", location="args")
+        args = parser.parse_args()
+
+        kinds = args["type"] or SUGGEST_KINDS
+        if request.user_role not in PATIENT_SUGGESTION_ROLES:
+            kinds = [kind for kind in kinds if kind != "patient"]
+
+        session = get_session()
+        search_index.ensure_fresh(session)
+
+        limit = max(1, min(args["limit"], MAX_SUGGESTIONS))
+        return {"suggestions": suggestions.suggest(args["q"], limit, kinds)}, 200
+
+
+class PatientSearchAPI(Resource):
+    @role_required(list(PATIENT_SUGGESTION_ROLES))
+    def get(self):
+        """Search patients by name, email or phone; ``mode=fuzzy`` tolerates misspelt names"""
+        parser = reqparse.RequestParser()
+        parser.add_argument("q", required=True, location="args")
+        parser.add_argument("mode", choices=("exact", "fuzzy"), default="exact", location="args")
+        parser.add_argument("limit", type=int, default=10, location="args")
+        args = parser.parse_args()
+        limit = max(1, min(args["limit"], MAX_SEARCH_RESULTS))
+
+        session = get_session()
+        if args["mode"] == "fuzzy":
+            scores = dict(fuzzy_patient_matches(session, args["q"], limit))
+        else:
+            search_index.ensure_fresh(session)
+            scores = dict.fromkeys(patient_index.search(args["q"], limit))
+        patients = fetch_ranked(session, Patient, patient_index, list(scores))
+        items = [dict(marshal(patient, patient_match_fields), score=scores[patient.id]) for patient in patients]
+        return {"items": items}, 200
@@ -0,0 +1,10 @@
+from flask_restful import Resource
+from db_session import session_factory
+from db import pool_stats
+from auth import admin_required
+
+class PoolStatsAPI(Resource):
+    @admin_required
+    def get(self):
+        """Connection pool of the worker serving the request: usage, overflow and checkout waits"""
+        return pool_stats(session_factory().kw['bind']), 200
@@ -1,12 +1,18 @@
-from flask_restful import Resource, reqparse, marshal_with
+from flask_restful import Resource, reqparse
 from flask import request, jsonify
 from flask_restx import Namespace, Api, fields as restx_fields
 from models import User, Doctor, Patient
-from db import SessionLocal
+from db_session import get_session
 from werkzeug.security import generate_password_hash, check_password_hash
 from sqlalchemy.exc import IntegrityError
-from auth import admin_required, get_current_user, generate_token
+from auth import admin_required, get_current_user, generate_token, load_user, invalidate_user
 from validators import validate_user_data
+from id_allocator import user_ids
+from error_handlers import APIError
+from pagination import page_args, paginate
+from search_index import reindex_user
+from expand import sparse
+from serializers import marshal, marshal_with
 
 VALID_ROLES = ["Patient", "Doctor", "Admin"]
 
@@ -33,12 +39,15 @@ api = Api()
 @ns.route('')
 class UserList(Resource):
     @admin_required
-    @marshal_with(user_fields)
     def get(self):
-        session = SessionLocal()
-        users = session.query(User).all()
-        session.close()
-        return users
+        cursor, limit = page_args()
+        session = get_session()
+        try:
+            query, item_fields = sparse(session.query(User), user_fields, User)
+            users, next_cursor = paginate(query, [User.id], cursor, limit)
+            return {"items": marshal(users, item_fields), "next_cursor": next_cursor}
+        except APIError as e:
+            return {"message": e.message}, e.status_code
 
     @admin_required
     @marshal_with(user_fields)
@@ -46,25 +55,17 @@ class UserList(Resource):
         args = parser.parse_args()
         validate_user_data(args)
         
-        session = SessionLocal()
+        session = get_session()
         try:
             # Check for existing username/email
             existing_user = session.query(User).filter(
                 (User.username == args["username"]) | (User.email == args["email"])
             ).first()
             if existing_user:
-                session.close()
                 return {"message": "Username or email already exists"}, 400
 
-            last = session.query(User).order_by(User.id.desc()).first()
-            if last:
-                last_num = int(last.id[1:])
-            else:
-                last_num = 0
-            new_id = f"U{last_num + 1:03}"
-
             new_user = User(
-                id=new_id,
+                id=user_ids.next_id(),
                 username=args["username"],
                 password=generate_password_hash(args["password"]),
                 email=args["email"],
@@ -73,11 +74,9 @@ class UserList(Resource):
             session.add(new_user)
             session.commit()
             session.refresh(new_user)
-            session.close()
             return new_user, 201
         except IntegrityError:
             session.rollback()
-            session.close()
             return {"message": "Database error occurred"}, 500
 
 @ns.route('/<string:id>')
@@ -85,9 +84,8 @@ class UserResource(Resource):
     @admin_required
     @marshal_with(user_fields)
     def get(self, id):
-        session = SessionLocal()
+        session = get_session()
         user = session.query(User).get(id)
-        session.close()
         if not user:
             return {"message": "User not found"}, 404
         return user
@@ -98,10 +96,9 @@ class UserResource(Resource):
         args = parser.parse_args()
         validate_user_data(args)
         
-        session = SessionLocal()
+        session = get_session()
         user = session.query(User).get(id)
         if not user:
-            session.close()
             return {"message": "User not found"}, 404
 
         try:
@@ -111,7 +108,6 @@ class UserResource(Resource):
                 (User.username == args["username"]) | (User.email == args["email"])
             ).first()
             if existing_user:
-                session.close()
                 return {"message": "Username or email already exists"}, 400
 
             user.username = args["username"]
@@ -120,31 +116,32 @@ class UserResource(Resource):
             user.role = args["role"]
 
             session.commit()
+            invalidate_user(id)
+            reindex_user(session, id)
             session.refresh(user)
-            session.close()
             return user
         except IntegrityError:
             session.rollback()
-            session.close()
             return {"message": "Database error occurred"}, 500
 
     @admin_required
     def delete(self, id):
-        session = SessionLocal()
+        session = get_session()
         user = session.query(User).get(id)
         if not user:
-            session.close()
             return {"message": "User not found"}, 404
         session.delete(user)
         session.commit()
-        session.close()
+        invalidate_user(id)
+        reindex_user(session, id)
         return {"message": f"User {id} deleted"}, 200
 
 @ns.route('/me')
 class CurrentUser(Resource):
     @marshal_with(user_fields)
     def get(self):
-        user = get_current_user()
+        identity = get_current_user()
+        user = load_user(identity.id) if identity else None
         if not user:
             return {"message": "Not authenticated"}, 401
         return user
@@ -154,11 +151,15 @@ class CurrentUser(Resource):
         args = parser.parse_args()
         validate_user_data(args)
         
-        user = get_current_user()
+        identity = get_current_user()
+        if not identity:
+            return {"message": "Not authenticated"}, 401
+
+        session = get_session()
+        user = session.query(User).get(identity.id)
         if not user:
             return {"message": "Not authenticated"}, 401
 
-        session = SessionLocal()
         try:
             # Check if new username/email conflicts with other users
             existing_user = session.query(User).filter(
@@ -166,7 +167,6 @@ class CurrentUser(Resource):
                 (User.username == args["username"]) | (User.email == args["email"])
             ).first()
             if existing_user:
-                session.close()
                 return {"message": "Username or email already exists"}, 400
 
             user.username = args["username"]
@@ -174,12 +174,12 @@ class CurrentUser(Resource):
             user.email = args["email"]
 
             session.commit()
+            invalidate_user(user.id)
+            reindex_user(session, user.id)
             session.refresh(user)
-            session.close()
             return user
         except IntegrityError:
             session.rollback()
-            session.close()
             return {"message": "Database error occurred"}, 500
 
 class UserLoginAPI(Resource):
@@ -189,16 +189,17 @@ class UserLoginAPI(Resource):
         parser.add_argument("password", required=True)
         args = parser.parse_args()
 
-        session = SessionLocal()
-        try:
-            user = session.query(User).filter(User.username == args["username"]).first()
-            if not user or not check_password_hash(user.password, args["password"]):
-                return {"message": "Invalid credentials"}, 401
-
-            token = generate_token(user.id, user.role)
-            return {"token": token, "user": marshal_with(user_fields)(lambda: user)()}, 200
-        finally:
-            session.close()
+        session = get_session()
+        user = session.query(User).filter(User.username == args["username"]).first()
+        if not user or not check_password_hash(user.password, args["password"]):
+            return {"message": "Invalid credentials"}, 401
+
+        patient = session.query(Patient.id).filter(Patient.user_id == user.id).first()
+        doctor = session.query(Doctor.id).filter(Doctor.user_id == user.id).first()
+        token = generate_token(user.id, user.role,
+                               patient_id=patient.id if patient else None,
+                               doctor_id=doctor.id if doctor else None)
+        return {"token": token, "user": marshal_with(user_fields)(lambda: user)()}, 200
 
 class UserLogoutAPI(Resource):
     def post(self):
@@ -1,77 +1,158 @@
-from sqlalchemy import or_
-from models import Doctor, Patient, Appointment, MedicalRecord, Department
+import re
+from datetime import datetime
+from sqlalchemy import and_, or_
+from sqlalchemy.orm import contains_eager
+from models import Doctor, Patient, Appointment, MedicalRecord, Department, Schedule
 from db import SessionLocal
+import search_index
+from search_index import patient_index, doctor_index
+from phonetic import soundex, metaphone, trigrams, similarity
+from pagination import paginate
+
+# Most rows a fuzzy search scores; a very common name stops here
+FUZZY_CANDIDATES = 2000
+
+def fetch_ranked(session, model, index, ids):
+    """Load rows for ranked ids, keeping the order and dropping ids deleted elsewhere"""
+    rows = {row.id: row for row in session.query(model).filter(model.id.in_(ids))} if ids else {}
+    for missing in set(ids) - set(rows):
+        index.remove(missing)
+    return [rows[i] for i in ids if i in rows]
 
 def search_doctors(query, department_id=None, limit=10):
-    """Search doctors by name or department"""
+    """Search doctors by name, email or phone, best match first"""
     session = SessionLocal()
     try:
-        search = f"%{query}%"
-        doctors_query = session.query(Doctor).filter(
-            or_(
-                Doctor.first_name.ilike(search),
-                Doctor.last_name.ilike(search)
-            )
-        )
-        
-        if department_id:
-            doctors_query = doctors_query.filter(Doctor.department_id == department_id)
-        
-        return doctors_query.limit(limit).all()
+        search_index.ensure_fresh(session)
+        ids = doctor_index.search(query, limit, tag=department_id)
+        return fetch_ranked(session, Doctor, doctor_index, ids)
     finally:
         session.close()
 
-def search_patients(query, limit=10):
-    """Search patients by name or email"""
+def search_patients(query, limit=10, fuzzy=False):
+    """Search patients by name, email or phone, best match first.
+
+    With ``fuzzy`` only names are searched, tolerating misspellings
+    (see ``fuzzy_patient_matches``).
+    """
     session = SessionLocal()
     try:
-        search = f"%{query}%"
-        return session.query(Patient).filter(
-            or_(
-                Patient.first_name.ilike(search),
-                Patient.last_name.ilike(search),
-                Patient.email.ilike(search)
-            )
-        ).limit(limit).all()
+        if fuzzy:
+            ids = [patient_id for patient_id, _ in fuzzy_patient_matches(session, query, limit)]
+            return fetch_ranked(session, Patient, patient_index, ids)
+        search_index.ensure_fresh(session)
+        ids = patient_index.search(query, limit)
+        return fetch_ranked(session, Patient, patient_index, ids)
     finally:
         session.close()
 
+def _name_matches(first, last):
+    """Patients whose first and last name sound like ``first`` and ``last``"""
+    return or_(
+        and_(Patient.last_name_soundex == soundex(last), Patient.first_name_soundex == soundex(first)),
+        and_(Patient.last_name_metaphone == metaphone(last), Patient.first_name_metaphone == metaphone(first)),
+    )
+
+def _fuzzy_candidates(words):
+    """WHERE clause selecting patients that share a phonetic key with the query words"""
+    if len(words) == 1:
+        code, key = soundex(words[0]), metaphone(words[0])
+        return or_(Patient.last_name_soundex == code, Patient.last_name_metaphone == key,
+                   Patient.first_name_soundex == code, Patient.first_name_metaphone == key)
+    # Names may be typed either way round
+    first, last = words[0], words[-1]
+    return or_(_name_matches(first, last), _name_matches(last, first))
+
+def fuzzy_patient_matches(session, query, limit=10):
+    """Rank patients by how closely their name matches ``query``; returns (id, score) pairs.
+
+    Candidates are found through the indexed Soundex and Metaphone keys,
+    so only rows that sound like the query are read, then scored by
+    trigram similarity. A single word is compared with the first and
+    last name separately, several words with the full name.
+    """
+    words = re.findall(r"[^\W\d_]+", query or "")
+    if not words:
+        return []
+    rows = session.query(Patient.id, Patient.first_name, Patient.last_name)\
+        .filter(_fuzzy_candidates(words)).limit(FUZZY_CANDIDATES).all()
+
+    grams = trigrams(" ".join(words))
+    scored = []
+    for row in rows:
+        if len(words) == 1:
+            score = max(similarity(grams, row.first_name), similarity(grams, row.last_name))
+        else:
+            score = similarity(grams, f"{row.first_name} {row.last_name}")
+        scored.append((row.id, round(score, 4)))
+    scored.sort(key=lambda match: (-match[1], match[0]))
+    return scored[:limit]
+
+def filter_appointments(query, doctor_id=None, patient_id=None, status=None, start_date=None, end_date=None):
+    """Apply the appointment search filters to a query that has ``schedules`` joined in"""
+    if doctor_id:
+        # The slot's doctor (always the appointment's) so (doctor_id, datetime) on schedules is used
+        query = query.filter(Schedule.doctor_id == doctor_id)
+    if patient_id:
+        query = query.filter(Appointment.patient_id == patient_id)
+    if status:
+        query = query.filter(Appointment.status == status)
+    if start_date:
+        query = query.filter(Schedule.datetime >= start_date)
+    if end_date:
+        query = query.filter(Schedule.datetime <= end_date)
+    return query
+
+def appointment_search_query(session, doctor_id=None, patient_id=None, status=None, start_date=None, end_date=None):
+    """Appointments joined to their slot once, filtered; order by ``Schedule.datetime, Appointment.id``"""
+    query = session.query(Appointment).join(Appointment.schedule).options(contains_eager(Appointment.schedule))
+    return filter_appointments(query, doctor_id, patient_id, status, start_date, end_date)
+
+def _timeline_page(session, upcoming, now, cursor, limit, doctor_id, patient_id):
+    query = appointment_search_query(session, doctor_id, patient_id)
+    query = query.filter(Schedule.datetime > now if upcoming else Schedule.datetime <= now)
+    return paginate(query, [Schedule.datetime, Appointment.id], cursor, limit, descending=not upcoming,
+                    key=lambda a: [a.schedule.datetime, a.id])
+
+def appointment_timeline(session, doctor_id=None, patient_id=None, upcoming_cursor=None, history_cursor=None,
+                         limit=None, now=None):
+    """A doctor's or patient's upcoming appointments (soonest first) and history (latest first).
+
+    Each list is one query joined to the slots and paged on its own cursor.
+    """
+    # Slot times are naive local times, as booking.py compares them
+    now = now or datetime.now()
+    upcoming, next_upcoming = _timeline_page(session, True, now, upcoming_cursor, limit, doctor_id, patient_id)
+    history, next_history = _timeline_page(session, False, now, history_cursor, limit, doctor_id, patient_id)
+    return {"upcoming": upcoming, "history": history,
+            "upcoming_cursor": next_upcoming, "history_cursor": next_history}
+
 def search_appointments(doctor_id=None, patient_id=None, status=None, start_date=None, end_date=None, limit=10):
-    """Search appointments with various filters"""
+    """Search appointments with various filters, earliest slot first"""
     session = SessionLocal()
     try:
-        query = session.query(Appointment)
-        
-        if doctor_id:
-            query = query.filter(Appointment.doctor_id == doctor_id)
-        if patient_id:
-            query = query.filter(Appointment.patient_id == patient_id)
-        if status:
-            query = query.filter(Appointment.status == status)
-        if start_date:
-            query = query.filter(Appointment.schedule.has(datetime >= start_date))
-        if end_date:
-            query = query.filter(Appointment.schedule.has(datetime <= end_date))
-        
-        return query.limit(limit).all()
+        query = appointment_search_query(session, doctor_id, patient_id, status, start_date, end_date)
+        return query.order_by(Schedule.datetime, Appointment.id).limit(limit).all()
     finally:
         session.close()
 
+def filter_medical_records(query, patient_id=None, department_id=None, start_date=None, end_date=None):
+    """Apply the medical record search filters to any query over MedicalRecord"""
+    if patient_id:
+        query = query.filter(MedicalRecord.patient_id == patient_id)
+    if department_id:
+        query = query.filter(MedicalRecord.department_id == department_id)
+    if start_date:
+        query = query.filter(MedicalRecord.visit_date >= start_date)
+    if end_date:
+        query = query.filter(MedicalRecord.visit_date <= end_date)
+    return query
+
 def search_medical_records(patient_id=None, department_id=None, start_date=None, end_date=None, limit=10):
     """Search medical records with various filters"""
     session = SessionLocal()
     try:
-        query = session.query(MedicalRecord)
-        
-        if patient_id:
-            query = query.filter(MedicalRecord.patient_id == patient_id)
-        if department_id:
-            query = query.filter(MedicalRecord.department_id == department_id)
-        if start_date:
-            query = query.filter(MedicalRecord.visit_date >= start_date)
-        if end_date:
-            query = query.filter(MedicalRecord.visit_date <= end_date)
-        
+        query = filter_medical_records(session.query(MedicalRecord), patient_id, department_id, start_date, end_date)
         return query.order_by(MedicalRecord.visit_date.desc()).limit(limit).all()
     finally:
         session.close()
@@ -0,0 +1,508 @@
+"""
+In-process inverted index for patient and doctor search.
+
+Each index maps tokens of a few fields (name, email, phone) to the set of
+documents containing them. A query token matches a document token exactly
+or as a prefix ("jo" finds "john"); prefixes are expanded through a sorted
+vocabulary with bisect, so no per-prefix postings are stored. Every query
+token must match; documents are ranked by field weight, exact matches
+counting double.
+
+``suggestions`` is a sorted-array prefix index over patient and doctor
+names, department names and specializations for the typeahead endpoint.
+
+The indexes live in each worker. Writes made through the API update them
+directly; rows changed by other workers are picked up by a periodic
+catch-up on ``updated_at``. Run ``python search_index.py`` to rebuild from
+the database and print the counts.
+"""
+import heapq
+import os
+import re
+import threading
+import time
+from bisect import bisect_left, insort
+from datetime import datetime, timedelta
+from models import Patient, Doctor, User, Department
+from db import SessionLocal
+
+REFRESH_SECONDS = int(os.getenv('SEARCH_INDEX_REFRESH_SECONDS', '5'))
+FIELD_WEIGHTS = {'name': 3, 'email': 2, 'phone': 1}
+
+_TOKEN = re.compile(r"[0-9a-z]+")
+_PHONE = re.compile(r"[\d\s()+.-]*\d{4}[\d\s()+.-]*")
+
+
+def query_terms(query):
+    """Split a search string into terms; a phone number stays one term"""
+    query = (query or '').strip().lower()
+    if _PHONE.fullmatch(query):
+        return [re.sub(r"\D", "", query)]
+    return list(dict.fromkeys(_TOKEN.findall(query)))
+
+
+def tokenize(field, value):
+    """Split a field value into index tokens"""
+    if not value:
+        return []
+    value = value.lower()
+    if field == 'phone':
+        # Search by the whole number however it was punctuated
+        digits = re.sub(r"\D", "", value)
+        return [digits] if digits else []
+    if field == 'email':
+        # The domain is shared by too many people to be worth a posting
+        value = value.split('@', 1)[0]
+    return _TOKEN.findall(value)
+
+
+class InvertedIndex:
+    """Token -> documents index over named text fields"""
+
+    def __init__(self, weights=FIELD_WEIGHTS):
+        self.weights = dict(weights)
+        self.fields = tuple(self.weights)
+        self._postings = {field: {} for field in self.weights}
+        self._vocabulary = []
+        self._docs = {}
+        self._tags = {}
+        self._lock = threading.RLock()
+
+    def __len__(self):
+        return len(self._docs)
+
+    def add(self, doc_id, fields, tag=None):
+        """Index (or re-index) a document; ``tag`` can later narrow a search"""
+        with self._lock:
+            self._remove(doc_id)
+            # A tuple in field order costs far less than a dict per document
+            values = self._docs[doc_id] = tuple(fields.get(field) for field in self.fields)
+            if tag is not None:
+                self._tags[doc_id] = tag
+            for field, value in zip(self.fields, values):
+                postings = self._postings[field]
+                for token in tokenize(field, value):
+                    docs = postings.get(token)
+                    if docs is None:
+                        docs = postings[token] = set()
+                        if not self._in_vocabulary(token):
+                            insort(self._vocabulary, token)
+                    docs.add(doc_id)
+
+    def remove(self, doc_id):
+        with self._lock:
+            self._remove(doc_id)
+
+    def clear(self):
+        with self._lock:
+            for postings in self._postings.values():
+                postings.clear()
+            self._vocabulary = []
+            self._docs.clear()
+            self._tags.clear()
+
+    def load(self, documents):
+        """Replace the contents with ``(doc_id, fields, tag)`` triples in one pass"""
+        with self._lock:
+            self.clear()
+            for doc_id, fields, tag in documents:
+                values = self._docs[doc_id] = tuple(fields.get(field) for field in self.fields)
+                if tag is not None:
+                    self._tags[doc_id] = tag
+                for field, value in zip(self.fields, values):
+                    postings = self._postings[field]
+                    for token in tokenize(field, value):
+                        postings.setdefault(token, set()).add(doc_id)
+            self._vocabulary = sorted(set().union(*self._postings.values()))
+
+    def search(self, query, limit=10, tag=None):
+        """Return up to ``limit`` doc ids, best match first (ties by id)"""
+        terms = query_terms(query)
+        if not terms:
+            return []
+        with self._lock:
+            tiers = [self._tiers(term) for term in terms]
+            if len(tiers) == 1:
+                return self._top_of_tiers(tiers[0], limit, tag)
+
+            # Several terms: only documents matching all of them, scored by
+            # the best tier each term reaches
+            tiers = [[(points, set().union(*load())) for points, load in term_tiers] for term_tiers in tiers]
+            matching = sorted((set().union(*(docs for _, docs in term_tiers)) for term_tiers in tiers), key=len)
+            candidates = matching[0].intersection(*matching[1:])
+            if tag is not None:
+                candidates = {d for d in candidates if self._tags.get(d) == tag}
+            scores = {doc_id: sum(next(points for points, docs in term_tiers if doc_id in docs)
+                                  for term_tiers in tiers)
+                      for doc_id in candidates}
+            return heapq.nsmallest(limit, scores, key=lambda d: (-scores[d], d))
+
+    def _tiers(self, term):
+        """Posting sets matching ``term`` grouped by points, highest first.
+
+        A field scores its weight for a prefix match and double for an exact
+        match. Each group is a function returning its sets, so a search that
+        fills its page from exact matches never expands the prefixes.
+        Callers union the sets, which keeps per-document work in C.
+        """
+        prefixed = []
+
+        def prefix_tokens():
+            if not prefixed:
+                start = bisect_left(self._vocabulary, term)
+                end = bisect_left(self._vocabulary, term + '\uffff', start)
+                prefixed.append([token for token in self._vocabulary[start:end] if token != term])
+            return prefixed[0]
+
+        def exact(postings):
+            return lambda: [postings[term]] if term in postings else []
+
+        def prefix(postings):
+            return lambda: [postings[t] for t in prefix_tokens() if t in postings]
+
+        grouped = {}
+        for field, weight in self.weights.items():
+            postings = self._postings[field]
+            grouped.setdefault(weight * 2, []).append(exact(postings))
+            grouped.setdefault(weight, []).append(prefix(postings))
+        return [(points, lambda loaders=loaders: [s for load in loaders for s in load()])
+                for points, loaders in sorted(grouped.items(), reverse=True)]
+
+    def _top_of_tiers(self, tiers, limit, tag):
+        """Walk the tiers best-first, stopping as soon as ``limit`` ids are found"""
+        results, seen = [], set()
+        for _, load in tiers:
+            docs = set().union(*load()) - seen
+            if tag is not None:
+                docs = {d for d in docs if self._tags.get(d) == tag}
+            results.extend(heapq.nsmallest(limit - len(results), docs))
+            if len(results) >= limit:
+                break
+            seen |= docs
+        return results
+
+    def _in_vocabulary(self, token):
+        i = bisect_left(self._vocabulary, token)
+        return i < len(self._vocabulary) and self._vocabulary[i] == token
+
+    def _remove(self, doc_id):
+        values = self._docs.pop(doc_id, None)
+        self._tags.pop(doc_id, None)
+        if values is None:
+            return
+        for field, value in zip(self.fields, values):
+            postings = self._postings[field]
+            for token in tokenize(field, value):
+                docs = postings.get(token)
+                if docs is not None:
+                    docs.discard(doc_id)
+                    if not docs:
+                        del postings[token]
+                        # Keep the vocabulary entry while another field still uses it
+                        if not any(token in p for p in self._postings.values()):
+                            i = bisect_left(self._vocabulary, token)
+                            if i < len(self._vocabulary) and self._vocabulary[i] == token:
+                                del self._vocabulary[i]
+
+
+class PrefixIndex:
+    """Sorted arrays of normalized labels for typeahead suggestions.
+
+    Each kind keeps its own sorted list of (key, id) pairs. A lookup bisects
+    to the first key with the prefix and reads at most ``limit`` matches, so
+    it costs O(log n + k) however many entries there are. A label gets one
+    key per word onwards ("ann lee", "lee") so a surname matches as well.
+    Kinds are searched in the order given, smallest and most specific first.
+    """
+
+    def __init__(self, kinds):
+        self.kinds = tuple(kinds)
+        self._entries = {kind: [] for kind in self.kinds}
+        self._labels = {}
+        self._refs = {}
+        self._lock = threading.RLock()
+
+    def add(self, kind, item_id, label):
+        with self._lock:
+            self._remove(kind, item_id)
+            if not suggest_keys(label):
+                return
+            self._labels[(kind, item_id)] = label
+            entries = self._entries[kind]
+            for key in suggest_keys(label):
+                insort(entries, (key, item_id))
+
+    def remove(self, kind, item_id):
+        with self._lock:
+            self._remove(kind, item_id)
+
+    def retain(self, kind, label):
+        """Count one more user of a shared label (e.g. a specialization)"""
+        item_id = normalize(label)
+        if not item_id:
+            return
+        with self._lock:
+            self._refs[(kind, item_id)] = self._refs.get((kind, item_id), 0) + 1
+            if self._refs[(kind, item_id)] == 1:
+                self.add(kind, item_id, label)
+
+    def release(self, kind, label):
+        item_id = normalize(label)
+        with self._lock:
+            count = self._refs.get((kind, item_id), 0) - 1
+            if count > 0:
+                self._refs[(kind, item_id)] = count
+            elif count == 0:
+                del self._refs[(kind, item_id)]
+                self._remove(kind, item_id)
+
+    def load(self, items, shared=()):
+        """Replace the contents with ``(kind, id, label)`` items and shared ``(kind, label)`` uses"""
+        with self._lock:
+            self._labels.clear()
+            self._refs.clear()
+            for kind, label in shared:
+                item_id = normalize(label)
+                if item_id:
+                    self._refs[(kind, item_id)] = self._refs.get((kind, item_id), 0) + 1
+                    self._labels.setdefault((kind, item_id), label)
+            for kind, item_id, label in items:
+                if suggest_keys(label):
+                    self._labels[(kind, item_id)] = label
+            entries = {kind: [] for kind in self.kinds}
+            for (kind, item_id), label in self._labels.items():
+                entries[kind].extend((key, item_id) for key in suggest_keys(label))
+            for kind in self.kinds:
+                entries[kind].sort()
+            self._entries = entries
+
+    def suggest(self, prefix, limit=10, kinds=None):
+        prefix = normalize(prefix)
+        if not prefix:
+            return []
+        results = []
+        with self._lock:
+            for kind in kinds or self.kinds:
+                entries = self._entries[kind]
+                seen = set()
+                i = bisect_left(entries, (prefix,))
+                while i < len(entries) and len(results) < limit:
+                    key, item_id = entries[i]
+                    if not key.startswith(prefix):
+                        break
+                    if item_id not in seen:
+                        seen.add(item_id)
+                        results.append({'type': kind, 'id': item_id, 'label': self._labels[(kind, item_id)]})
+                    i += 1
+                if len(results) >= limit:
+                    break
+        return results
+
+    def __len__(self):
+        return len(self._labels)
+
+    def _remove(self, kind, item_id):
+        label = self._labels.pop((kind, item_id), None)
+        if label is None:
+            return
+        entries = self._entries[kind]
+        for key in suggest_keys(label):
+            i = bisect_left(entries, (key, item_id))
+            if i < len(entries) and entries[i] == (key, item_id):
+                del entries[i]
+
+
+def normalize(text):
+    return ' '.join(_TOKEN.findall((text or '').lower()))
+
+
+def suggest_keys(label):
+    words = _TOKEN.findall((label or '').lower())
+    return {' '.join(words[i:]) for i in range(len(words))}
+
+
+SUGGEST_KINDS = ('department', 'specialization', 'doctor', 'patient')
+
+patient_index = InvertedIndex()
+doctor_index = InvertedIndex()
+suggestions = PrefixIndex(SUGGEST_KINDS)
+_doctor_specializations = {}
+
+
+def full_name(row):
+    return f"{row.first_name or ''} {row.last_name or ''}".strip()
+
+
+def patient_document(patient):
+    return patient.id, {
+        'name': full_name(patient),
+        'email': patient.email,
+        'phone': patient.phone,
+    }, None
+
+
+def doctor_document(doctor, email=None):
+    return doctor.id, {
+        'name': full_name(doctor),
+        'email': email,
+        'phone': doctor.phone,
+    }, doctor.department_id
+
+
+def _patient_rows(session, since=None):
+    query = session.query(Patient.id, Patient.first_name, Patient.last_name, Patient.email,
+                          Patient.phone, Patient.updated_at)
+    if since is not None:
+        query = query.filter(Patient.updated_at >= since)
+    return query.yield_per(5000)
+
+
+def _doctor_rows(session, since=None):
+    query = session.query(Doctor.id, Doctor.first_name, Doctor.last_name, Doctor.phone,
+                          Doctor.department_id, Doctor.specialization, Doctor.updated_at, User.email)\
+        .outerjoin(User, Doctor.user_id == User.id)
+    if since is not None:
+        query = query.filter(Doctor.updated_at >= since)
+    return query.yield_per(5000)
+
+
+def _department_rows(session, since=None):
+    query = session.query(Department.id, Department.name, Department.updated_at)
+    if since is not None:
+        query = query.filter(Department.updated_at >= since)
+    return query.yield_per(5000)
+
+
+class _Source:
+    """A table feeding the indexes, with its own catch-up watermark"""
+
+    def __init__(self, rows, apply):
+        self.rows = rows
+        self.apply = apply
+        self.watermark = None
+        self.refreshed_at = 0.0
+
+
+def _apply_doctor(row):
+    index_doctor(row, row.email)
+
+
+_SOURCES = {
+    'patients': _Source(_patient_rows, lambda row: index_patient(row)),
+    'doctors': _Source(_doctor_rows, _apply_doctor),
+    'departments': _Source(_department_rows, lambda row: index_department(row)),
+}
+_built = False
+
+
+def _watermark(rows):
+    stamps = [row.updated_at for row in rows if row.updated_at]
+    return max(stamps) if stamps else None
+
+
+def rebuild(session=None):
+    """Rebuild the search and suggestion indexes from the database; returns the counts"""
+    global _built
+    own = session is None
+    session = session or SessionLocal()
+    try:
+        loaded = {name: list(source.rows(session)) for name, source in _SOURCES.items()}
+        patient_index.load(patient_document(row) for row in loaded['patients'])
+        doctor_index.load(doctor_document(row, row.email) for row in loaded['doctors'])
+        _doctor_specializations.clear()
+        _doctor_specializations.update((row.id, row.specialization) for row in loaded['doctors'])
+        suggestions.load(
+            [('patient', row.id, full_name(row)) for row in loaded['patients']]
+            + [('doctor', row.id, full_name(row)) for row in loaded['doctors']]
+            + [('department', row.id, row.name) for row in loaded['departments']],
+            shared=[('specialization', row.specialization) for row in loaded['doctors']]
+        )
+        now = time.monotonic()
+        for name, source in _SOURCES.items():
+            source.watermark = _watermark(loaded[name]) or datetime.utcnow()
+            source.refreshed_at = now
+        _built = True
+        return {'patients': len(patient_index), 'doctors': len(doctor_index),
+                'departments': len(loaded['departments']), 'suggestions': len(suggestions)}
+    finally:
+        if own:
+            session.close()
+
+
+def ensure_fresh(session):
+    """Build the indexes on first use, then catch up on rows other workers changed"""
+    if not _built:
+        rebuild(session)
+        return
+    now = time.monotonic()
+    for source in _SOURCES.values():
+        if now - source.refreshed_at < REFRESH_SECONDS:
+            continue
+        # A little overlap so rows committed during the last catch-up are not missed
+        changed = list(source.rows(session, source.watermark - timedelta(seconds=REFRESH_SECONDS)))
+        for row in changed:
+            source.apply(row)
+        source.watermark = _watermark(changed) or source.watermark
+        source.refreshed_at = now
+
+
+def reset():
+    """Forget everything; the next search rebuilds from the database"""
+    global _built
+    patient_index.clear()
+    doctor_index.clear()
+    suggestions.load([])
+    _doctor_specializations.clear()
+    _built = False
+
+
+def index_patient(patient):
+    patient_index.add(*patient_document(patient))
+    suggestions.add('patient', patient.id, full_name(patient))
+
+
+def unindex_patient(patient_id):
+    patient_index.remove(patient_id)
+    suggestions.remove('patient', patient_id)
+
+
+def index_doctor(doctor, email=None):
+    doctor_index.add(*doctor_document(doctor, email))
+    suggestions.add('doctor', doctor.id, full_name(doctor))
+    previous = _doctor_specializations.get(doctor.id)
+    if previous != doctor.specialization:
+        if previous:
+            suggestions.release('specialization', previous)
+        suggestions.retain('specialization', doctor.specialization)
+        _doctor_specializations[doctor.id] = doctor.specialization
+
+
+def unindex_doctor(doctor_id):
+    doctor_index.remove(doctor_id)
+    suggestions.remove('doctor', doctor_id)
+    previous = _doctor_specializations.pop(doctor_id, None)
+    if previous:
+        suggestions.release('specialization', previous)
+
+
+def index_department(department):
+    suggestions.add('department', department.id, department.name)
+
+
+def unindex_department(department_id):
+    suggestions.remove('department', department_id)
+
+
+def reindex_user(session, user_id):
+    """Refresh the documents linked to a user after its email changed or it was deleted"""
+    user = session.query(User).get(user_id)
+    for doctor in session.query(Doctor).filter(Doctor.user_id == user_id):
+        index_doctor(doctor, user.email if user else None)
+    for patient in session.query(Patient).filter(Patient.user_id == user_id):
+        index_patient(patient)
+
+
+if __name__ == '__main__':
+    counts = rebuild()
+    print(f"Indexed {counts['patients']} patients, {counts['doctors']} doctors, "
+          f"{counts['departments']} departments ({counts['suggestions']} suggestions)")
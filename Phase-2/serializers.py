@@ -0,0 +1,201 @@
+"""
+Compiled marshalling: a drop-in for flask_restful's ``marshal`` and
+``marshal_with``.
+
+flask_restful walks the field map for every row: it instantiates field
+classes, resolves each attribute through ``get_value`` and dispatches to the
+field's ``output`` and ``format``. Here each field map is turned once into
+a generated function with the attribute reads and the formatting of the
+common field types (Raw, String, Integer, Boolean, Float, DateTime, Nested)
+inlined, and cached. A custom field can be inlined the same way by giving
+its class a ``compiled_format`` (see formats.Epoch); any other field type is
+still called through its ``output``, so custom fields keep working.
+
+The result is the same as flask_restful's, key for key and value for value,
+so the JSON bytes do not change. Rows that are indexable (dicts, tuples) are
+handed to flask_restful's marshal unchanged, as is any row whose compiled
+serialization raises, so errors are flask_restful's own too.
+
+``output_json`` is the JSON representation. With ``JSON_BACKEND = 'orjson'``
+and orjson installed it encodes with orjson. The values are the same, but
+the bytes are compact UTF-8 rather than the stdlib's ``", "``-separated
+ASCII, so it is opt-in.
+"""
+import logging
+import threading
+from collections import OrderedDict
+from functools import wraps
+
+from flask import current_app, make_response
+from flask_restful import fields as restful_fields
+from flask_restful import marshal as restful_marshal
+from flask_restful.representations.json import output_json as restful_output_json
+from flask_restful.utils import unpack
+
+try:
+    import orjson
+except ImportError:  # optional: only needed for JSON_BACKEND = 'orjson'
+    orjson = None
+
+logger = logging.getLogger(__name__)
+
+MAX_COMPILED = 512  # field maps kept; ?fields= makes new ones per request
+
+_compiled = OrderedDict()
+_lock = threading.Lock()
+_plain_types = {}  # type -> rows of it are read with getattr, not indexed
+
+
+def _is_plain(obj):
+    cls = type(obj)
+    plain = _plain_types.get(cls)
+    if plain is None:
+        plain = _plain_types[cls] = hasattr(obj, 'strip') or not hasattr(obj, '__iter__')
+    return plain
+
+
+def _key(fields):
+    return tuple((name, id(field)) for name, field in fields.items())
+
+
+def compile_fields(fields):
+    """Build the function that marshals one row with ``fields``"""
+    namespace = {'_plain': _is_plain, '_fallback': restful_marshal, '_fields': fields,
+                 '_get_value': restful_fields.get_value, '_rfc822': restful_fields._rfc822}
+    lines = ['def serialize(obj):',
+             '    if obj is None or not _plain(obj):',
+             '        return _fallback(obj, _fields)',
+             '    try:',
+             '        r = {}']
+    for i, (name, field) in enumerate(fields.items()):
+        if isinstance(field, dict):
+            namespace[f'n{i}'] = serializer(field)
+            lines.append(f'        r[{name!r}] = n{i}(obj)')
+            continue
+        if isinstance(field, type):
+            field = field()
+        namespace[f'f{i}'] = field
+        namespace[f'd{i}'] = field.default
+        lines += _field_lines(i, name, field, namespace)
+    lines += ['        return r',
+              '    except Exception:',
+              '        return _fallback(obj, _fields)  # raises what flask_restful raises']
+    exec('\n'.join(lines), namespace)
+    return namespace['serialize']
+
+
+def _field_lines(i, name, field, namespace):
+    kind = type(field)
+    attribute = name if field.attribute is None else field.attribute
+    # A field class can be inlined too: ``compiled_format`` is its format() as an expression in ``v``
+    compiled_format = kind.__dict__.get('compiled_format')
+    if compiled_format is None and kind not in (
+            restful_fields.Raw, restful_fields.String, restful_fields.Integer, restful_fields.Boolean,
+            restful_fields.Float, restful_fields.DateTime, restful_fields.Nested):
+        return [f'        r[{name!r}] = f{i}.output({name!r}, obj)']
+
+    if callable(attribute):
+        namespace[f'a{i}'] = attribute
+        read = f'a{i}(obj)'
+    elif isinstance(attribute, str) and '.' not in attribute:
+        read = f'getattr(obj, {attribute!r}, None)'
+    else:
+        namespace[f'a{i}'] = attribute
+        read = f'_get_value(a{i}, obj)'
+
+    if kind is restful_fields.Nested:
+        namespace[f'n{i}'] = _many(serializer(field.nested))
+        return [f'        v = {read}',
+                f'        r[{name!r}] = n{i}(v) if v is not None else '
+                f'(None if f{i}.allow_null else d{i} if d{i} is not None else n{i}(v))']
+
+    formatted = {
+        restful_fields.Raw: 'v',
+        restful_fields.String: 'str(v)',
+        restful_fields.Integer: 'int(v)',
+        restful_fields.Boolean: 'bool(v)',
+        restful_fields.Float: 'float(v)',
+    }.get(kind, compiled_format)
+    if compiled_format is not None:
+        namespace.update(kind.compiled_names)
+    elif kind is restful_fields.DateTime:
+        if field.dt_format == 'iso8601':
+            formatted = 'v.isoformat()'
+        elif field.dt_format == 'rfc822':
+            formatted = '_rfc822(v)'
+        else:
+            return [f'        r[{name!r}] = f{i}.output({name!r}, obj)']
+    return [f'        v = {read}',
+            f'        r[{name!r}] = d{i} if v is None else {formatted}']
+
+
+def _many(serialize):
+    # A nested value may be one row or a list of them, as in ``marshal``
+    def nested(value):
+        if isinstance(value, (list, tuple)):
+            return [serialize(row) for row in value]
+        return serialize(value)
+    return nested
+
+
+def serializer(fields):
+    """The compiled function for ``fields``, built on first use"""
+    key = _key(fields)
+    with _lock:
+        compiled = _compiled.get(key)
+        if compiled is not None:
+            _compiled.move_to_end(key)
+            return compiled
+    compiled = compile_fields(fields)
+    with _lock:
+        _compiled[key] = compiled
+        if len(_compiled) > MAX_COMPILED:
+            _compiled.popitem(last=False)
+    return compiled
+
+
+def marshal(data, fields, envelope=None):
+    """``flask_restful.marshal`` with a compiled serializer per field map"""
+    serialize = serializer(fields)
+    if isinstance(data, (list, tuple)):
+        result = [serialize(row) for row in data]
+    else:
+        result = serialize(data)
+    return {envelope: result} if envelope else result
+
+
+class marshal_with:
+    """``flask_restful.marshal_with`` over the compiled ``marshal``"""
+
+    def __init__(self, fields, envelope=None):
+        self.fields = fields
+        self.envelope = envelope
+
+    def __call__(self, f):
+        @wraps(f)
+        def wrapper(*args, **kwargs):
+            resp = f(*args, **kwargs)
+            if isinstance(resp, tuple):
+                data, code, headers = unpack(resp)
+                return marshal(data, self.fields, self.envelope), code, headers
+            return marshal(resp, self.fields, self.envelope)
+        return wrapper
+
+
+def output_json(data, code, headers=None):
+    """JSON representation: flask_restful's, or orjson when ``JSON_BACKEND`` asks for it"""
+    config = current_app.config
+    if config.get('JSON_BACKEND') != 'orjson' or orjson is None or current_app.debug or config.get('RESTFUL_JSON'):
+        return restful_output_json(data, code, headers)
+    dumped = orjson.dumps(data, option=orjson.OPT_APPEND_NEWLINE)
+    resp = make_response(dumped, code)
+    resp.headers.extend(headers or {})
+    resp.mimetype = 'application/json'
+    return resp
+
+
+def init_serializers(app, api):
+    """Use ``output_json`` for the API's JSON responses"""
+    if app.config.get('JSON_BACKEND') == 'orjson' and orjson is None:
+        logger.warning("JSON_BACKEND is 'orjson' but orjson is not installed; using the stdlib encoder")
+    api.representation('application/json')(output_json)
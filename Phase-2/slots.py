@@ -0,0 +1,140 @@
+from datetime import datetime, timedelta
+
+from sqlalchemy import insert, update, delete, select, exists, and_, or_
+
+from models import Schedule, Appointment
+from error_handlers import ValidationError
+from id_allocator import schedule_ids
+
+SLOT_MINUTES = 60
+HORIZON_DAYS = 30
+# Stay well below SQL Server's 2100 bind parameters per statement
+CHUNK_SIZE = 500
+
+
+def _parse_time(value):
+    """'9', '09', '9:30' -> minutes after midnight"""
+    hours, _, minutes = value.strip().partition(':')
+    total = int(hours) * 60 + int(minutes or 0)
+    if not 0 <= total <= 24 * 60:
+        raise ValueError(value)
+    return total
+
+
+def parse_availability(availability):
+    """Turn {"Monday": "9-12,13-17"} into {"Monday": [(540, 720), (780, 1020)]} (minutes)"""
+    ranges = {}
+    for day, spec in (availability or {}).items():
+        day_ranges = []
+        for time_range in str(spec).split(','):
+            if not time_range.strip():
+                continue
+            try:
+                start, end = time_range.split('-')
+                start, end = _parse_time(start), _parse_time(end)
+            except ValueError:
+                raise ValidationError(f"Invalid time range '{time_range.strip()}' for {day}. Use e.g. 9-17 or 9:00-17:00")
+            if start >= end:
+                raise ValidationError(f"End time must be after start time for {day}")
+            day_ranges.append((start, end))
+        ranges[day] = day_ranges
+    return ranges
+
+
+def expand_slots(ranges, start_date, end_date, duration=SLOT_MINUTES):
+    """Yield every slot start in [start_date, end_date) that fits entirely inside a range"""
+    current_date = start_date.replace(hour=0, minute=0, second=0, microsecond=0)
+    while current_date < end_date:
+        for start, end in ranges.get(current_date.strftime("%A"), ()):
+            minute = start
+            while minute + duration <= end:
+                slot = current_date + timedelta(minutes=minute)
+                if start_date <= slot < end_date:
+                    yield slot
+                minute += duration
+        current_date += timedelta(days=1)
+
+
+def _chunks(items, size=CHUNK_SIZE):
+    for i in range(0, len(items), size):
+        yield items[i:i + size]
+
+
+def materialize_schedule(session, doctor_id, availability, start_date=None, days=HORIZON_DAYS, duration=SLOT_MINUTES):
+    """Bring a doctor's Schedule rows in line with ``availability`` by diffing, not rebuilding.
+
+    Missing slots are inserted and free slots that no longer fit are deleted,
+    each in bulk statements. Booked slots are never touched. A free slot that
+    is still referenced by a (cancelled) appointment can't be deleted, so it is
+    marked unavailable instead, and is reopened once the availability covers
+    it again and no active appointment holds it. Does not commit.
+    """
+    if start_date is None:
+        start_date = datetime.now().replace(hour=0, minute=0, second=0, microsecond=0)
+    end_date = start_date + timedelta(days=days)
+    desired = set(expand_slots(parse_availability(availability), start_date, end_date, duration))
+
+    referenced = exists().where(Appointment.schedule_id == Schedule.id)
+    # As booking._holds_slot: only a cancelled appointment has given its slot back
+    held = exists().where(and_(Appointment.schedule_id == Schedule.id,
+                               or_(Appointment.status.is_(None), Appointment.status != 'Cancelled')))
+    existing = session.execute(
+        select(Schedule.id, Schedule.datetime, Schedule.is_available, referenced.label('referenced'),
+               held.label('held'))
+        .where(
+            Schedule.doctor_id == doctor_id,
+            Schedule.datetime >= start_date,
+            Schedule.datetime < end_date
+        )
+    ).all()
+
+    present = set()
+    to_delete, to_close, to_reopen = [], [], []
+    for row in existing:
+        present.add(row.datetime)
+        if row.datetime in desired:
+            if not row.is_available and not row.held:
+                to_reopen.append(row.id)
+            continue
+        if not row.is_available:
+            continue
+        (to_close if row.referenced else to_delete).append(row.id)
+
+    missing = sorted(desired - present)
+    # IDs first: on SQLite a block refill must not queue behind this session's write lock
+    new_ids = schedule_ids.next_ids(len(missing))
+    if missing:
+        session.execute(insert(Schedule), [
+            {'id': new_id, 'doctor_id': doctor_id, 'datetime': slot, 'duration': duration, 'is_available': True}
+            for new_id, slot in zip(new_ids, missing)
+        ])
+    # Re-check is_available in the WHERE clause: a slot booked since the SELECT above must survive
+    for ids in _chunks(to_delete):
+        session.execute(
+            delete(Schedule)
+            .where(Schedule.id.in_(ids), Schedule.is_available == True, ~referenced)
+            .execution_options(synchronize_session=False)
+        )
+    for ids in _chunks(to_close):
+        session.execute(
+            update(Schedule)
+            .where(Schedule.id.in_(ids), Schedule.is_available == True)
+            .values(is_available=False)
+            .execution_options(synchronize_session=False)
+        )
+    # Re-check that no appointment has taken the slot since the SELECT
+    for ids in _chunks(to_reopen):
+        session.execute(
+            update(Schedule)
+            .where(Schedule.id.in_(ids), Schedule.is_available == False, ~held)
+            .values(is_available=True)
+            .execution_options(synchronize_session=False)
+        )
+
+    return {
+        'added': len(missing),
+        'removed': len(to_delete),
+        'closed': len(to_close),
+        'reopened': len(to_reopen),
+        'kept': len(existing) - len(to_delete) - len(to_close) - len(to_reopen),
+    }
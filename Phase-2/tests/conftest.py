@@ -1,11 +1,34 @@
-import pytest
-from app import app as flask_app
-from db import Base, engine, SessionLocal
 import os
+import pytest
+from flask import Flask
+from flask_restful import Api
+from sqlalchemy import create_engine, event
+from sqlalchemy.orm import sessionmaker
+import db
+from db import Base
+from db_session import init_sessions
+from models import Doctor
+from id_allocator import (user_ids, patient_ids, doctor_ids, appointment_ids, medical_record_ids, department_ids,
+                          schedule_ids)
+import search
+import search_index
+
+ALLOCATORS = (user_ids, patient_ids, doctor_ids, appointment_ids, medical_record_ids, department_ids, schedule_ids)
+
+DOCTOR = {'first_name': 'John', 'last_name': 'Smith', 'specialization': 'Cardiology', 'qualification': 'MD',
+          'experience_years': 10}
+
+
+def doctor(id='D001', **columns):
+    """A Doctor row; the columns a test doesn't care about are filled in"""
+    return Doctor(id=id, **dict(DOCTOR, **columns))
+
 
 @pytest.fixture
 def app():
     """Create application for the tests."""
+    from app import create_app
+    flask_app = create_app()
     flask_app.config.update({
         'TESTING': True,
         'SQLALCHEMY_DATABASE_URI': os.getenv('TEST_DATABASE_URL', 'sqlite:///test.db')
@@ -20,13 +43,13 @@ def client(app):
 @pytest.fixture
 def session():
     """Create database session for the tests."""
-    Base.metadata.create_all(bind=engine)
-    session = SessionLocal()
+    Base.metadata.create_all(bind=db.engine)
+    session = db.SessionLocal()
     try:
         yield session
     finally:
         session.close()
-        Base.metadata.drop_all(bind=engine)
+        Base.metadata.drop_all(bind=db.engine)
 
 @pytest.fixture
 def auth_headers():
@@ -34,4 +57,65 @@ def auth_headers():
     return {
         'Authorization': 'Bearer test-token',
         'Content-Type': 'application/json'
-    } 
\ No newline at end of file
+    }
+
+
+@pytest.fixture
+def engine(tmp_path, monkeypatch):
+    """A SQLite file with the whole schema; the ID allocators reserve their blocks in it"""
+    engine = create_engine(f"sqlite:///{tmp_path}/test.db", connect_args={'check_same_thread': False, 'timeout': 30})
+    Base.metadata.create_all(bind=engine)
+    for allocator in ALLOCATORS:
+        monkeypatch.setattr(allocator, 'bind', engine)
+        allocator.reset()
+    search_index.reset()
+    yield engine
+    search_index.reset()
+    for allocator in ALLOCATORS:
+        allocator.reset()
+    engine.dispose()
+
+
+@pytest.fixture
+def Session(engine, monkeypatch):
+    """Session factory for ``engine``, also used by the search functions that open their own.
+
+    A test file seeds its data by overriding this fixture::
+
+        @pytest.fixture
+        def Session(Session):
+            with Session() as session:
+                ...
+            return Session
+    """
+    Session = sessionmaker(bind=engine)
+    monkeypatch.setattr(search, 'SessionLocal', Session)
+    return Session
+
+
+@pytest.fixture
+def statements(engine, Session):
+    """(sql, parameters) of each statement run on ``engine`` once the test's data is seeded"""
+    recorded = []
+    event.listen(engine, 'before_cursor_execute',
+                 lambda conn, cursor, statement, parameters, context, many: recorded.append((statement, parameters)))
+    return recorded
+
+
+@pytest.fixture
+def make_client(Session):
+    """make_client({url: resource}) -> a test client for an app serving them, one session per request
+
+    ``setup(app, api)``, if given, runs before the routes are added.
+    """
+    def make(routes, setup=None):
+        app = Flask(__name__)
+        app.debug = False
+        init_sessions(app, Session)
+        api = Api(app)
+        if setup:
+            setup(app, api)
+        for url, resource in routes.items():
+            api.add_resource(resource, url)
+        return app.test_client()
+    return make
@@ -0,0 +1,87 @@
+from datetime import datetime, timedelta
+import pytest
+from models import Appointment, Patient, Schedule
+from auth import generate_token
+import search
+import resources.appointments as appointment_resource
+from conftest import doctor
+
+START = datetime(2030, 1, 7, 9)
+
+@pytest.fixture
+def Session(Session):
+    with Session() as session:
+        session.add_all([doctor('D001'), doctor('D002')])
+        for patient_id in ('P001', 'P002'):
+            session.add(Patient(id=patient_id, first_name='Ann', last_name='Lee', email=f"{patient_id}@example.com"))
+        # Inserted newest first so slot order and id order disagree
+        for i in reversed(range(40)):
+            doctor_id, patient_id = f"D00{i % 2 + 1}", f"P00{i % 4 // 2 + 1}"
+            session.add(Schedule(id=f"SC{i:04}", doctor_id=doctor_id, datetime=START + timedelta(hours=i // 2),
+                                 duration=30, is_available=False))
+            session.add(Appointment(id=f"A{39 - i:03}", patient_id=patient_id, doctor_id=doctor_id,
+                                    schedule_id=f"SC{i:04}", status='Cancelled' if i % 5 == 0 else 'Scheduled'))
+        session.commit()
+    return Session
+
+def slot_times(appointments):
+    return [a.schedule.datetime for a in appointments]
+
+def test_date_range_filters_on_the_slot_time(Session):
+    found = search.search_appointments(doctor_id='D001', start_date=START + timedelta(hours=3),
+                                       end_date=START + timedelta(hours=6), limit=50)
+    assert slot_times(found) == [START + timedelta(hours=h) for h in range(3, 7)]
+    assert {a.doctor_id for a in found} == {'D001'}
+
+def test_filters_combine_and_results_come_in_slot_order(Session):
+    found = search.search_appointments(patient_id='P002', status='Scheduled', limit=50)
+    assert found and slot_times(found) == sorted(slot_times(found))
+    assert {(a.patient_id, a.status) for a in found} == {('P002', 'Scheduled')}
+
+@pytest.fixture
+def client(make_client):
+    client = make_client({'/api/appointments/search': appointment_resource.AppointmentSearchAPI})
+
+    def get(query, role='Admin', **claims):
+        token = generate_token('U001', role, **claims)
+        return client.get(f"/api/appointments/search?{query}", headers={'Authorization': f"Bearer {token}"})
+    return get
+
+def test_endpoint_pages_through_matches_by_slot_time(client):
+    seen, cursor = [], ''
+    while True:
+        body = client(f"doctor_id=D002&start_date=2030-01-07&end_date=2030-01-07&limit=3&cursor={cursor}").get_json()
+        seen.extend(body['items'])
+        cursor = body['next_cursor']
+        if not cursor:
+            break
+    # Slots run from 09:00 past midnight; the bare end date keeps the whole of the 7th and nothing after
+    assert len(seen) == 15
+    assert [item['datetime'] for item in seen] == sorted(item['datetime'] for item in seen)
+    assert seen[0]['datetime'] == '2030-01-07T09:00:00'
+
+def test_patients_only_see_their_own_appointments(client):
+    items = client('limit=100', role='Patient', patient_id='P001').get_json()['items']
+    assert items and {item['patient_id'] for item in items} == {'P001'}
+    assert client('patient_id=P002', role='Patient', patient_id='P001').status_code == 403
+    assert client('start_date=soon').status_code == 400
+
+def query_plan(session, query):
+    """EXPLAIN QUERY PLAN details for an ORM query on SQLite"""
+    statement = query.statement.compile(dialect=session.get_bind().dialect)
+    params = tuple(statement.params[name] for name in statement.positiontup)
+    return [row[-1] for row in session.connection().exec_driver_sql(f"EXPLAIN QUERY PLAN {statement}", params)]
+
+@pytest.mark.parametrize('filters, index', [
+    ({'doctor_id': 'D001', 'start_date': START, 'end_date': START + timedelta(days=1)}, 'sqlite_autoindex_schedules'),
+    ({'patient_id': 'P001', 'status': 'Scheduled'}, 'ix_appointments_patient_status'),
+    ({'start_date': START, 'end_date': START + timedelta(days=1)}, 'ix_schedules_datetime'),
+])
+def test_searches_use_indexes(Session, filters, index):
+    session = Session()
+    query = search.appointment_search_query(session, **filters)\
+        .order_by(Schedule.datetime, Appointment.id).limit(50)
+    plan = query_plan(session, query)
+    assert any(index in step for step in plan), plan
+    assert not [step for step in plan if step.startswith('SCAN')], plan
+    session.close()
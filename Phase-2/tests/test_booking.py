@@ -0,0 +1,172 @@
+import threading
+from datetime import datetime, timedelta
+import pytest
+from models import Patient, Schedule, Appointment
+from error_handlers import SlotUnavailableError, ValidationError
+import booking
+from resources.appointments import AppointmentAPI
+from prometheus_client import REGISTRY
+from conftest import doctor
+
+@pytest.fixture
+def Session(Session):
+    future = datetime.now() + timedelta(days=1)
+    with Session() as session:
+        session.add_all([
+            Patient(id='P001', first_name='Ann', last_name='Lee', email='ann@example.com'),
+            Patient(id='P002', first_name='Bob', last_name='Ray', email='bob@example.com'),
+            doctor('D001'),
+            doctor('D002', first_name='Sarah', last_name='Jones', specialization='Neurology', experience_years=8),
+            Schedule(id='SC0001', doctor_id='D001', datetime=future, duration=60, is_available=True),
+            Schedule(id='SC0002', doctor_id='D001', datetime=future + timedelta(hours=1), duration=60, is_available=True),
+            Schedule(id='SC0003', doctor_id='D002', datetime=future, duration=60, is_available=True),
+        ])
+        session.commit()
+    return Session
+
+def is_available(session, schedule_id):
+    return session.query(Schedule.is_available).filter(Schedule.id == schedule_id).scalar()
+
+def test_second_booking_of_a_slot_is_rejected(Session):
+    session = Session()
+    booking.book_appointment(session, 'P001', 'SC0001')
+    session.commit()
+
+    with pytest.raises(SlotUnavailableError):
+        booking.book_appointment(session, 'P002', 'SC0001')
+    session.rollback()
+
+    assert session.query(Appointment).count() == 1
+    assert is_available(session, 'SC0001') is False
+
+def test_reschedule_moves_the_claim(Session):
+    session = Session()
+    appointment = booking.book_appointment(session, 'P001', 'SC0001')
+    session.commit()
+
+    booking.reschedule_appointment(session, appointment, 'SC0002')
+    session.commit()
+
+    assert appointment.schedule_id == 'SC0002'
+    assert is_available(session, 'SC0001') is True
+    assert is_available(session, 'SC0002') is False
+
+def test_reschedule_to_other_doctor_is_rejected(Session):
+    session = Session()
+    appointment = booking.book_appointment(session, 'P001', 'SC0001')
+    session.commit()
+
+    with pytest.raises(ValidationError):
+        booking.reschedule_appointment(session, appointment, 'SC0003')
+
+def test_cancel_releases_the_slot(Session):
+    session = Session()
+    appointment = booking.book_appointment(session, 'P001', 'SC0001')
+    session.commit()
+
+    booking.cancel_appointment(session, appointment)
+    session.commit()
+
+    assert appointment.status == 'Cancelled'
+    assert is_available(session, 'SC0001') is True
+
+def test_cancelled_appointment_reclaims_its_slot_when_moved_back(Session):
+    session = Session()
+    appointment = booking.book_appointment(session, 'P001', 'SC0001')
+    booking.cancel_appointment(session, appointment)
+    session.commit()
+
+    booking.move_appointment(session, appointment, 'SC0001')
+    session.commit()
+    assert is_available(session, 'SC0001') is False
+
+    other = booking.book_appointment(session, 'P002', 'SC0002')
+    booking.cancel_appointment(session, other)
+    booking.book_appointment(session, 'P001', 'SC0002')
+    session.commit()
+    with pytest.raises(SlotUnavailableError):
+        booking.move_appointment(session, other, 'SC0002')
+    session.rollback()
+
+def test_put_cannot_double_book_a_rebooked_slot(Session, make_client):
+    client = make_client({'/api/appointments/<string:appointment_id>': AppointmentAPI})
+
+    session = Session()
+    first = booking.book_appointment(session, 'P001', 'SC0001')
+    session.commit()
+    booking.cancel_appointment(session, first)
+    session.commit()
+    booking.book_appointment(session, 'P002', 'SC0001')
+    session.commit()
+
+    body = {'patient_id': 'P001', 'schedule_id': 'SC0001', 'status': 'Scheduled'}
+    assert client.put(f"/api/appointments/{first.id}", json=body).status_code == 409
+    scheduled = session.query(Appointment).filter(Appointment.schedule_id == 'SC0001',
+                                                  Appointment.status == 'Scheduled')
+    assert scheduled.count() == 1
+
+    # Cancelling through PUT gives the slot back; making it Scheduled again claims it
+    second = scheduled.one()
+    response = client.put(f"/api/appointments/{second.id}", json=dict(body, status='Cancelled'))
+    assert response.get_json()['status'] == 'Cancelled'
+    assert is_available(session, 'SC0001') is True
+    assert client.put(f"/api/appointments/{first.id}", json=body).status_code == 200
+    assert is_available(session, 'SC0001') is False
+    session.close()
+
+def test_concurrent_bookers_get_one_winner(Session):
+    wins, losses = [], []
+    barrier = threading.Barrier(16)
+
+    def worker(patient_id):
+        session = Session()
+        barrier.wait()
+        try:
+            booking.book_appointment(session, patient_id, 'SC0001')
+            session.commit()
+            wins.append(patient_id)
+        except SlotUnavailableError:
+            session.rollback()
+            losses.append(patient_id)
+        finally:
+            session.close()
+
+    threads = [threading.Thread(target=worker, args=(['P001', 'P002'][i % 2],)) for i in range(16)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+
+    session = Session()
+    assert len(wins) == 1
+    assert len(losses) == 15
+    assert session.query(Appointment).filter(Appointment.schedule_id == 'SC0001').count() == 1
+
+def test_booking_outcomes_are_counted(Session):
+    def count(outcome):
+        return REGISTRY.get_sample_value('appointment_bookings_total', {'operation': 'book', 'outcome': outcome}) or 0
+    before = count('success'), count('conflict')
+    session = Session()
+    booking.book_appointment(session, 'P001', 'SC0002')
+    assert count('success') == before[0]  # not until the transaction commits
+    session.commit()
+    with pytest.raises(SlotUnavailableError):
+        booking.book_appointment(session, 'P002', 'SC0002')
+    session.rollback()
+    session.close()
+    assert (count('success') - before[0], count('conflict') - before[1]) == (1, 1)
+
+def test_rolled_back_bookings_are_not_counted(Session):
+    def count(operation):
+        return REGISTRY.get_sample_value('appointment_bookings_total', {'operation': operation, 'outcome': 'success'}) or 0
+    before = count('book'), count('move')
+    session = Session()
+    appointment = booking.book_appointment(session, 'P001', 'SC0002')
+    booking.move_appointment(session, appointment, 'SC0003')
+    session.rollback()
+    booking.book_appointment(session, 'P002', 'SC0002')
+    session.close()  # ended without a commit
+    session = Session()
+    session.commit()  # nothing is left over for an unrelated commit to count
+    session.close()
+    assert (count('book'), count('move')) == before
@@ -0,0 +1,117 @@
+import gzip
+import json
+import zlib
+import pytest
+from flask import Flask, Response
+from flask_restful import Api, Resource
+import compression
+from compression import init_compression
+import resources.medical_records as medical_records
+from test_export import bearer, fill
+
+ROWS = [{'id': f"A{i:05}", 'status': 'Scheduled', 'reason': 'Annual check-up'} for i in range(200)]
+
+@pytest.fixture
+def app():
+    app = Flask(__name__)
+    app.debug = False
+    api = Api(app)
+
+    class Appointments(Resource):
+        def get(self):
+            return ROWS
+
+    class One(Resource):
+        def get(self):
+            return ROWS[0]
+
+    class Private(Resource):
+        def get(self):
+            return ROWS, 200, {'Cache-Control': 'no-store'}
+
+    api.add_resource(Appointments, '/appointments')
+    api.add_resource(One, '/one')
+    api.add_resource(Private, '/private')
+    app.compressor = init_compression(app)
+    return app
+
+def test_gzip_for_large_bodies(app):
+    response = app.test_client().get('/appointments', headers={'Accept-Encoding': 'gzip'})
+    assert response.headers['Content-Encoding'] == 'gzip'
+    assert 'Accept-Encoding' in response.headers['Vary']
+    body = response.get_data()
+    assert int(response.headers['Content-Length']) == len(body)
+    assert json.loads(gzip.decompress(body)) == ROWS
+
+def test_brotli_preferred_when_available(app):
+    brotli = pytest.importorskip('brotli')
+    response = app.test_client().get('/appointments', headers={'Accept-Encoding': 'gzip, deflate, br'})
+    assert response.headers['Content-Encoding'] == 'br'
+    assert json.loads(brotli.decompress(response.get_data())) == ROWS
+    response = app.test_client().get('/appointments', headers={'Accept-Encoding': 'br;q=0.5, gzip'})
+    assert response.headers['Content-Encoding'] == 'gzip'
+
+def test_gzip_only_without_brotli(app, monkeypatch):
+    monkeypatch.setattr(compression, 'brotli', None)
+    response = app.test_client().get('/appointments', headers={'Accept-Encoding': 'br, gzip'})
+    assert response.headers['Content-Encoding'] == 'gzip'
+
+def test_small_bodies_and_unaccepted_encodings_go_as_they_are(app):
+    client = app.test_client()
+    small = client.get('/one', headers={'Accept-Encoding': 'gzip'})
+    assert 'Content-Encoding' not in small.headers
+    assert small.get_json() == ROWS[0]
+    plain = client.get('/appointments', headers={'Accept-Encoding': 'identity'})
+    assert 'Content-Encoding' not in plain.headers
+    assert 'Accept-Encoding' in plain.headers['Vary']
+    assert plain.get_json() == ROWS
+
+def test_compressed_bodies_are_cached_by_content(app):
+    client = app.test_client()
+    cache = app.compressor.cache
+    first = client.get('/appointments', headers={'Accept-Encoding': 'gzip'}).get_data()
+    second = client.get('/appointments', headers={'Accept-Encoding': 'gzip'}).get_data()
+    assert first == second
+    assert (cache.misses, cache.hits) == (1, 1)
+    client.get('/private', headers={'Accept-Encoding': 'gzip'})
+    assert (cache.misses, cache.hits) == (1, 1)
+
+def test_cache_is_bounded_by_bytes():
+    cache = compression.BodyCache(100)
+    for i in range(10):
+        cache.put(i, b'x' * 20)
+    assert cache.size <= 100
+    assert cache.get(0) is None and cache.get(9) == b'x' * 20
+
+def test_streamed_response_compressed_chunk_by_chunk(app):
+    closed = []
+
+    class Chunks:
+        def __iter__(self):
+            for i in range(3):
+                yield json.dumps(ROWS[i]) + '\n'
+
+        def close(self):
+            closed.append(True)
+
+    app.add_url_rule('/stream', 'stream', lambda: Response(Chunks(), mimetype='application/x-ndjson'))
+    response = app.test_client().get('/stream', headers={'Accept-Encoding': 'gzip'}, buffered=False)
+    assert response.headers['Content-Encoding'] == 'gzip'
+    assert 'Content-Length' not in response.headers
+    decompressor = zlib.decompressobj(16 + zlib.MAX_WBITS)
+    pieces = [decompressor.decompress(chunk) for chunk in response.response]
+    # Every chunk decompresses on arrival: nothing is held back for the next one
+    assert [json.loads(piece) for piece in pieces[:3]] == ROWS[:3]
+    response.close()
+    assert closed
+
+def test_export_streams_compressed(engine, make_client):
+    fill(engine, 2500)
+    client = make_client({'/api/medical-records/export': medical_records.MedicalRecordExportAPI},
+                         setup=lambda app, api: init_compression(app))
+    client.environ_base.update(bearer('Admin'))
+    response = client.get('/api/medical-records/export', headers={'Accept-Encoding': 'gzip'})
+    assert response.headers['Content-Encoding'] == 'gzip'
+    lines = gzip.decompress(response.get_data()).decode().splitlines()
+    assert len(lines) == 2500
+    assert json.loads(lines[0])['id'] == 'M0000000'
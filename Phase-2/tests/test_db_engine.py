@@ -0,0 +1,68 @@
+import pytest
+from flask import Flask
+from flask_restful import Api
+from sqlalchemy.exc import TimeoutError as PoolTimeout
+from sqlalchemy.orm import sessionmaker
+import db
+from auth import generate_token
+from config import ProductionConfig
+from db import TimedQueuePool, create_db_engine, init_engine, pool_stats
+from db_session import init_sessions
+from resources.system import PoolStatsAPI
+
+def sqlite_config(tmp_path, **settings):
+    return dict({'SQLALCHEMY_DATABASE_URI': f"sqlite:///{tmp_path}/pool.db"}, **settings)
+
+def test_pool_follows_the_config(tmp_path):
+    config = {key: getattr(ProductionConfig, key) for key in dir(ProductionConfig) if key.isupper()}
+    config['SQLALCHEMY_DATABASE_URI'] = f"sqlite:///{tmp_path}/pool.db"
+    engine = create_db_engine(config)
+    pool = engine.pool
+    assert isinstance(pool, TimedQueuePool)
+    assert (pool.size(), pool._max_overflow, pool.timeout(), pool._recycle) == (20, 10, 30, 1800)
+    assert pool._pre_ping and not engine.echo
+    engine.dispose()
+
+def test_in_memory_sqlite_has_no_pool_to_size():
+    engine = create_db_engine({'SQLALCHEMY_DATABASE_URI': 'sqlite://', 'SQLALCHEMY_POOL_SIZE': 5})
+    assert not isinstance(engine.pool, TimedQueuePool)
+    assert set(pool_stats(engine)) == {'pid', 'pool'}
+
+def test_stats_count_checkouts_waits_and_timeouts(tmp_path):
+    engine = create_db_engine(sqlite_config(tmp_path, SQLALCHEMY_POOL_SIZE=1, SQLALCHEMY_MAX_OVERFLOW=0,
+                                            SQLALCHEMY_POOL_TIMEOUT=0.2))
+    held = engine.connect()
+    with pytest.raises(PoolTimeout):
+        engine.connect()
+    stats = pool_stats(engine)
+    assert (stats['size'], stats['checked_out'], stats['overflow'], stats['max_overflow']) == (1, 1, 0, 0)
+    assert (stats['waits'], stats['timeouts']) == (2, 1)
+    assert stats['wait_seconds_max'] >= 0.2
+    held.close()
+    assert pool_stats(engine)['checked_out'] == 0
+    engine.dispose()
+
+def test_init_engine_rebinds_the_session_factory(tmp_path, monkeypatch):
+    monkeypatch.setattr(db, 'engine', db.engine)
+    original = db.SessionLocal.kw['bind']
+    try:
+        engine = init_engine(sqlite_config(tmp_path, SQLALCHEMY_POOL_SIZE=3))
+        assert db.engine is engine and db.SessionLocal.kw['bind'] is engine
+        assert pool_stats()['size'] == 3
+    finally:
+        db.SessionLocal.configure(bind=original)
+        engine.dispose()
+
+def test_endpoint_reports_the_pool_to_admins(tmp_path):
+    engine = create_db_engine(sqlite_config(tmp_path, SQLALCHEMY_POOL_SIZE=4))
+    app = Flask(__name__)
+    init_sessions(app, sessionmaker(bind=engine))
+    Api(app).add_resource(PoolStatsAPI, '/api/system/db-pool')
+    client = app.test_client()
+
+    def get(role):
+        return client.get('/api/system/db-pool', headers={'Authorization': f"Bearer {generate_token('U001', role)}"})
+    body = get('Admin').get_json()
+    assert (body['pool'], body['size'], body['checked_out']) == ('TimedQueuePool', 4, 0)
+    assert get('Doctor').status_code == 403
+    engine.dispose()
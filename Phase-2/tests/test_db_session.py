@@ -0,0 +1,74 @@
+import pytest
+from flask import Flask
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+from sqlalchemy.pool import QueuePool
+from db import Base
+from db_session import get_session, init_sessions
+from models import Department
+
+@pytest.fixture
+def app(tmp_path):
+    # A pool of two with no overflow: a single leaked connection per request would exhaust it quickly
+    engine = create_engine(f"sqlite:///{tmp_path}/sessions.db", poolclass=QueuePool, pool_size=2,
+                           max_overflow=0, pool_timeout=1)
+    Base.metadata.create_all(bind=engine)
+    app = Flask(__name__)
+    app.config.update(DB_LEAK_DETECTION=True, PROPAGATE_EXCEPTIONS=False)
+    init_sessions(app, sessionmaker(bind=engine))
+    held = []
+
+    @app.route('/departments/<name>', methods=['POST'])
+    def add(name):
+        session = get_session()
+        assert get_session() is session
+        session.add(Department(id=name, name=name))
+        if name == 'fail':
+            raise RuntimeError('boom')
+        return {}, 400 if name == 'bad' else 201
+
+    @app.route('/leak')
+    def leak():
+        held.append(engine.connect())
+        return {}
+
+    yield app, engine
+    for connection in held:
+        connection.close()
+    engine.dispose()
+
+def names(engine):
+    with sessionmaker(bind=engine)() as session:
+        return sorted(d.id for d in session.query(Department))
+
+def test_success_commits_and_failures_roll_back(app):
+    app, engine = app
+    client = app.test_client()
+    assert client.post('/departments/ok').status_code == 201
+    assert client.post('/departments/bad').status_code == 400
+    assert client.post('/departments/fail').status_code == 500
+    assert names(engine) == ['ok']
+    assert engine.pool.checkedout() == 0
+
+def test_failing_requests_do_not_exhaust_the_pool(app):
+    app, engine = app
+    client = app.test_client()
+    for _ in range(10):
+        assert client.post('/departments/fail').status_code == 500
+    assert client.post('/departments/ok').status_code == 201
+    assert app.extensions['db_sessions'].leaks == []
+
+def test_commit_failure_becomes_a_500(app):
+    app, engine = app
+    client = app.test_client()
+    assert client.post('/departments/dup').status_code == 201
+    response = client.post('/departments/dup')
+    assert response.status_code == 500
+    assert response.get_json()['message'] == 'Database error occurred'
+
+def test_leaked_connections_are_reported(app):
+    app, engine = app
+    app.test_client().get('/leak')
+    [(method, path, stack)] = app.extensions['db_sessions'].leaks
+    assert (method, path) == ('GET', '/leak')
+    assert 'in leak' in stack
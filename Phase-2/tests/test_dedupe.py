@@ -0,0 +1,97 @@
+import io
+import csv
+from datetime import date
+import pytest
+from models import Patient
+import dedupe
+import resources.patients as patient_resource
+from dedupe import Record, record, compare, find_duplicates, find_matches, write_report
+
+def rec(id, first, last, birth_date=None, phone=None, email=None):
+    return record(Record(id, first, last, birth_date, phone, email))
+
+def test_records_are_normalised():
+    r = rec('P1', ' Ann ', 'Lee', date(1990, 5, 1), '+1 (555) 010-2030', ' Ann@Example.com')
+    assert r == Record('P1', 'Ann', 'Lee', '1990-05-01', '0102030', 'ann@example.com')
+    assert rec('P2', 'Ann', 'Lee', phone='12-34').phone is None
+
+def test_compare_weighs_the_evidence():
+    a = rec('P1', 'Catherine', 'Jones', '1990-05-01', '555-0102030')
+    score, matched = compare(a, rec('P2', 'Kathryn', 'Jones', '1990-05-01', '0102030'))
+    assert score >= dedupe.REJECT_THRESHOLD and matched == ('name', 'birth_date', 'phone')
+    # Same name and phone, different birthday: a parent and child, not a duplicate
+    assert compare(a, rec('P3', 'Catherine', 'Jones', '1960-01-01', '555-0102030'))[0] < dedupe.REVIEW_THRESHOLD
+    # Nothing but the name to go on
+    assert compare(a, rec('P4', 'Catherine', 'Jones')) == (0.0, ())
+
+def test_only_patients_sharing_a_block_are_compared():
+    records = [rec(f"P{i:04}", f"Name{i}", f"Family{i}", f"19{i % 90 + 10}-01-{i % 28 + 1:02}", f"555{i:07}")
+               for i in range(2000)]
+    records.append(rec('P9999', 'Name7', 'Family7', records[7].birth_date, records[7].phone))
+    matches, stats = find_duplicates(records)
+    assert [(m.a.id, m.b.id) for m in matches] == [('P0007', 'P9999')]
+    assert stats['comparisons'] < len(records) * 10
+
+def test_pairs_in_several_blocks_are_scored_once_and_oversized_blocks_skipped():
+    records = [rec(f"P{i}", 'Ann', f"Lee{i}", '1990-01-01', f"555{i:07}") for i in range(20)]
+    records.append(rec('PX', 'Ann', 'Lee3', '1990-01-01', '5550000003'))
+    matches, stats = find_duplicates(records, max_block_size=10)
+    # Everyone shares the birth date and the sound of the surname; only the phone block is usable
+    assert stats['skipped_blocks'] == 2
+    assert [(m.a.id, m.b.id) for m in matches] == [('P3', 'PX')]
+    assert stats['comparisons'] == 1
+
+def test_process_pool_finds_the_same_pairs():
+    records = [rec(f"P{i:03}", 'John' if i % 2 else 'Jon', f"Smith{i // 2}", '1980-02-0' + str(i % 9 + 1),
+                   f"555{i // 2:07}") for i in range(200)]
+    serial, _ = find_duplicates(records, threshold=0.5)
+    parallel, _ = find_duplicates(records, threshold=0.5, processes=2)
+    assert serial and parallel == serial
+
+def test_report_lists_one_pair_per_row():
+    out = io.StringIO()
+    matches, _ = find_duplicates([rec('P1', 'Ann', 'Lee', '1990-01-01', '5550102030'),
+                                  rec('P2', 'Anne', 'Lee', '1990-01-01', '5550102030')])
+    write_report(matches, out)
+    rows = list(csv.DictReader(io.StringIO(out.getvalue())))
+    assert [(r['patient_id'], r['duplicate_id'], r['matched']) for r in rows] == [('P1', 'P2', 'name+birth_date+phone')]
+
+@pytest.fixture
+def Session(Session):
+    with Session() as session:
+        session.add(Patient(id='P001', first_name='Catherine', last_name='Jones', birth_date=date(1990, 5, 1),
+                            phone='555-0102030', email='cj@example.com'))
+        session.commit()
+    return Session
+
+@pytest.fixture
+def client(make_client):
+    return make_client({'/api/patients/register': patient_resource.PatientRegisterAPI})
+
+def test_find_matches_uses_the_database_blocks(Session):
+    session = Session()
+    assert [m.b.id for m in find_matches(session, 'Kathryn', 'Jones', '555-0102030', date(1990, 5, 1))] == ['P001']
+    assert find_matches(session, 'Peter', 'Novak', '555-9999999') == []
+    session.close()
+
+def test_registering_twice_is_refused(Session, client):
+    body = {'username': 'kjones', 'password': 'x', 'email': 'kj@example.com', 'first_name': 'Kathryn',
+            'last_name': 'Jones', 'phone': '5550102030', 'birth_date': '1990-05-01'}
+
+    assert client.post('/api/patients/register', json=body).status_code == 409
+    body.update(first_name='Peter', last_name='Novak', username='pnovak', email='pn@example.com')
+    assert client.post('/api/patients/register', json=body).status_code == 201
+    assert client.post('/api/patients/register', json=dict(body, birth_date='01/05/1990')).status_code == 400
+    session = Session()
+    assert session.query(Patient).count() == 2
+    session.close()
+
+def test_registration_matches_a_phone_written_differently(Session, client):
+    # First and last name swapped and no birth date: only the phone block can find P001 ('555-0102030')
+    body = {'username': 'cjones', 'password': 'x', 'email': 'c.jones@example.com', 'first_name': 'Jones',
+            'last_name': 'Catherine', 'phone': '+1 (555) 010-2030'}
+    assert client.post('/api/patients/register', json=body).status_code == 409
+    session = Session()
+    assert [m.b.id for m in find_matches(session, 'Jones', 'Catherine', '(555) 010 2030')] == ['P001']
+    assert session.query(Patient.phone_suffix).filter(Patient.id == 'P001').scalar() == '0102030'
+    session.close()
@@ -0,0 +1,80 @@
+import json
+from datetime import datetime, timedelta
+import pytest
+from flask_restful import fields
+from formats import COLUMNS, init_formats
+from models import Department, User
+from serializers import init_serializers
+import resources.doctors as doctor_resource
+from conftest import doctor
+
+# A Monday a week or more ahead, so the set-availability window covers it
+MONDAY = (datetime.now() + timedelta(days=7 - datetime.now().weekday())).replace(hour=0, minute=0, second=0,
+                                                                                microsecond=0)
+
+@pytest.fixture
+def Session(Session):
+    with Session() as session:
+        session.add(Department(id='DEPT1', name='Cardiology'))
+        for i in range(1, 6):
+            session.add(User(id=f"U{i:03}", username=f"doc{i}", password='x', email=f"doc{i}@example.com", role='Doctor'))
+            session.add(doctor(f"D{i:03}", user_id=f"U{i:03}", last_name=f"Smith{i}", department_id='DEPT1',
+                               phone='555-0100', availability={}))
+        session.commit()
+    return Session
+
+def formats(app, api):
+    init_serializers(app, api)
+    init_formats(api)
+
+@pytest.fixture
+def client(make_client):
+    return make_client({
+        '/api/doctors': doctor_resource.DoctorList,
+        '/api/doctors/<string:doctor_id>/set-availability': doctor_resource.DoctorSetAvailabilityAPI,
+        '/api/doctors/<string:doctor_id>/schedule': doctor_resource.DoctorViewScheduleAPI,
+    }, setup=formats)
+
+def test_doctor_list_expands_and_trims_fields(client, statements):
+    body = client.get('/api/doctors?limit=3&expand=department&fields=id,department').get_json()
+    assert body['items'] == [{'id': f"D{i:03}", 'department': 'Cardiology'} for i in range(1, 4)]
+    assert body['next_cursor']
+    # One query for the page and its departments; the unread nested user and availabilities are not loaded
+    assert len(statements) == 1
+
+def test_doctor_list_full_rows(client):
+    items = client.get('/api/doctors?limit=10').get_json()['items']
+    assert len(items) == 5
+    assert items[0]['user']['username'] == 'doc1' and items[0]['availabilities'] == []
+
+def test_set_availability_then_view_schedule(client):
+    response = client.post('/api/doctors/D001/set-availability', json={'availability': {'Monday': '9-12'}})
+    assert response.status_code == 200, response.get_json()
+    assert response.get_json()['slots']['added'] > 0
+
+    day = MONDAY.strftime('%Y-%m-%d')
+    next_day = (MONDAY + timedelta(days=1)).strftime('%Y-%m-%d')
+    rows = client.get(f"/api/doctors/D001/schedule?start_date={day}&end_date={next_day}").get_json()
+    # schedule_fields keeps flask_restful's default RFC 822 timestamps
+    assert [row['datetime'] for row in rows] == [fields.DateTime().format(MONDAY.replace(hour=h)) for h in (9, 10, 11)]
+
+    columns = client.get(f"/api/doctors/D001/schedule?start_date={day}&end_date={next_day}",
+                         headers={'Accept': COLUMNS})
+    assert columns.mimetype == COLUMNS
+    assert json.loads(columns.get_data())['id'] == [row['id'] for row in rows]
+
+def test_set_availability_rejects_bad_ranges_and_unknown_doctors(client):
+    assert client.post('/api/doctors/D001/set-availability', json={'availability': {'Monday': '17-9'}}).status_code == 400
+    assert client.post('/api/doctors/D999/set-availability', json={'availability': {}}).status_code == 404
+
+def test_app_starts_with_the_doctor_routes(tmp_path):
+    import app as app_module
+    from config import TestingConfig
+
+    class Config(TestingConfig):
+        SQLALCHEMY_DATABASE_URI = f"sqlite:///{tmp_path}/app.db"
+
+    flask_app = app_module.create_app(Config)
+    rules = {rule.rule for rule in flask_app.url_map.iter_rules()}
+    assert {'/api/doctors', '/api/doctors/<string:doctor_id>/appointments/sorted',
+            '/api/doctors/<string:doctor_id>/schedule'} <= rules
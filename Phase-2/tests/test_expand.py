@@ -0,0 +1,95 @@
+from datetime import date, datetime, timedelta
+import pytest
+from models import Appointment, Department, MedicalRecord, Patient, Schedule
+from auth import generate_token
+import resources.appointments as appointment_resource
+import resources.medical_records as medical_record_resource
+from conftest import doctor
+
+START = datetime(2030, 1, 7, 9)
+
+@pytest.fixture
+def rows():
+    return 6
+
+@pytest.fixture
+def Session(Session, rows):
+    with Session() as session:
+        for d in range(1, 4):
+            session.add(Department(id=f"DEPT{d}", name=f"Ward {d}"))
+            session.add(doctor(f"D{d:03}", last_name=f"Smith{d}", department_id=f"DEPT{d}"))
+        session.add(Patient(id='P001', first_name='Ann', last_name='Lee', email='ann@example.com'))
+        for i in range(rows):
+            doctor_id = f"D{i % 3 + 1:03}"
+            session.add(Schedule(id=f"SC{i:04}", doctor_id=doctor_id, datetime=START + timedelta(hours=i),
+                                 duration=30, is_available=False))
+            session.add(Appointment(id=f"A{i:04}", patient_id='P001', doctor_id=doctor_id, schedule_id=f"SC{i:04}",
+                                    status='Scheduled'))
+            session.add(MedicalRecord(id=f"M{i:04}", patient_id='P001', appointment_id=f"A{i:04}",
+                                      department_id=f"DEPT{i % 3 + 1}", diagnosis='ok', prescription='rest',
+                                      visit_date=date(2030, 1, 1) + timedelta(days=i)))
+        session.commit()
+    return Session
+
+@pytest.fixture
+def client(make_client):
+    return make_client({
+        '/api/appointments': appointment_resource.AppointmentListAPI,
+        '/api/appointments/search': appointment_resource.AppointmentSearchAPI,
+        '/api/medical-records': medical_record_resource.MedicalRecordListAPI,
+        '/api/medical-records/<string:record_id>': medical_record_resource.MedicalRecordAPI,
+        '/api/patients/<string:patient_id>/medical-records': medical_record_resource.PatientMedicalRecordsAPI,
+    })
+
+def get(client, url):
+    token = generate_token('U001', 'Admin')
+    response = client.get(url, headers={'Authorization': f"Bearer {token}"})
+    assert response.status_code == 200, response.get_data(as_text=True)
+    return response.get_json()
+
+@pytest.mark.parametrize('url, queries', [
+    ('/api/appointments?limit=100', 1),
+    ('/api/appointments?limit=100&expand=schedule,doctor', 1),
+    ('/api/appointments/search?patient_id=P001&limit=100&expand=doctor,schedule', 1),
+    ('/api/medical-records?limit=100&expand=department', 1),
+    ('/api/patients/P001/medical-records?expand=department', 2),
+])
+@pytest.mark.parametrize('rows', [6, 60])
+def test_query_count_does_not_grow_with_rows(client, statements, url, queries):
+    get(client, url)
+    assert len(statements) == queries
+
+def test_expanded_fields(client):
+    [first] = get(client, '/api/appointments?limit=1&expand=doctor,schedule')['items']
+    assert first['doctor_name'] == 'John Smith1'
+    assert (first['date'], first['start'], first['end']) == ('2030-01-07', '09:00:00', '09:30:00')
+    assert 'doctor_name' not in get(client, '/api/appointments?limit=1')['items'][0]
+    records = get(client, '/api/patients/P001/medical-records?expand=department')
+    assert {r['department'] for r in records} == {'Ward 1', 'Ward 2', 'Ward 3'}
+
+def test_unknown_expansion_is_rejected(client):
+    response = client.get('/api/medical-records?expand=department,doctor')
+    assert response.status_code == 400
+    assert 'doctor' in response.get_json()['message']
+    assert client.get('/api/patients/P001/medical-records?expand=nope').status_code == 400
+
+def test_sparse_fields_leave_unused_columns_unread(client, statements):
+    body = get(client, '/api/medical-records?limit=2&fields=id,visit_date')
+    assert body['items'] == [{'id': 'M0000', 'visit_date': '2030-01-01'}, {'id': 'M0001', 'visit_date': '2030-01-02'}]
+    [(statement, _)] = statements
+    assert 'diagnosis' not in statement and 'notes' not in statement
+    assert get(client, '/api/medical-records/M0002?fields=diagnosis') == {'diagnosis': 'ok'}
+
+def test_sparse_fields_combine_with_expand(client, statements):
+    records = get(client, '/api/patients/P001/medical-records?fields=id,department&expand=department')
+    assert records[-1] == {'id': 'M0000', 'department': 'Ward 1'}
+    assert len(statements) == 2
+    [first] = get(client, '/api/appointments?limit=1&fields=doctor_name&expand=doctor')['items']
+    assert first == {'doctor_name': 'John Smith1'}
+
+def test_unknown_fields_are_rejected(client):
+    response = client.get('/api/medical-records?fields=id,doctor_name')
+    assert response.status_code == 400
+    assert 'doctor_name' in response.get_json()['message']
+    assert client.get('/api/medical-records?fields=').status_code == 400
+    assert client.get('/api/medical-records/M0001?fields=nope').status_code == 400
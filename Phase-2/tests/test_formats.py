@@ -0,0 +1,100 @@
+import json
+import time
+from datetime import datetime, timedelta, timezone
+import pytest
+from flask import Flask
+from flask_restful import Api, Resource, fields
+from models import Doctor, Schedule
+import serializers
+from formats import COLUMNS, MSGPACK, REPRESENTATIONS, Epoch, init_formats, negotiated_marshal_with
+from serializers import init_serializers
+
+START = datetime(2030, 1, 7, 9)
+
+def epoch(naive):
+    # Slot times are naive local times
+    return int(time.mktime(naive.timetuple()))
+
+# The shape of the schedule views' field maps
+schedule_fields = {
+    'id': fields.String,
+    'doctor': fields.Nested({'id': fields.String, 'last_name': fields.String, 'joined': fields.DateTime}),
+    'datetime': fields.DateTime(dt_format='iso8601'),
+    'duration': fields.Integer,
+    'is_available': fields.Boolean,
+}
+
+@pytest.fixture
+def client():
+    app = Flask(__name__)
+    app.debug = False
+    api = Api(app)
+    init_serializers(app, api)
+    init_formats(api)
+    doctor = Doctor(id='D001', last_name='Smith')
+
+    class Slots(Resource):
+        representations = REPRESENTATIONS
+
+        @negotiated_marshal_with(schedule_fields)
+        def get(self):
+            return [Schedule(id=f"SC{i}", doctor=doctor, datetime=START + timedelta(minutes=30 * i), duration=30,
+                             is_available=bool(i % 2)) for i in range(3)]
+
+    class Doctors(Resource):
+        def get(self):
+            return [{'id': 'D001'}]
+
+    api.add_resource(Slots, '/slots')
+    api.add_resource(Doctors, '/doctors')
+    return app.test_client()
+
+@pytest.fixture
+def new_york(monkeypatch):
+    monkeypatch.setenv('TZ', 'America/New_York')
+    time.tzset()
+    yield
+    monkeypatch.undo()
+    time.tzset()
+
+def test_json_stays_the_default(client):
+    for accept in (None, '*/*', 'application/json', 'text/html'):
+        response = client.get('/slots', headers={'Accept': accept} if accept else {})
+        assert response.mimetype == 'application/json'
+        assert response.get_json()[1]['datetime'] == '2030-01-07T09:30:00'
+
+def test_msgpack_rows_with_epoch_seconds(client):
+    msgpack = pytest.importorskip('msgpack')
+    response = client.get('/slots', headers={'Accept': MSGPACK})
+    assert response.mimetype == MSGPACK
+    rows = msgpack.unpackb(response.get_data(), raw=False)
+    assert rows[1] == {'id': 'SC1', 'doctor': {'id': 'D001', 'last_name': 'Smith', 'joined': None},
+                       'datetime': epoch(START) + 1800, 'duration': 30, 'is_available': True}
+
+def test_columnar_json(client):
+    response = client.get('/slots', headers={'Accept': f"{COLUMNS}, application/json;q=0.5"})
+    assert response.mimetype == COLUMNS
+    body = json.loads(response.get_data())
+    assert list(body) == list(schedule_fields)
+    assert body['id'] == ['SC0', 'SC1', 'SC2']
+    assert body['datetime'] == [epoch(START) + 1800 * i for i in range(3)]
+
+def test_other_resources_only_speak_json(client):
+    assert client.get('/doctors', headers={'Accept': COLUMNS}).status_code == 406
+    assert client.get('/doctors', headers={'Accept': MSGPACK}).status_code == 406
+    response = client.get('/doctors', headers={'Accept': f"{COLUMNS}, application/json;q=0.5"})
+    assert response.mimetype == 'application/json'
+    assert response.get_json() == [{'id': 'D001'}]
+
+def test_epoch_reads_naive_times_as_local(client, new_york):
+    # 09:00 in New York in January is 14:00 UTC
+    expected = int(datetime(2030, 1, 7, 14, tzinfo=timezone.utc).timestamp())
+    body = json.loads(client.get('/slots', headers={'Accept': COLUMNS}).get_data())
+    assert body['datetime'][0] == expected
+    assert Epoch().format(datetime(2030, 1, 7, 14, tzinfo=timezone.utc)) == expected
+
+def test_epoch_is_compiled_inline(monkeypatch):
+    monkeypatch.setattr(Epoch, 'output', lambda *args: pytest.fail('called through output()'))
+    row = Schedule(id='SC1', datetime=datetime(1970, 1, 2, tzinfo=timezone.utc))
+    assert serializers.marshal(row, {'datetime': Epoch, 'none': Epoch(attribute='duration')}) == \
+        {'datetime': 86400, 'none': None}
@@ -0,0 +1,46 @@
+import threading
+import pytest
+from models import User, IdCounter
+from id_allocator import IdAllocator
+
+def test_ids_keep_prefix_and_width(engine):
+    allocator = IdAllocator('users', 'U', 3, User.id, block_size=5, bind=engine)
+    assert [allocator.next_id() for _ in range(3)] == ['U001', 'U002', 'U003']
+
+def test_counter_is_seeded_from_existing_rows(engine):
+    with engine.begin() as conn:
+        conn.execute(User.__table__.insert(), [
+            {'id': 'U999', 'username': 'a', 'password': 'x', 'email': 'a@example.com', 'role': 'Admin'},
+            {'id': 'U1000', 'username': 'b', 'password': 'x', 'email': 'b@example.com', 'role': 'Admin'},
+        ])
+    allocator = IdAllocator('users', 'U', 3, User.id, block_size=5, bind=engine)
+    assert allocator.next_id() == 'U1001'
+
+def test_blocks_are_reserved_not_per_id(engine):
+    allocator = IdAllocator('users', 'U', 3, User.id, block_size=10, bind=engine)
+    for _ in range(10):
+        allocator.next_id()
+    with engine.connect() as conn:
+        assert conn.execute(IdCounter.__table__.select()).one().next_value == 11
+    allocator.next_id()
+    with engine.connect() as conn:
+        assert conn.execute(IdCounter.__table__.select()).one().next_value == 21
+
+def test_workers_never_hand_out_the_same_id(engine):
+    # Separate allocators stand in for separate worker processes
+    workers = [IdAllocator('users', 'U', 3, User.id, block_size=7, bind=engine) for _ in range(8)]
+    issued = []
+    lock = threading.Lock()
+
+    def run(allocator):
+        ids = [allocator.next_id() for _ in range(50)]
+        with lock:
+            issued.extend(ids)
+
+    threads = [threading.Thread(target=run, args=(w,)) for w in workers]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+
+    assert len(issued) == len(set(issued)) == 400
@@ -0,0 +1,59 @@
+import pytest
+from flask import Flask
+from models import User
+import auth
+from auth import generate_token, get_current_user, doctor_required, invalidate_user, load_user, token_cache
+
+@pytest.fixture
+def Session(Session, monkeypatch):
+    with Session() as session:
+        session.add(User(id='U001', username='drsmith', password='x', email='s@example.com', role='Doctor'))
+        session.commit()
+    monkeypatch.setattr(auth, 'SessionLocal', Session)
+    invalidate_user()
+    token_cache.clear()
+    yield Session
+    invalidate_user()
+
+def test_identity_comes_from_token_claims(statements):
+    app = Flask(__name__)
+
+    @app.route('/schedule')
+    @doctor_required
+    def schedule():
+        first, second = get_current_user(), get_current_user()
+        assert first is second
+        return {'id': first.id, 'role': first.role, 'doctor_id': first.doctor_id}
+
+    token = generate_token('U001', 'Doctor', doctor_id='D001')
+    response = app.test_client().get('/schedule', headers={'Authorization': f"Bearer {token}"})
+
+    assert response.get_json() == {'id': 'U001', 'role': 'Doctor', 'doctor_id': 'D001'}
+    assert statements == []
+
+def test_doctor_required_rejects_patients():
+    app = Flask(__name__)
+    app.add_url_rule('/schedule', 'schedule', doctor_required(lambda: 'ok'))
+    token = generate_token('U002', 'Patient', patient_id='P001')
+    assert app.test_client().get('/schedule', headers={'Authorization': f"Bearer {token}"}).status_code == 403
+
+def test_get_current_user_without_token_is_none():
+    app = Flask(__name__)
+    with app.test_request_context('/'):
+        assert get_current_user() is None
+
+def test_user_cache_hits_until_invalidated(statements):
+    assert load_user('U001').username == 'drsmith'
+    assert load_user('U001').username == 'drsmith'
+    assert len(statements) == 1
+
+    invalidate_user('U001')
+    load_user('U001')
+    assert len(statements) == 2
+
+def test_user_cache_expires(statements, monkeypatch):
+    load_user('U001')
+    later = auth.time.monotonic() + auth.USER_CACHE_TTL + 1
+    monkeypatch.setattr(auth.time, 'monotonic', lambda: later)
+    load_user('U001')
+    assert len(statements) == 2
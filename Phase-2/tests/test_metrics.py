@@ -0,0 +1,55 @@
+import pytest
+from prometheus_client import REGISTRY
+from sqlalchemy import text
+from db_session import get_session
+from metrics import init_metrics
+from rate_limit import init_rate_limiting
+
+def item(item_id):
+    session = get_session()
+    session.execute(text('SELECT 1'))
+    session.execute(text('SELECT 2'))
+    return {'id': item_id}
+
+@pytest.fixture
+def client(engine, make_client):
+    def setup(app, api):
+        app.config['RATE_LIMITS'] = {'/limited': 1}
+        init_metrics(app, engine)
+        init_rate_limiting(app)
+        app.add_url_rule('/items/<item_id>', 'item', item)
+        app.add_url_rule('/limited', 'limited', lambda: 'ok')
+    return make_client({}, setup)
+
+def sample(name, **labels):
+    return REGISTRY.get_sample_value(name, labels) or 0
+
+def test_requests_are_timed_per_route_with_their_queries(client):
+    route = {'route': '/items/<item_id>'}
+    before = (sample('http_request_duration_seconds_count', method='GET', status='200', **route),
+              sample('db_queries_per_request_sum', **route))
+    for i in range(3):
+        assert client.get(f"/items/{i}").status_code == 200
+    assert sample('http_request_duration_seconds_count', method='GET', status='200', **route) - before[0] == 3
+    assert sample('db_queries_per_request_sum', **route) - before[1] == 6
+    assert sample('db_query_seconds_total', **route) > 0
+    assert sample('http_requests_in_flight', method='GET', **route) == 0
+
+def test_unknown_urls_share_one_label(client):
+    before = sample('http_request_duration_seconds_count', method='GET', route='<unmatched>', status='404')
+    client.get('/no/such/page')
+    client.get('/another/missing/page')
+    assert sample('http_request_duration_seconds_count', method='GET', route='<unmatched>', status='404') - before == 2
+
+def test_rate_limit_rejections_are_counted(client):
+    before = sample('rate_limit_rejections_total', route='/limited')
+    assert [client.get('/limited').status_code for _ in range(3)] == [200, 429, 429]
+    assert sample('rate_limit_rejections_total', route='/limited') - before == 2
+
+def test_metrics_endpoint_serves_the_text_format(client):
+    client.get('/items/1')
+    response = client.get('/metrics')
+    assert response.status_code == 200
+    assert response.content_type.startswith('text/plain')
+    assert b'http_request_duration_seconds_bucket{' in response.data
+    assert b'appointment_bookings_total' in response.data
@@ -0,0 +1,73 @@
+from datetime import datetime, timedelta
+import pytest
+from models import Department, Schedule
+from error_handlers import ValidationError
+from pagination import paginate, encode_cursor, decode_cursor, MAX_PAGE_SIZE
+import resources.departments as departments
+from conftest import doctor
+
+@pytest.fixture
+def Session(Session):
+    with Session() as session:
+        session.add_all([doctor('D001'), doctor('D002')])
+        start = datetime(2030, 1, 1, 9)
+        # Two doctors share each datetime so the id has to break the tie
+        session.add_all(Schedule(id=f"SC{i:04}", doctor_id=f"D00{i % 2 + 1}", datetime=start + timedelta(hours=i // 2),
+                                 duration=60, is_available=True) for i in range(25))
+        session.add_all(Department(id=f"DEPT{i:03}", name=f"Dept {i}") for i in range(7))
+        session.commit()
+    return Session
+
+def walk(session, query, columns, limit, **kwargs):
+    seen, cursor, pages = [], None, 0
+    while True:
+        rows, cursor = paginate(query, columns, cursor, limit, **kwargs)
+        seen.extend(row.id for row in rows)
+        pages += 1
+        if cursor is None:
+            return seen, pages
+
+def test_pages_cover_every_row_once_in_order(Session):
+    session = Session()
+    query = session.query(Schedule)
+    seen, pages = walk(session, query, [Schedule.datetime, Schedule.id], 4)
+    expected = [s.id for s in query.order_by(Schedule.datetime, Schedule.id)]
+    assert seen == expected
+    assert pages == 7
+
+def test_descending_order(Session):
+    session = Session()
+    seen, _ = walk(session, session.query(Schedule), [Schedule.datetime, Schedule.id], 10, descending=True)
+    assert seen == [f"SC{i:04}" for i in reversed(range(25))]
+
+def test_pages_never_skip_rows_with_offset(Session, statements):
+    session = Session()
+    walk(session, session.query(Schedule), [Schedule.datetime, Schedule.id], 10)
+    # SQLite always renders "LIMIT ? OFFSET ?"; the offset must stay 0
+    assert [parameters[-1] for _, parameters in statements] == [0, 0, 0]
+
+def test_page_size_is_capped(Session):
+    session = Session()
+    rows, _ = paginate(session.query(Schedule), [Schedule.id], limit=MAX_PAGE_SIZE * 10)
+    assert len(rows) == 25
+    with pytest.raises(ValidationError):
+        paginate(session.query(Schedule), [Schedule.id], limit=0)
+
+def test_cursor_round_trips_datetimes():
+    cursor = encode_cursor([datetime(2030, 1, 1, 9), 'SC0001'])
+    assert decode_cursor(cursor, [Schedule.datetime, Schedule.id]) == [datetime(2030, 1, 1, 9), 'SC0001']
+
+@pytest.mark.parametrize('cursor', ['garbage!', encode_cursor(['only-one']), encode_cursor(['x', 'y'])])
+def test_bad_cursor_is_rejected(cursor):
+    with pytest.raises(ValidationError):
+        decode_cursor(cursor, [Schedule.datetime, Schedule.id])
+
+def test_list_endpoint_returns_next_cursor(make_client):
+    client = make_client({'/api/departments': departments.DepartmentListAPI})
+
+    first = client.get('/api/departments?limit=5').get_json()
+    second = client.get(f"/api/departments?limit=5&cursor={first['next_cursor']}").get_json()
+
+    assert [d['id'] for d in first['items'] + second['items']] == [f"DEPT{i:03}" for i in range(7)]
+    assert second['next_cursor'] is None
+    assert client.get('/api/departments?cursor=nope').status_code == 400
@@ -0,0 +1,106 @@
+import pytest
+from sqlalchemy import insert, text
+from models import Patient
+from auth import generate_token
+import phonetic
+import search
+import resources.search as search_resource
+from phonetic import soundex, metaphone, similarity, name_keys
+
+@pytest.mark.parametrize('name, code', [
+    ('Robert', 'R163'), ('Rupert', 'R163'), ('Ashcraft', 'A261'), ('Tymczak', 'T522'),
+    ('Pfister', 'P236'), ('Lee', 'L000'), ("O'Brien", 'O165'), ('', ''),
+])
+def test_soundex(name, code):
+    assert soundex(name) == code
+
+@pytest.mark.parametrize('a, b', [
+    ('Catherine', 'Kathryn'), ('Christina', 'Kristina'), ('Philip', 'Filip'),
+    ('Smith', 'Smyth'), ('Knight', 'Night'), ('Stephen', 'Steven'),
+])
+def test_metaphone_folds_spelling_variants(a, b):
+    assert metaphone(a) == metaphone(b)
+
+def test_similarity_is_trigram_overlap():
+    assert similarity('john smith', 'Smith John') == 1.0
+    assert similarity('jon smith', 'john smith') > similarity('jon smith', 'jane smart') > 0
+    assert similarity('', 'smith') == 0.0
+
+@pytest.fixture
+def Session(Session):
+    with Session() as session:
+        for i, (first, last) in enumerate([('John', 'Smith'), ('Jon', 'Smyth'), ('Jane', 'Smart'),
+                                           ('Catherine', 'Jones'), ('Kathryn', 'Johns'), ('Peter', 'Novak')]):
+            session.add(Patient(id=f"P{i + 1:03d}", first_name=first, last_name=last, email=f"p{i}@example.com"))
+        session.commit()
+    return Session
+
+def test_keys_are_kept_up_to_date(Session):
+    session = Session()
+    patient = session.get(Patient, 'P006')
+    assert (patient.last_name_soundex, patient.last_name_metaphone) == ('N120', 'NFK')
+    patient.last_name = 'Nowak'
+    session.commit()
+    assert session.get(Patient, 'P006').last_name_soundex == 'N200'
+    session.close()
+
+def test_fuzzy_search_ranks_by_similarity(Session):
+    session = Session()
+    matches = search.fuzzy_patient_matches(session, 'Jon Smith')
+    assert [patient_id for patient_id, _ in matches] == ['P001', 'P002']
+    assert matches[0][1] > matches[1][1]
+    # Typed surname first, and a first name spelt differently
+    assert search.fuzzy_patient_matches(session, 'jones katherine')[0][0] == 'P004'
+    assert search.fuzzy_patient_matches(session, '123') == []
+    session.close()
+
+def test_single_word_matches_either_name(Session):
+    assert [p.id for p in search.search_patients('Smyth', fuzzy=True)] == ['P002', 'P001']
+    assert [p.id for p in search.search_patients('Kathrine', fuzzy=True)] == ['P005', 'P004']
+
+def test_candidates_come_from_the_key_indexes(Session):
+    session = Session()
+    condition = search._fuzzy_candidates(['jon', 'smith'])
+    sql = str(session.query(Patient.id).filter(condition).statement.compile(compile_kwargs={'literal_binds': True}))
+    plan = ' '.join(row[-1] for row in session.execute(text(f"EXPLAIN QUERY PLAN {sql}")))
+    assert 'ix_patients_name_soundex' in plan and 'ix_patients_name_metaphone' in plan
+    assert 'SCAN' not in plan.replace('SCAN CONSTANT ROW', '')
+    session.close()
+
+def test_backfill_fills_rows_written_without_keys(Session):
+    session = Session()
+    session.execute(insert(Patient), [{'id': 'P100', 'first_name': 'Anna', 'last_name': 'Lee', 'email': 'al@example.com'}])
+    session.commit()
+    assert phonetic.backfill(session) == 1
+    row = session.get(Patient, 'P100')
+    assert {k: getattr(row, k) for k in name_keys('Anna', 'Lee')} == name_keys('Anna', 'Lee')
+    session.close()
+
+def test_backfill_passes_names_without_latin_letters(Session):
+    session = Session()
+    session.execute(insert(Patient), [
+        {'id': 'P100', 'first_name': '李', 'last_name': 'Lee', 'email': 'li@example.com'},
+        {'id': 'P101', 'first_name': '42', 'last_name': 'Ray', 'email': 'n@example.com'},
+        {'id': 'P102', 'first_name': 'Anna', 'last_name': 'Lee', 'email': 'al@example.com'},
+    ])
+    session.commit()
+    assert phonetic.backfill(session, batch_size=1) == 1
+    assert session.get(Patient, 'P100').first_name_soundex is None
+    assert session.get(Patient, 'P100').last_name_soundex == name_keys('', 'Lee')['last_name_soundex']
+    assert session.get(Patient, 'P102').first_name_soundex == name_keys('Anna', '')['first_name_soundex']
+    session.close()
+
+def test_endpoint_returns_scores_for_staff(make_client):
+    client = make_client({'/api/search/patients': search_resource.PatientSearchAPI})
+
+    def get(query, role):
+        token = generate_token('U001', role)
+        return client.get(f"/api/search/patients?{query}", headers={'Authorization': f"Bearer {token}"})
+
+    response = get('q=Jon+Smith&mode=fuzzy', 'Doctor')
+    assert response.status_code == 200
+    items = response.get_json()['items']
+    assert [item['id'] for item in items] == ['P001', 'P002']
+    assert items[0]['score'] > items[1]['score']
+    assert [item['id'] for item in get('q=novak', 'Admin').get_json()['items']] == ['P006']
+    assert get('q=novak', 'Patient').status_code == 403
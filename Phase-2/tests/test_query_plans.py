@@ -0,0 +1,212 @@
+"""
+Query-plan regression checks: every query an endpoint issues must be answered
+from an index on SQLite. Statements are captured as the endpoint runs, then
+each SELECT is run through EXPLAIN QUERY PLAN. A ``SCAN <table>`` fails the
+test, and so does walking a whole index unless the query is a LIMITed page.
+"""
+import re
+from datetime import date, datetime, timedelta
+import pytest
+from sqlalchemy import inspect, text
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.schema import CreateTable
+from db import Base
+from models import (Appointment, Department, Doctor, DoctorAvailability, MedicalRecord, Patient,
+                    Schedule, User)
+from auth import generate_token
+import dedupe
+import migrate
+import virtual_slots
+import resources.appointments as appointment_resource
+import resources.departments as department_resource
+import resources.medical_records as medical_record_resource
+import resources.patients as patient_resource
+import resources.search as search_resource
+import resources.users as user_resource
+from conftest import doctor
+
+START = datetime(2030, 1, 7, 9)
+SCAN = re.compile(r'^SCAN (\w+)( USING .*)?$')
+
+def seed(session):
+    session.add(Department(id='DEPT001', name='Cardiology'))
+    for i in range(1, 4):
+        session.add(User(id=f"U00{i}", username=f"user{i}", password='x', email=f"u{i}@example.com", role='Patient'))
+        session.add(doctor(f"D00{i}", last_name=f"Smith{i}", department_id='DEPT001',
+                           availability={'Monday': '9-12'}))
+        session.add(Patient(id=f"P00{i}", user_id=f"U00{i}", first_name='Ann', last_name=f"Lee{i}",
+                            email=f"p{i}@example.com", birth_date=date(1990, 1, i), phone=f"555-000000{i}"))
+        session.add(DoctorAvailability(id=i, doctor_id=f"D00{i}", day_of_week=1,
+                                       start_time=START, end_time=START + timedelta(hours=3)))
+    session.get(User, 'U001').set_password('secret')
+    for i in range(30):
+        doctor_id, patient_id = f"D00{i % 3 + 1}", f"P00{i % 3 + 1}"
+        session.add(Schedule(id=f"SC{i:04}", doctor_id=doctor_id, datetime=START + timedelta(hours=i),
+                             duration=30, is_available=i % 2 == 0))
+        if i % 2:
+            session.add(Appointment(id=f"A{i:03}", patient_id=patient_id, doctor_id=doctor_id,
+                                    schedule_id=f"SC{i:04}", status='Scheduled'))
+            session.add(MedicalRecord(id=f"M{i:03}", patient_id=patient_id, appointment_id=f"A{i:03}",
+                                      department_id='DEPT001', diagnosis='ok', prescription='rest',
+                                      visit_date=(START + timedelta(hours=i)).date()))
+    session.commit()
+
+@pytest.fixture
+def Session(Session):
+    with Session() as session:
+        seed(session)
+    return Session
+
+def full_scans(engine, statements):
+    """Tables read in full by any captured SELECT, with the statement that did it"""
+    found = []
+    raw = engine.raw_connection()
+    try:
+        for statement, params in statements:
+            if not statement.lstrip().upper().startswith('SELECT'):
+                continue
+            for row in raw.execute(f"EXPLAIN QUERY PLAN {statement}", params):
+                match = SCAN.match(row[-1])
+                if not match or match.group(1) == 'CONSTANT':
+                    continue
+                # Reading an index in order is how a keyset page is found; without a LIMIT it reads every row
+                if match.group(2) and ' LIMIT ' in statement:
+                    continue
+                found.append((match.group(1), statement))
+    finally:
+        raw.close()
+    return found
+
+@pytest.fixture
+def client(make_client):
+    return make_client({
+        '/api/users': user_resource.UserList,
+        '/api/auth/login': user_resource.UserLoginAPI,
+        '/api/patients/<string:patient_id>/appointments': patient_resource.PatientAppointmentsAPI,
+        '/api/patients/<string:patient_id>/appointments/sorted': patient_resource.PatientAppointmentsSortedAPI,
+        '/api/appointments': appointment_resource.AppointmentListAPI,
+        '/api/appointments/search': appointment_resource.AppointmentSearchAPI,
+        '/api/appointments/<string:appointment_id>': appointment_resource.AppointmentAPI,
+        '/api/medical-records': medical_record_resource.MedicalRecordListAPI,
+        '/api/medical-records/export': medical_record_resource.MedicalRecordExportAPI,
+        '/api/patients/<string:patient_id>/medical-records': medical_record_resource.PatientMedicalRecordsAPI,
+        '/api/departments': department_resource.DepartmentListAPI,
+        '/api/search/patients': search_resource.PatientSearchAPI,
+    })
+
+@pytest.mark.parametrize('url', [
+    '/api/users?limit=2',
+    '/api/patients/P001/appointments',
+    '/api/patients/P001/appointments/sorted?limit=5',
+    '/api/appointments?limit=5',
+    '/api/appointments/A001',
+    '/api/appointments/search?doctor_id=D001&start_date=2030-01-07&end_date=2030-01-08',
+    '/api/appointments/search?patient_id=P002&status=Scheduled',
+    '/api/appointments/search?start_date=2030-01-08',
+    '/api/medical-records?limit=5',
+    '/api/patients/P001/medical-records',
+    '/api/medical-records/export?patient_id=P001&start_date=2030-01-07',
+    '/api/medical-records/export?department_id=DEPT001',
+    '/api/departments',
+    '/api/search/patients?q=Ann+Lee2&mode=fuzzy',
+])
+def test_endpoint_reads_no_table_in_full(engine, client, statements, url):
+    token = generate_token('U001', 'Admin')
+    response = client.get(url, headers={'Authorization': f"Bearer {token}"})
+    assert response.status_code == 200, response.get_data(as_text=True)
+    response.get_data()  # drain streamed responses
+    assert statements
+    assert full_scans(engine, statements) == []
+
+def test_login_reads_no_table_in_full(engine, client, statements):
+    response = client.post('/api/auth/login', json={'username': 'user1', 'password': 'secret'})
+    assert response.status_code == 200
+    assert full_scans(engine, statements) == []
+
+# Queries of resources that are exercised directly rather than over HTTP
+
+def doctor_open_slots(session):
+    doctor = session.get(Doctor, 'D001')
+    virtual_slots.open_slots(session, doctor, START, START + timedelta(days=7))
+
+def available_schedules(session):
+    session.query(Schedule).filter(
+        Schedule.doctor_id == 'D001',
+        Schedule.datetime >= START,
+        Schedule.datetime < START + timedelta(days=7),
+        Schedule.is_available == True
+    ).order_by(Schedule.datetime).all()
+
+def doctor_appointments(session):
+    session.get(Doctor, 'D002').appointments
+
+def department_doctors(session):
+    session.query(Doctor).filter(Doctor.department_id == 'DEPT001').all()
+
+def registration_duplicate_check(session):
+    dedupe.find_matches(session, 'Ann', 'Lee1', '555-0000001', date(1990, 1, 1), 'p1@example.com')
+
+@pytest.mark.parametrize('run', [doctor_open_slots, available_schedules, doctor_appointments,
+                                 department_doctors, registration_duplicate_check])
+def test_query_reads_no_table_in_full(engine, Session, statements, run):
+    session = Session()
+    run(session)
+    session.close()
+    assert statements
+    assert full_scans(engine, statements) == []
+
+def test_migration_adds_what_an_old_database_lacks(engine):
+    with engine.begin() as conn:
+        # Roll back to a schema without the phonetic columns and secondary indexes
+        for table in Base.metadata.sorted_tables:
+            for index in table.indexes:
+                conn.execute(text(f"DROP INDEX {index.name}"))
+        for column in ('first_name_soundex', 'last_name_soundex', 'first_name_metaphone', 'last_name_metaphone',
+                       'phone_suffix'):
+            conn.execute(text(f"ALTER TABLE patients DROP COLUMN {column}"))
+        conn.execute(text("INSERT INTO patients (id, first_name, last_name, email, phone) "
+                          "VALUES ('P001', 'Catherine', 'Jones', 'cj@example.com', '+1 (555) 010-2030')"))
+
+    applied = migrate.upgrade(engine)
+    assert 'add column patients.last_name_soundex' in applied
+    assert 'create index ix_medical_records_patient_visit on medical_records' in applied
+    assert applied[-2:] == ['fill phonetic keys for 1 patients', 'fill phone suffixes for 1 patients']
+    indexes = {i['name'] for i in inspect(engine).get_indexes('schedules')}
+    assert {'ix_schedules_datetime', 'ix_schedules_doctor_available'} <= indexes
+    with engine.connect() as conn:
+        assert conn.execute(text("SELECT last_name_metaphone FROM patients")).scalar() == 'JNS'
+        assert conn.execute(text("SELECT phone_suffix FROM patients")).scalar() == '0102030'
+    assert migrate.upgrade(engine) == []
+
+def old_schedules_table(engine):
+    """A database whose schedules table predates uq_schedules_doctor_datetime"""
+    ddl = str(CreateTable(Schedule.__table__).compile(engine))
+    ddl = re.sub(r',\s*CONSTRAINT uq_schedules_doctor_datetime UNIQUE \([^)]*\)', '', ddl)
+    with engine.begin() as conn:
+        conn.execute(text("DROP TABLE schedules"))
+        conn.execute(text(ddl))
+        for index in Schedule.__table__.indexes:
+            index.create(conn)
+        conn.execute(text("INSERT INTO schedules (id, doctor_id, datetime, duration, is_available) "
+                          "VALUES ('SC1', 'D001', '2030-01-07 09:00:00.000000', 60, 1)"))
+
+def test_migration_adds_missing_unique_constraints(engine):
+    old_schedules_table(engine)
+
+    assert migrate.upgrade(engine) == ['add unique constraint uq_schedules_doctor_datetime on schedules']
+    # Virtual booking relies on this to stop two bookers writing the same slot
+    with pytest.raises(IntegrityError), engine.begin() as conn:
+        conn.execute(text("INSERT INTO schedules (id, doctor_id, datetime, duration, is_available) "
+                          "VALUES ('SC2', 'D001', '2030-01-07 09:00:00.000000', 60, 1)"))
+    assert migrate.upgrade(engine) == []
+
+def test_migration_refuses_to_add_a_constraint_duplicates_break(engine):
+    old_schedules_table(engine)
+    with engine.begin() as conn:
+        conn.execute(text("INSERT INTO schedules (id, doctor_id, datetime, duration, is_available) "
+                          "VALUES ('SC2', 'D001', '2030-01-07 09:00:00.000000', 60, 1)"))
+
+    with pytest.raises(RuntimeError, match='uq_schedules_doctor_datetime'):
+        migrate.upgrade(engine)
+    with engine.connect() as conn:
+        assert [d for d, _ in migrate.pending(conn)] == ['add unique constraint uq_schedules_doctor_datetime on schedules']
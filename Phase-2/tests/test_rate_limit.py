@@ -0,0 +1,179 @@
+import multiprocessing
+import pytest
+from flask import Flask
+import rate_limit
+from auth import generate_token
+from rate_limit import (RateLimiter, SharedMemoryRateLimiter, RedisRateLimiter, create_limiter,
+                        init_rate_limiting, SLIDING_WINDOW, TOKEN_BUCKET)
+
+@pytest.fixture
+def clock(monkeypatch):
+    now = [1000.0 * 60]
+    monkeypatch.setattr(rate_limit.time, 'time', lambda: now[0])
+    return now
+
+@pytest.mark.parametrize('algorithm', [SLIDING_WINDOW, TOKEN_BUCKET])
+def test_limit_is_enforced_per_key(clock, algorithm):
+    limiter = RateLimiter(requests_per_minute=3, algorithm=algorithm)
+    assert [limiter.is_allowed('a') for _ in range(4)] == [True, True, True, False]
+    assert limiter.is_allowed('b')
+
+def test_sliding_window_weights_previous_window(clock):
+    limiter = RateLimiter(requests_per_minute=10)
+    for _ in range(10):
+        assert limiter.is_allowed('a')
+    # Half way into the next window half of the previous 10 still count
+    clock[0] += 90
+    assert sum(limiter.is_allowed('a') for _ in range(10)) == 5
+
+def test_token_bucket_refills_over_time(clock):
+    limiter = RateLimiter(requests_per_minute=60, algorithm=TOKEN_BUCKET)
+    for _ in range(60):
+        limiter.is_allowed('a')
+    assert not limiter.is_allowed('a')
+    clock[0] += 2
+    assert limiter.is_allowed('a')
+    assert limiter.is_allowed('a')
+    assert not limiter.is_allowed('a')
+
+@pytest.mark.parametrize('algorithm', [SLIDING_WINDOW, TOKEN_BUCKET])
+def test_idle_keys_are_evicted(clock, algorithm):
+    limiter = RateLimiter(requests_per_minute=5, algorithm=algorithm)
+    for i in range(1000):
+        limiter.is_allowed(f"client-{i}")
+    assert len(limiter) == 1000
+
+    clock[0] += 121
+    assert limiter.evict_idle() == 1000
+    assert len(limiter) == 0
+
+def test_checks_sweep_their_stripe_periodically(clock):
+    limiter = RateLimiter(requests_per_minute=5, stripes=1)
+    for i in range(1000):
+        limiter.is_allowed(f"client-{i}")
+
+    clock[0] += 121
+    limiter.is_allowed('fresh')
+    assert len(limiter) == 1
+
+def test_unknown_algorithm_is_rejected():
+    with pytest.raises(ValueError):
+        RateLimiter(algorithm='leaky')
+
+def test_per_call_limit_overrides_default(clock):
+    limiter = RateLimiter(requests_per_minute=100)
+    assert [limiter.is_allowed('login', 2) for _ in range(3)] == [True, True, False]
+
+def test_shared_memory_limit_holds_across_processes(tmp_path):
+    path = str(tmp_path / 'ratelimit')
+
+    def worker(queue):
+        limiter = SharedMemoryRateLimiter(path, requests_per_minute=50)
+        queue.put(sum(limiter.is_allowed('client') for _ in range(40)))
+
+    ctx = multiprocessing.get_context('fork')
+    queue = ctx.Queue()
+    procs = [ctx.Process(target=worker, args=(queue,)) for _ in range(4)]
+    for p in procs:
+        p.start()
+    for p in procs:
+        p.join()
+
+    # Four workers, one budget; a window boundary in between can only lower the total
+    assert sum(queue.get() for _ in procs) <= 50
+
+def test_shared_memory_table_stays_bounded(tmp_path, clock):
+    limiter = SharedMemoryRateLimiter(str(tmp_path / 'ratelimit'), requests_per_minute=1, slots=64, stripes=4)
+    for i in range(10000):
+        limiter.is_allowed(f"client-{i}")
+    assert (tmp_path / 'ratelimit').stat().st_size == 64 * SharedMemoryRateLimiter.SLOT.size
+    assert limiter.is_allowed('late-comer')
+
+def test_shared_memory_finds_a_key_past_an_idle_slot(tmp_path, clock):
+    limiter = SharedMemoryRateLimiter(str(tmp_path / 'ratelimit'), requests_per_minute=3, slots=16, stripes=1)
+    # Two keys with the same home slot: 'b' is stored one probe after 'a'
+    home = lambda key: (limiter.digest(key) >> 32) % limiter.stripe_slots
+    a = 'client-0'
+    b = next(f"client-{i}" for i in range(1, 10000) if home(f"client-{i}") == home(a))
+    assert limiter.is_allowed(a)
+    clock[0] += 90  # halfway through the next window: 'a' is still recent
+    assert [limiter.is_allowed(b) for _ in range(3)] == [True, True, True]
+    clock[0] += 30  # start of the window after: 'a' has gone idle, 'b' used its budget a moment ago
+    assert [limiter.is_allowed(b) for _ in range(2)] == [False, False]
+
+class FakeRedis:
+    """Just enough of redis-py for RedisRateLimiter"""
+
+    def __init__(self):
+        self.data = {}
+
+    def pipeline(self):
+        return FakePipeline(self)
+
+    def incr(self, key):
+        self.data[key] = self.data.get(key, 0) + 1
+        return self.data[key]
+
+    def decr(self, key):
+        self.data[key] = self.data.get(key, 0) - 1
+        return self.data[key]
+
+    def expire(self, key, seconds):
+        return True
+
+    def get(self, key):
+        value = self.data.get(key)
+        return None if value is None else str(value).encode()
+
+class FakePipeline:
+    def __init__(self, client):
+        self.client = client
+        self.calls = []
+
+    def __getattr__(self, name):
+        return lambda *args: self.calls.append((name, args))
+
+    def execute(self):
+        return [getattr(self.client, name)(*args) for name, args in self.calls]
+
+def test_redis_backend_shares_one_budget(clock):
+    server = FakeRedis()
+    hosts = [RedisRateLimiter(server, requests_per_minute=3) for _ in range(2)]
+    results = [hosts[i % 2].is_allowed('client') for i in range(5)]
+    assert results == [True, True, True, False, False]
+
+def test_redis_backend_fails_open(clock):
+    class Down:
+        def pipeline(self):
+            raise ConnectionError('down')
+    assert RedisRateLimiter(Down(), requests_per_minute=1).is_allowed('client')
+
+def test_create_limiter_picks_backend(tmp_path):
+    assert isinstance(create_limiter('memory://'), RateLimiter)
+    assert isinstance(create_limiter(f"shm://{tmp_path}/rl"), SharedMemoryRateLimiter)
+    with pytest.raises(ValueError):
+        create_limiter('carrier-pigeon://')
+
+def test_route_limits_are_applied_per_route():
+    app = Flask(__name__)
+    app.config['RATE_LIMITS'] = {'/login': 2}
+    init_rate_limiting(app)
+    app.add_url_rule('/login', 'login', lambda: 'ok', methods=['POST'])
+    app.add_url_rule('/other', 'other', lambda: 'ok')
+    client = app.test_client()
+
+    assert [client.post('/login').status_code for _ in range(3)] == [200, 200, 429]
+    assert client.get('/other').status_code == 200
+
+def test_route_limits_ignore_unverified_authorization_headers():
+    app = Flask(__name__)
+    app.config['RATE_LIMITS'] = {'/login': 5}
+    init_rate_limiting(app)
+    app.add_url_rule('/login', 'login', lambda: 'ok', methods=['POST'])
+    client = app.test_client()
+
+    statuses = [client.post('/login', headers={'Authorization': f"junk{i}"}).status_code for i in range(7)]
+    assert statuses == [200] * 5 + [429] * 2
+    # A verified token is its user's budget, wherever it is sent from
+    token = generate_token('U001', 'Patient')
+    assert client.post('/login', headers={'Authorization': f"Bearer {token}"}).status_code == 200
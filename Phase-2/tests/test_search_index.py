@@ -0,0 +1,88 @@
+import pytest
+from models import Patient, User
+import search
+import search_index
+from search_index import InvertedIndex, patient_index
+from conftest import doctor
+
+def build(*people):
+    index = InvertedIndex()
+    for doc_id, name, email, phone in people:
+        index.add(doc_id, {'name': name, 'email': email, 'phone': phone})
+    return index
+
+def test_prefix_and_exact_matches_are_ranked():
+    index = build(('P1', 'Jon Snow', 'jon@example.com', None),
+                  ('P2', 'Jonathan Park', 'jp@example.com', None),
+                  ('P3', 'Mary Jones', 'mj@example.com', None))
+    assert index.search('jon') == ['P1', 'P2', 'P3']
+    assert index.search('jona') == ['P2']
+
+def test_every_query_term_must_match():
+    index = build(('P1', 'Mary Smith', None, None), ('P2', 'Mary Jones', None, None))
+    assert index.search('mary jo') == ['P2']
+    assert index.search('mary nobody') == []
+
+def test_phone_matches_regardless_of_punctuation():
+    index = build(('P1', 'Ann Lee', None, '(555) 123-4567'))
+    assert index.search('5551234567') == ['P1']
+    assert index.search('555123') == ['P1']
+
+def test_email_domain_is_not_indexed():
+    index = build(('P1', 'Ann Lee', 'ann.lee@hospital.org', None))
+    assert index.search('ann.lee') == ['P1']
+    assert index.search('hospital') == []
+
+def test_update_and_remove_keep_postings_in_sync():
+    index = build(('P1', 'Ann Lee', None, None))
+    index.add('P1', {'name': 'Ann Park'})
+    assert index.search('lee') == []
+    assert index.search('park') == ['P1']
+    index.remove('P1')
+    assert index.search('ann') == []
+    assert len(index) == 0
+
+def test_tag_narrows_results():
+    index = InvertedIndex()
+    index.add('D1', {'name': 'Greg House'}, tag='DEPT001')
+    index.add('D2', {'name': 'Greg Smith'}, tag='DEPT002')
+    assert index.search('greg', tag='DEPT002') == ['D2']
+
+@pytest.fixture
+def Session(Session):
+    with Session() as session:
+        session.add(User(id='U001', username='house', password='x', email='greg.house@example.com', role='Doctor'))
+        session.add(doctor('D001', user_id='U001', first_name='Gregory', last_name='House', department_id='DEPT001',
+                           specialization='Diagnostics', experience_years=20))
+        session.add(Patient(id='P001', first_name='Ann', last_name='Lee', email='ann@example.com', phone='555-0100'))
+        session.commit()
+    return Session
+
+def test_search_builds_index_and_returns_rows(Session):
+    assert [p.id for p in search.search_patients('ann')] == ['P001']
+    assert [d.id for d in search.search_doctors('greg.house')] == ['D001']
+    assert search.search_doctors('house', department_id='DEPT002') == []
+
+def test_rows_written_by_other_workers_are_caught_up(Session, monkeypatch):
+    search.search_patients('ann')
+    session = Session()
+    session.add(Patient(id='P002', first_name='Annabel', last_name='Ray', email='ar@example.com'))
+    session.commit()
+    session.close()
+
+    source = search_index._SOURCES['patients']
+    monkeypatch.setattr(source, 'refreshed_at', source.refreshed_at - search_index.REFRESH_SECONDS)
+    assert [p.id for p in search.search_patients('ann')] == ['P001', 'P002']
+
+def test_rows_deleted_elsewhere_are_dropped(Session):
+    search.search_patients('ann')
+    session = Session()
+    session.query(Patient).filter(Patient.id == 'P001').delete()
+    session.commit()
+    session.close()
+
+    assert search.search_patients('ann') == []
+    assert len(patient_index) == 0
+
+def test_rebuild_reports_counts(Session):
+    assert search_index.rebuild(Session()) == {'patients': 1, 'doctors': 1, 'departments': 0, 'suggestions': 3}
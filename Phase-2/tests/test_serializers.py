@@ -0,0 +1,111 @@
+import json
+from datetime import date, datetime
+import pytest
+from flask import Flask
+from flask_restful import Api, Resource
+from flask_restful import fields, marshal as restful_marshal
+from flask_restful.fields import MarshallingException
+from models import Appointment, Department, Doctor, MedicalRecord, Schedule, User
+import serializers
+from serializers import init_serializers, marshal, marshal_with
+from resources.appointments import appointment_fields, appointment_search_fields, slot_fields, doctor_name_fields
+from resources.medical_records import medical_record_fields
+from resources.departments import department_fields
+from resources.users import user_fields
+
+def get_day(obj):
+    return obj.datetime.strftime("%A")
+
+# The shape of resources.schedules.schedule_fields, which cannot be imported here
+doctor_fields = {
+    'id': fields.String,
+    'first_name': fields.String,
+    'department': fields.String(attribute=lambda d: d.department_obj.name if d.department_obj else None),
+    'availability': fields.Raw,
+}
+schedule_fields = {
+    'id': fields.String,
+    'doctor': fields.Nested(doctor_fields),
+    'datetime': fields.DateTime(dt_format='iso8601'),
+    'created': fields.DateTime(attribute='datetime'),  # rfc822
+    'day': fields.String(attribute=get_day),
+    'duration': fields.Integer,
+    'is_available': fields.Boolean,
+    'slot': {'start': fields.DateTime(dt_format='iso8601', attribute='datetime'), 'minutes': fields.Integer(attribute='duration')},
+}
+
+def rows():
+    dept = Department(id='DEPT1', name='Cardiologie é')
+    doctor = Doctor(id='D001', first_name='Jöhn', department_obj=dept, availability={'Monday': '9-12'})
+    locum = Doctor(id='D002', first_name=None, department_obj=None, availability=None)
+    schedules = [Schedule(id='SC1', doctor=doctor, datetime=datetime(2030, 1, 7, 9), duration=30, is_available=True),
+                 Schedule(id='SC2', doctor=locum, datetime=datetime(2030, 1, 7, 9, 30), duration=None, is_available=None)]
+    appointments = [Appointment(id='A1', patient_id='P1', doctor_id='D001', schedule=schedules[0], doctor=doctor,
+                                status='Scheduled'),
+                    Appointment(id='A2', patient_id=None, schedule=None, status=None)]
+    records = [MedicalRecord(id='M1', patient_id='P1', diagnosis='ok', visit_date=date(2030, 1, 1),
+                             date_created=datetime(2030, 1, 1, 8), updated_at=None)]
+    users = [User(id='U1', username='ann', email='a@example.com', role='Patient', is_active=True)]
+    return [(schedule_fields, schedules), (doctor_fields, [doctor]),
+            (appointment_fields, appointments), (appointment_search_fields, appointments[:1]),
+            (dict(appointment_fields, **slot_fields, **doctor_name_fields), appointments),
+            (medical_record_fields, records), (department_fields, [dept]), (user_fields, users)]
+
+@pytest.mark.parametrize('field_map, data', rows())
+def test_output_is_byte_for_byte_flask_restfuls(field_map, data, monkeypatch):
+    expected = json.dumps(restful_marshal(data, field_map))
+    fallbacks = []
+    monkeypatch.setattr(serializers, 'restful_marshal', lambda *args: fallbacks.append(args))
+    monkeypatch.setattr(serializers, '_compiled', serializers.OrderedDict())
+    assert json.dumps(marshal(data, field_map)) == expected
+    assert fallbacks == []  # compiled, not handed back to flask_restful
+    monkeypatch.undo()
+    assert json.dumps(marshal(data[0], field_map, envelope='item')) == \
+        json.dumps(restful_marshal(data[0], field_map, envelope='item'))
+
+def test_dicts_none_and_errors_follow_flask_restful():
+    row = {'id': 'X1', 'status': 5, 'doctor': None}
+    assert marshal(row, appointment_fields) == restful_marshal(row, appointment_fields)
+    assert marshal(None, appointment_fields) == restful_marshal(None, appointment_fields)
+    nested = {'id': fields.String, 'doctor': fields.Nested(appointment_fields),
+              'maybe': fields.Nested(appointment_fields, allow_null=True, attribute='doctor'),
+              'empty': fields.Nested(appointment_fields, default={}, attribute='doctor')}
+    assert marshal([row], nested) == restful_marshal([row], nested)
+    bad = Schedule(id='SC3', datetime=datetime(2030, 1, 7), duration='thirty')
+    with pytest.raises(MarshallingException):
+        marshal(bad, {'duration': fields.Integer})
+
+def test_marshal_with_keeps_status_and_headers():
+    @marshal_with(department_fields)
+    def created():
+        return Department(id='DEPT2', name='ER'), 201, {'X-Id': 'DEPT2'}
+    assert created() == ({'id': 'DEPT2', 'name': 'ER', 'description': None}, 201, {'X-Id': 'DEPT2'})
+
+def test_compiled_maps_are_bounded(monkeypatch):
+    monkeypatch.setattr(serializers, 'MAX_COMPILED', 4)
+    monkeypatch.setattr(serializers, '_compiled', serializers.OrderedDict())
+    for i in range(10):
+        marshal(Department(id='D', name='x'), {f"name{i}": fields.String(attribute='name')})
+    assert len(serializers._compiled) == 4
+
+@pytest.mark.parametrize('backend', ['json', 'orjson'])
+def test_json_backends_encode_the_same_values(backend):
+    if backend == 'orjson':
+        pytest.importorskip('orjson')
+    app = Flask(__name__)
+    app.debug = False  # flask_restful indents in debug mode
+    app.config['JSON_BACKEND'] = backend
+    api = Api(app)
+    init_serializers(app, api)
+
+    class Departments(Resource):
+        def get(self):
+            return marshal([Department(id='DEPT1', name='Cardiologie é')], department_fields)
+    api.add_resource(Departments, '/departments')
+
+    response = app.test_client().get('/departments')
+    assert response.mimetype == 'application/json'
+    expected = [{'id': 'DEPT1', 'name': 'Cardiologie é', 'description': None}]
+    assert json.loads(response.get_data()) == expected
+    if backend == 'json':
+        assert response.get_data(as_text=True) == json.dumps(expected) + "\n"
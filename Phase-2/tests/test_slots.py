@@ -0,0 +1,159 @@
+from datetime import datetime, timedelta
+import pytest
+from flask import Flask
+from models import Doctor, DoctorAvailability, Patient, Schedule, Appointment
+from error_handlers import ValidationError, ResourceNotFoundError, SlotUnavailableError
+from slots import parse_availability, expand_slots, materialize_schedule
+from virtual_slots import open_slots, use_virtual
+import booking
+from conftest import doctor
+
+# A Monday, so weekday names in the tests line up with dates
+START = datetime(2030, 1, 7)
+
+@pytest.fixture
+def session(Session):
+    session = Session()
+    session.add(doctor('D001'))
+    session.add(Patient(id='P001', first_name='Ann', last_name='Lee', email='ann@example.com'))
+    session.commit()
+    yield session
+    session.close()
+
+def slot_times(session):
+    return sorted(t for (t,) in session.query(Schedule.datetime).filter(Schedule.doctor_id == 'D001'))
+
+def test_parse_accepts_hours_and_minutes():
+    assert parse_availability({"Monday": "9-12, 13:30-17:00"}) == {"Monday": [(540, 720), (810, 1020)]}
+
+def test_parse_rejects_bad_ranges():
+    with pytest.raises(ValidationError):
+        parse_availability({"Monday": "nine-five"})
+    with pytest.raises(ValidationError):
+        parse_availability({"Monday": "17-9"})
+
+def test_expand_only_yields_whole_slots():
+    ranges = parse_availability({"Monday": "9-11:30"})
+    assert list(expand_slots(ranges, START, START + timedelta(days=7))) == [
+        START.replace(hour=9), START.replace(hour=10)
+    ]
+
+def test_first_run_inserts_the_whole_window(session):
+    changes = materialize_schedule(session, 'D001', {"Monday": "9-12"}, start_date=START, days=14)
+    session.commit()
+    assert changes == {'added': 6, 'removed': 0, 'closed': 0, 'reopened': 0, 'kept': 0}
+    assert len(set(sid for (sid,) in session.query(Schedule.id))) == 6
+
+def test_unchanged_availability_writes_nothing(session):
+    materialize_schedule(session, 'D001', {"Monday": "9-12"}, start_date=START, days=14)
+    session.commit()
+    before = session.query(Schedule.id).order_by(Schedule.id).all()
+
+    changes = materialize_schedule(session, 'D001', {"Monday": "9-12"}, start_date=START, days=14)
+    session.commit()
+
+    assert changes == {'added': 0, 'removed': 0, 'closed': 0, 'reopened': 0, 'kept': 6}
+    assert session.query(Schedule.id).order_by(Schedule.id).all() == before
+
+def test_shrinking_keeps_booked_slots(session):
+    materialize_schedule(session, 'D001', {"Monday": "9-12"}, start_date=START, days=7)
+    session.commit()
+    booked = session.query(Schedule).filter(Schedule.datetime == START.replace(hour=11)).one()
+    booked.is_available = False
+    session.add(Appointment(id='A001', patient_id='P001', doctor_id='D001', schedule_id=booked.id, status='Scheduled'))
+    session.commit()
+
+    changes = materialize_schedule(session, 'D001', {"Monday": "9-10"}, start_date=START, days=7)
+    session.commit()
+
+    assert changes == {'added': 0, 'removed': 1, 'closed': 0, 'reopened': 0, 'kept': 2}
+    assert slot_times(session) == [START.replace(hour=9), START.replace(hour=11)]
+
+def test_slot_of_cancelled_appointment_is_closed_not_deleted(session):
+    materialize_schedule(session, 'D001', {"Monday": "9-10"}, start_date=START, days=7)
+    session.commit()
+    slot = session.query(Schedule).one()
+    session.add(Appointment(id='A001', patient_id='P001', doctor_id='D001', schedule_id=slot.id, status='Cancelled'))
+    session.commit()
+
+    changes = materialize_schedule(session, 'D001', {}, start_date=START, days=7)
+    session.commit()
+    session.expire_all()
+
+    assert changes['closed'] == 1
+    assert session.query(Schedule).one().is_available is False
+
+def test_closed_slot_reopens_when_availability_returns(session):
+    materialize_schedule(session, 'D001', {"Monday": "9-11"}, start_date=START, days=7)
+    session.commit()
+    nine, ten = session.query(Schedule).order_by(Schedule.datetime).all()
+    for appointment_id, slot in (('A001', nine), ('A002', ten)):
+        slot.is_available = False
+        session.add(Appointment(id=appointment_id, patient_id='P001', doctor_id='D001', schedule_id=slot.id,
+                                status='Scheduled'))
+    session.commit()
+
+    # The doctor drops Monday: both booked slots stay; then the 9:00 patient cancels
+    materialize_schedule(session, 'D001', {}, start_date=START, days=7)
+    booking.cancel_appointment(session, session.query(Appointment).get('A001'))
+    session.commit()
+    assert materialize_schedule(session, 'D001', {}, start_date=START, days=7)['closed'] == 1
+    session.commit()
+
+    doctor = session.query(Doctor).get('D001')
+    doctor.availability = {"Monday": "9-11"}
+    changes = materialize_schedule(session, 'D001', doctor.availability, start_date=START, days=7)
+    session.commit()
+    session.expire_all()
+
+    assert changes == {'added': 0, 'removed': 0, 'closed': 0, 'reopened': 1, 'kept': 1}
+    assert session.query(Schedule).get(nine.id).is_available is True
+    assert session.query(Schedule).get(ten.id).is_available is False
+    assert [slot.id for slot in open_slots(session, doctor, START, START + timedelta(days=1))] == [nine.id]
+
+def test_virtual_open_slots_skip_booked_and_blocked_time(session):
+    doctor = session.query(Doctor).get('D001')
+    doctor.availability = {"Monday": "9-13"}
+    session.add(DoctorAvailability(doctor_id='D001', day_of_week=0, is_available=False,
+                                   start_time=datetime(2000, 1, 1, 12), end_time=datetime(2000, 1, 1, 13)))
+    session.add(Schedule(id='SC9000', doctor_id='D001', datetime=START.replace(hour=10), duration=60, is_available=False))
+    session.commit()
+
+    free = open_slots(session, doctor, START, START + timedelta(days=1))
+
+    assert [slot.datetime.hour for slot in free] == [9, 11]
+    assert free[0].id == 'D001@20300107T0900'
+    assert session.query(Schedule).count() == 1
+
+def test_booking_a_virtual_slot_writes_one_row(session):
+    session.query(Doctor).get('D001').availability = {"Monday": "9-12"}
+    session.add(Patient(id='P002', first_name='Bob', last_name='Ray', email='bob@example.com'))
+    session.commit()
+
+    appointment = booking.book_appointment(session, 'P001', 'D001@20300107T1000')
+    session.commit()
+    with pytest.raises(SlotUnavailableError):
+        booking.book_appointment(session, 'P002', 'D001@20300107T1000')
+    session.rollback()
+
+    slot = session.query(Schedule).one()
+    assert appointment.schedule_id == slot.id
+    assert slot.datetime == START.replace(hour=10)
+    assert slot.is_available is False
+
+def test_virtual_slot_outside_the_rules_cannot_be_booked(session):
+    session.query(Doctor).get('D001').availability = {"Monday": "9-12"}
+    session.commit()
+    with pytest.raises(ResourceNotFoundError):
+        booking.book_appointment(session, 'P001', 'D001@20300107T1500')
+
+def test_slot_mode_comes_from_the_app_config():
+    app = Flask(__name__)
+    app.config['SLOT_MODE'] = 'virtual'
+    with app.app_context():
+        assert use_virtual() is True
+        assert use_virtual('materialized') is False
+    app.config['SLOT_MODE'] = 'materialized'
+    with app.app_context():
+        assert use_virtual() is False
+        assert use_virtual('virtual') is True
@@ -0,0 +1,104 @@
+import time
+from datetime import datetime, timedelta
+import pytest
+from models import Appointment, Patient, Schedule
+import search
+import resources.doctors as doctor_resource
+import resources.patients as patient_resource
+from conftest import doctor
+
+NOW = datetime.now().replace(microsecond=0)
+
+@pytest.fixture
+def Session(Session):
+    with Session() as session:
+        session.add(doctor('D001'))
+        session.add(Patient(id='P001', first_name='Ann', last_name='Lee', email='ann@example.com'))
+        session.add(Patient(id='P002', first_name='Bob', last_name='Lee', email='bob@example.com'))
+        # Ids run against slot time so id order cannot pass for slot order
+        for i in range(-30, 30):
+            session.add(Schedule(id=f"SC{i + 30:04}", doctor_id='D001', datetime=NOW + timedelta(hours=i, minutes=30),
+                                 duration=30, is_available=False))
+            session.add(Appointment(id=f"A{99 - i:03}", patient_id='P001' if i % 3 else 'P002', doctor_id='D001',
+                                    schedule_id=f"SC{i + 30:04}", status='Scheduled'))
+        session.commit()
+    return Session
+
+@pytest.fixture
+def client(make_client):
+    return make_client({
+        '/api/patients/<string:patient_id>/appointments/sorted': patient_resource.PatientAppointmentsSortedAPI,
+        '/api/doctors/<string:doctor_id>/appointments/sorted': doctor_resource.DoctorAppointmentsSortedAPI,
+    })
+
+def test_upcoming_soonest_first_and_history_latest_first(client):
+    body = client.get('/api/patients/P001/appointments/sorted?limit=100').get_json()
+    upcoming = [a['datetime'] for a in body['upcoming']]
+    history = [a['datetime'] for a in body['history']]
+    assert len(upcoming) == 20 and len(history) == 20
+    assert upcoming == sorted(upcoming) and upcoming[0] > NOW.isoformat()
+    assert history == sorted(history, reverse=True) and history[0] < NOW.isoformat()
+    assert {a['patient_id'] for a in body['upcoming'] + body['history']} == {'P001'}
+    assert body['next_upcoming_cursor'] is None and body['next_history_cursor'] is None
+
+def test_query_count_does_not_grow_with_appointments(client, statements):
+    client.get('/api/patients/P001/appointments/sorted?limit=100')
+    # Patient lookup, then one query each for upcoming and history; no per-row slot loads
+    assert len(statements) == 3
+
+def test_each_list_pages_on_its_own_cursor(client):
+    seen, cursor = [], ''
+    while True:
+        body = client.get(f"/api/patients/P001/appointments/sorted?limit=7&history_cursor={cursor}").get_json()
+        assert len(body['upcoming']) == 7
+        seen.extend(a['id'] for a in body['history'])
+        cursor = body['next_history_cursor']
+        if not cursor:
+            break
+    everything = client.get('/api/patients/P001/appointments/sorted?limit=100').get_json()['history']
+    assert seen == [a['id'] for a in everything]
+
+def test_unknown_patient_and_bad_cursor(client):
+    assert client.get('/api/patients/P999/appointments/sorted').status_code == 404
+    assert client.get('/api/patients/P001/appointments/sorted?upcoming_cursor=junk').status_code == 400
+
+def test_doctor_timeline_covers_all_patients(Session):
+    session = Session()
+    timeline = search.appointment_timeline(session, doctor_id='D001', limit=100, now=NOW)
+    assert len(timeline['upcoming']) == 30 and len(timeline['history']) == 30
+    assert {a.patient_id for a in timeline['upcoming']} == {'P001', 'P002'}
+    session.close()
+
+def test_timeline_splits_on_the_booking_clock(Session, monkeypatch):
+    # Nine hours ahead of UTC: a split on UTC time would list the next nine hours' past slots as upcoming
+    with monkeypatch.context() as patch:
+        patch.setenv('TZ', 'Asia/Tokyo')
+        time.tzset()
+        try:
+            session = Session()
+            timeline = search.appointment_timeline(session, doctor_id='D001', limit=100)
+            now = datetime.now()
+            assert all(a.schedule.datetime > now for a in timeline['upcoming'])
+            assert all(a.schedule.datetime <= now for a in timeline['history'])
+            session.close()
+        finally:
+            patch.undo()
+            time.tzset()
+
+def test_doctor_sorted_view_pages_in_two_queries(client, statements):
+    body = client.get('/api/doctors/D001/appointments/sorted?limit=100').get_json()
+    # Doctor lookup, then one paged query each for upcoming and history
+    assert len(statements) == 3
+    upcoming = [a['datetime'] for a in body['upcoming']]
+    history = [a['datetime'] for a in body['history']]
+    assert len(upcoming) == 30 and len(history) == 30
+    assert upcoming == sorted(upcoming) and history == sorted(history, reverse=True)
+    assert {a['patient_id'] for a in body['upcoming']} == {'P001', 'P002'}
+
+    statements.clear()
+    body = client.get('/api/doctors/D001/appointments/sorted?limit=5').get_json()
+    assert len(statements) == 3
+    assert len(body['upcoming']) == 5 and body['next_upcoming_cursor']
+
+def test_doctor_sorted_view_unknown_doctor(client):
+    assert client.get('/api/doctors/D999/appointments/sorted').status_code == 404
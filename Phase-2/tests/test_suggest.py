@@ -0,0 +1,82 @@
+import pytest
+from models import Department, Doctor, Patient
+from auth import generate_token
+import search_index
+from search_index import PrefixIndex, SUGGEST_KINDS, suggestions
+import resources.search as search_resource
+from conftest import doctor
+
+def labels(results):
+    return [r['label'] for r in results]
+
+def test_prefix_matches_any_word_onwards():
+    index = PrefixIndex(['patient'])
+    index.add('patient', 'P1', 'Ann Lee')
+    index.add('patient', 'P2', 'Leo Park')
+    assert labels(index.suggest('le')) == ['Ann Lee', 'Leo Park']
+    assert labels(index.suggest('ann l')) == ['Ann Lee']
+    assert index.suggest('  ') == []
+
+def test_kinds_come_in_priority_order_up_to_the_limit():
+    index = PrefixIndex(SUGGEST_KINDS)
+    index.add('patient', 'P1', 'Carl Diaz')
+    index.add('doctor', 'D1', 'Cara Wong')
+    index.add('department', 'DEPT001', 'Cardiology')
+    assert [r['type'] for r in index.suggest('car')] == ['department', 'doctor', 'patient']
+    assert labels(index.suggest('car', limit=2)) == ['Cardiology', 'Cara Wong']
+    assert index.suggest('car', kinds=['patient']) == [{'type': 'patient', 'id': 'P1', 'label': 'Carl Diaz'}]
+
+def test_renaming_and_removing_update_the_arrays():
+    index = PrefixIndex(['patient'])
+    index.add('patient', 'P1', 'Ann Lee')
+    index.add('patient', 'P1', 'Ann Park')
+    assert index.suggest('lee') == []
+    index.remove('patient', 'P1')
+    assert index.suggest('ann') == []
+
+def test_shared_labels_are_reference_counted():
+    index = PrefixIndex(['specialization'])
+    index.retain('specialization', 'Cardiology')
+    index.retain('specialization', 'cardiology')
+    index.release('specialization', 'Cardiology')
+    assert labels(index.suggest('card')) == ['Cardiology']
+    index.release('specialization', 'Cardiology')
+    assert index.suggest('card') == []
+
+@pytest.fixture
+def Session(Session):
+    with Session() as session:
+        session.add(Department(id='DEPT001', name='Cardiology'))
+        session.add(doctor('D001', first_name='Carla', last_name='Mendes', department_id='DEPT001',
+                           specialization='Cardiac Surgery', experience_years=12))
+        session.add(Patient(id='P001', first_name='Carlos', last_name='Ruiz', email='cr@example.com'))
+        session.commit()
+    return Session
+
+@pytest.fixture
+def client(make_client):
+    return make_client({'/api/search/suggest': search_resource.SearchSuggestAPI})
+
+def get(client, query, role):
+    token = generate_token('U001', role)
+    return client.get(f"/api/search/suggest?{query}", headers={'Authorization': f"Bearer {token}"})
+
+def test_endpoint_builds_lazily_and_suggests(client):
+    response = get(client, 'q=car', 'Admin')
+    assert response.status_code == 200
+    assert labels(response.get_json()['suggestions']) == ['Cardiology', 'Cardiac Surgery', 'Carla Mendes', 'Carlos Ruiz']
+
+def test_patients_are_hidden_from_patients(client):
+    assert 'Carlos Ruiz' not in labels(get(client, 'q=car', 'Patient').get_json()['suggestions'])
+
+def test_endpoint_requires_login(client):
+    assert client.get('/api/search/suggest?q=car').status_code == 401
+
+def test_changing_a_doctor_moves_the_specialization(client):
+    get(client, 'q=car', 'Admin')
+    doctor = Doctor(id='D001', first_name='Carla', last_name='Mendes', department_id='DEPT001',
+                    specialization='Neurology', qualification='MD', experience_years=12)
+    search_index.index_doctor(doctor)
+    result = labels(get(client, 'q=car&type=specialization&type=doctor', 'Admin').get_json()['suggestions'])
+    assert result == ['Carla Mendes']
+    assert labels(suggestions.suggest('neu')) == ['Neurology']
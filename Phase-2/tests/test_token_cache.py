@@ -0,0 +1,69 @@
+from datetime import datetime, timedelta
+import jwt
+import pytest
+from flask import Flask
+import auth
+from auth import TokenCache, generate_token, verify_token, role_required, token_cache
+
+@pytest.fixture(autouse=True)
+def fresh_cache():
+    token_cache.clear()
+    yield
+    token_cache.clear()
+
+def make_token(user_id='U001', exp=None):
+    payload = {'user_id': user_id, 'role': 'Admin', 'exp': exp or datetime.utcnow() + timedelta(hours=1)}
+    return jwt.encode(payload, auth.SECRET_KEY, algorithm='HS256')
+
+def test_second_verification_is_a_hit(monkeypatch):
+    token = generate_token('U001', 'Admin')
+    assert verify_token(token)['user_id'] == 'U001'
+
+    def no_decode(*args, **kwargs):
+        raise AssertionError('decoded twice')
+    monkeypatch.setattr(auth.jwt, 'decode', no_decode)
+
+    assert verify_token(token)['user_id'] == 'U001'
+    assert token_cache.stats()['hits'] == 1
+    assert token_cache.stats()['misses'] == 1
+
+def test_invalid_tokens_are_not_cached():
+    assert verify_token('not-a-token') is None
+    assert verify_token('not-a-token') is None
+    assert token_cache.stats() == {'hits': 0, 'misses': 2, 'size': 0, 'maxsize': auth.TOKEN_CACHE_SIZE}
+
+def test_entries_expire_with_the_token(monkeypatch):
+    token = make_token()
+    verify_token(token)
+    later = datetime.utcnow() + timedelta(hours=2)
+    monkeypatch.setattr(auth.time, 'time', lambda: later.timestamp())
+    assert token_cache.get(token) is None
+    assert token_cache.stats()['size'] == 0
+
+def test_least_recently_used_is_evicted():
+    cache = TokenCache(maxsize=2)
+    tokens = [make_token(f"U00{i}") for i in range(3)]
+    for token in tokens[:2]:
+        cache.put(token, jwt.decode(token, auth.SECRET_KEY, algorithms=['HS256']))
+    cache.get(tokens[0])
+    cache.put(tokens[2], jwt.decode(tokens[2], auth.SECRET_KEY, algorithms=['HS256']))
+
+    assert cache.get(tokens[0]) is not None
+    assert cache.get(tokens[1]) is None
+    assert cache.stats()['size'] == 2
+
+def test_decorators_share_the_cache():
+    app = Flask(__name__)
+
+    @app.route('/admin')
+    @role_required(['Admin'])
+    def admin_only():
+        return {'user': auth.verify_token(auth.get_token_from_header())['user_id']}
+
+    client = app.test_client()
+    headers = {'Authorization': f"Bearer {generate_token('U001', 'Admin')}"}
+    assert client.get('/admin', headers=headers).status_code == 200
+    assert client.get('/admin', headers=headers).status_code == 200
+    assert client.get('/admin', headers={'Authorization': 'Bearer bogus'}).status_code == 401
+    # One decode for the first request; the rest were served from the cache
+    assert token_cache.stats()['hits'] == 3
@@ -0,0 +1,155 @@
+import calendar
+import os
+from datetime import datetime, timedelta
+
+from flask import current_app, has_app_context
+from sqlalchemy import insert, select
+from sqlalchemy.exc import IntegrityError
+
+from models import Doctor, DoctorAvailability, Schedule
+from error_handlers import ResourceNotFoundError
+from id_allocator import schedule_ids
+from slots import parse_availability, expand_slots, SLOT_MINUTES, HORIZON_DAYS
+
+# "materialized": free time is pre-generated Schedule rows (DoctorSetAvailabilityAPI).
+# "virtual": free time is computed from the doctor's rules on every read and a
+# Schedule row is only written when a slot gets booked.
+SLOT_MODE = os.getenv('SLOT_MODE', 'materialized')
+SLOT_MODES = ['materialized', 'virtual']
+
+# Virtual slots are addressed as "<doctor_id>@<YYYYMMDDTHHMM>", e.g. D001@20300107T0900
+VIRTUAL_ID_FORMAT = '%Y%m%dT%H%M'
+
+
+class VirtualSlot:
+    """A free slot derived from the doctor's rules; it has no Schedule row until it is booked"""
+    is_available = True
+
+    def __init__(self, doctor, start, duration=SLOT_MINUTES):
+        self.doctor = doctor
+        self.doctor_id = doctor.id
+        self.datetime = start
+        self.duration = duration
+        self.id = virtual_slot_id(doctor.id, start)
+
+
+def virtual_slot_id(doctor_id, start):
+    return f"{doctor_id}@{start.strftime(VIRTUAL_ID_FORMAT)}"
+
+
+def is_virtual_slot_id(schedule_id):
+    return '@' in (schedule_id or '')
+
+
+def parse_virtual_slot_id(schedule_id):
+    doctor_id, _, stamp = schedule_id.partition('@')
+    try:
+        return doctor_id, datetime.strptime(stamp, VIRTUAL_ID_FORMAT)
+    except ValueError:
+        raise ResourceNotFoundError('Schedule not found')
+
+
+def use_virtual(mode=None):
+    """``?mode=`` if given, else the app's SLOT_MODE (config.py), else the environment's"""
+    if not mode:
+        mode = current_app.config.get('SLOT_MODE', SLOT_MODE) if has_app_context() else SLOT_MODE
+    return mode == 'virtual'
+
+
+def doctor_ranges(session, doctor):
+    """Working ranges per weekday from Doctor.availability plus DoctorAvailability rules.
+
+    Rules with is_available False are blocked time and cut into the ranges.
+    """
+    ranges = parse_availability(doctor.availability)
+    blocked = {}
+    rules = session.query(DoctorAvailability).filter(DoctorAvailability.doctor_id == doctor.id).all()
+    for rule in rules:
+        day = calendar.day_name[rule.day_of_week]
+        window = (rule.start_time.hour * 60 + rule.start_time.minute,
+                  rule.end_time.hour * 60 + rule.end_time.minute)
+        if window[0] >= window[1]:
+            continue
+        (ranges if rule.is_available else blocked).setdefault(day, []).append(window)
+
+    for day, windows in blocked.items():
+        remaining = []
+        for start, end in ranges.get(day, []):
+            pieces = [(start, end)]
+            for b_start, b_end in windows:
+                pieces = [piece for s, e in pieces for piece in ((s, min(e, b_start)), (max(s, b_end), e)) if piece[0] < piece[1]]
+            remaining.extend(pieces)
+        ranges[day] = remaining
+    return ranges
+
+
+def _rule_slots(session, doctor, start_date, end_date):
+    return expand_slots(doctor_ranges(session, doctor), start_date, end_date)
+
+
+def _window_rows(session, doctor_id, start_date, end_date):
+    return session.query(Schedule)\
+        .filter(
+            Schedule.doctor_id == doctor_id,
+            Schedule.datetime >= start_date,
+            Schedule.datetime < end_date
+        )\
+        .all()
+
+
+def open_slots(session, doctor, start_date, end_date):
+    """Free slots in [start_date, end_date): rule slots plus free Schedule rows, minus booked times"""
+    rows = _window_rows(session, doctor.id, start_date, end_date)
+    taken = {row.datetime for row in rows if not row.is_available}
+    free = {row.datetime: row for row in rows if row.is_available and row.datetime not in taken}
+    for start in _rule_slots(session, doctor, start_date, end_date):
+        if start not in taken and start not in free:
+            free[start] = VirtualSlot(doctor, start)
+    return [free[start] for start in sorted(free)]
+
+
+def doctor_schedule(session, doctor, start_date, end_date):
+    """Booked Schedule rows and free slots in [start_date, end_date), ordered by time"""
+    rows = _window_rows(session, doctor.id, start_date, end_date)
+    booked = [row for row in rows if not row.is_available]
+    return sorted(booked + open_slots(session, doctor, start_date, end_date), key=lambda slot: slot.datetime)
+
+
+def default_window(start_date=None, end_date=None):
+    start_date = start_date or datetime.now().replace(hour=0, minute=0, second=0, microsecond=0)
+    return start_date, end_date or start_date + timedelta(days=HORIZON_DAYS)
+
+
+def materialize_slot(session, schedule_id, bind=None):
+    """Return the Schedule.id backing a virtual slot, writing the row if it doesn't exist yet.
+
+    The row is inserted as *available* on its own connection, so the caller
+    still has to win it with booking.claim_slot; concurrent bookers of the
+    same virtual slot therefore race on one row, never on two.
+    """
+    doctor_id, start = parse_virtual_slot_id(schedule_id)
+    doctor = session.query(Doctor).get(doctor_id)
+    if not doctor or start not in set(_rule_slots(session, doctor, start, start + timedelta(minutes=1))):
+        raise ResourceNotFoundError('Schedule not found')
+
+    existing = select(Schedule.id)\
+        .where(Schedule.doctor_id == doctor_id, Schedule.datetime == start)\
+        .order_by(Schedule.id)
+    found = session.execute(existing).scalars().first()
+    if found:
+        return found
+
+    new_id = schedule_ids.next_id()
+    try:
+        with (bind or session.get_bind()).begin() as conn:
+            conn.execute(insert(Schedule).values(
+                id=new_id,
+                doctor_id=doctor_id,
+                datetime=start,
+                duration=SLOT_MINUTES,
+                is_available=True
+            ))
+    except IntegrityError:
+        # Another booker wrote the row first (uq_schedules_doctor_datetime)
+        pass
+    return session.execute(existing).scalars().first()